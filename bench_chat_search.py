@@ -0,0 +1,140 @@
+"""
+Benchmark de búsqueda en el historial de chats: FTS5 vs. LIKE.
+
+Genera una base SQLite temporal con N mensajes sintéticos repartidos entre
+varios clientes y usuarios (el índice conversation_fts se mantiene por trigger
+durante la carga) y compara, para varias consultas:
+- Antes: LIKE '%termino%' sobre conversation_history (recorre la tabla)
+- Ahora: search_conversation_history (FTS5 + bm25, con snippet resaltado)
+
+También mide el costo del trigger al insertar (mensajes/segundo).
+
+Uso: python bench_chat_search.py [mensajes] [clientes]
+"""
+import os
+import sys
+import time
+import random
+import itertools
+import sqlite3
+import tempfile
+
+from src import database
+
+# Vocabulario del dominio (lo que se busca) + relleno con distribución tipo Zipf
+DOMAIN_WORDS = (
+    "cita limpieza dental precio consulta horario ortodoncia brackets blanqueamiento "
+    "urgencia muela pago transferencia ubicación estacionamiento pizza hamburguesa "
+    "envío domicilio pedido factura descuento promoción talla"
+).split()
+SYLLABLES = ["ma", "lo", "te", "ra", "si", "no", "pe", "ca", "du", "ri", "ba", "go", "ne", "ti", "sa", "vo"]
+FILLER_WORDS = ["".join(random.Random(i).choices(SYLLABLES, k=random.Random(i).randint(1, 4))) for i in range(5000)]
+FILLER_CUM_WEIGHTS = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(FILLER_WORDS))))
+DOMAIN_WORD_PROBABILITY = 0.25
+
+QUERIES = ["ortodoncia", "cita limpieza", "blanqueamiento precio", "factura", "estacionam"]
+
+
+def synthetic_message():
+    words = random.choices(FILLER_WORDS, cum_weights=FILLER_CUM_WEIGHTS, k=random.randint(4, 18))
+    while random.random() < DOMAIN_WORD_PROBABILITY:
+        words.insert(random.randrange(len(words) + 1), random.choice(DOMAIN_WORDS))
+    return " ".join(words)
+
+
+def seed(db_path, n_messages, n_clients):
+    database.DB_NAME = db_path
+    database.init_db()
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    users = [f"52155{random.randint(10000000, 99999999)}" for _ in range(max(10, n_messages // 200))]
+    insert_seconds = 0.0
+    batch = []
+    for i in range(n_messages):
+        batch.append((
+            random.randint(1, n_clients),
+            random.choice(users),
+            synthetic_message(),
+            i % 2,
+            f"-{random.randint(0, 60 * 24 * 90)} minutes",
+        ))
+        if len(batch) >= 50000:
+            insert_seconds += _insert(cursor, batch)
+            batch = []
+    if batch:
+        insert_seconds += _insert(cursor, batch)
+    started = time.perf_counter()
+    conn.commit()
+    insert_seconds += time.perf_counter() - started
+    conn.execute("ANALYZE")
+    conn.close()
+    return insert_seconds
+
+
+def _insert(cursor, batch):
+    started = time.perf_counter()
+    cursor.executemany(
+        "INSERT INTO conversation_history (client_id, phone_number, content, is_user, created_at) "
+        "VALUES (?, ?, ?, ?, datetime('now', ?))",
+        batch
+    )
+    return time.perf_counter() - started
+
+
+def search_like(client_id, query, page_size=20):
+    conn = sqlite3.connect(database.DB_NAME)
+    terms = query.split()
+    where = "client_id = ?" + " AND content LIKE ?" * len(terms)
+    params = [client_id] + [f"%{t}%" for t in terms]
+    total = conn.execute(f"SELECT COUNT(*) FROM conversation_history WHERE {where}", params).fetchone()[0]
+    rows = conn.execute(
+        f"SELECT id, content FROM conversation_history WHERE {where} ORDER BY created_at DESC LIMIT ?",
+        params + [page_size]
+    ).fetchall()
+    conn.close()
+    return total, rows
+
+
+def timed(fn, *args, repeat=5, **kwargs):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+
+def main():
+    n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    n_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    random.seed(42)
+
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        print(f"📦 Generando {n_messages:,} mensajes para {n_clients} clientes...")
+        load_seconds = seed(db_path, n_messages, n_clients)
+        print(f"   Carga con índice FTS por trigger: {load_seconds:.1f}s ({n_messages / load_seconds:,.0f} msg/s)")
+        print(f"   Tamaño de la base: {os.path.getsize(db_path) / 1048576:.1f} MB\n")
+
+        client_id = 1
+        print(f"{'consulta':<24}{'LIKE (ms)':>12}{'FTS5 (ms)':>12}{'FTS5 pág.5':>12}{'total':>9}")
+        for query in QUERIES:
+            like_ms, (like_total, _) = timed(search_like, client_id, query)
+            fts_ms, result = timed(database.search_conversation_history, client_id, query)
+            page_ms, _ = timed(database.search_conversation_history, client_id, query, page=5, order="recent")
+            print(f"{query:<24}{like_ms:>12.1f}{fts_ms:>12.1f}{page_ms:>12.1f}{result['total']:>9}")
+            if like_total != result['total'] and query != "estacionam":
+                print(f"   ⚠️ LIKE encontró {like_total} (coincidencias dentro de palabras)")
+
+        sample = database.search_conversation_history(client_id, QUERIES[0], page_size=1)
+        if sample['results']:
+            print(f"\nEjemplo de snippet: {sample['results'][0]['snippet']}")
+    finally:
+        os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark de cold start en serverless: copiar la base a /tmp vs. overlay.
+
+Para cada tamaño de base empaquetada mide el arranque hasta la primera
+consulta de un cliente por phone_number_id:
+- Copia: lo que se hacía antes (shutil.copy2 a /tmp + conexión)
+- Overlay: base empaquetada inmutable + overlay vacío en /tmp (migraciones
+  incluidas), ver src/sqlite_overlay.py
+- Overlay + snapshot: además restaura un overlay respaldado con historial
+
+El tamaño se llena con chunks de conocimiento. Los archivos quedan en el page
+cache del sistema, así que la copia mide el mejor caso (en un cold start real
+también se leen del disco).
+
+Uso: python bench_cold_start.py [MB ...]   (por defecto 8 64 256)
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+
+from src import database
+from src.sqlite_overlay import OverlayDatabase
+
+CHUNK = ("Horario de atención de lunes a viernes de 9:00 a 19:00. Limpieza dental, "
+         "ortodoncia, blanqueamiento y urgencias. ") * 20
+
+
+def build_base(path, size_mb):
+    database.DB_NAME = path
+    database.init_db()
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO clients (name, whatsapp_token, phone_number_id, verify_token) VALUES (?, ?, ?, ?)",
+        [(f"Cliente {i}", "tok", f"pnid_{i}", "vt") for i in range(200)]
+    )
+    rows = max(1, size_mb * 1024 * 1024 // len(CHUNK))
+    conn.executemany(
+        "INSERT INTO knowledge_base (client_id, content, source_file) VALUES (?, ?, ?)",
+        ((i % 200 + 1, CHUNK, "menu.pdf") for i in range(rows))
+    )
+    conn.commit()
+    conn.close()
+
+
+def first_query(conn):
+    conn.execute("SELECT * FROM clients WHERE phone_number_id = ?", ("pnid_42",)).fetchone()
+    conn.close()
+
+
+def cold_copy(base, workdir):
+    target = os.path.join(workdir, "copy.db")
+    started = time.perf_counter()
+    shutil.copy2(base, target)
+    first_query(sqlite3.connect(target))
+    return time.perf_counter() - started
+
+
+def cold_overlay(base, workdir, snapshot=None):
+    overlay = OverlayDatabase(base, os.path.join(workdir, "overlay.db"), snapshot_path=snapshot)
+    started = time.perf_counter()
+    overlay.bootstrap()
+    first_query(overlay.connect())
+    return time.perf_counter() - started
+
+
+def build_snapshot(base, path):
+    overlay = OverlayDatabase(base, os.path.join(os.path.dirname(path), "seed-overlay.db"), snapshot_path=path)
+    overlay.bootstrap()
+    conn = overlay.connect()
+    conn.executemany(
+        "INSERT INTO conversation_history (phone_number, content, is_user, client_id) VALUES (?, ?, ?, ?)",
+        [(f"52155{i % 500:08d}", "Hola, ¿tienen cita disponible esta semana?", i % 2, i % 200 + 1) for i in range(20_000)]
+    )
+    conn.commit()
+    conn.close()
+    overlay.snapshot()
+    return os.path.getsize(path)
+
+
+def timed(fn, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        workdir = tempfile.mkdtemp()
+        try:
+            best = min(best, fn(*args[:1], workdir, *args[1:]))
+        finally:
+            shutil.rmtree(workdir)
+    return best * 1000
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [8, 64, 256]
+    root = tempfile.mkdtemp()
+    try:
+        snapshot = os.path.join(root, "snapshot.db")
+        print(f"{'base (MB)':>10}{'copia (ms)':>13}{'overlay (ms)':>15}{'overlay+snapshot (ms)':>24}")
+        for size_mb in sizes:
+            base = os.path.join(root, f"base-{size_mb}.db")
+            build_base(base, size_mb)
+            if not os.path.exists(snapshot):
+                snapshot_kb = build_snapshot(base, snapshot) / 1024
+            copy_ms = timed(cold_copy, base)
+            overlay_ms = timed(cold_overlay, base)
+            restore_ms = timed(cold_overlay, base, snapshot)
+            actual_mb = os.path.getsize(base) / (1024 * 1024)
+            print(f"{actual_mb:>10.0f}{copy_ms:>13.1f}{overlay_ms:>15.1f}{restore_ms:>24.1f}")
+        print(f"\nSnapshot del overlay: {snapshot_kb:.0f} KB (20.000 mensajes de historial)")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark de serialización de respuestas: jsonable_encoder + json vs. orjson.
+
+Compara, con los mismos datos sintéticos:
+- Antes: lo que hacía FastAPI sin response_model (jsonable_encoder + JSONResponse)
+- Ahora con modelo: validación/serialización de pydantic-core (response_model)
+  + FastJSONResponse (orjson)
+- Ahora directo: FastJSONResponse sobre un payload de tipos nativos (métricas)
+
+Cargas:
+- Lista de 5.000 clientes (/api/clients)
+- Exportación de 10.000 mensajes de chat (/api/clients/{id}/chats)
+
+Uso: python bench_json.py [clientes] [mensajes]
+"""
+import sys
+import time
+import random
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from src import jsonutil
+from src.jsonutil import FastJSONResponse
+from src.schemas import ClientOut, ChatsPage
+
+
+def synthetic_clients(n):
+    plans = ['free', 'basic', 'pro', 'enterprise']
+    return [
+        {
+            'id': i,
+            'name': f"Cliente {i} — Consultorio Dental",
+            'phone': f"52155{random.randint(10000000, 99999999)}",
+            'phone_number_id': f"pnid_{i}",
+            'email': f"cliente{i}@ejemplo.com",
+            'whatsapp_token': "EAAG" + "x" * 180,
+            'verify_token': f"verify_{i}",
+            'response_type': 'text',
+            'system_instruction': "Eres el asistente de la clínica. Responde breve y amable. " * 4,
+            'menu_json': '{"text": "Bienvenido", "options": [{"title": "Citas"}, {"title": "Horarios"}]}',
+            'plan': random.choice(plans),
+            'knowledge_version': random.randint(0, 40),
+            'knowledge_bytes': random.randint(0, 5_000_000),
+            'menu_version': time.time_ns(),
+            'created_at': "2024-01-01 00:00:00",
+        }
+        for i in range(1, n + 1)
+    ]
+
+
+def synthetic_chats(n):
+    now = datetime.now(timezone.utc)
+    users = [f"52155{random.randint(10000000, 99999999)}" for _ in range(200)]
+    chats = []
+    for i in range(n):
+        chats.append({
+            'id': f"chat{i:06d}",
+            'user_number': random.choice(users),
+            'message': "Hola, ¿tienen cita disponible para limpieza dental esta semana? " * random.randint(1, 3),
+            'response': "¡Claro! Tenemos disponibilidad el martes a las 10:00 y el jueves a las 16:00. ¿Cuál prefieres? 😊",
+            # Firestore entrega datetimes; _chat_to_dict los convierte a ISO
+            'timestamp': (now - timedelta(minutes=i)).isoformat(),
+        })
+    return {'chats': chats, 'next_cursor': chats[-1]['id'], 'has_more': True}
+
+
+def before(payload):
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+def with_model(adapter, exclude_unset):
+    def run(payload):
+        # Lo que hace FastAPI con response_model: validar y serializar en modo JSON
+        content = adapter.dump_python(adapter.validate_python(payload), mode='json', exclude_unset=exclude_unset)
+        return FastJSONResponse(content).body
+    return run
+
+
+def direct(payload):
+    return FastJSONResponse(payload).body
+
+
+def timed(fn, payload, repeat=5):
+    best = float("inf")
+    body = b""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn(payload)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, len(body)
+
+
+def main():
+    n_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    n_messages = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    random.seed(42)
+    print(f"orjson disponible: {'sí' if jsonutil.HAS_ORJSON else 'no (respaldo json)'}\n")
+
+    cases = [
+        (f"{n_clients:,} clientes", synthetic_clients(n_clients), TypeAdapter(List[ClientOut])),
+        (f"{n_messages:,} mensajes", synthetic_chats(n_messages), TypeAdapter(ChatsPage)),
+    ]
+    print(f"{'carga':<20}{'antes (ms)':>12}{'modelo (ms)':>13}{'directo (ms)':>14}{'KB':>9}")
+    for label, payload, adapter in cases:
+        before_ms, size = timed(before, payload)
+        model_ms, _ = timed(with_model(adapter, exclude_unset=True), payload)
+        direct_ms, _ = timed(direct, payload)
+        print(f"{label:<20}{before_ms:>12.1f}{model_ms:>13.1f}{direct_ms:>14.1f}{size / 1024:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark de memoria: tenants e historial como dicts vs. modelos con slots.
+
+Construye N clientes (filas reales de la tabla clients, vía sqlite3.Row) y
+N mensajes de historial, una vez como dicts (lo que se cacheaba antes) y otra
+como `models.Client` / `models.HistoryMessage`, y mide con tracemalloc los
+bytes retenidos y el tiempo de construcción. También mide una lectura por
+llave (`client.get('whatsapp_token')`), que es lo que hace el webhook.
+
+Uso: python bench_models.py [N]   (por defecto 10000)
+"""
+import gc
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+from src.models import Client, HistoryMessage
+
+
+def build_rows(n):
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+        CREATE TABLE clients (
+            id INTEGER PRIMARY KEY, name TEXT, whatsapp_token TEXT, phone_number_id TEXT,
+            verify_token TEXT, system_instruction TEXT, stripe_api_key TEXT, bank_name TEXT,
+            clabe TEXT, beneficiary_name TEXT, created_at TEXT, menu_json TEXT,
+            menu_version INTEGER, knowledge_version INTEGER, knowledge_bytes INTEGER, plan TEXT
+        )
+    """)
+    conn.executemany(
+        "INSERT INTO clients VALUES (NULL, ?, ?, ?, ?, ?, NULL, NULL, NULL, NULL, ?, ?, 1, 3, 20480, 'pro')",
+        [(f"Consultorio {i}", f"EAAG{i:012d}token", f"10{i:013d}", f"verify_{i}",
+          "Eres el asistente del consultorio. Sé amable y breve.", "2026-01-01 10:00:00",
+          '{"text": "Hola", "options": []}') for i in range(n)]
+    )
+    clients = conn.execute("SELECT * FROM clients").fetchall()
+    conn.execute("CREATE TABLE conversation_history (content TEXT, is_user INTEGER, created_at TEXT)")
+    conn.executemany(
+        "INSERT INTO conversation_history VALUES (?, ?, '2026-01-01 10:00:00')",
+        [(f"Mensaje {i}: ¿tienen cita disponible esta semana?", i % 2) for i in range(n)]
+    )
+    history = conn.execute("SELECT * FROM conversation_history").fetchall()
+    conn.close()
+    return clients, history
+
+
+def measure(build, rows):
+    """
+    Bytes retenidos y milisegundos para construir los objetos desde las filas
+    (el tiempo se mide en otra pasada: tracemalloc hace lenta cada asignación).
+    """
+    started = time.perf_counter()
+    objects = [build(row) for row in rows]
+    elapsed = time.perf_counter() - started
+    del objects
+    gc.collect()
+    tracemalloc.start()
+    objects = [build(row) for row in rows]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return objects, retained, elapsed * 1000
+
+
+def lookup_ns(objects, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        for obj in objects:
+            obj.get('whatsapp_token')
+        best = min(best, (time.perf_counter_ns() - started) / len(objects))
+    return best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    clients, history = build_rows(n)
+
+    print(f"{'':<26}{'memoria (KB)':>14}{'bytes/objeto':>14}{'construcción (ms)':>20}{'get (ns)':>10}")
+    for label, build, rows, with_lookup in (
+        ("clients como dict", dict, clients, True),
+        ("clients como Client", Client.from_row, clients, True),
+        ("historial como dict", dict, history, False),
+        ("historial como History…", HistoryMessage.from_row, history, False),
+    ):
+        objects, retained, ms = measure(build, rows)
+        lookup = f"{lookup_ns(objects):>10.0f}" if with_lookup else f"{'-':>10}"
+        print(f"{label:<26}{retained / 1024:>14.0f}{retained / n:>14.0f}{ms:>20.1f}{lookup}")
+        del objects
+
+
+if __name__ == "__main__":
+    main()
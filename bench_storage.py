@@ -0,0 +1,190 @@
+"""
+Conformidad y rendimiento de los backends de storage.py.
+
+1. Conformidad: los mismos casos contra cada backend (tenants por lote,
+   append + historial por conversación con límite, conocimiento en orden).
+   Cualquier diferencia de semántica entre backends falla aquí.
+2. Rendimiento: operaciones por lote vs. la misma cantidad de llamadas de a
+   una (lo que hacían las funciones de database.py).
+
+Backends: memoria y SQLite de src/storage.py (archivo temporal con el esquema
+de migrations.py) siempre; Firestore de functions/src/storage.py solo si
+FIRESTORE_EMULATOR_HOST apunta a un emulador (tests/test_storage.py lo
+prueba también contra loadtest.fakes.FakeFirestore).
+
+Uso: python bench_storage.py [conversaciones]   (por defecto 200)
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from functions.src import models as functions_models
+from src import migrations
+from src.models import Client
+from src.storage import (ChatExchange, KNOWLEDGE_SEPARATOR, MemoryStorage, SQLiteStorage,
+                         Storage, history_key)
+
+
+# ============================================
+# BACKENDS (cada uno con su forma de precargar datos)
+# ============================================
+
+def memory_backend(clients, knowledge):
+    return MemoryStorage(clients, knowledge), lambda: None
+
+
+def sqlite_backend(clients, knowledge):
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, "storage.db")
+    migrations.migrate(path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO clients (id, name, whatsapp_token, phone_number_id, verify_token) VALUES (?, ?, ?, ?, ?)",
+            [(c['id'], c['name'], "tok", c['phone_number_id'], "vt") for c in clients]
+        )
+        conn.executemany(
+            "INSERT INTO knowledge_base (client_id, content, source_file, document_key, chunk_index) VALUES (?, ?, ?, ?, ?)",
+            [(client_id, chunk, "menu.pdf", "menu.pdf", i) for client_id, chunks in knowledge.items()
+             for i, chunk in enumerate(chunks)]
+        )
+    conn.close()
+    return SQLiteStorage(lambda **kw: sqlite3.connect(path, **kw)), lambda: shutil.rmtree(workdir)
+
+
+def firestore_backend(clients, knowledge):
+    import firebase_admin
+    from firebase_admin import firestore
+    from functions.src.storage import FirestoreStorage
+    try:
+        firebase_admin.initialize_app(options={'projectId': 'zotek-bench'})
+    except ValueError:
+        pass
+    db = firestore.client()
+    prefix = f"bench{int(time.time())}_"
+    for client in clients:
+        ref = db.collection('clients').document(prefix + str(client['id']))
+        ref.set({k: v for k, v in client.items() if k != 'id'})
+        for i, chunk in enumerate(knowledge.get(client['id'], ())):
+            ref.collection('knowledge').document(f"chunk_{i:04d}").set(
+                {'content': chunk, 'document_id': 'doc_menu', 'chunk_index': i})
+    storage = FirestoreStorage(lambda: db)
+    storage.id_prefix = prefix
+    return storage, lambda: None
+
+
+BACKENDS = [("memory", memory_backend), ("sqlite", sqlite_backend)]
+if os.getenv("FIRESTORE_EMULATOR_HOST"):
+    BACKENDS.append(("firestore", firestore_backend))
+
+
+def cid(storage, client_id):
+    """ID del cliente en el backend (Firestore usa un prefijo por corrida)."""
+    return getattr(storage, 'id_prefix', '') + str(client_id)
+
+
+# ============================================
+# CONFORMIDAD
+# ============================================
+
+def conformance(storage):
+    checks = []
+
+    def check(name, condition):
+        checks.append((name, bool(condition)))
+
+    check("implementa Storage", isinstance(storage, Storage))
+
+    tenants = storage.get_tenants_many([cid(storage, 1), cid(storage, 2), cid(storage, 1), cid(storage, 5000)])
+    check("get_tenants_many: solo los existentes, por str(id)", sorted(tenants) == [cid(storage, 1), cid(storage, 2)])
+    # Cada app tiene su copia de models.py: Client de src/ o de functions/src/
+    check("get_tenants_many: retorna Client",
+          all(isinstance(c, (Client, functions_models.Client)) for c in tenants.values()))
+    check("get_tenants_many: datos del cliente", tenants.get(cid(storage, 1), {}).get('phone_number_id') == "pn_1")
+    check("get_tenants_many: lista vacía", storage.get_tenants_many([]) == {})
+
+    client_a, client_b = cid(storage, 1), cid(storage, 2)
+    saved = storage.append_messages([ChatExchange(client_a, "5215550001", f"hola {i}", f"respuesta {i}") for i in range(3)])
+    storage.append_messages([ChatExchange(client_a, "5215550002", "otro usuario", "ok"),
+                             ChatExchange(client_b, "5215550001", "otro cliente", "ok")])
+    check("append_messages: retorna cuántos guardó", saved == 3)
+    check("append_messages: lista vacía", storage.append_messages([]) == 0)
+
+    keys = [(client_a, "5215550001"), (client_a, "5215550002"), (client_b, "5215550001"), (client_b, "000")]
+    history = storage.get_history_many(keys, limit=4)
+    convo = history.get(history_key(client_a, "5215550001"), [])
+    check("get_history_many: todas las llaves pedidas", set(history) == {history_key(*k) for k in keys})
+    check("get_history_many: respeta el límite", len(convo) == 4)
+    check("get_history_many: del más antiguo al más reciente, usuario y luego asistente",
+          [(m.content, m.is_user) for m in convo] ==
+          [("hola 1", True), ("respuesta 1", False), ("hola 2", True), ("respuesta 2", False)])
+    check("get_history_many: aísla por usuario", [m.content for m in history[history_key(client_a, "5215550002")]] == ["otro usuario", "ok"])
+    check("get_history_many: aísla por cliente", [m.content for m in history[history_key(client_b, "5215550001")]] == ["otro cliente", "ok"])
+    check("get_history_many: conversación sin mensajes", history[history_key(client_b, "000")] == [])
+    check("get_history_many: límite impar", len(storage.get_history_many([keys[0]], limit=3)[history_key(*keys[0])]) == 3)
+
+    check("get_knowledge: chunks en orden", storage.get_knowledge(client_a) == KNOWLEDGE_SEPARATOR.join(["uno", "dos", "tres"]))
+    check("get_knowledge: sin conocimiento", storage.get_knowledge(cid(storage, 3)) == "")
+    return checks
+
+
+# ============================================
+# RENDIMIENTO
+# ============================================
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+def performance(storage, conversations):
+    ids = [cid(storage, i % 1000 + 1) for i in range(conversations)]
+    users = [f"52155{i:08d}" for i in range(conversations)]
+    exchanges = [ChatExchange(ids[i], users[i], "¿Tienen cita esta semana?", "Sí, el jueves a las 10:00.")
+                 for i in range(conversations)]
+    keys = list(zip(ids, users))
+
+    # Historial previo: 10 intercambios por conversación
+    storage.append_messages(exchanges * 10)
+    return [
+        ("tenants", timed(lambda: [storage.get_tenants_many([i]) for i in ids]), timed(lambda: storage.get_tenants_many(ids))),
+        ("append", timed(lambda: [storage.append_messages([e]) for e in exchanges]), timed(lambda: storage.append_messages(exchanges))),
+        ("historial", timed(lambda: [storage.get_history_many([k]) for k in keys]), timed(lambda: storage.get_history_many(keys))),
+    ]
+
+
+def main():
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    clients = [{'id': i, 'name': f"Consultorio {i}", 'phone_number_id': f"pn_{i}"} for i in range(1, 1001)]
+    knowledge = {1: ["uno", "dos", "tres"]}
+
+    failures = 0
+    results = []
+    for name, factory in BACKENDS:
+        storage, cleanup = factory(clients, knowledge)
+        try:
+            print(f"\n🔎 {name}")
+            for check_name, passed in conformance(storage):
+                failures += not passed
+                print(f"  {'✅' if passed else '❌'} {check_name}")
+            results.append((name, performance(storage, conversations)))
+        finally:
+            cleanup()
+
+    print(f"\n{conversations} conversaciones — una por una vs. por lote (ms)")
+    print(f"{'backend':<11}{'operación':<11}{'una por una':>13}{'lote':>10}{'x':>8}")
+    for name, rows in results:
+        for operation, single_ms, batch_ms in rows:
+            print(f"{name:<11}{operation:<11}{single_ms:>13.1f}{batch_ms:>10.1f}{single_ms / max(batch_ms, 1e-6):>8.1f}")
+
+    if failures:
+        print(f"\n❌ {failures} verificaciones fallaron")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark de /api/metrics/usage: consultas N+1 vs. agregación agrupada.
+
+Genera una base SQLite temporal con N clientes y M registros en message_logs
+(repartidos entre el mes actual y el anterior) y compara:
+- Antes: get_monthly_message_count + check_message_limit por cliente (2N consultas)
+- Ahora: get_usage_summary (una consulta GROUP BY)
+
+Uso: python bench_usage.py [clientes] [mensajes]
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+
+from src import database
+
+
+def seed(db_path, n_clients, n_logs):
+    database.DB_NAME = db_path
+    database.init_db()
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    plans = ['free', 'basic', 'pro', 'enterprise']
+    cursor.executemany(
+        "INSERT INTO clients (id, name, whatsapp_token, phone_number_id, verify_token, plan) VALUES (?, ?, '', ?, '', ?)",
+        [(i, f"Cliente {i}", f"pnid_{i}", random.choice(plans)) for i in range(1, n_clients + 1)]
+    )
+
+    # 70% del mes actual, 30% del mes anterior
+    batch = []
+    for _ in range(n_logs):
+        days_ago = random.randint(0, 27) if random.random() < 0.7 else random.randint(35, 60)
+        batch.append((random.randint(1, n_clients), random.choice(['inbound', 'outbound']), f"-{days_ago} days"))
+        if len(batch) >= 50000:
+            cursor.executemany(
+                "INSERT INTO message_logs (client_id, direction, created_at) VALUES (?, ?, datetime('now', 'start of month', '+1 day', ?))",
+                batch
+            )
+            batch = []
+    if batch:
+        cursor.executemany(
+            "INSERT INTO message_logs (client_id, direction, created_at) VALUES (?, ?, datetime('now', 'start of month', '+1 day', ?))",
+            batch
+        )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def usage_n_plus_one():
+    usage_data = []
+    for client in database.list_clients():
+        monthly_count = database.get_monthly_message_count(client['id'])
+        plan = client.get('plan', 'free')
+        allowed, message = database.check_message_limit(client['id'], plan)
+        usage_data.append({'client_id': client['id'], 'monthly_messages': monthly_count, 'limit_allowed': allowed})
+    return usage_data
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"{label:<32} {elapsed:10.1f} ms  ({len(result)} clientes)")
+    return result, elapsed
+
+
+if __name__ == "__main__":
+    n_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_logs = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench_usage.db")
+        print(f"📦 Generando {n_clients} clientes x {n_logs} mensajes...")
+        start = time.perf_counter()
+        seed(db_path, n_clients, n_logs)
+        print(f"   listo en {time.perf_counter() - start:.1f}s\n")
+
+        old, old_ms = timed("N+1 (2 consultas por cliente)", usage_n_plus_one)
+        new, new_ms = timed("Agregado (GROUP BY)", database.get_usage_summary)
+
+        old_counts = {row['client_id']: row['monthly_messages'] for row in old}
+        new_counts = {row['client_id']: row['monthly_messages'] for row in new}
+        assert old_counts == new_counts, "Los conteos no coinciden"
+        print(f"\n⚡ Speedup: {old_ms / new_ms:.1f}x")
@@ -0,0 +1,98 @@
+"""
+Benchmark de regresión del webhook: replay de tráfico sintético en proceso.
+
+Genera payloads realistas de Meta (texto, button_reply, list_reply, estados,
+lotes de varios mensajes) para N tenants y M usuarios y los envía a la app
+FastAPI con Gemini, la Graph API de WhatsApp y Firestore simulados (ver
+loadtest/). No necesita red ni llaves: misma semilla, misma carga.
+
+Con --engine genai corre el GeminiEngine real (reintentos incluidos) sobre un
+cliente genai falso con tasas de 503/429; con --graph http los envíos van por
+HTTP a una Graph API local, para medir pooling y concurrencia.
+
+Reporta throughput, latencia p50/p95/p99 del POST /webhook y el desglose por
+span de la app. Con --save guarda la corrida como baseline; con --compare
+falla (exit 1) si el throughput o la latencia empeoran más que --tolerance.
+
+Uso:
+    python bench_webhook.py --target src --requests 2000 --concurrency 16
+    python bench_webhook.py --target functions --gemini-ms 400 --whatsapp-ms 120
+    python bench_webhook.py --target src --engine genai --gemini-503-rate 0.05 --gemini-retry-delay 0.05
+    python bench_webhook.py --target functions --graph http --whatsapp-ms 80 --whatsapp-429-rate 0.01
+    python bench_webhook.py --target src --save baseline_src.json
+    python bench_webhook.py --target src --compare baseline_src.json --tolerance 0.2
+"""
+import argparse
+import json
+import sys
+
+from loadtest import LoadOptions, compare, render, run
+
+
+def parse_args():
+    defaults = LoadOptions()
+    parser = argparse.ArgumentParser(description="Replay offline del webhook con stand-ins")
+    parser.add_argument("--target", choices=("src", "functions"), default="src",
+                        help="App a probar: src (SQLite) o functions (Firestore)")
+    parser.add_argument("--requests", type=int, default=defaults.requests, help="Payloads medidos")
+    parser.add_argument("--tenants", type=int, default=defaults.tenants)
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--concurrency", type=int, default=defaults.concurrency, help="Requests en vuelo")
+    parser.add_argument("--warmup", type=int, default=defaults.warmup, help="Payloads de calentamiento (no se miden)")
+    parser.add_argument("--gemini-ms", type=float, default=defaults.gemini_ms, help="Latencia simulada de Gemini")
+    parser.add_argument("--whatsapp-ms", type=float, default=defaults.whatsapp_ms, help="Latencia simulada de la Graph API")
+    parser.add_argument("--firestore-ms", type=float, default=defaults.firestore_ms, help="Latencia simulada por RPC de Firestore")
+    parser.add_argument("--engine", choices=("stub", "genai"), default=defaults.engine,
+                        help="stub: Gemini simulado entero. genai: GeminiEngine real con el cliente de loadtest/fake_genai.py")
+    parser.add_argument("--gemini-503-rate", type=float, default=defaults.gemini_503_rate, help="Solo --engine genai")
+    parser.add_argument("--gemini-429-rate", type=float, default=defaults.gemini_429_rate, help="Solo --engine genai")
+    parser.add_argument("--gemini-retry-delay", type=float, default=defaults.gemini_retry_delay_seconds,
+                        help="GEMINI_RETRY_DELAY_SECONDS de la app (por defecto el de la app)")
+    parser.add_argument("--graph", choices=("inprocess", "http"), default=defaults.graph,
+                        help="inprocess: requests simulado. http: servidor local loadtest/graph_server.py")
+    parser.add_argument("--whatsapp-error-rate", type=float, default=defaults.whatsapp_error_rate, help="500 de la Graph API (--graph http)")
+    parser.add_argument("--whatsapp-429-rate", type=float, default=defaults.whatsapp_429_rate, help="429 de la Graph API (--graph http)")
+    parser.add_argument("--coalesce-window", type=float, default=defaults.coalesce_window_seconds,
+                        help="COALESCE_WINDOW_SECONDS de la app (0 = sin agrupar)")
+    parser.add_argument("--save", metavar="JSON", help="Guardar la corrida como baseline")
+    parser.add_argument("--compare", metavar="JSON", help="Comparar contra un baseline guardado")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Empeoramiento permitido vs. baseline")
+    parser.add_argument("--verbose", action="store_true", help="No silenciar los prints de la app")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    options = LoadOptions(
+        requests=args.requests, tenants=args.tenants, users=args.users, seed=args.seed,
+        concurrency=args.concurrency, warmup=args.warmup, gemini_ms=args.gemini_ms,
+        whatsapp_ms=args.whatsapp_ms, firestore_ms=args.firestore_ms,
+        coalesce_window_seconds=args.coalesce_window, engine=args.engine,
+        gemini_503_rate=args.gemini_503_rate, gemini_429_rate=args.gemini_429_rate,
+        gemini_retry_delay_seconds=args.gemini_retry_delay, graph=args.graph,
+        whatsapp_error_rate=args.whatsapp_error_rate, whatsapp_429_rate=args.whatsapp_429_rate,
+    )
+    result = run(args.target, options, quiet=not args.verbose)
+    print(render(result))
+    current = result.to_dict()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Baseline guardado en {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ Regresiones vs. {args.compare} (tolerancia {args.tolerance:.0%}):")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print(f"\n✅ Sin regresiones vs. {args.compare} (tolerancia {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
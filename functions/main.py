@@ -8,7 +8,7 @@ import os
 import asyncio
 import io
 
-from firebase_functions import https_fn
+from firebase_functions import https_fn, scheduler_fn
 
 # Ensure the functions src directory is in path
 this_dir = os.path.abspath(os.path.dirname(__file__))
@@ -16,6 +16,8 @@ if this_dir not in sys.path:
     sys.path.insert(0, this_dir)
 
 from src.main import app
+from src import database
+from src.logger import log, flush_logs
 
 
 def asgi_to_response(asgi_app, request: https_fn.Request) -> https_fn.Response:
@@ -86,5 +88,27 @@ def api_handler(req: https_fn.Request) -> https_fn.Response:
     except Exception as e:
         import traceback
         error = f"Fatal error: {e}\n{traceback.format_exc()}"
-        print(error)
+        log.exception("Fatal error", error=str(e))
         return https_fn.Response(error, status=500, content_type="text/plain")
+    finally:
+        # La instancia puede congelarse al responder: vaciar la cola de logs antes
+        flush_logs()
+
+
+# Retención de chats: días a conservar (0 = desactivado)
+CHAT_RETENTION_DAYS = int(os.getenv("CHAT_RETENTION_DAYS", "0"))
+
+
+@scheduler_fn.on_schedule(schedule="every day 03:00", timeout_sec=540, memory=512)
+def chat_retention_job(event: scheduler_fn.ScheduledEvent) -> None:
+    """Borra por páginas los chats más antiguos que CHAT_RETENTION_DAYS de todos los clientes."""
+    if CHAT_RETENTION_DAYS <= 0:
+        return
+    try:
+        results = database.purge_expired_chats(CHAT_RETENTION_DAYS)
+        log.info("Retención de chats completada", retention_days=CHAT_RETENTION_DAYS,
+                 clients=len(results), deleted=sum(r['deleted'] for r in results.values()))
+    except Exception as e:
+        log.exception("Error en la retención de chats", error=str(e))
+    finally:
+        flush_logs()
@@ -0,0 +1,180 @@
+"""
+Ventana de agrupación (coalescing) de mensajes por conversación.
+
+Los usuarios de WhatsApp suelen mandar varios mensajes cortos seguidos
+("hola", "quería saber", "precio de limpieza"). En lugar de una llamada a
+Gemini por mensaje, el primer mensaje de la ráfaga (líder) espera a que pase
+`window_seconds` sin mensajes nuevos de la misma conversación y procesa todos
+los textos juntos; los demás (seguidores) se absorben y no generan respuesta
+propia.
+
+Orden garantizado: cada ráfaga recibe un turno al abrirse y las ráfagas de
+una misma conversación se procesan en orden de turno, aunque la siguiente
+ráfaga se haya cerrado mientras la anterior seguía en Gemini. Los mensajes que
+no se agrupan (botones, listas, comandos) también toman turno con
+`add(..., mergeable=False)`: cierran la ráfaga abierta y esperan a que se
+responda antes. La espera de turno está acotada (`turn_timeout_seconds`): si
+quien tiene el turno no lo libera, se salta su turno.
+
+Desactivado por defecto (`window_seconds=0`): mientras espera, el líder ocupa
+un hilo del executor.
+
+Uso:
+    burst, is_leader = coalescer.add((client_id, user), texto)   # no bloquea
+    if not is_leader:
+        return {"status": "coalesced"}
+    with coalescer.flush(burst) as textos:                       # bloquea la ventana y el turno
+        procesar("\\n".join(textos))
+"""
+
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterator, List, Tuple
+
+
+class Burst:
+    """Ráfaga abierta de mensajes de una conversación."""
+
+    __slots__ = ('key', 'texts', 'first_at', 'last_at', 'ticket', 'closed', 'mergeable')
+
+    def __init__(self, key: Hashable, text: str, ticket: int, mergeable: bool = True):
+        self.key = key
+        self.texts = [text]
+        self.first_at = self.last_at = time.monotonic()
+        self.ticket = ticket
+        # Los no agrupables nacen cerrados: solo esperan su turno
+        self.closed = not mergeable
+        self.mergeable = mergeable
+
+
+class MessageCoalescer:
+    """
+    Agrupa mensajes por conversación dentro de una ventana deslizante.
+
+    Args:
+        window_seconds: Silencio requerido para cerrar la ráfaga (0 = desactivado)
+        max_wait_seconds: Espera máxima desde el primer mensaje de la ráfaga
+        max_messages: Tope de mensajes por ráfaga (al llegar se cierra)
+        turn_timeout_seconds: Espera máxima del turno; al vencer se saltan los
+            turnos anteriores pendientes
+    """
+
+    def __init__(self, window_seconds: float = 0.0, max_wait_seconds: float = 5.0, max_messages: int = 10,
+                 turn_timeout_seconds: float = 60.0):
+        self.window_seconds = window_seconds
+        self.max_wait_seconds = max(max_wait_seconds, window_seconds)
+        self.max_messages = max_messages
+        self.turn_timeout_seconds = turn_timeout_seconds
+        self._cond = threading.Condition()
+        self._open: Dict[Hashable, Burst] = {}
+        # Turnos pendientes por conversación, en orden; el primero es el que se atiende.
+        # Los turnos son únicos en el proceso (no se reutilizan al vaciarse la cola).
+        self._turns: Dict[Hashable, deque] = {}
+        self._ticket_seq = 0
+        self.messages = 0
+        self.bursts = 0
+        self.skipped_turns = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_seconds > 0
+
+    def add(self, key: Hashable, text: str, mergeable: bool = True) -> Tuple[Burst, bool]:
+        """
+        Registra un mensaje sin bloquear.
+
+        Args:
+            key: Conversación (ej. (phone_number_id, usuario))
+            text: Texto del mensaje
+            mergeable: False para mensajes que se responden solos (botones,
+                listas, comandos): cierran la ráfaga abierta y toman turno
+
+        Returns:
+            Tuple (ráfaga, es_lider). Si no es líder, el texto ya quedó en la
+            ráfaga abierta y el mensaje no debe procesarse por separado.
+        """
+        with self._cond:
+            self.messages += 1
+            burst = self._open.get(key)
+            if mergeable and burst is not None and not burst.closed and len(burst.texts) < self.max_messages:
+                burst.texts.append(text)
+                burst.last_at = time.monotonic()
+                self._cond.notify_all()
+                return burst, False
+
+            if burst is not None and not mergeable:
+                # Lo que llegue después no debe sumarse a la ráfaga anterior
+                burst.closed = True
+                del self._open[key]
+                self._cond.notify_all()
+
+            self._ticket_seq += 1
+            self._turns.setdefault(key, deque()).append(self._ticket_seq)
+            burst = Burst(key, text, self._ticket_seq, mergeable)
+            if mergeable:
+                self._open[key] = burst
+            self.bursts += 1
+            return burst, True
+
+    @contextmanager
+    def flush(self, burst: Burst) -> Iterator[List[str]]:
+        """
+        Espera a que cierre la ventana y a que sea el turno de la ráfaga.
+
+        Yields:
+            Lista de textos de la ráfaga en orden de llegada
+        """
+        with self._cond:
+            while not burst.closed:
+                now = time.monotonic()
+                deadline = min(burst.last_at + self.window_seconds, burst.first_at + self.max_wait_seconds)
+                if now >= deadline or len(burst.texts) >= self.max_messages:
+                    break
+                self._cond.wait(deadline - now)
+            burst.closed = True
+            if self._open.get(burst.key) is burst:
+                del self._open[burst.key]
+
+            self._wait_turn(burst)
+            texts = list(burst.texts)
+
+        try:
+            yield texts
+        finally:
+            with self._cond:
+                turns = self._turns.get(burst.key)
+                if turns is not None:
+                    # Si a esta ráfaga le saltaron el turno ya no está en la cola
+                    if burst.ticket in turns:
+                        turns.remove(burst.ticket)
+                    if not turns:
+                        # Conversación sin ráfagas pendientes: liberar memoria
+                        del self._turns[burst.key]
+                self._cond.notify_all()
+
+    def _wait_turn(self, burst: Burst):
+        """Espera (con el lock tomado) a que la ráfaga sea la primera de su cola."""
+        turns = self._turns.get(burst.key)
+        deadline = time.monotonic() + self.turn_timeout_seconds
+        while turns and burst.ticket in turns and turns[0] != burst.ticket:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Quien tiene el turno no lo liberó (se colgó o murió): saltarlo
+                while turns[0] != burst.ticket:
+                    turns.popleft()
+                    self.skipped_turns += 1
+                break
+            self._cond.wait(remaining)
+
+    def stats(self) -> Dict[str, int]:
+        """Mensajes recibidos, ráfagas procesadas y llamadas al LLM ahorradas."""
+        with self._cond:
+            return {
+                'messages': self.messages,
+                'bursts': self.bursts,
+                'llm_calls_saved': self.messages - self.bursts,
+                'open_bursts': len(self._open),
+                'skipped_turns': self.skipped_turns,
+            }
@@ -1,6 +1,18 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
 import os
+import base64
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+from .tracing import tracer
+from .logger import log
+from .services import pdf_text
+from . import purge
+from .demo_registry import demos
+from .models import Client
+from .tenant_snapshot import TenantDirectory
+from .storage import ChatExchange, FirestoreStorage
 
 # Inicializar Firebase Admin si no está inicializado
 try:
@@ -27,111 +39,465 @@ def init_db():
     print("ℹ️ Firestore no requiere init_db tradicional. Esquema bajo demanda.")
     pass
 
+# === Snapshot de tenants (lecturas de clients en memoria) ===
+
+# Documento con el contador de versión de la colección clients; se incrementa en
+# cada escritura de la app y cada instancia lo consulta para recargar su foto
+TENANTS_META = ('meta', 'tenants')
+
+
+def _tenants_meta_ref():
+    return get_db().collection(TENANTS_META[0]).document(TENANTS_META[1])
+
+
+def _load_clients():
+    return [Client.from_snapshot(doc) for doc in get_db().collection('clients').stream()]
+
+
+def _read_tenant_version():
+    doc = _tenants_meta_ref().get()
+    return (doc.to_dict() or {}).get('version', 0) if doc.exists else 0
+
+
+tenants = TenantDirectory(
+    _load_clients,
+    _read_tenant_version,
+    poll_interval_seconds=float(os.getenv("TENANT_POLL_INTERVAL_SECONDS", "30")),
+)
+
+# Backend de la interfaz común de almacenamiento (ver storage.py); get_db se
+# resuelve en cada llamada
+storage = FirestoreStorage(lambda: get_db(), tenants)
+
+
+def mark_tenants_changed(batch=None):
+    """
+    Incrementa la versión de clients (otras instancias recargan al verla) y
+    recarga la foto de esta instancia. Con `batch`, el incremento se agrega al
+    batch y el llamador debe recargar tras el commit.
+    """
+    if batch is not None:
+        batch.set(_tenants_meta_ref(), {'version': firestore.Increment(1)}, merge=True)
+        return
+    try:
+        _tenants_meta_ref().set({'version': firestore.Increment(1)}, merge=True)
+        tenants.refresh()
+    except Exception as e:
+        print(f"⚠️ ERROR actualizando snapshot de tenants: {e}")
+
+
+def _refresh_tenants():
+    try:
+        tenants.refresh()
+    except Exception as e:
+        print(f"⚠️ ERROR actualizando snapshot de tenants: {e}")
+
+
+def _client_from_query(query):
+    for doc in query.stream():
+        # Otra instancia pudo crearlo hace unos segundos: recargar la foto
+        tenants.wake()
+        return Client.from_snapshot(doc)
+    return None
+
+
+@tracer.traced("db.get_client_by_phone_id")
 def get_client_by_phone_id(phone_number_id):
     """Obtiene los datos de un cliente por su Phone Number ID o número de WhatsApp."""
     try:
-        db = get_db()
-        clients_ref = db.collection('clients')
-        
+        # Inmutable: para cambiar campos en una request, client.with_overrides(...)
+        client = tenants.current().get_by_phone(phone_number_id)
+        if client is not None:
+            return client
+
+        clients_ref = get_db().collection('clients')
         # 1. Intentar por phone_number_id (ID numérico de Meta)
-        query = clients_ref.where('phone_number_id', '==', str(phone_number_id)).stream()
-        for doc in query:
-            client_data = doc.to_dict()
-            client_data['id'] = doc.id
-            return client_data
-            
         # 2. Intentar por whatsapp_number (por si Meta envía el número en el webhook)
-        query = clients_ref.where('whatsapp_number', '==', str(phone_number_id)).stream()
-        for doc in query:
-            client_data = doc.to_dict()
-            client_data['id'] = doc.id
-            return client_data
-            
-        return None
+        return (_client_from_query(clients_ref.where('phone_number_id', '==', str(phone_number_id)).limit(1))
+                or _client_from_query(clients_ref.where('whatsapp_number', '==', str(phone_number_id)).limit(1)))
     except Exception as e:
         print(f"❌ ERROR get_client_by_phone_id: {e}")
         return None
 
+def normalize_email(email):
+    """Email de login normalizado (así se guarda y se busca en clients.email)."""
+    return str(email).lower().strip()
+
+@tracer.traced("db.get_client_by_email")
 def get_client_by_email(email):
     """Obtiene un cliente por su email de login (SaaS Phase 3)."""
     if not email: return None
+    client = tenants.current().get_by_email(email)
+    if client is not None:
+        return client
     clients_ref = get_db().collection('clients')
-    query = clients_ref.where('email', '==', str(email).lower().strip()).stream()
-    
-    for doc in query:
-        client_data = doc.to_dict()
-        client_data['id'] = doc.id
-        return client_data
+    return _client_from_query(clients_ref.where('email', '==', normalize_email(email)).limit(1))
+
+@tracer.traced("db.get_client_id_by_email")
+def get_client_id_by_email(email):
+    """
+    ID del cliente vinculado a un email de login.
+
+    Primero en la foto de tenants; si no está, consulta de igualdad sobre el
+    índice de campo único de `email`, limitada a un documento y sin traer sus
+    campos (solo la llave).
+    """
+    if not email: return None
+    client = tenants.current().get_by_email(email)
+    if client is not None:
+        return client['id']
+    query = get_db().collection('clients').where('email', '==', normalize_email(email)).limit(1).select([])
+    for doc in query.stream():
+        tenants.wake()
+        return doc.id
     return None
 
+@tracer.traced("db.get_client_knowledge")
 def get_client_knowledge(client_id):
     """Retorna el contenido de la base de conocimientos de un cliente."""
-    # Buscamos en la subcolección 'knowledge' del cliente
-    knowledge_ref = get_db().collection('clients').document(str(client_id)).collection('knowledge').stream()
-    
-    entries = [doc.to_dict().get('content', '') for doc in knowledge_ref]
-    if not entries:
-        return "Sin base de conocimiento configurada."
-    return "\n\n".join(entries)
+    return storage.get_knowledge(client_id) or "Sin base de conocimiento configurada."
 
+@tracer.traced("db.add_knowledge_entry")
 def add_knowledge_entry(client_id, content, source_file=None):
-    """Agrega una nueva entrada a la base de conocimientos de un cliente."""
-    client_ref = get_db().collection('clients').document(str(client_id))
-    knowledge_ref = client_ref.collection('knowledge').document() # ID automático
-    
-    knowledge_ref.set({
-        'content': content,
+    """
+    Agrega (o reemplaza) una entrada en la base de conocimientos de un cliente.
+
+    La entrada se identifica por `source_file` (o por su contenido si no tiene
+    nombre): volver a subir el mismo contenido no escribe nada.
+    """
+    document_id = knowledge_document_id(source_file, content)
+    manifest = get_knowledge_manifest(client_id, document_id)
+    allowed, usage = check_knowledge_quota(client_id, text_bytes(content), manifest)
+    if not allowed:
+        log.warning("Entrada de conocimiento excede la cuota del plan", client_id=str(client_id), plan=usage['plan'],
+                    projected_bytes=usage['projected_bytes'], quota_bytes=usage['quota_bytes'])
+        return False
+    chunk_hashes = [content_hash(content)]
+    add_knowledge_chunks(client_id, document_id, source_file, [content],
+                         previous_hashes=(manifest or {}).get('chunk_hashes'), chunk_hashes=chunk_hashes)
+    finalize_knowledge_document(client_id, document_id, source_file, chunk_hashes, manifest, text_bytes(content))
+    return True
+
+
+# ============================================
+# VERSIONADO DE CONOCIMIENTO
+# ============================================
+# Cada documento tiene un manifiesto en `knowledge_manifests/{document_id}` con
+# el hash de cada chunk. Los re-uploads idénticos no escriben nada y los
+# documentos modificados solo reescriben los chunks que cambiaron. El campo
+# `knowledge_version` del cliente se incrementa en cada cambio para que los
+# cachés (ej. GeminiEngine) se invaliden sin releer la base de conocimientos.
+
+def content_hash(text):
+    """Hash SHA-256 (hex) de un texto."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def knowledge_document_id(source_file, content=None):
+    """ID estable de un documento: derivado del nombre del archivo (o del contenido)."""
+    key = str(source_file).strip().lower() if source_file else content_hash(content or "")
+    return "doc_" + hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+
+def _document_hash(chunk_hashes):
+    return content_hash("".join(chunk_hashes))
+
+
+def text_bytes(text):
+    """Tamaño en bytes (UTF-8) de un texto, la unidad de las cuotas de conocimiento."""
+    return len(text.encode('utf-8'))
+
+
+def get_knowledge_manifest(client_id, document_id):
+    """Manifiesto (hashes por chunk, versión) de un documento, o None si no existe."""
+    doc = get_db().collection('clients').document(str(client_id)).collection('knowledge_manifests').document(str(document_id)).get()
+    return doc.to_dict() if doc.exists else None
+
+
+def get_knowledge_version(client_id):
+    """Versión actual del conocimiento del cliente (0 si nunca se modificó)."""
+    doc = get_db().collection('clients').document(str(client_id)).get()
+    return (doc.to_dict() or {}).get('knowledge_version', 0) if doc.exists else 0
+
+
+@tracer.traced("db.finalize_knowledge_document")
+def finalize_knowledge_document(client_id, document_id, source_file, chunk_hashes, manifest=None, document_bytes=None):
+    """
+    Cierra la escritura de un documento: elimina los chunks sobrantes de la
+    versión anterior, guarda el manifiesto, incrementa `knowledge_version` y
+    ajusta `knowledge_bytes` del cliente con la diferencia de tamaño.
+
+    Args:
+        client_id: ID del cliente
+        document_id: ID del documento
+        source_file: Nombre del archivo
+        chunk_hashes: Hash de cada chunk de la versión nueva, en orden
+        manifest: Manifiesto previo (de get_knowledge_manifest)
+        document_bytes: Bytes de la versión nueva (para la cuota del plan)
+
+    Returns:
+        Dict con `changed` (bool), `version` del documento y `chunks_deleted`
+    """
+    document_hash = _document_hash(chunk_hashes)
+    if manifest and manifest.get('content_hash') == document_hash:
+        return {'changed': False, 'version': manifest.get('version', 1), 'chunks_deleted': 0}
+
+    db = get_db()
+    client_ref = db.collection('clients').document(str(client_id))
+    knowledge_ref = client_ref.collection('knowledge')
+
+    stale_refs = [knowledge_ref.document(f"{document_id}_{i:05d}")
+                  for i in range(len(chunk_hashes), (manifest or {}).get('chunk_count', 0))]
+    previous_bytes = (manifest or {}).get('bytes', 0)
+    if not manifest and source_file:
+        # Entradas antiguas (sin chunks) del mismo archivo: se reemplazan
+        for doc in knowledge_ref.where('source_file', '==', source_file).stream():
+            data = doc.to_dict()
+            if not data.get('document_id'):
+                stale_refs.append(doc.reference)
+                previous_bytes += text_bytes(data.get('content', ''))
+
+    version = (manifest or {}).get('version', 0) + 1
+    batch = db.batch()
+    pending = 0
+    for ref in stale_refs:
+        batch.delete(ref)
+        pending += 1
+        if pending >= FIRESTORE_BATCH_SIZE:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    batch.set(client_ref.collection('knowledge_manifests').document(str(document_id)), {
         'source_file': source_file,
+        'content_hash': document_hash,
+        'chunk_hashes': chunk_hashes,
+        'chunk_count': len(chunk_hashes),
+        'version': version,
+        'bytes': document_bytes or 0,
         'updated_at': firestore.SERVER_TIMESTAMP
     })
-    return True
+    batch.set(client_ref, {
+        'knowledge_version': firestore.Increment(1),
+        'knowledge_bytes': firestore.Increment((document_bytes or 0) - previous_bytes),
+    }, merge=True)
+    # knowledge_version del cliente invalida la caché de conocimiento de Gemini
+    mark_tenants_changed(batch)
+    batch.commit()
+    _refresh_tenants()
+    return {'changed': True, 'version': version, 'chunks_deleted': len(stale_refs)}
+
+# Máximo de escrituras por batch de Firestore (límite del servicio: 500)
+FIRESTORE_BATCH_SIZE = 400
+
+
+@tracer.traced("db.add_knowledge_chunks")
+def add_knowledge_chunks(client_id, document_id, source_file, chunks, start_index=0, previous_hashes=None, chunk_hashes=None):
+    """
+    Guarda los chunks de un documento en la base de conocimientos usando
+    escrituras en batch.
+
+    Cada chunk es un documento `knowledge/{document_id}_{indice}` con los campos
+    `document_id` y `chunk_index`, así el documento se lista y elimina como uno solo.
+
+    Args:
+        client_id: ID del cliente
+        document_id: ID lógico del documento (ver knowledge_document_id)
+        source_file: Nombre del archivo de origen
+        chunks: Lista de textos
+        start_index: Índice del primer chunk de esta llamada
+        previous_hashes: Hashes por índice de la versión anterior; los chunks
+            con el mismo hash en el mismo índice no se reescriben
+        chunk_hashes: Hashes de `chunks` (se calculan si no se pasan)
+
+    Returns:
+        Cantidad de chunks escritos
+    """
+    db = get_db()
+    knowledge_ref = db.collection('clients').document(str(client_id)).collection('knowledge')
+    previous_hashes = previous_hashes or []
+    chunk_hashes = chunk_hashes or [content_hash(c) for c in chunks]
+    written = 0
+    batch, pending = db.batch(), 0
+    for i, content in enumerate(chunks):
+        chunk_index = start_index + i
+        if chunk_index < len(previous_hashes) and previous_hashes[chunk_index] == chunk_hashes[i]:
+            continue
+        batch.set(knowledge_ref.document(f"{document_id}_{chunk_index:05d}"), {
+            'content': content,
+            'content_hash': chunk_hashes[i],
+            'source_file': source_file,
+            'document_id': document_id,
+            'chunk_index': chunk_index,
+            'updated_at': firestore.SERVER_TIMESTAMP
+        })
+        written += 1
+        pending += 1
+        if pending >= FIRESTORE_BATCH_SIZE:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+    return written
+
+
+# ============================================
+# CUOTA DE CONOCIMIENTO POR PLAN
+# ============================================
+# Mismos límites que `knowledge_base_mb` de Config.CLIENT_PLANS (src/config.py).
+# El campo `knowledge_bytes` del cliente se mantiene con Increment en cada
+# escritura/eliminación; los clientes anteriores a la contabilidad se
+# calculan una vez (recorriendo sus chunks) en el primer uso.
+
+KNOWLEDGE_QUOTA_MB = {'free': 5, 'basic': 20, 'pro': 100, 'enterprise': 500}
+# 'compact': compactar lo que exceda y rechazar solo si aun así no cabe; 'reject': rechazar
+KNOWLEDGE_OVER_QUOTA_POLICY = os.getenv("KNOWLEDGE_OVER_QUOTA_POLICY", "compact")
+
+
+def get_knowledge_quota_bytes(plan):
+    """Cuota de conocimiento de un plan en bytes (-1 = ilimitado)."""
+    megabytes = KNOWLEDGE_QUOTA_MB.get(plan or 'free', KNOWLEDGE_QUOTA_MB['free'])
+    return -1 if megabytes == -1 else int(megabytes * 1024 * 1024)
+
+
+def _recount_knowledge_bytes(client_id):
+    """Bytes reales de la base de conocimientos (recorre todos los chunks)."""
+    knowledge_ref = get_db().collection('clients').document(str(client_id)).collection('knowledge')
+    return sum(text_bytes((doc.to_dict() or {}).get('content', '')) for doc in knowledge_ref.stream())
 
+
+@tracer.traced("db.get_knowledge_usage")
+def get_knowledge_usage(client_id):
+    """
+    Uso de la base de conocimientos de un cliente contra la cuota de su plan.
+
+    Returns:
+        Dict con plan, used_bytes, quota_bytes (-1 = ilimitado) y percent
+    """
+    client_ref = get_db().collection('clients').document(str(client_id))
+    doc = client_ref.get()
+    data = (doc.to_dict() or {}) if doc.exists else {}
+    used = data.get('knowledge_bytes')
+    if used is None and doc.exists:
+        used = _recount_knowledge_bytes(client_id)
+        client_ref.set({'knowledge_bytes': used}, merge=True)
+    plan = data.get('plan') or 'free'
+    quota = get_knowledge_quota_bytes(plan)
+    used = max(0, used or 0)
+    return {
+        'plan': plan,
+        'used_bytes': used,
+        'quota_bytes': quota,
+        'percent': round(used * 100 / quota, 1) if quota > 0 else 0,
+    }
+
+
+def check_knowledge_quota(client_id, new_bytes, manifest=None):
+    """
+    Verifica si un documento de `new_bytes` cabe en la cuota (reemplazando la
+    versión anterior descrita por `manifest`).
+
+    Returns:
+        Tuple (allowed: bool, usage: dict de get_knowledge_usage con `projected_bytes`)
+    """
+    usage = get_knowledge_usage(client_id)
+    projected = usage['used_bytes'] - (manifest or {}).get('bytes', 0) + new_bytes
+    usage['projected_bytes'] = projected
+    return usage['quota_bytes'] == -1 or projected <= usage['quota_bytes'], usage
+
+
+@tracer.traced("db.compact_client_knowledge")
+def compact_client_knowledge(client_id):
+    """
+    Compacta toda la base de conocimientos de un cliente (encabezados/pies
+    repetidos, números de página, líneas y párrafos duplicados, espacios).
+
+    Las entradas antiguas sin chunks se convierten a documentos versionados.
+    Al terminar, `knowledge_bytes` queda con el total real.
+
+    Returns:
+        Dict con documents, documents_compacted, bytes_before, bytes_after y bytes_saved
+    """
+    db = get_db()
+    client_ref = db.collection('clients').document(str(client_id))
+    knowledge_ref = client_ref.collection('knowledge')
+
+    documents = {}
+    for doc in knowledge_ref.stream():
+        data = doc.to_dict() or {}
+        document_id = data.get('document_id')
+        entry = documents.setdefault(document_id or doc.id, {
+            'document_id': document_id, 'legacy_id': None if document_id else doc.id,
+            'source_file': data.get('source_file'), 'chunks': []})
+        entry['chunks'].append((data.get('chunk_index', 0), data.get('content', '')))
+
+    bytes_before = bytes_after = compacted_count = 0
+    for entry in documents.values():
+        chunks = [content for _, content in sorted(entry['chunks'], key=lambda item: item[0])]
+        size = sum(text_bytes(chunk) for chunk in chunks)
+        compacted = pdf_text.compact_chunks(chunks, max(len(chunk) for chunk in chunks) or 1)
+        compacted_size = sum(text_bytes(chunk) for chunk in compacted)
+        bytes_before += size
+        if not compacted or compacted_size >= size:
+            bytes_after += size
+            continue
+
+        document_id = entry['document_id'] or knowledge_document_id(entry['source_file'], "".join(chunks))
+        manifest = get_knowledge_manifest(client_id, document_id) if entry['document_id'] else None
+        chunk_hashes = [content_hash(chunk) for chunk in compacted]
+        add_knowledge_chunks(client_id, document_id, entry['source_file'], compacted,
+                             previous_hashes=(manifest or {}).get('chunk_hashes'), chunk_hashes=chunk_hashes)
+        finalize_knowledge_document(client_id, document_id, entry['source_file'], chunk_hashes, manifest, compacted_size)
+        if entry['legacy_id'] and not entry['source_file']:
+            # finalize_knowledge_document solo reemplaza entradas antiguas con nombre de archivo
+            knowledge_ref.document(entry['legacy_id']).delete()
+        bytes_after += compacted_size
+        compacted_count += 1
+
+    client_ref.set({'knowledge_bytes': bytes_after}, merge=True)
+    log.info("Conocimiento compactado", client_id=str(client_id), bytes_before=bytes_before, bytes_after=bytes_after,
+             documents_compacted=compacted_count, documents=len(documents))
+    return {
+        'documents': len(documents),
+        'documents_compacted': compacted_count,
+        'bytes_before': bytes_before,
+        'bytes_after': bytes_after,
+        'bytes_saved': bytes_before - bytes_after,
+    }
+
+
+def save_ingest_job(client_id, job_id, data):
+    """Guarda el estado de un job de ingesta (consultable desde cualquier instancia)."""
+    try:
+        job_ref = get_db().collection('clients').document(str(client_id)).collection('ingest_jobs').document(str(job_id))
+        job_ref.set({**data, 'updated_at': firestore.SERVER_TIMESTAMP}, merge=True)
+        return True
+    except Exception as e:
+        log.error("Error guardando job de ingesta", client_id=str(client_id), job_id=str(job_id), error=str(e))
+        return False
+
+
+def get_ingest_job(client_id, job_id):
+    """Obtiene el estado de un job de ingesta."""
+    doc = get_db().collection('clients').document(str(client_id)).collection('ingest_jobs').document(str(job_id)).get()
+    if not doc.exists:
+        return None
+    data = doc.to_dict()
+    if data.get('updated_at'):
+        data['updated_at'] = str(data['updated_at'])
+    return data
+
+@tracer.traced("db.list_clients")
 def list_clients():
     """Retorna una lista de todos los clientes, incluyendo los de demostración."""
-    clients_ref = get_db().collection('clients').stream()
     clients = []
     
-    # Inyectar clientes demo
-    demo_clients = [
-        {
-            "id": "demo_restaurante", 
-            "name": "🍕 Demo Restaurante V9", 
-            "phone": "521550000001",
-            "phone_number_id": "demo_123", 
-            "email": "demo@zotek.ia",
-            "response_type": "text",
-            "gemini_prompt": "Eres el asistente de una Pizzería Gourmet. Saluda con entusiasmo y ofrece las pizzas del día.",
-            "created_at": "2024-01-01 00:00:00"
-        },
-        {
-            "id": "demo_clinica", 
-            "name": "🏥 Demo Clínica Dental", 
-            "phone": "521550000002",
-            "phone_number_id": "demo_456", 
-            "email": "demo@zotek.ia",
-            "response_type": "text",
-            "gemini_prompt": "Eres el asistente de una Clínica Dental. Ayuda a los pacientes a conocer los servicios de ortodoncia y limpieza.",
-            "created_at": "2024-01-01 00:00:00"
-        },
-        {
-            "id": "demo_tienda", 
-            "name": "🛍️ Demo Tienda e-Commerce", 
-            "phone": "521550000003",
-            "phone_number_id": "demo_789", 
-            "email": "demo@zotek.ia",
-            "response_type": "text",
-            "gemini_prompt": "Eres el asistente de una tienda de gadgets tecnológicos. Recomienda los mejores productos según las necesidades del cliente.",
-            "created_at": "2024-01-01 00:00:00"
-        }
-    ]
+    # Inyectar clientes demo (registro precargado)
+    demo_clients = demos.firestore_listing()
     clients.extend(demo_clients)
     
-    for doc in clients_ref:
-        if doc.id in ["demo_restaurante", "demo_clinica", "demo_tienda"]:
+    for client in tenants.current().clients:
+        if demos.by_client_id(client['id']):
             continue
-        client_data = doc.to_dict()
-        client_data['id'] = doc.id
-        clients.append(client_data)
+        clients.append(client.as_dict(include_none=False))
     return clients
 
 def update_client(client_id, data):
@@ -140,8 +506,11 @@ def update_client(client_id, data):
         # Limpiar el ID de los datos para no guardarlo como campo si viene incluido
         if 'id' in data:
             del data['id']
+        if data.get('email'):
+            data['email'] = normalize_email(data['email'])
             
         get_db().collection('clients').document(str(client_id)).update(data)
+        mark_tenants_changed()
         return True
     except Exception as e:
         print(f"❌ ERROR UPDATE CLIENT (Firestore): {e}")
@@ -153,27 +522,33 @@ def add_client(data):
         # Firestore puede generar el ID solo
         doc_ref = get_db().collection('clients').document()
         doc_data = data.copy()
+        if doc_data.get('email'):
+            doc_data['email'] = normalize_email(doc_data['email'])
         doc_data['created_at'] = firestore.SERVER_TIMESTAMP
         doc_ref.set(doc_data)
+        mark_tenants_changed()
         return True
     except Exception as e:
         print(f"❌ ERROR ADD CLIENT (Firestore): {e}")
         return False
 
+@tracer.traced("db.get_client_by_id")
 def get_client_by_id(client_id):
     """Obtiene un cliente por su ID (document string en Firestore)."""
+    client = tenants.current().get_by_id(client_id)
+    if client is not None:
+        return client
     doc_ref = get_db().collection('clients').document(str(client_id)).get()
     if doc_ref.exists:
-        client_data = doc_ref.to_dict()
-        client_data['id'] = doc_ref.id
-        return client_data
+        tenants.wake()
+        return Client.from_snapshot(doc_ref)
     return None
 
 def list_client_documents(client_id):
     """Lista los archivos de conocimiento de un cliente."""
     knowledge_ref = get_db().collection('clients').document(str(client_id)).collection('knowledge').stream()
     
-    docs = []
+    docs = {}
     for doc in knowledge_ref:
         doc_data = doc.to_dict()
         # Convertir timestamp a string si es necesario para el frontend
@@ -181,61 +556,252 @@ def list_client_documents(client_id):
         if updated_at:
             doc_data['updated_at'] = str(updated_at)
         
-        docs.append({
-            'id': doc.id,
+        # Los chunks de un documento se muestran como una sola entrada
+        document_id = doc_data.get('document_id') or doc.id
+        if document_id in docs:
+            docs[document_id]['chunks'] += 1
+            continue
+        docs[document_id] = {
+            'id': document_id,
             'source_file': doc_data.get('source_file') or 'Documento sin nombre',
-            'updated_at': doc_data.get('updated_at', '')
-        })
-    return docs
+            'updated_at': doc_data.get('updated_at', ''),
+            'chunks': 1
+        }
+    return list(docs.values())
 
 
 def delete_knowledge_entry(client_id, doc_id):
     """Elimina una entrada de la base de conocimientos de un cliente."""
     try:
-        doc_ref = get_db().collection('clients').document(str(client_id)).collection('knowledge').document(str(doc_id))
-        doc_ref.delete()
+        db = get_db()
+        get_knowledge_usage(client_id)  # Asegura el conteo inicial antes del decremento
+        knowledge_ref = db.collection('clients').document(str(client_id)).collection('knowledge')
+        client_ref = db.collection('clients').document(str(client_id))
+        chunk_docs = list(knowledge_ref.where('document_id', '==', str(doc_id)).stream())
+        if not chunk_docs:
+            # Entrada antigua (un solo documento sin chunks)
+            legacy = knowledge_ref.document(str(doc_id)).get()
+            chunk_docs = [legacy] if legacy.exists else []
+        chunk_refs = [doc.reference for doc in chunk_docs] or [knowledge_ref.document(str(doc_id))]
+        removed_bytes = sum(text_bytes(doc.to_dict().get('content', '')) for doc in chunk_docs)
+        chunk_refs.append(client_ref.collection('knowledge_manifests').document(str(doc_id)))
+        for offset in range(0, len(chunk_refs), FIRESTORE_BATCH_SIZE):
+            batch = db.batch()
+            for ref in chunk_refs[offset:offset + FIRESTORE_BATCH_SIZE]:
+                batch.delete(ref)
+            batch.commit()
+        client_ref.set({
+            'knowledge_version': firestore.Increment(1),
+            'knowledge_bytes': firestore.Increment(-removed_bytes),
+        }, merge=True)
+        mark_tenants_changed()
         return True
     except Exception as e:
         print(f"❌ ERROR DELETE KNOWLEDGE (Firestore): {e}")
         return False
 
+@tracer.traced("db.save_chat_message")
 def save_chat_message(client_id, user_number, message, response):
     """Guarda un mensaje de chat en Firestore para el historial."""
     try:
-        chat_ref = get_db().collection('clients').document(str(client_id)).collection('chats').document()
-        chat_ref.set({
-            'user_number': user_number,
-            'message': message,
-            'response': response,
-            'timestamp': firestore.SERVER_TIMESTAMP
-        })
+        storage.append_messages([ChatExchange(client_id, user_number, message, response)])
         return True
     except Exception as e:
         print(f"❌ ERROR SAVE CHAT (Firestore): {e}")
         return False
 
+# Campos de un chat que se pueden pedir con `fields` (proyección)
+CHAT_FIELDS = ('user_number', 'message', 'response', 'timestamp')
+CHATS_MAX_PAGE_SIZE = 200
+
+
+class InvalidChatCursor(ValueError):
+    """`start_after` que no salió de `next_cursor` (o de otra versión del formato)."""
+
+
+def encode_chat_cursor(timestamp, doc_id) -> str:
+    """
+    Cursor opaco de la página de chats: (timestamp, ID) del último chat entregado.
+
+    No depende de que el documento siga existiendo (retención o purga).
+    """
+    raw = f"{timestamp.isoformat()}|{doc_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_chat_cursor(cursor: str):
+    """
+    Returns:
+        Tuple (timestamp, doc_id)
+
+    Raises:
+        InvalidChatCursor: Si el cursor no tiene el formato de `encode_chat_cursor`
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        timestamp, doc_id = raw.split('|', 1)
+        timestamp = datetime.fromisoformat(timestamp)
+    except ValueError as e:
+        raise InvalidChatCursor(str(cursor)) from e
+    if not doc_id or timestamp.tzinfo is None:
+        raise InvalidChatCursor(str(cursor))
+    return timestamp, doc_id
+
+
+def _chat_to_dict(doc):
+    chat_data = doc.to_dict() or {}
+    chat_data['id'] = doc.id
+    # Convertir timestamp a ISO string para JSON
+    ts = chat_data.get('timestamp')
+    if ts and hasattr(ts, 'isoformat'):
+        chat_data['timestamp'] = ts.isoformat()
+    return chat_data
+
+
+def group_chats_by_user(chats):
+    """
+    Agrupa chats (más recientes primero) en hilos por usuario.
+
+    Returns:
+        Lista de {user_number, last_timestamp, count, messages} ordenada por el
+        último mensaje; los mensajes de cada hilo van en orden cronológico
+    """
+    threads = {}
+    for chat in chats:
+        thread = threads.setdefault(chat.get('user_number'), {
+            'user_number': chat.get('user_number'),
+            'last_timestamp': chat.get('timestamp'),
+            'count': 0,
+            'messages': [],
+        })
+        thread['count'] += 1
+        thread['messages'].append(chat)
+    for thread in threads.values():
+        thread['messages'].reverse()
+    return list(threads.values())
+
+
+@tracer.traced("db.get_client_chats_page")
+def get_client_chats_page(client_id, limit=50, start_after=None, user_number=None, since=None, until=None,
+                          fields=None, threads=False):
+    """
+    Página de chats de un cliente, del más reciente al más antiguo.
+
+    Args:
+        client_id: ID del cliente
+        limit: Chats por página (máx. CHATS_MAX_PAGE_SIZE)
+        start_after: Cursor (`next_cursor` de la página anterior); InvalidChatCursor si no es válido
+        user_number: Filtrar por número del usuario
+        since / until: datetime para filtrar por rango [since, until)
+        fields: Campos a traer (subconjunto de CHAT_FIELDS); None = todos
+        threads: Si True, agrupa la página en hilos por usuario
+
+    Returns:
+        Dict con `chats` (o `threads`), `next_cursor` (None en la última página) y `has_more`
+    """
+    limit = max(1, min(int(limit), CHATS_MAX_PAGE_SIZE))
+    chats_ref = get_db().collection('clients').document(str(client_id)).collection('chats')
+    query = chats_ref
+    if user_number:
+        query = query.where('user_number', '==', str(user_number))
+    if since:
+        query = query.where('timestamp', '>=', since)
+    if until:
+        query = query.where('timestamp', '<', until)
+    # __name__ desempata chats con el mismo timestamp (es el orden implícito de Firestore)
+    query = (query.order_by('timestamp', direction=firestore.Query.DESCENDING)
+             .order_by('__name__', direction=firestore.Query.DESCENDING))
+
+    if fields:
+        # timestamp y user_number se necesitan para el orden y los hilos
+        required = {'timestamp', 'user_number'} if threads else {'timestamp'}
+        query = query.select(sorted(set(fields) | required))
+    if start_after:
+        timestamp, doc_id = decode_chat_cursor(str(start_after))
+        query = query.start_after({'timestamp': timestamp, '__name__': doc_id})
+
+    # Un documento extra indica si hay otra página sin hacer una consulta más
+    docs = list(query.limit(limit + 1).stream())
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    chats = [_chat_to_dict(doc) for doc in docs]
+
+    page = {
+        'next_cursor': encode_chat_cursor(docs[-1].get('timestamp'), docs[-1].id) if has_more else None,
+        'has_more': has_more,
+    }
+    if threads:
+        page['threads'] = group_chats_by_user(chats)
+    else:
+        page['chats'] = chats
+    return page
+
+
+@tracer.traced("db.get_client_chats")
 def get_client_chats(client_id, limit=50):
     """Obtiene los últimos mensajes de chat de un cliente."""
     try:
-        chats_ref = get_db().collection('clients').document(str(client_id)).collection('chats')
-        query = chats_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit).stream()
-        
-        chats = []
-        for doc in query:
-            chat_data = doc.to_dict()
-            chat_data['id'] = doc.id
-            # Convertir timestamp a ISO string para JSON
-            ts = chat_data.get('timestamp')
-            if ts:
-                chat_data['timestamp'] = ts.isoformat()
-            chats.append(chat_data)
-        return chats
+        return get_client_chats_page(client_id, limit=limit)['chats']
     except Exception as e:
         print(f"❌ ERROR GET CHATS (Firestore): {e}")
         return []
 
+# --- BORRADO PAGINADO (reset de demos, bajas y retención) ---
+
+@tracer.traced("db.purge_client_chats")
+def purge_client_chats(client_id, older_than_days=None, on_progress=None):
+    """
+    Borra los chats de un cliente por páginas y batches acotados.
+
+    Args:
+        client_id: ID del cliente
+        older_than_days: Solo chats más antiguos que N días (None = todos)
+        on_progress: Función que recibe {deleted, batches, seconds} tras cada batch
+
+    Returns:
+        Dict con deleted, batches y seconds
+    """
+    query = get_db().collection('clients').document(str(client_id)).collection('chats')
+    if older_than_days:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+        query = query.where('timestamp', '<', cutoff)
+    return purge.purge_query(get_db(), query, on_progress=on_progress)
+
+
+@tracer.traced("db.delete_client")
+def delete_client(client_id, on_progress=None):
+    """
+    Elimina un cliente con todas sus subcolecciones (chats, conocimiento,
+    manifiestos, jobs de ingesta y configuración).
+
+    Returns:
+        Dict con deleted, batches y seconds
+    """
+    client_ref = get_db().collection('clients').document(str(client_id))
+    result = purge.purge_document(get_db(), client_ref, purge.TENANT_SUBCOLLECTIONS, on_progress=on_progress)
+    mark_tenants_changed()
+    return result
+
+
+def purge_expired_chats(retention_days):
+    """
+    Job de retención: borra de todos los clientes los chats más antiguos que
+    `retention_days`.
+
+    Returns:
+        Dict {client_id: resultado del borrado} (solo clientes con chats borrados)
+    """
+    results = {}
+    for doc in get_db().collection('clients').select([]).stream():
+        result = purge_client_chats(doc.id, older_than_days=retention_days)
+        if result['deleted']:
+            results[doc.id] = result
+    return results
+
+
 # --- GESTIÓN DE SESIONES DE DEMO (SANDBOX) ---
 
+@tracer.traced("db.get_user_session")
 def get_user_session(user_number):
     """Obtiene la sesión de sandbox actual para un número de usuario."""
     try:
@@ -247,6 +813,7 @@ def get_user_session(user_number):
         print(f"❌ ERROR GET USER SESSION: {e}")
         return None
 
+@tracer.traced("db.save_user_session")
 def save_user_session(user_number, session_data):
     """Guarda o actualiza la sesión de sandbox para un número de usuario."""
     try:
@@ -257,6 +824,7 @@ def save_user_session(user_number, session_data):
         print(f"❌ ERROR SAVE USER SESSION: {e}")
         return False
 
+@tracer.traced("db.delete_user_session")
 def delete_user_session(user_number):
     """Elimina la sesión de sandbox de un usuario (para salir de la demo)."""
     try:
@@ -0,0 +1,185 @@
+"""
+Logging estructurado (JSON), con niveles, no bloqueante y con redacción de PII.
+
+- Cada línea es un objeto JSON compatible con Cloud Logging (campo `severity`)
+  e incluye el trace_id del span actual.
+- Los registros se encolan (QueueHandler) y un hilo (QueueListener) los escribe
+  en stdout, así el webhook no paga el syscall de escritura por cada log.
+- Los logs DEBUG se muestrean con LOG_DEBUG_SAMPLE_RATE.
+- Los campos con teléfonos, textos de usuario o tokens se sanitizan antes de encolar.
+
+Uso:
+    from .logger import log
+    log.info("Mensaje recibido", user_number=numero, phone_number_id=pnid)
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+from .tracing import tracer
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_PHONE_VISIBLE_DIGITS = 4
+LOG_MESSAGE_PREVIEW_LENGTH = 50
+
+PHONE_FIELDS = {'phone', 'user_number', 'numero', 'numero_usuario', 'to', 'from', 'wa_id'}
+TEXT_FIELDS = {'text', 'texto', 'message', 'prompt', 'response', 'body', 'response_body'}
+SECRET_FIELDS = {'token', 'whatsapp_token', 'access_token', 'password', 'code'}
+
+
+def sanitize_phone(phone: str, visible_digits: int = LOG_PHONE_VISIBLE_DIGITS) -> str:
+    """Sanitiza un número de teléfono para logs, mostrando solo los últimos dígitos."""
+    phone = str(phone)
+    if len(phone) > visible_digits:
+        return "*" * (len(phone) - visible_digits) + phone[-visible_digits:]
+    return phone
+
+
+def sanitize_message_preview(message: str, max_length: int = LOG_MESSAGE_PREVIEW_LENGTH) -> str:
+    """Trunca un mensaje para logs, mostrando solo un preview."""
+    message = str(message)
+    if len(message) <= max_length:
+        return message
+    return message[:max_length] + "..."
+
+
+def redact_fields(fields: dict) -> dict:
+    """Aplica la redacción de PII a los campos estructurados de un log."""
+    redacted = {}
+    for key, value in fields.items():
+        if value is None:
+            redacted[key] = value
+        elif key in SECRET_FIELDS:
+            redacted[key] = "***"
+        elif key in PHONE_FIELDS:
+            redacted[key] = sanitize_phone(value)
+        elif key in TEXT_FIELDS:
+            redacted[key] = sanitize_message_preview(value)
+        else:
+            redacted[key] = value
+    return redacted
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatea cada registro como una línea JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'severity': record.levelname,
+            'message': record.getMessage(),
+            'logger': record.name,
+        }
+        trace_id = getattr(record, 'trace_id', None)
+        if trace_id:
+            entry['trace_id'] = trace_id
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _DebugSampler(logging.Filter):
+    """Deja pasar solo una fracción de los logs DEBUG."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        return random.random() < LOG_DEBUG_SAMPLE_RATE
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta en lugar de bloquear si la cola está llena."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolver la excepción en el hilo de origen (el traceback no viaja bien)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_stream_handler = logging.StreamHandler(sys.stdout)
+_stream_handler.setFormatter(JsonFormatter())
+_listener = logging.handlers.QueueListener(_queue, _stream_handler, respect_handler_level=False)
+
+_base_logger = logging.getLogger("zotek")
+_base_logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+_base_logger.propagate = False
+_queue_handler = _NonBlockingQueueHandler(_queue)
+_queue_handler.addFilter(_DebugSampler())
+_base_logger.addHandler(_queue_handler)
+
+_listener.start()
+atexit.register(_listener.stop)
+
+
+def flush_logs(timeout: float = 1.0):
+    """
+    Espera a que el hilo de logging vacíe la cola (ej. antes de que la instancia
+    serverless se congele al terminar el request).
+    """
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+class StructuredLogger:
+    """Fachada con campos como kwargs: log.info("evento", campo=valor)."""
+
+    __slots__ = ('_logger',)
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    def _log(self, level: int, msg: str, exc_info=None, **fields):
+        if not self._logger.isEnabledFor(level):
+            return
+        extra = {'fields': redact_fields(fields) if fields else None, 'trace_id': tracer.current_trace_id()}
+        self._logger.log(level, msg, exc_info=exc_info, extra=extra)
+
+    def isEnabledFor(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def debug(self, msg: str, **fields):
+        self._log(logging.DEBUG, msg, **fields)
+
+    def info(self, msg: str, **fields):
+        self._log(logging.INFO, msg, **fields)
+
+    def warning(self, msg: str, **fields):
+        self._log(logging.WARNING, msg, **fields)
+
+    def error(self, msg: str, **fields):
+        self._log(logging.ERROR, msg, **fields)
+
+    def exception(self, msg: str, **fields):
+        self._log(logging.ERROR, msg, exc_info=True, **fields)
+
+
+def get_logger(name: str = None) -> StructuredLogger:
+    return StructuredLogger(_base_logger.getChild(name) if name else _base_logger)
+
+
+log = get_logger()
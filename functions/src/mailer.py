@@ -0,0 +1,184 @@
+"""
+Envío de emails en segundo plano con una conexión SMTP reutilizable.
+
+Conectar, hacer STARTTLS y autenticarse con Gmail toma segundos; hacerlo dentro
+de un handler `async` bloquea el event loop. `SMTPMailer` recibe los mensajes
+en una cola acotada y un hilo trabajador los envía:
+
+- Reutiliza la conexión autenticada entre envíos y la cierra tras
+  `idle_timeout` segundos sin mensajes
+- Reintenta con backoff exponencial los errores transitorios (desconexión,
+  red, respuestas 4xx); los permanentes (5xx, autenticación) fallan de inmediato
+- `submit()` regresa al instante con un Future que se resuelve al entregar
+
+Mismo módulo en src/ y functions/src/.
+"""
+
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import Future
+from email.message import Message
+from typing import Any, Callable, Dict, Optional
+
+MAIL_QUEUE_SIZE = 100
+MAIL_MAX_RETRIES = 3
+MAIL_BACKOFF_SECONDS = 1.0
+MAIL_IDLE_TIMEOUT_SECONDS = 60
+MAIL_CONNECT_TIMEOUT_SECONDS = 15
+
+
+class MailQueueFull(Exception):
+    """La cola de envío está llena."""
+
+
+def _is_transient(error: Exception) -> bool:
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    return isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError))
+
+
+class SMTPMailer:
+    """Cola de salida de emails con un hilo trabajador y conexión persistente."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 587,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        starttls: bool = True,
+        queue_size: int = MAIL_QUEUE_SIZE,
+        max_retries: int = MAIL_MAX_RETRIES,
+        backoff_seconds: float = MAIL_BACKOFF_SECONDS,
+        idle_timeout: float = MAIL_IDLE_TIMEOUT_SECONDS,
+        connect_timeout: float = MAIL_CONNECT_TIMEOUT_SECONDS,
+        on_error: Optional[Callable[[Message, Exception], None]] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.on_error = on_error
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._counters = {"sent": 0, "failed": 0, "retries": 0, "connections": 0}
+
+    # ============================================
+    # API
+    # ============================================
+
+    def submit(self, message: Message) -> Future:
+        """
+        Encola un mensaje para envío.
+
+        Returns:
+            Future que se resuelve en True al entregarse (o con la excepción final)
+
+        Raises:
+            MailQueueFull: si la cola está llena
+        """
+        self._ensure_worker()
+        future: Future = Future()
+        try:
+            self._queue.put_nowait((message, future))
+        except queue.Full:
+            raise MailQueueFull(f"Cola de email llena ({self._queue.maxsize})")
+        return future
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._counters, queued=self._queue.qsize(), connected=self._smtp is not None)
+
+    def close(self, timeout: float = 5.0):
+        """Detiene el trabajador después de vaciar la cola."""
+        if self._thread and self._thread.is_alive():
+            self._queue.put((None, None))
+            self._thread.join(timeout)
+
+    # ============================================
+    # TRABAJADOR
+    # ============================================
+
+    def _ensure_worker(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="smtp-mailer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                message, future = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._disconnect()
+                continue
+            if message is None:
+                self._disconnect()
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self._deliver(message)
+                self._counters["sent"] += 1
+                future.set_result(True)
+            except Exception as e:
+                self._counters["failed"] += 1
+                if self.on_error:
+                    try:
+                        self.on_error(message, e)
+                    except Exception:
+                        pass
+                future.set_exception(e)
+
+    def _deliver(self, message: Message):
+        attempt = 0
+        while True:
+            try:
+                self._connection().send_message(message)
+                return
+            except Exception as e:
+                # La conexión puede quedar en mal estado: reconectar en el siguiente intento
+                self._disconnect()
+                if attempt >= self.max_retries or not _is_transient(e):
+                    raise
+                self._counters["retries"] += 1
+                time.sleep(self.backoff_seconds * (2 ** attempt))
+                attempt += 1
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.connect_timeout)
+            try:
+                if self.starttls:
+                    smtp.starttls()
+                if self.username and self.password:
+                    smtp.login(self.username, self.password)
+            except Exception:
+                smtp.close()
+                raise
+            self._smtp = smtp
+            self._counters["connections"] += 1
+        return self._smtp
+
+    def _disconnect(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                self._smtp.close()
+            self._smtp = None
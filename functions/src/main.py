@@ -1,12 +1,11 @@
 import os
 # Triggering redeploy for dynamic prompt fix
 import random
+import asyncio
 import threading
-import smtplib
 from email.mime.text import MIMEText
-from datetime import datetime, timedelta
-from collections import deque
-import sys # Added for sys.stdout.flush()
+from datetime import datetime, timedelta, timezone
+from typing import List
 
 from fastapi import FastAPI, Request, HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordBearer
@@ -15,18 +14,24 @@ from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from dotenv import load_dotenv
-import io
 import sqlite3
 import traceback # Added for traceback.format_exc()
 
-try:
-    from pypdf import PdfReader
-except ImportError:
-    PdfReader = None
-
 # Local imports
 from . import database
-from .services import whatsapp_service
+from .demo_registry import demos, DEMO_START_PHRASE
+from . import tracing
+from .tracing import tracer
+from .logger import log
+from .jsonutil import FastJSONResponse
+from .auth_cache import Principal, TokenCache
+from . import verification_store
+from .mailer import SMTPMailer, MailQueueFull
+from .models import InboundMessage, Menu
+from .schemas import ClientOut, ChatsPage
+from . import webhook_batch
+from .coalescer import MessageCoalescer
+from .services import whatsapp_service, pdf_ingestion, pdf_text
 from .services.gemini_service import GeminiEngine
 
 # Load configuration
@@ -40,14 +45,18 @@ ADMIN_EMAILS = [
     ADMIN_EMAIL,
     "morentinomar@gmail.com"
 ]
+ADMIN_EMAIL_SET = {e.lower().strip() for e in ADMIN_EMAILS if e}
 EMAIL_PASSWORD = os.getenv("EMAIL_APP_PASSWORD")
 
 # Security
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/verify-code")
 
-# In-memory storage for 2FA codes (In production use Redis)
-verification_codes = {}  # {email: {"code": str, "expiry": datetime}}
+# Códigos 2FA en Firestore: request-code y verify-code pueden caer en instancias distintas
+if os.getenv("VERIFICATION_CODE_STORE", "firestore") == "memory":
+    verification_codes = verification_store.MemoryVerificationStore(SECRET_KEY)
+else:
+    verification_codes = verification_store.FirestoreVerificationStore(database.get_db, SECRET_KEY)
 
 # Paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -55,11 +64,27 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Pero el hosting sirve desde el root /workspace/www
 # Es mejor no depender de archivos estáticos en FastAPI si usamos Firebase Hosting.
 
-app = FastAPI()
+# Respuestas serializadas con orjson (FastJSONResponse) en lugar de json estándar
+app = FastAPI(default_response_class=FastJSONResponse)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Abre el span raíz de cada request al webhook o la API para medirlas por etapas."""
+    if not tracing.should_trace(request.url.path):
+        with tracer.suppressed():
+            return await call_next(request)
+    with tracer.span(f"{request.method} {request.url.path}", **{'http.method': request.method, 'http.route': request.url.path}) as span:
+        response = await call_next(request)
+        span.set_attribute('http.status_code', response.status_code)
+        response.headers['X-Trace-Id'] = span.trace_id
+        return response
+
 
 @app.get("/api/health")
 async def health_check():
-    return {"status": "ok", "timestamp": datetime.now().isoformat()}
+    return {"status": "ok", "timestamp": datetime.now().isoformat(), "coalescing": coalescer.stats(),
+            "tenants": database.tenants.stats()}
 
 @app.get("/api/test-whatsapp")
 async def test_whatsapp(to: str = "523123173431"):
@@ -83,7 +108,7 @@ async def test_whatsapp(to: str = "523123173431"):
         
         # Step 4: Test WhatsApp API - Send Message
         import requests as req
-        url = f"https://graph.facebook.com/v22.0/{phone_id}/messages"
+        url = f"{whatsapp_service.WHATSAPP_API_BASE_URL}/{phone_id}/messages"
         headers = {
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/json"
@@ -117,19 +142,32 @@ async def test_whatsapp(to: str = "523123173431"):
 
 
 # Cache for WhatsApp retries
-PROCESSED_MESSAGES = deque(maxlen=100)
+PROCESSED_MESSAGES = webhook_batch.RecentIds(1000)
+
+# Conversaciones procesándose en paralelo por payload del webhook
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "8"))
+
+# Ventana de agrupación de ráfagas por conversación (0 = desactivado).
+# Solo agrupa mensajes que llegan a la misma instancia.
+coalescer = MessageCoalescer(
+    window_seconds=float(os.getenv("COALESCE_WINDOW_SECONDS", "0")),
+    max_wait_seconds=5.0,
+    max_messages=10,
+)
+
+DEMO_EXIT_COMMANDS = ["salir", "terminar", "terminar demo", "salir demo"]
 
 # Initialize DB at module level (Firebase copies DB to /tmp, locally creates tables)
 database.init_db()
 
 # Initialize Gemini at module level (startup events don't fire in our custom ASGI bridge)
 gemini = None
-print(f"GEMINI_API_KEY present: {bool(GEMINI_API_KEY)}, starts: {GEMINI_API_KEY[:10] if GEMINI_API_KEY else 'NONE'}"); sys.stdout.flush()
+log.info("Inicializando GeminiEngine", gemini_api_key_present=bool(GEMINI_API_KEY))
 try:
     gemini = GeminiEngine(api_key=GEMINI_API_KEY)
-    print("GeminiEngine initialized OK"); sys.stdout.flush()
+    log.info("GeminiEngine initialized OK")
 except Exception as e:
-    print(f"GeminiEngine INIT FAILED: {e}"); sys.stdout.flush()
+    log.error("GeminiEngine INIT FAILED", error=str(e))
     gemini = None
 
 
@@ -150,304 +188,297 @@ async def verify_webhook(request: Request):
 async def recibir_mensaje(request: Request):
     try:
         data = await request.json()
-        print(f"DEBUG: Webhook data received: {data}"); sys.stdout.flush()
-        
-        if data.get('object') == 'whatsapp_business_account':
-            for entry in data.get('entry', []):
-                for change in entry.get('changes', []):
-                    value = change.get('value', {})
-                    if 'messages' in value:
-                        message = value['messages'][0]
-                        message_id = message.get('id')
-                        
-                        if message_id in PROCESSED_MESSAGES:
-                            print(f"DEBUG: Message {message_id} already processed."); sys.stdout.flush()
-                            return {"status": "already_processed"}
-                        
-                        PROCESSED_MESSAGES.append(message_id)
-                        if len(PROCESSED_MESSAGES) > 100: PROCESSED_MESSAGES.pop(0)
-
-                        numero_usuario = message['from']
-                        phone_number_id = value['metadata']['phone_number_id']
-                        
-                        print(f"[Webhook] Message from {numero_usuario}, phoneID={phone_number_id}"); sys.stdout.flush()
-                        
-                        # --- VERIFICAR SESIÓN DEMO PRIMERO ---
-                        session = database.get_user_session(numero_usuario)
-                        demo_client_id = None
-                        if session and session.get("demo_mode"):
-                            demo_mode = session.get("demo_mode")
-                            if demo_mode == "Restaurante": demo_client_id = "demo_restaurante"
-                            elif demo_mode == "Clínica" or demo_mode == "Clinica": demo_client_id = "demo_clinica"
-                            elif demo_mode == "Tienda": demo_client_id = "demo_tienda"
-                        
-                        # Obtener siempre el cliente real primero (propietario del número base)
-                        real_client = database.get_client_by_phone_id(phone_number_id)
-
-                        client_data = None
-                        if demo_client_id:
-                            print(f"[Webhook] Sesión Demo activa, cargando cliente: {demo_client_id}"); sys.stdout.flush()
-                            client_data = database.get_client_by_id(demo_client_id)
-                            # Heredar token e ID del bot principal para poder responder por WhatsApp
-                            if client_data and real_client:
-                                client_data['whatsapp_token'] = real_client.get('whatsapp_token')
-                                client_data['phone_number_id'] = real_client.get('phone_number_id')
-                        
-                        # Fallback a phone_number_id si no es demo o no se encontró
-                        if not client_data:
-                            client_data = real_client
-                            
-                        if not client_data:
-                            print(f"❌ ERROR: No client found for phoneID {phone_number_id}"); sys.stdout.flush()
-                            return {"status": "error", "message": "Client not found"}
-                        
-                        print(f"✅ Client Found: {client_data.get('name')} (ID: {client_data.get('id')})"); sys.stdout.flush()
-                        
-                        # 1. Detectar tipo de mensaje
-                        texto_usuario = ""
-                        texto_menu = "" # Default to avoid NameError
-                        if message.get('type') == 'text':
-                            texto_usuario = message.get('text', {}).get('body', "")
-                        elif message.get('type') == 'interactive':
-                            interactive = message.get('interactive', {})
-                            if interactive.get('type') == 'button_reply':
-                                texto_usuario = interactive.get('button_reply', {}).get('title', "")
-                            elif interactive.get('type') == 'list_reply':
-                                texto_usuario = interactive.get('list_reply', {}).get('title', "")
-                        
-                        print(f"DEBUG: Texto de usuario detectado: '{texto_usuario}'"); sys.stdout.flush()
-                        
-                        # --- INTERCEPCIÓN DE DEMOS (SANDBOX) ---
-                        texto_lower = texto_usuario.lower().strip()
-                        if "quiero probar la demo de" in texto_lower:
-                            # Identificar el tipo de demo
-                            tipo_demo = None
-                            if "restaurante" in texto_lower: tipo_demo = "Restaurante"
-                            elif "clínica" in texto_lower or "clinica" in texto_lower: tipo_demo = "Clínica"
-                            elif "tienda" in texto_lower: tipo_demo = "Tienda"
-                            
-                            if tipo_demo:
-                                print(f"[Demo] Iniciando sesión de demo para {numero_usuario} modo: {tipo_demo}"); sys.stdout.flush()
-                                database.save_user_session(numero_usuario, {"demo_mode": tipo_demo})
-                                
-                                # Send welcome message with buttons for the demo
-                                if tipo_demo == "Restaurante":
-                                    texto_welcome = "¡Bienvenido a *La Trattoria*! 👋 Soy tu asistente virtual. ¿Qué te gustaría hacer hoy?"
-                                    opciones = ["Ver Menú", "Hacer Reserva", "Horarios"]
-                                elif tipo_demo == "Clínica":
-                                    texto_welcome = "Bienvenido a la *Clínica San Juan*. 🏥 ¿En qué podemos ayudarte hoy?"
-                                    opciones = ["Agendar Cita", "Especialidades", "Ubicación"]
-                                else: # Tienda
-                                    texto_welcome = "¡Hola! Bienvenido a *Moda Urbana*. 🛍️ ✨ ¿Cómo podemos ayudarte con tu estilo hoy?"
-                                    opciones = ["Ver Catálogo", "Tallas", "Devoluciones"]
-
-                                whatsapp_service.enviar_menu_botones(numero_usuario, texto_welcome, opciones, client_data['whatsapp_token'], client_data['phone_number_id'])
-                                return {"status": "demo_started"}
-
-                        # Comprobar si desea salir de la demo
-                        if texto_lower in ["salir", "terminar", "terminar demo", "salir demo"]:
-                            session = database.get_user_session(numero_usuario)
-                            if session and session.get("demo_mode"):
-                                database.delete_user_session(numero_usuario)
-                                print(f"[Demo] Terminando sesión de demo para {numero_usuario}"); sys.stdout.flush()
-                                msg_salida = "Has salido del modo demo. Ahora vuelvo a ser el asistente general de Zotek Soluciones IA. ¿En qué más puedo ayudarte?"
-                                whatsapp_service.enviar_mensaje_whatsapp(numero_usuario, msg_salida, client_data['whatsapp_token'], client_data['phone_number_id'])
-                                return {"status": "demo_ended"}
-                        # --- FIN INTERCEPCIÓN DEMOS ---
-
-                        if not client_data.get('is_active', True):
-                            print(f"[Webhook] Bot is INACTIVE for '{client_data['name']}'. Skipping AI."); sys.stdout.flush()
-                            return {"status": "bot_inactive"}
-
-                        print(f"[Webhook] Bot is ACTIVE. WhatsApp token present: {bool(client_data.get('whatsapp_token'))}, token starts: {str(client_data.get('whatsapp_token', ''))[:15]}..."); sys.stdout.flush()
-
-                        # Intercepción de Opciones del Menú Personalizado
-                        menu_data = None
-                        try:
-                            # Reutilizamos la lógica del menú aquí para evitar funciones anidadas problemáticas
-                            menu_doc = database.get_db().collection('clients').document(str(client_data['id'])).collection('config').document('menu').get()
-                            if menu_doc.exists: menu_data = menu_doc.to_dict()
-                        except Exception as e:
-                            print(f"DEBUG: Error al cargar menú desde Firestore: {e}"); sys.stdout.flush()
-
-                        if menu_data:
-                            def buscar_opcion(opciones, texto):
-                                for opt in opciones:
-                                    is_dict = isinstance(opt, dict)
-                                    title = opt.get('title') if is_dict else opt
-                                    icon = opt.get('icon', '') if is_dict else ''
-                                    full_title = f"{icon} {title}".strip()
-                                    
-                                    # Comparar con título completo (con icono) y con solo el título
-                                    if str(full_title).lower().strip() == texto.lower().strip(): return opt
-                                    if str(title).lower().strip() == texto.lower().strip(): return opt
-
-                                    if is_dict and opt.get('submenu') and opt['submenu'].get('options'):
-                                        found = buscar_opcion(opt['submenu']['options'], texto)
-                                        if found: return found
-                                    elif is_dict and 'opciones' in opt: # Soporte para estructura vieja
-                                        found = buscar_opcion(opt['opciones'], texto)
-                                        if found: return found
-                                return None
-
-                            match = buscar_opcion(menu_data.get('options', []), texto_usuario)
-                            if not match and 'opciones' in menu_data: # Backup para estructura vieja
-                                match = buscar_opcion(menu_data['opciones'], texto_usuario)
-
-                            if match and isinstance(match, dict):
-                                if match.get('submenu') and match['submenu'].get('options'):
-                                    sub = match['submenu']
-                                    titles = []
-                                    for o in sub['options']:
-                                        t = o.get('title', 'Opción') if isinstance(o, dict) else str(o)
-                                        i = o.get('icon', '') if isinstance(o, dict) else ''
-                                        titles.append(f"{i} {t}".strip())
-                                        
-                                    if len(titles) == 0:
-                                        msg = sub.get('text', f"Opciones para {match['title']}:")
-                                        whatsapp_service.enviar_mensaje_whatsapp(numero_usuario, msg, client_data['whatsapp_token'], client_data['phone_number_id'])
-                                    elif len(titles) > 3:
-                                        whatsapp_service.enviar_menu_lista(numero_usuario, sub.get('text', 'Opciones:'), "Ver", match['title'], titles, client_data['whatsapp_token'], client_data['phone_number_id'])
-                                    else:
-                                        whatsapp_service.enviar_menu_botones(numero_usuario, sub.get('text', 'Opciones:'), titles, client_data['whatsapp_token'], client_data['phone_number_id'])
-                                    database.save_chat_message(client_data['id'], numero_usuario, texto_usuario, sub.get('text', 'Opciones:'))
-                                    return {"status": "submenu_sent"}
-                                elif match.get('response'):
-                                    res_text = match['response']
-                                    cal_url = client_data.get('calendly_url')
-                                    if cal_url:
-                                        res_text = res_text.replace("{{calendly_url}}", cal_url)
-                                        if "agendar cita" in str(match.get('title')).lower():
-                                            if cal_url not in res_text: res_text += f"\n\nLink: {cal_url}"
-                                    
-                                    print(f"DEBUG: Enviando respuesta predefinida para '{match.get('title')}'"); sys.stdout.flush()
-                                    database.save_chat_message(client_data['id'], numero_usuario, texto_usuario, res_text)
-                                    
-                                    # Inline de enviar_respuesta_con_opciones
-                                    texto_para_enviar = res_text
-                                    opciones_dinamicas = []
-                                    if "[OPCIONES]:" in res_text:
-                                        partes = res_text.split("[OPCIONES]:")
-                                        texto_para_enviar = partes[0].strip()
-                                        dict_opciones = partes[1].split("|")
-                                        opciones_dinamicas = [o.strip() for o in dict_opciones if o.strip()]
-
-                                    whatsapp_service.enviar_mensaje_whatsapp(numero_usuario, texto_para_enviar, client_data['whatsapp_token'], client_data['phone_number_id'])
-                                    if opciones_dinamicas:
-                                        if len(opciones_dinamicas) > 3:
-                                            whatsapp_service.enviar_menu_lista(numero_usuario, "Selecciona:", "Opciones", "Menú", opciones_dinamicas, client_data['whatsapp_token'], client_data['phone_number_id'])
-                                        elif len(opciones_dinamicas) > 0:
-                                            whatsapp_service.enviar_menu_botones(numero_usuario, "Selecciona:", opciones_dinamicas, client_data['whatsapp_token'], client_data['phone_number_id'])
-                                    return {"status": "predefined_sent"}
-
-                            if not match and menu_data.get('fallback_text'):
-                                print(f"DEBUG: No menu match found. Sending fallback_text for {client_data['name']}"); sys.stdout.flush()
-                                fallback_msg = menu_data['fallback_text']
-                                opciones_raw = menu_data.get('options', menu_data.get('opciones', []))
-                                opciones = []
-                                for opt in opciones_raw:
-                                    t = opt.get('title', 'Opción') if isinstance(opt, dict) else str(opt)
-                                    i = opt.get('icon', '') if isinstance(opt, dict) else ''
-                                    opciones.append(f"{i} {t}".strip())
-                                
-                                if len(opciones) > 0:
-                                    if len(opciones) > 3:
-                                        whatsapp_service.enviar_menu_lista(numero_usuario, fallback_msg, "Ver Opciones", "Menú", opciones, client_data['whatsapp_token'], client_data['phone_number_id'])
-                                    else:
-                                        whatsapp_service.enviar_menu_botones(numero_usuario, fallback_msg, opciones, client_data['whatsapp_token'], client_data['phone_number_id'])
-                                    database.save_chat_message(client_data['id'], numero_usuario, texto_usuario, f"[Fallback enviado: {fallback_msg}]")
-                                    return {"status": "fallback_sent"}
-
-                        # Keywords de menú (hola, menu, etc.)
-                        if texto_usuario.lower().strip() in ["hola", "menu", "menú", "inicio", "opciones"]:
-                            print(f"[Webhook] ✅ Keyword match: '{texto_usuario}' -> checking for explicit menu options"); sys.stdout.flush()
-                            
-                            opciones_raw = []
-                            texto_menu_local = ""
-                            if menu_data:
-                                opciones_raw = menu_data.get('options', menu_data.get('opciones', []))
-                                texto_menu_local = menu_data.get('text', f"¡Hola! Bienvendu@ a {client_data['name']}. 👋\n\n¿En qué puedo ayudarte?")
-                            
-                            if len(opciones_raw) > 0:
-                                print(f"[send_menu_followup_inline] Starting for client {client_data.get('name')}"); sys.stdout.flush()
-                                opciones = []
-                                for opt in opciones_raw:
-                                    t = opt.get('title', 'Opción') if isinstance(opt, dict) else str(opt)
-                                    i = opt.get('icon', '') if isinstance(opt, dict) else ''
-                                    opciones.append(f"{i} {t}".strip())
-                                
-                                print(f"[send_menu_followup_inline] Sending menu with {len(opciones)} options to {numero_usuario}"); sys.stdout.flush()
-                                try:
-                                    if len(opciones) > 3:
-                                        send_result = whatsapp_service.enviar_menu_lista(numero_usuario, texto_menu_local, "Ver Opciones", "Menú", opciones, client_data['whatsapp_token'], client_data['phone_number_id'])
-                                    else:
-                                        send_result = whatsapp_service.enviar_menu_botones(numero_usuario, texto_menu_local, opciones, client_data['whatsapp_token'], client_data['phone_number_id'])
-                                    
-                                    database.save_chat_message(client_data['id'], numero_usuario, texto_usuario, f"[Menu enviado: {send_result}]")
-                                    print(f"[Webhook] ✅ Menu flow complete. send_result={send_result}"); sys.stdout.flush()
-                                    return {"status": "menu_sent"}
-                                except Exception as e:
-                                    print(f"❌ ERROR enviando menú: {e}\n{traceback.format_exc()}"); sys.stdout.flush()
-                                    return {"status": "error_sending_menu"}
-                            else:
-                                print(f"[Webhook] Menu has 0 options. Allowing Gemini to handle the greeting."); sys.stdout.flush()
-                                # Do not return here. Let it fall through to Gemini.
-
-                        # Proceso con Gemini
-                        if gemini is None: return {"status": "no_gemini"}
-                        
-                        # --- INYECCIÓN DE CONTEXTO DEMO ---
-                        session = database.get_user_session(numero_usuario)
-                        if session and session.get('demo_mode'):
-                            demo_mode = session['demo_mode']
-                            if demo_mode == "Restaurante":
-                                if not client_data.get('name'): client_data['name'] = "La Trattoria"
-                                if not client_data.get('system_instruction'): client_data['system_instruction'] = "Eres el asistente inteligente del restaurante 'La Trattoria'. Tu objetivo es ayudar a los clientes a hacer reservas, ver el menú (ofreces pizzas, pastas y ensaladas) y responder dudas sobre los horarios (abierto 12pm a 11pm). Sé amigable, breve y apetitoso."
-                            elif demo_mode == "Clínica":
-                                if not client_data.get('name'): client_data['name'] = "Clínica San Juan"
-                                if not client_data.get('system_instruction'): client_data['system_instruction'] = "Eres el asistente de la 'Clínica San Juan'. Ayudas a pacientes a agendar citas médicas (Medicina general, Odontología, Pediatría) y das información de ubicación. Sé empático, breve, profesional y tranquilizador."
-                            elif demo_mode == "Tienda":
-                                if not client_data.get('name'): client_data['name'] = "Moda Urbana Tienda"
-                                if not client_data.get('system_instruction'): client_data['system_instruction'] = "Eres el asistente de la tienda de ropa 'Moda Urbana'. Ayudas a encontrar prendas (camisetas, jeans, tenis), verificar disponibilidad de tallas y hacer devoluciones. Usa emojis, sé casual, vendedor, dinámico y muy breve."
-                            print(f"[Demo] Inyectando contexto de {demo_mode} para Gemini."); sys.stdout.flush()
-                        
-                        prompt = texto_usuario
-                        if message.get('type') == 'interactive':
-                            prompt = f"[Menú]: {texto_usuario}"
-                        
-                        if menu_data:
-                            client_data['menu_data'] = menu_data
-                        
-                        print(f"[Webhook] Calling Gemini for: '{prompt[:50]}...'")
-                        res_ai = gemini.generar_respuesta(prompt, client_data, numero_usuario)
-                        print(f"[Webhook] Gemini response preview: {res_ai[:80]}")
-                        
-                        # Parse dynamic [OPCIONES]: generated by Gemini
-                        texto_para_enviar = res_ai
-                        opciones_dinamicas = []
-                        if "[OPCIONES]:" in res_ai:
-                            partes = res_ai.split("[OPCIONES]:")
-                            texto_para_enviar = partes[0].strip()
-                            dict_opciones = partes[1].split("|")
-                            opciones_dinamicas = [o.strip() for o in dict_opciones if o.strip()][:10] # WhatsApp list limit 10
-                        
-                        success = whatsapp_service.enviar_mensaje_whatsapp(numero_usuario, texto_para_enviar, client_data['whatsapp_token'], client_data['phone_number_id'])
-                        
-                        if success and opciones_dinamicas:
-                            if len(opciones_dinamicas) > 3:
-                                whatsapp_service.enviar_menu_lista(numero_usuario, "Por favor, selecciona una opción:", "Ver opciones", "Menú", opciones_dinamicas, client_data['whatsapp_token'], client_data['phone_number_id'])
-                            elif len(opciones_dinamicas) > 0:
-                                whatsapp_service.enviar_menu_botones(numero_usuario, "Selecciona una opción:", opciones_dinamicas, client_data['whatsapp_token'], client_data['phone_number_id'])
-
-                        print(f"[Webhook] WhatsApp send result: {success}")
-                        if success:
-                            database.save_chat_message(client_data['id'], numero_usuario, texto_usuario, res_ai)
+    except Exception as e:
+        log.exception("WEBHOOK CRITICAL ERROR", error=str(e))
+        return {"status": "ok"}
+
+    # Sin volcar el payload completo (contiene teléfonos y textos de usuarios)
+    log.debug("Webhook data received", object=data.get('object'), entries=len(data.get('entry', [])))
+    if data.get('object') != 'whatsapp_business_account':
+        return {"status": "ok"}
+
+    # Fan-out: todos los entry/changes/messages/statuses del payload
+    events, statuses = webhook_batch.extract_events(data)
+
+    if statuses:
+        procesar_estados(statuses)
+
+    events, duplicates = webhook_batch.dedupe_messages(events, PROCESSED_MESSAGES)
+    if duplicates:
+        log.debug("Messages already processed", duplicates=duplicates)
+    if not events:
+        return {"status": "already_processed" if duplicates else "ok", "statuses": len(statuses)}
+
+    absorbed = webhook_batch.coalesce_events(events, coalescer, eligible=_se_puede_agrupar)
+
+    memo = webhook_batch.BatchMemo()
+    results = await webhook_batch.fan_out(
+        events,
+        lambda event: procesar_mensaje(event, memo),
+        max_concurrency=WEBHOOK_MAX_CONCURRENCY,
+        on_error=_error_en_mensaje,
+    )
+    log.info("Webhook batch procesado", messages=len(events), statuses=len(statuses), duplicates=duplicates,
+             coalesced=absorbed, llm_calls_saved_total=coalescer.stats()['llm_calls_saved'])
+    return {"status": "ok", "messages": len(events), "statuses": len(statuses), "results": results}
+
+
+def _se_puede_agrupar(event):
+    """Los comandos de demo no se mezclan con otros mensajes de la ráfaga."""
+    texto = event['message'].get('text', {}).get('body', "").lower().strip()
+    return DEMO_START_PHRASE not in texto and texto not in DEMO_EXIT_COMMANDS
+
+
+def _error_en_mensaje(event, error):
+    log.error("WEBHOOK CRITICAL ERROR", error=str(error), phone_number_id=event.get('phone_number_id'))
+    return {"status": "error"}
+
+
+def procesar_estados(statuses):
+    """Registra en bloque las actualizaciones de estado (sent/delivered/read/failed)."""
+    counts, failed = webhook_batch.summarize_statuses(statuses)
+    log.info("WhatsApp statuses", **{f"status_{state}": count for state, count in counts.items()})
+    for item in failed:
+        log.warning("Entrega fallida", **item)
+
+
+def procesar_mensaje(event, memo):
+    """
+    Procesa un mensaje entrante. Si se sumó a una ráfaga abierta de la misma
+    conversación, lo responde el líder de la ráfaga con todos los textos juntos.
+    """
+    if event.get('coalesced'):
+        return {"status": "coalesced"}
+    with webhook_batch.merged_event(event, coalescer) as merged:
+        return _procesar_mensaje(merged, memo)
+
+
+def _procesar_mensaje(event, memo):
+    """
+    Procesa un mensaje entrante: demos, menú personalizado o respuesta con Gemini.
+
+    El cliente del phone_number_id, los clientes demo y los menús se cargan una
+    sola vez por payload (`memo`) y se comparten entre mensajes del mismo cliente.
+    """
+    message = event['message']
+    phone_number_id = event['phone_number_id']
+
+    inbound = InboundMessage.from_webhook(message)
+    numero_usuario = inbound.sender
+
+    log.info("Webhook message received", user_number=numero_usuario, phone_number_id=phone_number_id, message_type=inbound.type)
+
+    with tracer.span('tenant.lookup', phone_number_id=phone_number_id):
+        # --- VERIFICAR SESIÓN DEMO PRIMERO ---
+        session = database.get_user_session(numero_usuario)
+        demo_client_id = None
+        if session and session.get("demo_mode"):
+            demo = demos.by_mode(session.get("demo_mode"))
+            demo_client_id = demo.firestore_id if demo else None
+
+        # Obtener siempre el cliente real primero (propietario del número base)
+        real_client = memo.get(('client', phone_number_id), lambda: database.get_client_by_phone_id(phone_number_id))
+
+        client_data = None
+        if demo_client_id:
+            log.info("Sesión demo activa", demo_client_id=demo_client_id)
+            client_data = memo.get(('client_id', demo_client_id), lambda: database.get_client_by_id(demo_client_id))
+            # Heredar token e ID del bot principal para poder responder por WhatsApp
+            # (copia: el cliente del memo y de la foto de tenants es compartido)
+            if client_data and real_client:
+                client_data = client_data.with_overrides(
+                    whatsapp_token=real_client.get('whatsapp_token'),
+                    phone_number_id=real_client.get('phone_number_id'),
+                )
+
+    # Fallback a phone_number_id si no es demo o no se encontró
+    if not client_data:
+        client_data = real_client
+
+    if not client_data:
+        log.error("No client found for phone_number_id", phone_number_id=phone_number_id)
+        return {"status": "error", "message": "Client not found"}
+
+    log.debug("Client found", client_id=client_data.get('id'), client_name=client_data.get('name'))
+
+    # 1. Texto del mensaje (o título del botón/opción de lista)
+    texto_usuario = inbound.text
+
+    log.debug("Texto de usuario detectado", text=texto_usuario)
+
+    # --- INTERCEPCIÓN DE DEMOS (SANDBOX) ---
+    texto_lower = texto_usuario.lower().strip()
+    demo = demos.match_start_command(texto_lower)
+    if demo:
+        log.info("Iniciando sesión de demo", user_number=numero_usuario, demo_mode=demo.demo_mode)
+        database.save_user_session(numero_usuario, {"demo_mode": demo.demo_mode})
+
+        # Mensaje de bienvenida con los botones del menú de la demo
+        whatsapp_service.enviar_menu_botones(numero_usuario, demo.welcome_text, demo.button_titles, client_data['whatsapp_token'], client_data['phone_number_id'])
+        return {"status": "demo_started"}
+
+    # Comprobar si desea salir de la demo
+    if texto_lower in DEMO_EXIT_COMMANDS:
+        session = database.get_user_session(numero_usuario)
+        if session and session.get("demo_mode"):
+            database.delete_user_session(numero_usuario)
+            log.info("Terminando sesión de demo", user_number=numero_usuario)
+            msg_salida = "Has salido del modo demo. Ahora vuelvo a ser el asistente general de Zotek Soluciones IA. ¿En qué más puedo ayudarte?"
+            whatsapp_service.enviar_mensaje_whatsapp(numero_usuario, msg_salida, client_data['whatsapp_token'], client_data['phone_number_id'])
+            return {"status": "demo_ended"}
+    # --- FIN INTERCEPCIÓN DEMOS ---
+
+    if not client_data.get('is_active', True):
+        log.info("Bot inactivo, se omite la IA", client_id=client_data.get('id'))
+        return {"status": "bot_inactive"}
+
+    log.debug("Bot activo", client_id=client_data.get('id'), whatsapp_token_present=bool(client_data.get('whatsapp_token')))
+
+    # Intercepción de Opciones del Menú Personalizado
+    menu_data = None
+    menu = None
+    try:
+        # Reutilizamos la lógica del menú aquí para evitar funciones anidadas problemáticas
+        def _load_menu():
+            with tracer.span('menu.load', client_id=str(client_data['id'])):
+                menu_doc = database.get_db().collection('clients').document(str(client_data['id'])).collection('config').document('menu').get()
+            return menu_doc.to_dict() if menu_doc.exists else None
 
+        menu_data = memo.get(('menu', str(client_data['id'])), _load_menu)
+        if menu_data:
+            menu = memo.get(('menu_model', str(client_data['id'])), lambda: Menu.from_dict(menu_data))
     except Exception as e:
-        import traceback
-        print(f"❌ WEBHOOK CRITICAL ERROR: {e}\n{traceback.format_exc()}")
+        log.warning("Error al cargar menú desde Firestore", client_id=client_data.get('id'), error=str(e))
+
+    if menu:
+        match = menu.find(texto_usuario)
+
+        if match:
+            if match.submenu and match.submenu.options:
+                sub = match.submenu
+                sub_text = sub.text or 'Opciones:'
+                titles = list(sub.labels)
+                if len(titles) > 3:
+                    whatsapp_service.enviar_menu_lista(numero_usuario, sub_text, "Ver", match.title, titles, client_data['whatsapp_token'], client_data['phone_number_id'])
+                else:
+                    whatsapp_service.enviar_menu_botones(numero_usuario, sub_text, titles, client_data['whatsapp_token'], client_data['phone_number_id'])
+                database.save_chat_message(client_data['id'], numero_usuario, texto_usuario, sub_text)
+                return {"status": "submenu_sent"}
+            elif match.response:
+                res_text = match.response
+                cal_url = client_data.get('calendly_url')
+                if cal_url:
+                    res_text = res_text.replace("{{calendly_url}}", cal_url)
+                    if "agendar cita" in match.title.lower():
+                        if cal_url not in res_text: res_text += f"\n\nLink: {cal_url}"
+
+                log.debug("Enviando respuesta predefinida", option=match.title)
+                database.save_chat_message(client_data['id'], numero_usuario, texto_usuario, res_text)
+
+                # Inline de enviar_respuesta_con_opciones
+                texto_para_enviar = res_text
+                opciones_dinamicas = []
+                if "[OPCIONES]:" in res_text:
+                    partes = res_text.split("[OPCIONES]:")
+                    texto_para_enviar = partes[0].strip()
+                    dict_opciones = partes[1].split("|")
+                    opciones_dinamicas = [o.strip() for o in dict_opciones if o.strip()]
+
+                whatsapp_service.enviar_mensaje_whatsapp(numero_usuario, texto_para_enviar, client_data['whatsapp_token'], client_data['phone_number_id'])
+                if opciones_dinamicas:
+                    if len(opciones_dinamicas) > 3:
+                        whatsapp_service.enviar_menu_lista(numero_usuario, "Selecciona:", "Opciones", "Menú", opciones_dinamicas, client_data['whatsapp_token'], client_data['phone_number_id'])
+                    elif len(opciones_dinamicas) > 0:
+                        whatsapp_service.enviar_menu_botones(numero_usuario, "Selecciona:", opciones_dinamicas, client_data['whatsapp_token'], client_data['phone_number_id'])
+                return {"status": "predefined_sent"}
+
+        if not match and menu.fallback_text:
+            log.debug("Sin coincidencia de menú, enviando fallback_text", client_id=client_data.get('id'))
+            fallback_msg = menu.fallback_text
+            opciones = list(menu.labels)
+
+            if len(opciones) > 0:
+                if len(opciones) > 3:
+                    whatsapp_service.enviar_menu_lista(numero_usuario, fallback_msg, "Ver Opciones", "Menú", opciones, client_data['whatsapp_token'], client_data['phone_number_id'])
+                else:
+                    whatsapp_service.enviar_menu_botones(numero_usuario, fallback_msg, opciones, client_data['whatsapp_token'], client_data['phone_number_id'])
+                database.save_chat_message(client_data['id'], numero_usuario, texto_usuario, f"[Fallback enviado: {fallback_msg}]")
+                return {"status": "fallback_sent"}
+
+    # Keywords de menú (hola, menu, etc.)
+    if texto_usuario.lower().strip() in ["hola", "menu", "menú", "inicio", "opciones"]:
+        log.debug("Keyword de menú detectada", text=texto_usuario)
+
+        opciones = list(menu.labels) if menu else []
+        if len(opciones) > 0:
+            texto_menu_local = menu.text or f"¡Hola! Bienvendu@ a {client_data['name']}. 👋\n\n¿En qué puedo ayudarte?"
+
+            log.debug("Enviando menú", options=len(opciones), user_number=numero_usuario)
+            try:
+                if len(opciones) > 3:
+                    send_result = whatsapp_service.enviar_menu_lista(numero_usuario, texto_menu_local, "Ver Opciones", "Menú", opciones, client_data['whatsapp_token'], client_data['phone_number_id'])
+                else:
+                    send_result = whatsapp_service.enviar_menu_botones(numero_usuario, texto_menu_local, opciones, client_data['whatsapp_token'], client_data['phone_number_id'])
+
+                database.save_chat_message(client_data['id'], numero_usuario, texto_usuario, f"[Menu enviado: {send_result}]")
+                log.info("Menú enviado", client_id=client_data.get('id'), send_result=send_result)
+                return {"status": "menu_sent"}
+            except Exception as e:
+                log.exception("ERROR enviando menú", client_id=client_data.get('id'))
+                return {"status": "error_sending_menu"}
+        else:
+            log.debug("Menú sin opciones, Gemini responde el saludo", client_id=client_data.get('id'))
+            # Do not return here. Let it fall through to Gemini.
+
+    # Proceso con Gemini
+    if gemini is None: return {"status": "no_gemini"}
+
+    # --- INYECCIÓN DE CONTEXTO DEMO ---
+    session = database.get_user_session(numero_usuario)
+    if session and session.get('demo_mode'):
+        demo_mode = session['demo_mode']
+        demo = demos.by_mode(demo_mode)
+        if demo:
+            client_data = client_data.with_overrides(
+                name=client_data.get('name') or demo.assistant_name,
+                system_instruction=client_data.get('system_instruction') or demo.system_instruction,
+            )
+        log.debug("Inyectando contexto demo para Gemini", demo_mode=demo_mode)
+
+    prompt = texto_usuario
+    if inbound.is_interactive:
+        prompt = f"[Menú]: {texto_usuario}"
+
+    if menu_data:
+        client_data = client_data.with_overrides(menu_data=menu_data)
+
+    log.debug("Calling Gemini", prompt=prompt)
+    with tracer.span('gemini', client_id=str(client_data['id'])):
+        res_ai = gemini.generar_respuesta(prompt, client_data, numero_usuario)
+    log.debug("Gemini response", response=res_ai)
+
+    # Parse dynamic [OPCIONES]: generated by Gemini
+    texto_para_enviar = res_ai
+    opciones_dinamicas = []
+    if "[OPCIONES]:" in res_ai:
+        partes = res_ai.split("[OPCIONES]:")
+        texto_para_enviar = partes[0].strip()
+        dict_opciones = partes[1].split("|")
+        opciones_dinamicas = [o.strip() for o in dict_opciones if o.strip()][:10] # WhatsApp list limit 10
+
+    success = whatsapp_service.enviar_mensaje_whatsapp(numero_usuario, texto_para_enviar, client_data['whatsapp_token'], client_data['phone_number_id'])
+
+    if success and opciones_dinamicas:
+        if len(opciones_dinamicas) > 3:
+            whatsapp_service.enviar_menu_lista(numero_usuario, "Por favor, selecciona una opción:", "Ver opciones", "Menú", opciones_dinamicas, client_data['whatsapp_token'], client_data['phone_number_id'])
+        elif len(opciones_dinamicas) > 0:
+            whatsapp_service.enviar_menu_botones(numero_usuario, "Selecciona una opción:", opciones_dinamicas, client_data['whatsapp_token'], client_data['phone_number_id'])
+
+    log.info("Respuesta IA enviada", client_id=client_data.get('id'), success=success)
+    if success:
+        database.save_chat_message(client_data['id'], numero_usuario, texto_usuario, res_ai)
+    return {"status": "ai_sent" if success else "send_failed"}
 
-    return {"status": "ok"}
 
 
 # === Security Helpers ===
@@ -459,40 +490,78 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+# Tokens verificados -> Principal (una carga del panel hace 5-10 llamadas con el mismo token)
+token_cache = TokenCache()
+
+
+def _decode_token(token: str):
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+
+def _build_principal(payload) -> Principal:
+    """
+    Rol calculado con ADMIN_EMAILS (un token con rol viejo no lo conserva) y
+    cliente del token o, si falta, el vinculado a su email.
+    """
+    email = payload.get("sub")
+    if email is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    email = email.lower().strip()
+    role = "admin" if email in ADMIN_EMAIL_SET else "client"
+    client_id = payload.get("client_id")
+    if role == "client" and not client_id:
+        # Re-vincular si es necesario
+        client_id = database.get_client_id_by_email(email)
+    log.debug("Token verificado", email=email, role=role)
+    return Principal(email, role, client_id)
+
+
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    """Usuario del token; la verificación y la búsqueda del cliente se hacen una vez por token."""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return email
+        return await asyncio.to_thread(token_cache.resolve, token, _decode_token, _build_principal)
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
-def send_security_code(email: str, code: str):
-    if not EMAIL_PASSWORD:
-        print("ERROR: EMAIL_APP_PASSWORD no configurada en .env")
-        return False
+async def get_current_user(principal: Principal = Depends(get_current_principal)):
+    return principal.email
 
-    print(f"Intentando enviar email a {email}...")
 
+def _on_email_error(msg, error):
+    log.error("Error enviando email", email=msg['To'], error=str(error))
+
+# Emails salientes: un hilo con la conexión SMTP autenticada reutilizable entre requests
+mailer = SMTPMailer(
+    os.getenv("SMTP_HOST", "smtp.gmail.com"),
+    int(os.getenv("SMTP_PORT", "587")),
+    ADMIN_EMAIL,
+    EMAIL_PASSWORD,
+    on_error=_on_email_error,
+)
+
+
+def send_security_code(email: str, code: str):
+    """
+    Encola el email con el código en el mailer.
+
+    Returns:
+        Future de la entrega, o None si no se pudo encolar
+    """
+    if not EMAIL_PASSWORD:
+        log.error("EMAIL_APP_PASSWORD no configurada en .env")
+        return None
+
+    log.info("Encolando email", email=email)
+    msg = MIMEText(f"Tu codigo de acceso para el panel administrativo es: {code}\nExpira en 10 minutos.")
+    msg['Subject'] = f"{code} es tu código de verificación"
+    msg['From'] = ADMIN_EMAIL
+    msg['To'] = email
     try:
-        msg = MIMEText(f"Tu codigo de acceso para el panel administrativo es: {code}\nExpira en 10 minutos.")
-        msg['Subject'] = f"{code} es tu código de verificación"
-        msg['From'] = ADMIN_EMAIL
-        msg['To'] = email
-
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(ADMIN_EMAIL, EMAIL_PASSWORD)
-            server.send_message(msg)
-        return True
-    except Exception as e:
-        import traceback
-        print(f"Error enviando email: {e}")
-        traceback.print_exc()
-        return False
+        return mailer.submit(msg)
+    except MailQueueFull as e:
+        log.error("Cola de email llena", error=str(e))
+        return None
 
 
 # === Routes ===
@@ -516,24 +585,33 @@ async def request_code(request: Request):
     
     # SaaS Phase 3: Permitir admin O email de cliente registrado
     normalized_email = email.lower().strip()
-    is_admin = normalized_email in [e.lower().strip() for e in ADMIN_EMAILS]
+    is_admin = normalized_email in ADMIN_EMAIL_SET
     
-    client = None
     if not is_admin:
-        client = database.get_client_by_email(normalized_email)
-        if not client:
+        if not database.get_client_id_by_email(normalized_email):
             return JSONResponse(status_code=403, content={"detail": f"Acceso restringido: Email {email} no registrado"})
 
     code = f"{random.randint(100000, 999999)}"
-    verification_codes[email] = {
-        "code": code,
-        "expiry": datetime.utcnow() + timedelta(minutes=10)
-    }
+    if not await asyncio.to_thread(verification_codes.issue, email, code):
+        raise HTTPException(status_code=429, detail="Espera antes de pedir otro codigo")
 
-    if send_security_code(email, code):
-        return {"status": "code_sent"}
-    else:
-        raise HTTPException(status_code=500, detail="Error enviando el codigo")
+    # En Cloud Functions la CPU se limita al responder: se espera la entrega
+    # sin bloquear el event loop (la conexión SMTP se reutiliza entre requests)
+    delivery = send_security_code(email, code)
+    try:
+        if delivery is None:
+            raise RuntimeError("email no encolado")
+        await asyncio.wrap_future(delivery)
+    except Exception:
+        await asyncio.to_thread(verification_codes.discard, email)
+        raise HTTPException(status_code=503, detail="Error enviando el codigo")
+    except asyncio.CancelledError:
+        # Entrega cancelada (o request cancelada): el código no llegó
+        await asyncio.to_thread(verification_codes.discard, email)
+        if delivery.cancelled():
+            raise HTTPException(status_code=503, detail="Error enviando el codigo")
+        raise
+    return {"status": "code_sent"}
 
 
 @app.post("/api/auth/verify-code")
@@ -542,49 +620,29 @@ async def verify_code(request: Request):
     email = data.get("email")
     code = data.get("code")
 
-    stored = verification_codes.get(email)
-    if not stored or stored["code"] != code or datetime.utcnow() > stored["expiry"]:
+    # Verifica en tiempo constante y consume el código (un solo uso)
+    result = await asyncio.to_thread(verification_codes.verify, email, code)
+    if result == verification_store.LOCKED:
+        log.warning("Demasiados intentos de verificación", email=email)
+        raise HTTPException(status_code=429, detail=f"Demasiados intentos. Intenta de nuevo en {verification_codes.ttl_seconds // 60} minutos")
+    if result != verification_store.VERIFIED:
         raise HTTPException(status_code=401, detail="Codigo invalido o expirado")
 
-    del verification_codes[email]
-
     # SaaS Phase 3: Determinar rol y client_id
     normalized_email = email.lower().strip()
-    is_admin = normalized_email in [e.lower().strip() for e in ADMIN_EMAILS]
+    is_admin = normalized_email in ADMIN_EMAIL_SET
     role = "admin" if is_admin else "client"
     client_id = None
     if role == "client":
-        client = database.get_client_by_email(normalized_email)
-        client_id = str(client['id']) if client else None
+        client_id = database.get_client_id_by_email(normalized_email)
 
     access_token = create_access_token(data={"sub": email, "role": role, "client_id": client_id})
     return {"access_token": access_token, "token_type": "bearer", "role": role}
 
 @app.get("/api/me")
-async def get_me(token: str = Depends(oauth2_scheme)):
+async def get_me(principal: Principal = Depends(get_current_principal)):
     """Retorna el perfil del usuario actual basado en el JWT."""
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub", "").lower().strip()
-        
-        # Calcular el rol dinámicamente para que los cambios en ADMIN_EMAILS 
-        # surtan efecto incluso si el token tiene un rol viejo.
-        is_admin = email in [e.lower().strip() for e in ADMIN_EMAILS]
-        role = "admin" if is_admin else "client"
-        
-        client_id = payload.get("client_id")
-        if role == "client" and not client_id:
-            # Re-vincular si es necesario
-            client = database.get_client_by_email(email)
-            client_id = str(client['id']) if client else None
-        
-        return {
-            "email": email,
-            "role": role,
-            "client_id": client_id
-        }
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    return principal.as_dict()
 
 
 # === Dynamic Redirections ===
@@ -614,18 +672,18 @@ async def whatsapp_redirect(text: str = "Hola, quisiera mas informacion"):
     encoded_text = urllib.parse.quote(text)
 
     if target_number:
-        print(f"[Redirect] Redirecting to client number: {target_number}")
+        log.info("Redirect a número de cliente", to=target_number)
         return RedirectResponse(url=f"https://wa.me/{target_number}?text={encoded_text}")
 
     # Fallback de seguridad (Bot Zotek: 3123775877)
     fallback_url = f"https://wa.me/523123775877?text={encoded_text}"
-    print(f"[Redirect] No numbers found in DB, using fallback: 523123775877")
+    log.info("Sin números en DB, usando fallback", to="523123775877")
     return RedirectResponse(url=fallback_url)
 
 
 # === Protected Admin API ===
 
-@app.get("/api/clients")
+@app.get("/api/clients", response_model=List[ClientOut], response_model_exclude_unset=True)
 async def list_clients(current_user: str = Depends(get_current_user)):
     return database.list_clients()
 
@@ -653,11 +711,34 @@ async def update_client(client_id: str, request: Request, current_user: str = De
     raise HTTPException(status_code=400, detail="Error updating client")
 
 
+def _require_admin(current_user: str):
+    if current_user.lower().strip() not in ADMIN_EMAIL_SET:
+        raise HTTPException(status_code=403, detail="Solo administradores")
+
+
+@app.delete("/api/clients/{client_id}")
+async def delete_client(client_id: str, current_user: str = Depends(get_current_user)):
+    """Elimina un cliente y todas sus subcolecciones (chats, conocimiento, config...)."""
+    _require_admin(current_user)
+    if not database.get_client_by_id(client_id):
+        raise HTTPException(status_code=404, detail="Client not found")
+    result = await asyncio.to_thread(database.delete_client, client_id)
+    return {"status": "deleted", **result}
+
+
+@app.delete("/api/clients/{client_id}/chats")
+async def purge_chats(client_id: str, older_than_days: int = None, current_user: str = Depends(get_current_user)):
+    """Borra los chats de un cliente (todos, o solo los más antiguos que N días)."""
+    _require_admin(current_user)
+    result = await asyncio.to_thread(database.purge_client_chats, client_id, older_than_days)
+    return {"status": "deleted", **result}
+
+
 @app.get("/api/clients/{client_id}")
 async def get_client(client_id: str, current_user: str = Depends(get_current_user)):
     client = database.get_client_by_id(client_id)
     if client:
-        return client
+        return client.as_dict(include_none=False)
     raise HTTPException(status_code=404, detail="Client not found")
 
 
@@ -674,6 +755,19 @@ async def delete_document(client_id: str, doc_id: str, current_user: str = Depen
     raise HTTPException(status_code=404, detail="Documento no encontrado o no se pudo eliminar")
 
 
+@app.get("/api/clients/{client_id}/knowledge/usage")
+async def get_knowledge_usage(client_id: str, current_user: str = Depends(get_current_user)):
+    """Bytes de conocimiento usados contra la cuota del plan."""
+    return database.get_knowledge_usage(client_id)
+
+
+@app.post("/api/clients/{client_id}/knowledge/compact")
+async def compact_knowledge(client_id: str, current_user: str = Depends(get_current_user)):
+    """Compacta el conocimiento del cliente y reporta los bytes ahorrados."""
+    result = await asyncio.to_thread(database.compact_client_knowledge, client_id)
+    return {"status": "compacted", **result, "usage": database.get_knowledge_usage(client_id)}
+
+
 @app.get("/api/clients/{client_id}/menu")
 async def get_client_menu(client_id: str, current_user: str = Depends(get_current_user)):
     """Obtiene la configuración del menú de un cliente."""
@@ -697,51 +791,6 @@ async def reset_demo_client(client_id: str, current_user: str = Depends(get_curr
     if not str(client_id).startswith('demo_'):
         raise HTTPException(status_code=400, detail="Solo se pueden restablecer los clientes de ejemplo (ID debe comenzar con 'demo_').")
     
-    # Plantillas de configuración original por tipo de demo
-    demo_templates = {
-        "restaurante": {
-            "name": "Restaurante La Trattoria",
-            "email": "restaurante@ejemplo.com",
-            "is_active": True,
-            "menu": {
-                "text": "¡Bienvenido a *La Trattoria*! 👋 Soy tu asistente virtual. ¿Qué te gustaría hacer hoy?",
-                "options": [
-                    {"title": "Ver Menú", "icon": "🍕", "response": "Nuestro menú incluye pizzas a la leña, pastas frescas y postres italianos."},
-                    {"title": "Hacer Reserva", "icon": "📅", "response": "Indícanos la fecha y hora para verificar disponibilidad."},
-                    {"title": "Horarios", "icon": "⏰", "response": "Estamos abiertos todos los días de 12:00 PM a 11:00 PM."}
-                ],
-                "fallback_text": "Lo siento, no entendí eso. Aquí tienes las opciones principales de La Trattoria:"
-            }
-        },
-        "clinica": {
-            "name": "Clínica San Juan",
-            "email": "clinica@ejemplo.com",
-            "is_active": True,
-            "menu": {
-                "text": "Bienvenido a la *Clínica San Juan*. 🏥 ¿En qué podemos ayudarte hoy?",
-                "options": [
-                    {"title": "Agendar Cita", "icon": "📅", "response": "Por favor, dinos para qué especialidad buscas cita."},
-                    {"title": "Especialidades", "icon": "👨‍⚕️", "response": "Contamos con Medicina General, Odontología y Pediatría."},
-                    {"title": "Ubicación", "icon": "📍", "response": "Estamos en Av. Central #123. Haz clic aquí para ver en el mapa: https://maps.google.com"}
-                ],
-                "fallback_text": "No comprendo tu solicitud. Selecciona una de estas opciones de la clínica:"
-            }
-        },
-        "tienda": {
-            "name": "Moda Urbana",
-            "email": "tienda@ejemplo.com",
-            "is_active": True,
-            "menu": {
-                "text": "¡Hola! Bienvenido a *Moda Urbana*. 🛍️ ✨ ¿Cómo podemos ayudarte con tu estilo hoy?",
-                "options": [
-                    {"title": "Ver Catálogo", "icon": "👕", "response": "Nuestra nueva colección de otoño ya está disponible."},
-                    {"title": "Tallas", "icon": "📏", "response": "Manejamos tallas desde XS hasta XL en la mayoría de nuestras prendas."},
-                    {"title": "Devoluciones", "icon": "🔄", "response": "Tienes 30 días para realizar cambios o devoluciones con tu ticket."}
-                ],
-                "fallback_text": "Ups, no reconozco eso. Aquí tienes lo que puedo hacer por ti en Moda Urbana:"
-            }
-        }
-    }
     db = database.get_db()
     
     # 1. Obtener el cliente actual para saber su phone_number_id y determinar el tipo de demo
@@ -753,56 +802,98 @@ async def reset_demo_client(client_id: str, current_user: str = Depends(get_curr
     current_data = client_doc.to_dict()
     phone_id = str(current_data.get('phone_number_id', '')).lower()
     
-    # Determinar el tipo de demo por phone_number_id o por el ID del cliente
-    template_key = None
-    if 'restaurante' in phone_id or 'restaurante' in client_id.lower() or phone_id == 'demo_123':
-        template_key = 'restaurante'
-    elif 'clinica' in phone_id or 'clinica' in client_id.lower() or phone_id == 'demo_456':
-        template_key = 'clinica'
-    elif 'tienda' in phone_id or 'tienda' in client_id.lower() or phone_id == 'demo_789':
-        template_key = 'tienda'
-    
-    # Si no se pudo determinar, intentar por el nombre del cliente
-    if not template_key:
-        client_name = str(current_data.get('name', '')).lower()
-        if 'restaurante' in client_name or 'trattoria' in client_name:
-            template_key = 'restaurante'
-        elif 'clínica' in client_name or 'clinica' in client_name or 'san juan' in client_name:
-            template_key = 'clinica'
-        elif 'tienda' in client_name or 'moda' in client_name or 'urbana' in client_name or 'ecommerce' in client_name or 'e-commerce' in client_name:
-            template_key = 'tienda'
-    
-    if not template_key:
+    # Determinar el tipo de demo por phone_number_id, por el ID o por el nombre del cliente
+    demo = demos.match_client(client_id, phone_id, current_data.get('name', ''))
+    if not demo:
         raise HTTPException(status_code=400, detail=f"No se pudo determinar el tipo de demo para '{client_id}'. Verifica que el phone_number_id o nombre del cliente indique el tipo (restaurante, clinica, tienda).")
-    
-    template = demo_templates[template_key]
+    template_key = demo.key
     
     # 2. Actualizar información básica (preservar phone_number_id y campos técnicos)
-    client_info = template.copy()
-    menu_data = client_info.pop("menu")
+    client_info = demo.firestore_client()
+    menu_data = demo.firestore_menu()
     client_info["id"] = client_id
     # Preservar el phone_number_id original para no romper la integración de WhatsApp
     client_info["phone_number_id"] = current_data.get('phone_number_id', phone_id)
     
     client_ref.set(client_info, merge=True)
+    database.mark_tenants_changed()
     
     # 3. Sobrescribir el menú completo con la configuración original
     client_ref.collection('config').document('menu').set(menu_data)
     
-    # 4. Limpiar chats para un estado limpio
-    chats = client_ref.collection('chats').stream()
-    batch = db.batch()
-    for doc in chats:
-        batch.delete(doc.reference)
-    batch.commit()
+    # 4. Limpiar chats para un estado limpio (por páginas, sin el límite de 500 por batch)
+    purged = await asyncio.to_thread(database.purge_client_chats, client_id)
+
+    return {
+        "status": "success",
+        "message": f"Cliente {client_id} restablecido correctamente como demo de '{template_key}'",
+        "chats_deleted": purged['deleted'],
+    }
+
 
-    return {"status": "success", "message": f"Cliente {client_id} restablecido correctamente como demo de '{template_key}'"}
+@app.get("/api/debug/traces")
+async def get_debug_traces(limit: int = 20, route: str = "POST /webhook", current_user: str = Depends(get_current_user)):
+    """Lista las trazas más lentas entre las recientes de esta instancia."""
+    return {"traces": tracer.collector.slowest(limit=limit, name_prefix=route)}
 
 
-@app.get("/api/clients/{client_id}/chats")
-async def list_chats(client_id: str, limit: int = 50, current_user: str = Depends(get_current_user)):
-    """Obtiene el historial de chats de un cliente."""
-    return database.get_client_chats(client_id, limit=limit)
+def _parse_chat_datetime(value: str, name: str):
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"'{name}' debe ser una fecha ISO 8601")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+@app.get("/api/clients/{client_id}/chats", response_model=ChatsPage, response_model_exclude_unset=True)
+async def list_chats(
+    client_id: str,
+    limit: int = 50,
+    start_after: str = None,
+    user_number: str = None,
+    since: str = None,
+    until: str = None,
+    fields: str = None,
+    view: str = "list",
+    current_user: str = Depends(get_current_user),
+):
+    """
+    Historial de chats de un cliente, paginado por cursor (más recientes primero).
+
+    Args:
+        limit: Chats por página (máx. 200)
+        start_after: `next_cursor` de la página anterior (400 `invalid_cursor` si no es uno)
+        user_number: Filtrar por número del usuario
+        since / until: Rango de fechas ISO 8601
+        fields: Campos separados por coma (user_number,message,response,timestamp)
+        view: 'list' (chats) o 'threads' (agrupados por usuario)
+
+    Returns:
+        Dict con `chats` o `threads`, `next_cursor` y `has_more`
+    """
+    if view not in ("list", "threads"):
+        raise HTTPException(status_code=400, detail="view debe ser 'list' o 'threads'")
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    if field_list and not set(field_list) <= set(database.CHAT_FIELDS):
+        raise HTTPException(status_code=400, detail=f"fields permitidos: {', '.join(database.CHAT_FIELDS)}")
+    try:
+        return await asyncio.to_thread(
+            database.get_client_chats_page, client_id,
+            limit=limit,
+            start_after=start_after,
+            user_number=user_number,
+            since=_parse_chat_datetime(since, "since") if since else None,
+            until=_parse_chat_datetime(until, "until") if until else None,
+            fields=field_list,
+            threads=(view == "threads"),
+        )
+    except database.InvalidChatCursor:
+        raise HTTPException(status_code=400, detail="invalid_cursor")
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.exception("Error obteniendo chats", client_id=client_id)
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/migrate")
 async def migrate_sqlite_to_firestore(current_user: str = Depends(get_current_user)):
@@ -812,31 +903,30 @@ async def migrate_sqlite_to_firestore(current_user: str = Depends(get_current_us
         return {"status": "error", "message": f"SQLite DB not found at {db_path}"}
     
     try:
-        print(f"[Migration] SQLite DB found at {db_path}. Opening connection...")
+        log.info("[Migration] SQLite DB found. Opening connection...", db_path=db_path)
         conn = sqlite3.connect(db_path)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
         # Migrar Clientes
-        print("[Migration] Extracting clients from SQLite...")
+        log.info("[Migration] Extracting clients from SQLite...")
         cursor.execute("SELECT * FROM clients")
         clients = cursor.fetchall()
-        print(f"[Migration] Found {len(clients)} clients to migrate.")
+        log.info("[Migration] Clients to migrate", count=len(clients))
         migrated_clients = 0
         for client in clients:
             client_dict = dict(client)
             old_id = client_dict.pop('id')
             
-            print(f"[Migration] Migrating client {old_id} ({client_dict.get('name')})...")
+            log.info("[Migration] Migrating client", client_id=old_id)
             # Subir a Firestore usando el ID anterior como nombre de doc para mantener refs
             doc_ref = database.get_db().collection('clients').document(str(old_id))
             doc_ref.set(client_dict)
             
             # Migrar Conocimiento
-            print(f"[Migration]   Extracting knowledge for client {old_id}...")
             cursor.execute("SELECT * FROM knowledge_base WHERE client_id = ?", (old_id,))
             knowledge = cursor.fetchall()
-            print(f"[Migration]   Found {len(knowledge)} entries.")
+            log.info("[Migration] Knowledge entries", client_id=old_id, count=len(knowledge))
             for k in knowledge:
                 k_dict = dict(k)
                 k_id = k_dict.pop('id')
@@ -844,15 +934,13 @@ async def migrate_sqlite_to_firestore(current_user: str = Depends(get_current_us
                 doc_ref.collection('knowledge').document(str(k_id)).set(k_dict)
             
             migrated_clients += 1
-            print(f"[Migration]   Client {old_id} migrated successfully.")
+            log.info("[Migration] Client migrated", client_id=old_id)
         
         conn.close()
-        print(f"[Migration] Success! Total migrated: {migrated_clients}")
+        log.info("[Migration] Success", migrated_clients=migrated_clients)
         return {"status": "success", "migrated_clients": migrated_clients}
     except Exception as e:
-        import traceback
-        error_msg = f"Error en migración: {str(e)}\n{traceback.format_exc()}"
-        print(f"[Migration] FATAL ERROR: {error_msg}")
+        log.exception("[Migration] FATAL ERROR", error=str(e))
         return {"status": "error", "message": str(e)}
 
 
@@ -877,49 +965,67 @@ async def get_settings(request: Request, current_user: str = Depends(get_current
 # so we don't need to mount it here if we are only an API.
 @app.post("/api/clients/{client_id}/upload-pdf")
 async def upload_pdf(client_id: str, request: Request, current_user: str = Depends(get_current_user)):
-    """Endpoint para subir un PDF, extraer su texto y guardarlo en la base de conocimientos."""
-    global PdfReader
-    if not PdfReader:
-        # Intentar re-importar por si se instaló después del inicio
-        try:
-            from pypdf import PdfReader as PR
-            PdfReader = PR
-        except ImportError:
-            raise HTTPException(status_code=500, detail="Biblioteca pypdf no instalada en el servidor.")
-    
-    try:
-        form = await request.form()
-        file = form.get("file")
-        
-        if not file or not hasattr(file, 'filename'):
-            raise HTTPException(status_code=400, detail="No se recibió ningún archivo.")
+    """
+    Sube un PDF y lo ingiere en la base de conocimientos.
 
-        if not file.filename.lower().endswith(".pdf"):
-            raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF.")
+    El archivo se copia a disco por bloques y se procesa antes de responder
+    (extracción por páginas en paralelo, limpieza, chunks y escrituras en
+    batch): en Cloud Functions la CPU se limita al enviar la respuesta. El
+    `job_id` permite seguir el progreso desde otra pestaña en
+    GET /api/clients/{client_id}/ingest-jobs/{job_id}.
+    """
+    if pdf_text.PdfReader is None:
+        raise HTTPException(status_code=500, detail="Biblioteca pypdf no instalada en el servidor.")
 
-        # Read the file into memory
-        contents = await file.read()
-        f = io.BytesIO(contents)
-        
-        reader = PdfReader(f)
-        text_content = ""
-        for page in reader.pages:
-            extracted = page.extract_text()
-            if extracted:
-                text_content += extracted + "\n"
-        
-        if not text_content.strip():
-            raise HTTPException(status_code=400, detail="No se pudo extraer texto del PDF (podría ser una imagen).")
+    form = await request.form()
+    file = form.get("file")
 
-        # Save to database
-        database.add_knowledge_entry(client_id, text_content, source_file=file.filename)
-        
-        return {
-            "status": "success",
-            "message": f"Contenido de '{file.filename}' procesado y guardado correctamente.",
-            "extracted_length": len(text_content)
-        }
+    if not file or not hasattr(file, 'filename'):
+        raise HTTPException(status_code=400, detail="No se recibió ningún archivo.")
+
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF.")
+
+    usage = database.get_knowledge_usage(client_id)
+    if usage['quota_bytes'] != -1 and usage['used_bytes'] >= usage['quota_bytes']:
+        raise HTTPException(status_code=413, detail=f"Cuota de conocimiento del plan '{usage['plan']}' agotada. "
+                                                    "Elimina o compacta documentos antes de subir más.")
+
+    try:
+        path = await pdf_ingestion.spool_upload(file)
+        job = await asyncio.to_thread(pdf_ingestion.run_job, client_id, path, file.filename)
     except Exception as e:
-        import traceback
-        print(f"Error procesando PDF: {e}\n{traceback.format_exc()}")
+        log.exception("Error procesando PDF", client_id=client_id, error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
+
+    if job['status'] == 'no_text':
+        raise HTTPException(status_code=400, detail=job['error'])
+    if job['status'] == 'over_quota':
+        raise HTTPException(status_code=413, detail=job['error'])
+    if job['status'] != 'done':
+        raise HTTPException(status_code=500, detail=job['error'] or "No se pudo procesar el PDF.")
+
+    if job['unchanged']:
+        message = f'"{file.filename}" ya estaba en la base de conocimientos con el mismo contenido. No hubo cambios.'
+    else:
+        message = (f'"{file.filename}" se añadió a la base de conocimientos ({job["pages_total"]} páginas). '
+                   "El bot usará este contenido para responder.")
+    return {
+        "status": "success",
+        "message": message,
+        "job_id": job['job_id'],
+        "job": job
+    }
+
+
+@app.get("/api/clients/{client_id}/ingest-jobs/{job_id}")
+async def get_ingest_job(client_id: str, job_id: str, current_user: str = Depends(get_current_user)):
+    """
+    Progreso de la ingesta de un PDF (status, pages_done/pages_total,
+    chunks_written). Al terminar, `unchanged` indica si el contenido era
+    idéntico al ya guardado y `document_version` la versión del documento.
+    """
+    job = pdf_ingestion.get_job(client_id, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return job
@@ -0,0 +1,167 @@
+"""
+Borrado paginado de colecciones de Firestore.
+
+Firestore no borra subcolecciones al eliminar un documento y un batch admite
+como máximo 500 operaciones. `purge_query` recorre la consulta por páginas
+(cursor `start_after`, sin cargar todas las referencias en memoria), borra
+primero las subcolecciones indicadas de cada documento y confirma los batches
+en paralelo con un tope de batches en vuelo.
+
+Uso:
+    purge_query(db, client_ref.collection('chats'))                       # reset de demo
+    purge_document(db, client_ref, subcollections=TENANT_SUBCOLLECTIONS)  # baja de cliente
+    purge_query(db, chats_ref.where('timestamp', '<', cutoff))            # retención
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping, Optional, Union
+
+from .logger import log
+
+PURGE_PAGE_SIZE = 300  # Documentos leídos por página
+PURGE_BATCH_SIZE = 450  # Borrados por batch (límite de Firestore: 500)
+PURGE_MAX_PARALLEL_COMMITS = 4
+
+# Subcolecciones de un cliente (clients/{id})
+TENANT_SUBCOLLECTIONS = ('chats', 'knowledge', 'knowledge_manifests', 'ingest_jobs', 'config')
+
+# Subcolecciones a borrar: nombres (sin más niveles) o {nombre: subcolecciones de sus documentos}
+Subcollections = Union[Iterable[str], Mapping[str, Any]]
+
+
+def _normalize(subcollections: Subcollections) -> Dict[str, Dict]:
+    if isinstance(subcollections, Mapping):
+        return {name: _normalize(children or ()) for name, children in subcollections.items()}
+    return {name: {} for name in subcollections}
+
+
+class PurgeProgress:
+    """Progreso de un borrado (se pasa a `on_progress` después de cada batch)."""
+
+    __slots__ = ('deleted', 'batches', 'started_at')
+
+    def __init__(self):
+        self.deleted = 0
+        self.batches = 0
+        self.started_at = time.monotonic()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'deleted': self.deleted,
+            'batches': self.batches,
+            'seconds': round(time.monotonic() - self.started_at, 3),
+        }
+
+
+def _iter_refs(query, subcollections: Dict[str, Dict], page_size: int) -> Iterator[Any]:
+    """Referencias a borrar, página por página; las subcolecciones antes que su documento."""
+    last = None
+    while True:
+        page = query.limit(page_size)
+        if last is not None:
+            page = page.start_after(last)
+        docs = list(page.stream())
+        for doc in docs:
+            for name, children in subcollections.items():
+                yield from _iter_refs(doc.reference.collection(name), children, page_size)
+            yield doc.reference
+        if len(docs) < page_size:
+            return
+        last = docs[-1]
+
+
+def _delete_refs(
+    db,
+    refs: Iterator[Any],
+    batch_size: int,
+    max_parallel: int,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]],
+) -> Dict[str, Any]:
+    progress = PurgeProgress()
+    batch_size = max(1, min(batch_size, 500))
+
+    def commit(batch, count):
+        batch.commit()
+        return count
+
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel), thread_name_prefix="fs-purge") as executor:
+        in_flight = set()
+
+        def collect(done):
+            for future in done:
+                progress.deleted += future.result()
+                progress.batches += 1
+                if on_progress:
+                    on_progress(progress.as_dict())
+
+        batch, pending = db.batch(), 0
+        for ref in refs:
+            batch.delete(ref)
+            pending += 1
+            if pending >= batch_size:
+                if len(in_flight) >= max_parallel:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight.add(executor.submit(commit, batch, pending))
+                batch, pending = db.batch(), 0
+        if pending:
+            in_flight.add(executor.submit(commit, batch, pending))
+        done, _ = wait(in_flight)
+        collect(done)
+    return progress.as_dict()
+
+
+def purge_query(
+    db,
+    query,
+    subcollections: Subcollections = (),
+    page_size: int = PURGE_PAGE_SIZE,
+    batch_size: int = PURGE_BATCH_SIZE,
+    max_parallel: int = PURGE_MAX_PARALLEL_COMMITS,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Borra todos los documentos de una colección o consulta.
+
+    Args:
+        db: Cliente de Firestore
+        query: Colección o consulta (ej. `chats.where('timestamp', '<', corte)`)
+        subcollections: Subcolecciones de cada documento a borrar también; un dict
+            {nombre: subcolecciones} borra niveles más profundos
+        page_size: Documentos leídos por página
+        batch_size: Borrados por batch (máx. 500)
+        max_parallel: Batches confirmándose a la vez
+        on_progress: Función que recibe {deleted, batches, seconds} tras cada batch
+
+    Returns:
+        Dict con deleted, batches y seconds
+    """
+    return _delete_refs(db, _iter_refs(query, _normalize(subcollections), page_size), batch_size, max_parallel, on_progress)
+
+
+def purge_document(
+    db,
+    doc_ref,
+    subcollections: Subcollections = TENANT_SUBCOLLECTIONS,
+    page_size: int = PURGE_PAGE_SIZE,
+    batch_size: int = PURGE_BATCH_SIZE,
+    max_parallel: int = PURGE_MAX_PARALLEL_COMMITS,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Borra un documento junto con sus subcolecciones (ej. un cliente completo).
+
+    Returns:
+        Dict con deleted, batches y seconds (incluye el documento)
+    """
+    subcollections = _normalize(subcollections)
+
+    def refs():
+        for name, children in subcollections.items():
+            yield from _iter_refs(doc_ref.collection(name), children, page_size)
+        yield doc_ref
+
+    result = _delete_refs(db, refs(), batch_size, max_parallel, on_progress)
+    log.info("Documento purgado", path=getattr(doc_ref, 'path', None), **result)
+    return result
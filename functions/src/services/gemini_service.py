@@ -1,23 +1,59 @@
 from google import genai
 from google.genai import types
+import importlib
 import os
 import time
-import traceback
 from .. import database  # Relative import within src package
+from ..tracing import tracer
+from ..logger import log
+
+# Respaldo por si el conocimiento se modifica sin incrementar knowledge_version
+KNOWLEDGE_CACHE_TTL_SECONDS = 300
+
+# Espera base entre reintentos por 503/429 (se multiplica por el intento)
+GEMINI_RETRY_DELAY_SECONDS = float(os.getenv("GEMINI_RETRY_DELAY_SECONDS", "2"))
+
+# Cliente de genai alternativo como "modulo:funcion" (ej. el stand-in sin red
+# loadtest.fake_genai:from_env); vacío = google.genai.Client
+GEMINI_CLIENT_FACTORY = os.getenv("GEMINI_CLIENT_FACTORY", "")
+
+
+def crear_cliente_genai(api_key):
+    """Cliente de genai: el de GEMINI_CLIENT_FACTORY si está configurado, si no google.genai.Client."""
+    if GEMINI_CLIENT_FACTORY:
+        module_name, _, attribute = GEMINI_CLIENT_FACTORY.partition(":")
+        factory = getattr(importlib.import_module(module_name), attribute)
+        return factory(api_key=api_key)
+    return genai.Client(api_key=api_key)
+
 
 class GeminiEngine:
-    def __init__(self, api_key):
-        self.client = genai.Client(api_key=api_key)
+    def __init__(self, api_key, client=None):
+        self.client = client if client is not None else crear_cliente_genai(api_key)
         self.model_id = "gemini-2.0-flash"
+        # Caché de conocimiento por cliente: {client_id: (knowledge_version, expira, texto)}
+        self._knowledge_cache = {}
+
+    def _get_knowledge(self, client_data):
+        """Conocimiento del cliente, cacheado mientras no cambie su `knowledge_version`."""
+        client_id = str(client_data['id'])
+        version = client_data.get('knowledge_version', 0)
+        cached = self._knowledge_cache.get(client_id)
+        if cached and cached[0] == version and time.time() < cached[1]:
+            return cached[2]
+        conocimiento = database.get_client_knowledge(client_id)
+        self._knowledge_cache[client_id] = (version, time.time() + KNOWLEDGE_CACHE_TTL_SECONDS, conocimiento)
+        return conocimiento
 
+    @tracer.traced("gemini.generar_respuesta")
     def generar_respuesta(self, mensaje_usuario, client_data, numero_telefono):
         """Genera una respuesta inteligente basada en el contexto del cliente y su base de conocimientos."""
         
         client_id = client_data['id']
         nombre_cliente = client_data['name']
         
-        # 1. Recuperar conocimiento específico del PDF/DB
-        conocimiento = database.get_client_knowledge(client_id)
+        # 1. Recuperar conocimiento específico del PDF/DB (cacheado por versión)
+        conocimiento = self._get_knowledge(client_data)
         
         # 2. Configurar la instrucción maestra con el contexto dinámico
         # Si el cliente tiene instrucciones personalizadas, las usamos. Si no, usamos una por defecto.
@@ -62,27 +98,27 @@ class GeminiEngine:
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                response = self.client.models.generate_content(
-                    model=self.model_id,
-                    config={
-                        "system_instruction": prompt_sistema,
-                        "temperature": 0.5,
-                    },
-                    contents=mensaje_usuario
-                )
+                with tracer.span("gemini.generate_content", attempt=attempt + 1, model=self.model_id):
+                    response = self.client.models.generate_content(
+                        model=self.model_id,
+                        config={
+                            "system_instruction": prompt_sistema,
+                            "temperature": 0.5,
+                        },
+                        contents=mensaje_usuario
+                    )
                 return response.text
 
             except Exception as e:
                 error_str = str(e)
                 if ("503" in error_str or "429" in error_str) and attempt < max_retries - 1:
-                    wait_time = (attempt + 1) * 2
-                    print(f"⚠️ Reintentando Gemini ({attempt+1}/{max_retries}) en {wait_time}s por error: {error_str[:50]}...")
+                    wait_time = (attempt + 1) * GEMINI_RETRY_DELAY_SECONDS
+                    log.warning("Reintentando Gemini", attempt=attempt + 1, max_retries=max_retries,
+                                wait_seconds=wait_time, error=error_str[:50])
                     time.sleep(wait_time)
                     continue
                 
-                error_msg = f"💀 ERROR GEMINI ({type(e).__name__}): {error_str}\n{traceback.format_exc()}"
-                print(error_msg)
-                # Ensure logs directory exists if logging to file
+                log.exception("ERROR GEMINI", error_type=type(e).__name__, error=error_str)
                 return "Lo siento, tuve un problema procesando tu mensaje. ¿Puedes repetirlo?"
 
         return "Lo siento, tuve un problema procesando tu mensaje. ¿Puedes repetirlo?"
@@ -0,0 +1,252 @@
+"""
+Ingesta de PDFs para la base de conocimientos.
+
+Flujo de un upload:
+1. `spool_upload` copia el archivo por bloques a un archivo temporal (no se
+   carga completo en memoria).
+2. `run_job` registra el job (memoria + Firestore) y lo procesa dentro del
+   request: en Cloud Functions la CPU se limita en cuanto se envía la
+   respuesta, así que un job que siguiera en un hilo después del 202 quedaría
+   detenido o se perdería con la instancia.
+3. El job extrae las páginas en un pool de procesos (PDFs grandes) o en el
+   mismo hilo (PDFs pequeños), limpia el texto y lo parte en chunks; luego
+   los escribe en Firestore en batches, actualizando el progreso.
+4. Antes de escribir se verifica la cuota `knowledge_base_mb` del plan: si el
+   texto no cabe se compacta (o se rechaza, según KNOWLEDGE_OVER_QUOTA_POLICY)
+   y el job termina en `over_quota` sin tocar la versión anterior.
+5. Los chunks se comparan por hash con la versión anterior del mismo archivo:
+   solo se escriben los que cambiaron (un re-upload idéntico no escribe nada).
+
+Mientras corre, el progreso se puede consultar con `get_job` (memoria de la
+instancia y, si la consulta llega a otra instancia, el documento
+`ingest_jobs` en Firestore).
+"""
+
+import os
+import time
+import uuid
+import tempfile
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+from .. import database
+from ..logger import log
+from . import pdf_text
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = 8  # Páginas por tarea del pool
+PDF_INLINE_MAX_PAGES = 16  # PDFs pequeños: sin levantar procesos
+KNOWLEDGE_CHUNK_CHARS = 4000
+CHUNK_WRITE_BATCH = 50  # Chunks acumulados antes de escribir en Firestore
+SPOOL_READ_BYTES = 1024 * 1024
+PROGRESS_SAVE_INTERVAL_SECONDS = 2.0
+MAX_TRACKED_JOBS = 200
+COMPACT_EXTRACT_HEADROOM = 2  # Con política 'compact', extraer hasta 2x el espacio libre antes de abortar
+
+_jobs: Dict[str, Dict[str, Any]] = {}
+_jobs_lock = threading.Lock()
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+class KnowledgeQuotaExceeded(Exception):
+    """El documento no cabe en la cuota de conocimiento del plan."""
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Pool de procesos creado bajo demanda. Usa 'spawn' porque el proceso
+    padre tiene hilos de gRPC (Firestore) que no sobreviven a un fork."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+async def spool_upload(upload) -> str:
+    """
+    Copia un UploadFile a un archivo temporal por bloques.
+
+    Returns:
+        Ruta del archivo temporal (el job lo elimina al terminar)
+    """
+    fd, path = tempfile.mkstemp(suffix=".pdf", prefix="ingest_")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                block = await upload.read(SPOOL_READ_BYTES)
+                if not block:
+                    break
+                out.write(block)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path
+
+
+def _iter_pages(path: str, pages_total: int, job: Dict[str, Any]) -> Iterator[str]:
+    """Texto limpio de cada página en orden; actualiza `pages_done`."""
+    if pages_total <= PDF_INLINE_MAX_PAGES or PDF_WORKERS <= 1:
+        ranges = [pdf_text.extract_pages(path, 0, pages_total)]
+    else:
+        pool = _get_process_pool()
+        # map() conserva el orden; las tareas se ejecutan en paralelo
+        ranges = pool.map(
+            pdf_text.extract_pages,
+            itertools.repeat(path),
+            range(0, pages_total, PDF_PAGES_PER_TASK),
+            range(PDF_PAGES_PER_TASK, pages_total + PDF_PAGES_PER_TASK, PDF_PAGES_PER_TASK),
+        )
+    for pages in ranges:
+        for page in pages:
+            job['pages_done'] += 1
+            yield pdf_text.clean_text(page)
+
+
+def _save_progress(job: Dict[str, Any], force: bool = False):
+    now = time.monotonic()
+    if force or now - job.get('_saved_at', 0) >= PROGRESS_SAVE_INTERVAL_SECONDS:
+        job['_saved_at'] = now
+        database.save_ingest_job(job['client_id'], job['job_id'], _public(job))
+
+
+def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in job.items() if not k.startswith('_')}
+
+
+def _over_quota_error(usage: Dict[str, Any], document_bytes: int) -> str:
+    return (f"El documento ({document_bytes / 1048576:.2f} MB) excede la cuota de conocimiento del plan "
+            f"'{usage['plan']}' ({usage['used_bytes'] / 1048576:.2f} de {usage['quota_bytes'] / 1048576:.0f} MB usados).")
+
+
+def _run_job(job: Dict[str, Any], path: str):
+    try:
+        job['status'] = 'extracting'
+        job['pages_total'] = pdf_text.count_pages(path)
+        manifest = database.get_knowledge_manifest(job['client_id'], job['document_id'])
+        previous_hashes = (manifest or {}).get('chunk_hashes')
+        _, usage = database.check_knowledge_quota(job['client_id'], 0, manifest)
+        compact = database.KNOWLEDGE_OVER_QUOTA_POLICY == 'compact'
+        # Espacio disponible para este documento; con compactación se tolera
+        # extraer más (se reduce antes de escribir)
+        available = usage['quota_bytes'] - usage['projected_bytes']
+        extract_limit = available * (COMPACT_EXTRACT_HEADROOM if compact else 1)
+        _save_progress(job, force=True)
+
+        # 1. Extraer y partir: el texto (no el PDF) se acumula para decidir la
+        #    cuota antes de sobrescribir cualquier chunk de la versión anterior
+        chunks: List[str] = []
+        for chunk in pdf_text.chunk_text(_iter_pages(path, job['pages_total'], job), KNOWLEDGE_CHUNK_CHARS):
+            chunks.append(chunk)
+            job['chunks_total'] += 1
+            job['chars'] += len(chunk)
+            job['bytes'] += pdf_text.text_bytes(chunk)
+            if usage['quota_bytes'] != -1 and job['bytes'] > extract_limit:
+                raise KnowledgeQuotaExceeded(_over_quota_error(usage, job['bytes']))
+            _save_progress(job)
+
+        if not chunks:
+            job['status'] = 'no_text'
+            job['error'] = "No se pudo extraer texto del PDF (podría ser una imagen)."
+            return
+
+        # 2. Cuota: compactar si no cabe (según la política) o rechazar
+        if usage['quota_bytes'] != -1 and job['bytes'] > available:
+            if compact:
+                chunks = pdf_text.compact_chunks(chunks, KNOWLEDGE_CHUNK_CHARS)
+                compacted_bytes = sum(pdf_text.text_bytes(chunk) for chunk in chunks)
+                job['bytes_saved'] = job['bytes'] - compacted_bytes
+                job['bytes'] = compacted_bytes
+                job['chunks_total'] = len(chunks)
+            if job['bytes'] > available:
+                raise KnowledgeQuotaExceeded(_over_quota_error(usage, job['bytes']))
+
+        # 3. Escribir en batches (solo los chunks cuyo hash cambió)
+        job['status'] = 'writing'
+        chunk_hashes = [database.content_hash(chunk) for chunk in chunks]
+        for start in range(0, len(chunks), CHUNK_WRITE_BATCH):
+            job['chunks_written'] += database.add_knowledge_chunks(
+                job['client_id'], job['document_id'], job['source_file'], chunks[start:start + CHUNK_WRITE_BATCH], start,
+                previous_hashes=previous_hashes, chunk_hashes=chunk_hashes[start:start + CHUNK_WRITE_BATCH])
+            _save_progress(job)
+
+        result = database.finalize_knowledge_document(
+            job['client_id'], job['document_id'], job['source_file'], chunk_hashes, manifest, job['bytes'])
+        job['unchanged'] = not result['changed']
+        job['document_version'] = result['version']
+        job['chunks_deleted'] = result['chunks_deleted']
+        job['status'] = 'done'
+        log.info("PDF ingerido", client_id=job['client_id'], job_id=job['job_id'], pages=job['pages_total'],
+                 chunks=job['chunks_total'], chunks_written=job['chunks_written'], unchanged=job['unchanged'],
+                 chars=job['chars'], bytes=job['bytes'], bytes_saved=job['bytes_saved'])
+    except KnowledgeQuotaExceeded as e:
+        job['status'] = 'over_quota'
+        job['error'] = str(e)
+        log.warning("PDF excede la cuota de conocimiento", client_id=job['client_id'], job_id=job['job_id'],
+                    bytes=job['bytes'])
+    except Exception as e:
+        job['status'] = 'error'
+        job['error'] = str(e)
+        log.exception("Error procesando PDF", client_id=job['client_id'], job_id=job['job_id'])
+    finally:
+        job['finished_at'] = time.time()
+        _save_progress(job, force=True)
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def run_job(client_id: str, path: str, source_file: str) -> Dict[str, Any]:
+    """
+    Registra y procesa (bloqueante) la ingesta de un PDF ya copiado a `path`.
+
+    Returns:
+        Estado final del job (incluye `job_id` y `status`: done, no_text,
+        over_quota o error)
+    """
+    job_id = uuid.uuid4().hex
+    job = {
+        'job_id': job_id,
+        'client_id': str(client_id),
+        'document_id': database.knowledge_document_id(source_file),
+        'source_file': source_file,
+        'status': 'queued',
+        'pages_total': None,
+        'pages_done': 0,
+        'chunks_total': 0,
+        'chunks_written': 0,
+        'chunks_deleted': 0,
+        'unchanged': None,
+        'document_version': None,
+        'chars': 0,
+        'bytes': 0,
+        'bytes_saved': 0,
+        'error': None,
+        'created_at': time.time(),
+        'finished_at': None,
+    }
+    with _jobs_lock:
+        if len(_jobs) >= MAX_TRACKED_JOBS:
+            # Olvidar los jobs terminados más antiguos
+            finished = sorted((j for j in _jobs.values() if j['finished_at']), key=lambda j: j['finished_at'])
+            for old in finished[:len(_jobs) - MAX_TRACKED_JOBS + 1]:
+                del _jobs[old['job_id']]
+        _jobs[job_id] = job
+    _save_progress(job, force=True)
+    _run_job(job, path)
+    return _public(job)
+
+
+def get_job(client_id: str, job_id: str) -> Optional[Dict[str, Any]]:
+    """Estado de un job de ingesta (memoria local o Firestore)."""
+    job = _jobs.get(job_id)
+    if job and job['client_id'] == str(client_id):
+        return _public(job)
+    return database.get_ingest_job(client_id, job_id)
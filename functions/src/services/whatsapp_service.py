@@ -1,59 +1,78 @@
+import os
 import requests
 import json
-import sys
 from firebase_admin import firestore
 from datetime import datetime
 
-def enviar_mensaje_whatsapp(numero, texto, whatsapp_token, phone_number_id):
-    """Envía un mensaje de texto plano a través de la API de WhatsApp Cloud."""
-    url = f"https://graph.facebook.com/v22.0/{phone_number_id}/messages"
+from ..tracing import tracer
+from ..logger import log
+
+# Guardar cada envío en Firestore (debug_logs) solo si se habilita explícitamente;
+# por defecto solo se guardan los envíos fallidos.
+WHATSAPP_DEBUG_LOGS = os.getenv("WHATSAPP_DEBUG_LOGS", "").lower() in ("1", "true", "yes")
+
+# Sobrescribible para apuntar a un stand-in local (loadtest/graph_server.py)
+WHATSAPP_API_BASE_URL = os.getenv("WHATSAPP_API_BASE_URL", "https://graph.facebook.com/v22.0")
+
+
+def _post_mensaje(tipo, numero, data, whatsapp_token, phone_number_id):
+    """Hace el POST a la Graph API y registra el resultado. Retorna la respuesta HTTP."""
+    url = f"{WHATSAPP_API_BASE_URL}/{phone_number_id}/messages"
     headers = {
         "Authorization": f"Bearer {whatsapp_token}",
         "Content-Type": "application/json; charset=utf-8"
     }
-    data = {
-        "messaging_product": "whatsapp",
-        "to": numero,
-        "type": "text",
-        "text": {"body": texto}
-    }
-    try:
-        # Usamos json.dumps con ensure_ascii=False para enviar tildes reales y no códigos \u00xx
-        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
-        response = requests.post(url, headers=headers, data=payload)
-        
-        # Log to Firestore for real-time debugging
+    # Usamos json.dumps con ensure_ascii=False para enviar tildes reales y no códigos \u00xx
+    payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    response = requests.post(url, headers=headers, data=payload)
+
+    span = tracer.current_span()
+    if span:
+        span.set_attribute("http.status_code", response.status_code)
+
+    # Log to Firestore for real-time debugging (solo errores, salvo WHATSAPP_DEBUG_LOGS)
+    if WHATSAPP_DEBUG_LOGS or response.status_code != 200:
         try:
             from .. import database
             db = database.get_db()
             db.collection('debug_logs').add({
-                'type': 'text',
+                'type': tipo,
                 'to': numero,
                 'status': response.status_code,
                 'response': response.text[:500],
                 'timestamp': firestore.SERVER_TIMESTAMP
             })
         except Exception as log_err:
-            print(f"⚠️ LOGGING FAILED: {log_err}"); sys.stdout.flush()
+            log.warning("LOGGING FAILED", error=str(log_err))
+
+    return response
+
+
+@tracer.traced("whatsapp.enviar_mensaje")
+def enviar_mensaje_whatsapp(numero, texto, whatsapp_token, phone_number_id):
+    """Envía un mensaje de texto plano a través de la API de WhatsApp Cloud."""
+    data = {
+        "messaging_product": "whatsapp",
+        "to": numero,
+        "type": "text",
+        "text": {"body": texto}
+    }
+    try:
+        response = _post_mensaje('text', numero, data, whatsapp_token, phone_number_id)
 
         if response.status_code == 200:
-            print(f"✅ WHATSAPP [{numero}]: {texto[:50]}..."); sys.stdout.flush()
+            log.info("WHATSAPP enviado", to=numero, text=texto)
             return True
         else:
-            print(f"❌ ERROR WHATSAPP ({response.status_code}): {response.text}"); sys.stdout.flush()
+            log.error("ERROR WHATSAPP", status=response.status_code, response_body=response.text)
             return False
     except Exception as e:
-        print(f"🔥 EXCEPCIÓN WHATSAPP: {e}"); sys.stdout.flush()
+        log.error("EXCEPCIÓN WHATSAPP", error=str(e))
         return False
 
+@tracer.traced("whatsapp.enviar_menu_botones")
 def enviar_menu_botones(numero, texto, opciones, whatsapp_token, phone_number_id):
     """Envía un mensaje con hasta 3 botones de respuesta rápida."""
-    url = f"https://graph.facebook.com/v22.0/{phone_number_id}/messages"
-    headers = {
-        "Authorization": f"Bearer {whatsapp_token}",
-        "Content-Type": "application/json; charset=utf-8"
-    }
-    
     buttons = []
     for i, opcion in enumerate(opciones[:3]):
         buttons.append({
@@ -75,41 +94,20 @@ def enviar_menu_botones(numero, texto, opciones, whatsapp_token, phone_number_id
             "action": {"buttons": buttons}
         }
     }
-    
+
     try:
-        # Usamos json.dumps con ensure_ascii=False para enviar tildes reales y no códigos \u00xx
-        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
-        response = requests.post(url, headers=headers, data=payload)
-        
-        # Log to Firestore for real-time debugging
-        try:
-            from .. import database
-            db = database.get_db()
-            db.collection('debug_logs').add({
-                'type': 'interactive_button',
-                'to': numero,
-                'status': response.status_code,
-                'response': response.text[:500],
-                'timestamp': firestore.SERVER_TIMESTAMP
-            })
-        except Exception as log_err:
-            print(f"⚠️ LOGGING FAILED: {log_err}"); sys.stdout.flush()
+        response = _post_mensaje('interactive_button', numero, data, whatsapp_token, phone_number_id)
 
         if response.status_code != 200:
-            print(f"❌ ERROR WHATSAPP LISTA/BOTONES ({response.status_code}): {response.text}"); sys.stdout.flush()
+            log.error("ERROR WHATSAPP LISTA/BOTONES", status=response.status_code, response_body=response.text)
         return response.status_code == 200
     except Exception as e:
-        print(f"🔥 ERROR ENVIANDO BOTONES/LISTA: {e}"); sys.stdout.flush()
+        log.error("ERROR ENVIANDO BOTONES/LISTA", error=str(e))
         return False
 
+@tracer.traced("whatsapp.enviar_menu_lista")
 def enviar_menu_lista(numero, texto, titulo_boton, titulo_seccion, opciones, whatsapp_token, phone_number_id):
     """Envía un mensaje con un menú de lista desplegable (hasta 10 opciones)."""
-    url = f"https://graph.facebook.com/v22.0/{phone_number_id}/messages"
-    headers = {
-        "Authorization": f"Bearer {whatsapp_token}",
-        "Content-Type": "application/json; charset=utf-8"
-    }
-
     rows = []
     for i, opcion in enumerate(opciones[:10]):
         rows.append({
@@ -139,25 +137,8 @@ def enviar_menu_lista(numero, texto, titulo_boton, titulo_seccion, opciones, wha
     }
 
     try:
-        # Usamos json.dumps con ensure_ascii=False para enviar tildes reales y no códigos \u00xx
-        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
-        response = requests.post(url, headers=headers, data=payload)
-        
-        # Log to Firestore for real-time debugging
-        try:
-            from .. import database
-            db = database.get_db()
-            db.collection('debug_logs').add({
-                'type': 'interactive_list',
-                'to': numero,
-                'status': response.status_code,
-                'response': response.text[:512],
-                'timestamp': firestore.SERVER_TIMESTAMP
-            })
-        except Exception as log_err:
-            print(f"⚠️ LOGGING FAILED: {log_err}"); sys.stdout.flush()
-
+        response = _post_mensaje('interactive_list', numero, data, whatsapp_token, phone_number_id)
         return response.status_code == 200
     except Exception as e:
-        print(f"🔥 ERROR ENVIANDO LISTA: {e}")
+        log.error("ERROR ENVIANDO LISTA", error=str(e))
         return False
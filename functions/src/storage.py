@@ -0,0 +1,252 @@
+"""
+Interfaz única de almacenamiento sobre SQLite, Firestore y memoria.
+
+`src/database.py` (SQLite) y `functions/src/database.py` (Firestore) crecieron
+por separado: el historial se guarda con `add_to_conversation_history` en uno
+y `save_chat_message` en el otro, y `get_client_knowledge` une los chunks de
+forma distinta. `Storage` fija un contrato común con operaciones por lotes:
+
+- `get_tenants_many(ids)`: varios clientes en una lectura (primero la foto de
+  tenants, luego un solo `IN (...)` / `get_all` para los que falten)
+- `append_messages(exchanges)`: varios intercambios en una transacción/batch
+- `get_history_many(keys, limit)`: historial de varias conversaciones
+- `get_knowledge(client_id)`: chunks en orden de documento, unidos con
+  KNOWLEDGE_SEPARATOR ("" si no hay conocimiento)
+
+Cada app trae solo su backend: `FirestoreStorage` aquí y `SQLiteStorage` en
+src/storage.py. El contrato y `MemoryStorage` (benchmarks y pruebas locales)
+son iguales en los dos módulos. tests/test_storage.py y `bench_storage.py`
+verifican que los tres backends cumplan el mismo contrato.
+"""
+
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Protocol, Sequence, Tuple, runtime_checkable
+
+from .models import Client, HistoryMessage
+
+KNOWLEDGE_SEPARATOR = "\n\n"
+
+# Límite del backend por operación
+FIRESTORE_MAX_BATCH_WRITES = 500
+
+# (str(client_id), número del usuario)
+HistoryKey = Tuple[str, str]
+
+
+def history_key(client_id, user_number) -> HistoryKey:
+    return (str(client_id), str(user_number))
+
+
+def _unique(values: Iterable) -> List:
+    return list(dict.fromkeys(values))
+
+
+@dataclass(frozen=True, slots=True)
+class ChatExchange:
+    """Mensaje del usuario y respuesta del asistente en una conversación."""
+
+    client_id: Any
+    user_number: str
+    message: str
+    response: str
+
+
+@runtime_checkable
+class Storage(Protocol):
+    """Contrato común de los backends (ver docstring del módulo)."""
+
+    backend: str
+
+    def get_tenants_many(self, client_ids: Iterable[Any]) -> Dict[str, Client]:
+        """Clientes encontrados, por str(id); los que no existen no aparecen."""
+        ...
+
+    def append_messages(self, exchanges: Sequence[ChatExchange]) -> int:
+        """Guarda los intercambios (en orden) y retorna cuántos se guardaron."""
+        ...
+
+    def get_history_many(self, keys: Iterable[HistoryKey], limit: int = 10) -> Dict[HistoryKey, List[HistoryMessage]]:
+        """
+        Últimos `limit` mensajes (usuario y asistente) de cada conversación,
+        del más antiguo al más reciente. Toda llave pedida aparece (lista vacía si no hay).
+        """
+        ...
+
+    def get_knowledge(self, client_id) -> str:
+        ...
+
+
+class _TenantSnapshotMixin:
+    """Lecturas de clientes desde la foto de tenants antes de ir a la base."""
+
+    tenants = None
+
+    def _split_snapshot(self, client_ids: Iterable[Any]) -> Tuple[Dict[str, Client], List[str]]:
+        found: Dict[str, Client] = {}
+        missing: List[str] = []
+        snapshot = self.tenants.current() if self.tenants is not None else None
+        for client_id in _unique(str(c) for c in client_ids):
+            client = snapshot.get_by_id(client_id) if snapshot is not None else None
+            if client is not None:
+                found[client_id] = client
+            else:
+                missing.append(client_id)
+        return found, missing
+
+    def _wake_tenants(self):
+        # Había clientes en la base que no estaban en la foto
+        if self.tenants is not None:
+            self.tenants.wake()
+
+
+# ============================================
+# MEMORIA
+# ============================================
+
+class MemoryStorage:
+    """Backend en memoria, para benchmarks y pruebas locales (no persiste)."""
+
+    backend = "memory"
+
+    def __init__(self, clients: Iterable[Any] = (), knowledge: Optional[Mapping[Any, Sequence[str]]] = None):
+        """
+        Args:
+            clients: Clientes iniciales (`Client` o dicts con `id`)
+            knowledge: Chunks de conocimiento por client_id, en orden
+        """
+        self._lock = threading.Lock()
+        self._clients: Dict[str, Client] = {}
+        self._history: Dict[HistoryKey, List[HistoryMessage]] = {}
+        self._knowledge: Dict[str, List[str]] = {}
+        for client in clients:
+            self.put_client(client)
+        for client_id, chunks in (knowledge or {}).items():
+            self.set_knowledge(client_id, chunks)
+
+    def put_client(self, client):
+        client = client if isinstance(client, Client) else Client.from_dict(client)
+        self._clients[str(client.id)] = client
+
+    def set_knowledge(self, client_id, chunks: Sequence[str]):
+        self._knowledge[str(client_id)] = list(chunks)
+
+    def get_tenants_many(self, client_ids: Iterable[Any]) -> Dict[str, Client]:
+        clients = self._clients
+        return {key: clients[key] for key in _unique(str(c) for c in client_ids) if key in clients}
+
+    def append_messages(self, exchanges: Sequence[ChatExchange]) -> int:
+        created_at = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            for exchange in exchanges:
+                history = self._history.setdefault(history_key(exchange.client_id, exchange.user_number), [])
+                history.append(HistoryMessage(exchange.message, True, created_at))
+                history.append(HistoryMessage(exchange.response, False, created_at))
+        return len(exchanges)
+
+    def get_history_many(self, keys: Iterable[HistoryKey], limit: int = 10) -> Dict[HistoryKey, List[HistoryMessage]]:
+        result = {}
+        for key in _unique(history_key(*key) for key in keys):
+            history = self._history.get(key, ())
+            result[key] = list(history[-limit:]) if limit > 0 else []
+        return result
+
+    def get_knowledge(self, client_id) -> str:
+        return KNOWLEDGE_SEPARATOR.join(self._knowledge.get(str(client_id), ()))
+
+
+# ============================================
+# FIRESTORE
+# ============================================
+
+class FirestoreStorage(_TenantSnapshotMixin):
+    """
+    Backend sobre clients/{id} con las subcolecciones chats y knowledge.
+    Cada intercambio es un documento de chats (user_number, message, response, timestamp).
+    """
+
+    backend = "firestore"
+
+    def __init__(self, get_db: Callable[[], Any], tenants=None):
+        """
+        Args:
+            get_db: Retorna el cliente de Firestore (ej. `lambda: database.get_db()`)
+            tenants: `TenantDirectory` opcional para servir clientes desde memoria
+        """
+        # Import diferido: la app de SQLite no carga firebase-admin al arrancar
+        from firebase_admin import firestore
+        self._firestore = firestore
+        self._get_db = get_db
+        self.tenants = tenants
+
+    def _client_ref(self, db, client_id):
+        return db.collection('clients').document(str(client_id))
+
+    def get_tenants_many(self, client_ids: Iterable[Any]) -> Dict[str, Client]:
+        found, missing = self._split_snapshot(client_ids)
+        if not missing:
+            return found
+        db = self._get_db()
+        # get_all: una sola llamada RPC para todos los documentos
+        docs = [doc for doc in db.get_all([self._client_ref(db, key) for key in missing]) if doc.exists]
+        for doc in docs:
+            found[doc.id] = Client.from_snapshot(doc)
+        if docs:
+            self._wake_tenants()
+        return found
+
+    def append_messages(self, exchanges: Sequence[ChatExchange]) -> int:
+        exchanges = list(exchanges)
+        if len(exchanges) > 1:
+            # Todo el batch recibiría el mismo SERVER_TIMESTAMP y el orden de
+            # una conversación quedaría indefinido: hora local + 1 µs por intercambio
+            base = datetime.now(timezone.utc)
+            timestamps = [base + timedelta(microseconds=i) for i in range(len(exchanges))]
+        else:
+            timestamps = [self._firestore.SERVER_TIMESTAMP]
+        db = self._get_db()
+        for start in range(0, len(exchanges), FIRESTORE_MAX_BATCH_WRITES):
+            batch = db.batch()
+            for exchange, timestamp in zip(exchanges[start:start + FIRESTORE_MAX_BATCH_WRITES],
+                                           timestamps[start:start + FIRESTORE_MAX_BATCH_WRITES]):
+                batch.set(self._client_ref(db, exchange.client_id).collection('chats').document(), {
+                    'user_number': exchange.user_number,
+                    'message': exchange.message,
+                    'response': exchange.response,
+                    'timestamp': timestamp,
+                })
+            batch.commit()
+        return len(exchanges)
+
+    def get_history_many(self, keys: Iterable[HistoryKey], limit: int = 10) -> Dict[HistoryKey, List[HistoryMessage]]:
+        keys = _unique(history_key(*key) for key in keys)
+        result: Dict[HistoryKey, List[HistoryMessage]] = {key: [] for key in keys}
+        if limit <= 0:
+            return result
+        db = self._get_db()
+        exchanges_needed = (limit + 1) // 2
+        # Firestore no limita por grupo en una consulta: una por conversación
+        # (índice compuesto user_number + timestamp de firestore.indexes.json)
+        for key in keys:
+            client_id, user_number = key
+            query = (self._client_ref(db, client_id).collection('chats')
+                     .where('user_number', '==', user_number)
+                     .order_by('timestamp', direction=self._firestore.Query.DESCENDING)
+                     .limit(exchanges_needed))
+            messages = []
+            for doc in reversed(list(query.stream())):
+                data = doc.to_dict() or {}
+                ts = data.get('timestamp')
+                created_at = ts.isoformat() if hasattr(ts, 'isoformat') else ts
+                messages.append(HistoryMessage(data.get('message', ''), True, created_at))
+                messages.append(HistoryMessage(data.get('response', ''), False, created_at))
+            result[key] = messages[-limit:]
+        return result
+
+    def get_knowledge(self, client_id) -> str:
+        db = self._get_db()
+        docs = [(doc.id, doc.to_dict() or {}) for doc in self._client_ref(db, client_id).collection('knowledge').stream()]
+        # Los chunks de un mismo documento se ordenan por posición
+        docs.sort(key=lambda item: (item[1].get('document_id') or item[0], item[1].get('chunk_index', 0)))
+        return KNOWLEDGE_SEPARATOR.join(data.get('content', '') for _, data in docs)
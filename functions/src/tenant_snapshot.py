@@ -0,0 +1,196 @@
+"""
+Snapshot en memoria de la configuración de todos los tenants (clientes).
+
+Cada webhook lee su cliente por phone_number_id y el panel lo lee por id o
+email, pero la tabla/colección `clients` casi nunca cambia. `TenantDirectory`
+mantiene una foto inmutable de todos los clientes, indexada por id,
+phone_number_id, whatsapp_number y email:
+
+- Las lecturas son búsquedas en dicts de la foto actual, sin locks ni I/O
+- Un hilo de fondo consulta un contador de versión barato (fila
+  tenant_version en SQLite, documento meta/tenants en Firestore) y, si cambió,
+  reconstruye la foto completa y la reemplaza con una sola asignación
+- Si se pide un cliente que no está (creado en otra instancia hace segundos),
+  el llamador consulta la base y pide una actualización con `wake()`
+- Aunque la versión no cambie, la foto se reconstruye cada `max_age_seconds`
+  (escrituras de scripts que no incrementan el contador)
+
+Los clientes de la foto son `models.Client` (inmutables); quien necesite
+cambiar campos para una request usa `with_overrides()`. Mismo módulo en src/ y
+functions/src/.
+"""
+
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from .models import Client
+
+TENANT_POLL_INTERVAL_SECONDS = 2
+TENANT_MAX_AGE_SECONDS = 300
+
+
+def _key(value) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def _email_key(value) -> Optional[str]:
+    return str(value).lower().strip() if value else None
+
+
+def _approx_size(clients: Iterable[Client]) -> int:
+    """Bytes aproximados de los clientes (objetos + valores de primer nivel)."""
+    total = 0
+    for client in clients:
+        total += sys.getsizeof(client) + sum(sys.getsizeof(value) for value in client.values())
+        if client.extra:
+            total += sys.getsizeof(client.extra)
+    return total
+
+
+class TenantSnapshot:
+    """Foto inmutable de los clientes con sus índices."""
+
+    __slots__ = ('version', 'clients', 'by_id', 'by_phone_number_id', 'by_whatsapp_number', 'by_email',
+                 'built_at', 'build_seconds', 'size_bytes')
+
+    def __init__(self, version: Any, clients: Iterable[Client]):
+        self.version = version
+        self.clients = tuple(clients)
+        by_id, by_phone, by_whatsapp, by_email = {}, {}, {}, {}
+        for client in self.clients:
+            for index, key in ((by_id, _key(client.get('id'))),
+                               (by_phone, _key(client.get('phone_number_id'))),
+                               (by_whatsapp, _key(client.get('whatsapp_number'))),
+                               (by_email, _email_key(client.get('email')))):
+                # Si hay duplicados gana el primero, como en las consultas con limit(1)
+                if key is not None and key not in index:
+                    index[key] = client
+        self.by_id = by_id
+        self.by_phone_number_id = by_phone
+        self.by_whatsapp_number = by_whatsapp
+        self.by_email = by_email
+        self.built_at = time.time()
+        self.build_seconds = 0.0
+        self.size_bytes = _approx_size(self.clients)
+
+    def get_by_id(self, client_id) -> Optional[Client]:
+        return self.by_id.get(_key(client_id))
+
+    def get_by_phone(self, phone_number_id) -> Optional[Client]:
+        """Por phone_number_id de Meta o, si no, por número de WhatsApp."""
+        key = _key(phone_number_id)
+        return self.by_phone_number_id.get(key) or self.by_whatsapp_number.get(key)
+
+    def get_by_email(self, email) -> Optional[Client]:
+        return self.by_email.get(_email_key(email))
+
+
+class TenantDirectory:
+    """Foto actual de los tenants y el hilo que la mantiene al día."""
+
+    def __init__(self, load: Callable[[], Iterable[Client]], read_version: Callable[[], Any],
+                 poll_interval_seconds: float = TENANT_POLL_INTERVAL_SECONDS,
+                 max_age_seconds: float = TENANT_MAX_AGE_SECONDS):
+        """
+        Args:
+            load: Lee todos los clientes de la base (como `Client`)
+            read_version: Lee el contador de versión de los clientes
+            poll_interval_seconds: Cada cuánto se consulta la versión
+            max_age_seconds: Antigüedad máxima de la foto aunque la versión no cambie
+        """
+        self._load = load
+        self._read_version = read_version
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_age_seconds = max_age_seconds
+        self._snapshot: Optional[TenantSnapshot] = None
+        self._build_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._force_next = False
+        self._thread: Optional[threading.Thread] = None
+        self._last_check = 0.0
+        self._counters = {"refreshes": 0, "refresh_errors": 0, "version_checks": 0}
+
+    def current(self) -> TenantSnapshot:
+        """
+        Foto actual. La primera llamada la construye; las siguientes no
+        bloquean. Si el hilo no ha revisado la versión en un
+        rato (ej. CPU limitada entre requests en Cloud Functions), lo despierta.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._build_lock:
+                if self._snapshot is None:
+                    self._rebuild(self._read_version())
+                snapshot = self._snapshot
+        elif time.monotonic() - self._last_check > 2 * self.poll_interval_seconds:
+            self._wake.set()
+        return snapshot
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Reconstruye la foto si cambió la versión, si es muy antigua o si `force`.
+
+        Returns:
+            True si se reemplazó la foto
+        """
+        with self._build_lock:
+            self._counters["version_checks"] += 1
+            self._last_check = time.monotonic()
+            version = self._read_version()
+            snapshot = self._snapshot
+            if (not force and snapshot is not None and version == snapshot.version
+                    and time.time() - snapshot.built_at < self.max_age_seconds):
+                return False
+            self._rebuild(version)
+            return True
+
+    def wake(self):
+        """Pide al hilo recargar la foto ya (ej. un cliente estaba en la base pero no en la foto)."""
+        self._force_next = True
+        self._wake.set()
+
+    def _rebuild(self, version):
+        started = time.perf_counter()
+        snapshot = TenantSnapshot(version, self._load())
+        snapshot.build_seconds = time.perf_counter() - started
+        # Asignación atómica: los lectores ven la foto anterior o la nueva completa
+        self._snapshot = snapshot
+        self._last_check = time.monotonic()
+        self._counters["refreshes"] += 1
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="tenant-snapshot", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval_seconds)
+            self._wake.clear()
+            force, self._force_next = self._force_next, False
+            try:
+                self.refresh(force=force)
+            except Exception as e:
+                # Se conserva la foto anterior
+                self._counters["refresh_errors"] += 1
+                print(f"⚠️ ERROR actualizando snapshot de tenants: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return dict(self._counters, loaded=False)
+        return dict(
+            self._counters,
+            loaded=True,
+            version=snapshot.version,
+            tenants=len(snapshot.clients),
+            size_bytes=snapshot.size_bytes,
+            refresh_ms=round(snapshot.build_seconds * 1000, 2),
+            age_seconds=round(time.time() - snapshot.built_at, 1),
+        )
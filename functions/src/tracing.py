@@ -0,0 +1,285 @@
+"""
+Tracing ligero por spans para el camino caliente del webhook.
+
+API:
+- `with tracer.span("nombre", atributo=valor):` mide un bloque
+- `@tracer.traced("nombre")` mide una función (sync o async)
+- `tracer.current_trace_id()` para correlacionar logs
+- `with tracer.suppressed():` no registra spans (requests fuera de `should_trace`)
+
+Los spans se propagan con contextvars (funciona con asyncio y asyncio.to_thread).
+Al cerrar el span raíz, la traza completa se entrega al colector en memoria
+(últimas N trazas, consultables por duración) y, si TRACE_EXPORT_PATH está
+definido, se agrega como una línea JSON en formato OTLP/JSON compatible con
+OpenTelemetry.
+"""
+
+import os
+import json
+import time
+import secrets
+import threading
+import functools
+import asyncio
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+
+class Span:
+    """Un intervalo medido dentro de una traza."""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns',
+                 'wall_start', 'attributes', 'status', 'error')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.wall_start = time.time_ns()
+        self.attributes = attributes
+        self.status = 'ok'
+        self.error = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.perf_counter_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self, root_start_ns: int = None) -> Dict[str, Any]:
+        data = {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'duration_ms': round(self.duration_ms, 3),
+            'status': self.status,
+        }
+        if root_start_ns is not None:
+            data['offset_ms'] = round((self.start_ns - root_start_ns) / 1e6, 3)
+        if self.attributes:
+            data['attributes'] = self.attributes
+        if self.error:
+            data['error'] = self.error
+        return data
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """Representación OTLP/JSON (opentelemetry-proto) del span."""
+        end_wall = self.wall_start + ((self.end_ns or self.start_ns) - self.start_ns)
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 2 if self.parent_id is None else 1,  # SERVER / INTERNAL
+            'startTimeUnixNano': str(self.wall_start),
+            'endTimeUnixNano': str(end_wall),
+            'attributes': [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            'status': {'code': 2, 'message': self.error or ''} if self.status == 'error' else {'code': 1},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+class InMemoryCollector:
+    """Guarda las últimas N trazas completas para inspección (/api/debug/traces)."""
+
+    def __init__(self, max_traces: int = 200):
+        self.traces = deque(maxlen=max_traces)
+
+    def export(self, spans: List[Span]):
+        self.traces.append(spans)
+
+    def slowest(self, limit: int = 20, name_prefix: str = None) -> List[Dict[str, Any]]:
+        """
+        Retorna las trazas más lentas entre las recientes.
+
+        Args:
+            limit: Cantidad máxima de trazas
+            name_prefix: Filtrar por nombre del span raíz (ej. "POST /webhook")
+        """
+        roots = []
+        for spans in list(self.traces):
+            root = spans[-1]  # El raíz es el último en cerrar
+            if name_prefix and not root.name.startswith(name_prefix):
+                continue
+            roots.append((root, spans))
+
+        roots.sort(key=lambda item: item[0].duration_ms, reverse=True)
+        result = []
+        for root, spans in roots[:limit]:
+            result.append({
+                'trace_id': root.trace_id,
+                'name': root.name,
+                'duration_ms': round(root.duration_ms, 3),
+                'started_at': root.wall_start / 1e9,
+                'attributes': root.attributes,
+                'spans': [s.to_dict(root.start_ns) for s in sorted(spans, key=lambda s: s.start_ns)],
+            })
+        return result
+
+
+class FileExporter:
+    """Exporta cada traza como una línea OTLP/JSON (resourceSpans) a un archivo local."""
+
+    def __init__(self, path: str, service_name: str):
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]):
+        payload = {
+            'resourceSpans': [{
+                'resource': {'attributes': [_otlp_attribute('service.name', self.service_name)]},
+                'scopeSpans': [{
+                    'scope': {'name': 'zotek.tracing'},
+                    'spans': [s.to_otlp() for s in spans],
+                }],
+            }]
+        }
+        line = json.dumps(payload, ensure_ascii=False)
+        try:
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+        except Exception as e:
+            print(f"⚠️ ERROR exportando traza: {e}")
+
+
+# Solo el webhook y la API llevan span raíz. Los archivos estáticos, el panel y
+# los endpoints que el dashboard consulta cada pocos segundos desplazarían las
+# trazas del webhook del colector en memoria.
+TRACED_PATH_PREFIXES = ("/webhook", "/api/")
+UNTRACED_PATH_PREFIXES = ("/api/metrics", "/api/debug/")
+
+
+def should_trace(path: str) -> bool:
+    """True si las requests a `path` se trazan."""
+    return path.startswith(TRACED_PATH_PREFIXES) and not path.startswith(UNTRACED_PATH_PREFIXES)
+
+
+class Tracer:
+    """Tracer por spans con propagación vía contextvars."""
+
+    def __init__(self, service_name: str = "zotek-api", max_traces: int = 200, export_path: str = None):
+        self.service_name = service_name
+        self.collector = InMemoryCollector(max_traces)
+        self.exporters: List[Any] = [self.collector]
+        if export_path:
+            self.exporters.append(FileExporter(export_path, service_name))
+        self._listeners: List[Callable[[Span], None]] = []
+        self._current: ContextVar[Optional[Span]] = ContextVar('zotek_current_span', default=None)
+        self._suppressed: ContextVar[bool] = ContextVar('zotek_tracing_suppressed', default=False)
+        self._active: Dict[str, List[Span]] = {}
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener: Callable[[Span], None]):
+        """Registra una función que se llama al cerrar cada span (ej. métricas por etapa)."""
+        self._listeners.append(listener)
+
+    def current_span(self) -> Optional[Span]:
+        return self._current.get()
+
+    def current_trace_id(self) -> Optional[str]:
+        span = self._current.get()
+        return span.trace_id if span else None
+
+    def log_prefix(self) -> str:
+        """Prefijo corto para correlacionar prints con la traza actual."""
+        trace_id = self.current_trace_id()
+        return f"[trace={trace_id[:16]}] " if trace_id else ""
+
+    @contextmanager
+    def suppressed(self):
+        """Dentro del bloque los spans no se registran ni se exportan."""
+        token = self._suppressed.set(True)
+        try:
+            yield
+        finally:
+            self._suppressed.reset(token)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        if self._suppressed.get():
+            yield Span(name, "", None, attributes)
+            return
+        parent = self._current.get()
+        if parent is None:
+            span = Span(name, secrets.token_hex(16), None, attributes)
+            with self._lock:
+                self._active[span.trace_id] = []
+        else:
+            span = Span(name, parent.trace_id, parent.span_id, attributes)
+
+        token = self._current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = 'error'
+            span.error = f"{type(e).__name__}: {str(e)[:200]}"
+            raise
+        finally:
+            span.end_ns = time.perf_counter_ns()
+            self._current.reset(token)
+            self._finish(span)
+
+    def _finish(self, span: Span):
+        for listener in self._listeners:
+            try:
+                listener(span)
+            except Exception as e:
+                print(f"⚠️ ERROR en listener de tracing: {e}")
+
+        with self._lock:
+            spans = self._active.get(span.trace_id)
+            if spans is None:
+                return  # La traza raíz ya se cerró (span huérfano de un hilo en segundo plano)
+            spans.append(span)
+            if span.parent_id is not None:
+                return
+            del self._active[span.trace_id]
+
+        for exporter in self.exporters:
+            exporter.export(spans)
+
+    def traced(self, name: str = None, **attributes):
+        """Decorador que envuelve una función (sync o async) en un span."""
+        def decorator(func):
+            span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(span_name, **attributes):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, **attributes):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+# Instancia global del proceso
+tracer = Tracer(
+    service_name=os.getenv("OTEL_SERVICE_NAME", "zotek-api"),
+    max_traces=int(os.getenv("TRACE_MAX_TRACES", "200")),
+    export_path=os.getenv("TRACE_EXPORT_PATH"),
+)
@@ -0,0 +1,12 @@
+"""
+Suite de carga offline del webhook: payloads realistas de Meta, stand-ins de
+Gemini/WhatsApp/Firestore y replay en proceso contra la app FastAPI.
+
+Uso: python bench_webhook.py --help
+Graph API falsa por HTTP: python -m loadtest.graph_server --help
+"""
+
+from .fake_genai import FakeGenaiClient
+from .fakes import FakeFirestore, FakeGemini, FakeGraphAPI
+from .harness import LoadOptions, LoadResult, TARGETS, compare, render, run
+from .payloads import Tenant, TrafficMix, WebhookPayloadFactory, count_messages
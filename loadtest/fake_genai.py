@@ -0,0 +1,130 @@
+"""
+Stand-in de `google.genai.Client` para correr GeminiEngine sin red ni llaves.
+
+Implementa solo `client.models.generate_content(model, contents, config)` con:
+
+- Latencia configurable (media ± jitter uniforme, en ms)
+- Tasas de error 503 (UNAVAILABLE) y 429 (RESOURCE_EXHAUSTED), lanzadas como
+  los `google.genai.errors` reales para que la lógica de reintentos las
+  reconozca igual que en producción
+
+Resultados deterministas sin importar el orden de los hilos: cada llamada
+sortea con un `random.Random` sembrado por (semilla, contenido, n-ésimo
+intento con ese contenido), así el reintento del mismo mensaje saca otro
+número pero dos corridas iguales fallan en las mismas llamadas.
+
+Se inyecta en la app por configuración:
+
+    GEMINI_CLIENT_FACTORY=loadtest.fake_genai:from_env
+    FAKE_GENAI_LATENCY_MS=400 FAKE_GENAI_JITTER_MS=100
+    FAKE_GENAI_503_RATE=0.05 FAKE_GENAI_429_RATE=0.02 FAKE_GENAI_SEED=42
+"""
+
+import os
+import random
+import threading
+import time
+from collections import Counter
+from typing import Any, Optional
+
+try:
+    from google.genai import errors as genai_errors
+except ImportError:
+    genai_errors = None
+
+
+class FakeGenaiError(Exception):
+    """Error con el mismo formato de mensaje que google.genai.errors.APIError."""
+
+    def __init__(self, code: int, status: str, message: str):
+        super().__init__(f"{code} {status}. {{'error': {{'code': {code}, 'message': '{message}', 'status': '{status}'}}}}")
+        self.code = code
+        self.status = status
+
+
+def _api_error(code: int) -> Exception:
+    status, message = {
+        503: ("UNAVAILABLE", "The model is overloaded. Please try again later."),
+        429: ("RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota)."),
+    }[code]
+    if genai_errors is None:
+        return FakeGenaiError(code, status, message)
+    error_class = genai_errors.ServerError if code >= 500 else genai_errors.ClientError
+    return error_class(code, {'error': {'code': code, 'message': message, 'status': status}})
+
+
+class FakeGenerateContentResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _FakeModels:
+    def __init__(self, client: "FakeGenaiClient"):
+        self._client = client
+
+    def generate_content(self, model: str, contents: Any, config: Optional[Any] = None, **kwargs) -> FakeGenerateContentResponse:
+        return self._client._generate(model, contents, config)
+
+
+class FakeGenaiClient:
+    """Cliente de genai falso con latencia y errores 503/429 configurables."""
+
+    def __init__(self, api_key: Optional[str] = None, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_503_rate: float = 0.0, error_429_rate: float = 0.0, seed: int = 0,
+                 reply: str = "Con gusto te ayudo. Recibimos: {contents}"):
+        """
+        Args:
+            api_key: Ignorada (misma firma que genai.Client)
+            latency_ms: Latencia media por llamada
+            jitter_ms: Variación uniforme ± sobre la media
+            error_503_rate: Probabilidad de 503 por llamada
+            error_429_rate: Probabilidad de 429 por llamada
+            seed: Semilla de los sorteos
+            reply: Plantilla de la respuesta (`{contents}` = mensaje recibido)
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_503_rate = error_503_rate
+        self.error_429_rate = error_429_rate
+        self.seed = seed
+        self.reply = reply
+        self.models = _FakeModels(self)
+        self.calls = 0
+        self.errors: Counter = Counter()
+        self._attempts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _generate(self, model: str, contents: Any, config: Optional[Any]) -> FakeGenerateContentResponse:
+        text = str(contents)
+        with self._lock:
+            self.calls += 1
+            self._attempts[text] += 1
+            attempt = self._attempts[text]
+        rng = random.Random(f"{self.seed}:{text}:{attempt}")
+        delay = self.latency_ms + rng.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        draw = rng.random()
+        code = None
+        if draw < self.error_503_rate:
+            code = 503
+        elif draw < self.error_503_rate + self.error_429_rate:
+            code = 429
+        if code is not None:
+            with self._lock:
+                self.errors[code] += 1
+            raise _api_error(code)
+        return FakeGenerateContentResponse(self.reply.format(contents=text[:40]))
+
+
+def from_env(api_key: Optional[str] = None) -> FakeGenaiClient:
+    """Fábrica para GEMINI_CLIENT_FACTORY: parámetros desde variables FAKE_GENAI_*."""
+    return FakeGenaiClient(
+        api_key=api_key,
+        latency_ms=float(os.getenv("FAKE_GENAI_LATENCY_MS", "0")),
+        jitter_ms=float(os.getenv("FAKE_GENAI_JITTER_MS", "0")),
+        error_503_rate=float(os.getenv("FAKE_GENAI_503_RATE", "0")),
+        error_429_rate=float(os.getenv("FAKE_GENAI_429_RATE", "0")),
+        seed=int(os.getenv("FAKE_GENAI_SEED", "0")),
+    )
@@ -0,0 +1,347 @@
+"""
+Stand-ins en proceso para correr el webhook sin red: Gemini, la Graph API de
+WhatsApp y Firestore.
+
+- `FakeGemini` reemplaza al `GeminiEngine` de la app (`main.gemini`) con una
+  latencia configurable
+- `FakeGraphAPI` reemplaza el módulo `requests` dentro de whatsapp_service:
+  el armado del mensaje y los spans `whatsapp.*` se siguen ejecutando, solo
+  el POST HTTP es falso (y queda registrado)
+- `FakeFirestore` es un Firestore en memoria con lo que usa la app de
+  Firebase: documentos y subcolecciones, where/order_by (también por
+  `__name__`)/limit/select/start_after (snapshot o dict de valores), batches,
+  get_all, Increment y SERVER_TIMESTAMP. No implementa transacciones (el
+  webhook no las usa)
+
+Las latencias simuladas salen de un `random.Random(seed)` propio de cada fake.
+"""
+
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from firebase_admin import firestore
+except ImportError:
+    firestore = None
+
+
+class _Latency:
+    """Latencia simulada: media ± jitter (uniforme), en milisegundos."""
+
+    def __init__(self, mean_ms: float = 0.0, jitter_ms: float = 0.0, seed: int = 0):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sleep(self):
+        if self.mean_ms <= 0 and self.jitter_ms <= 0:
+            return
+        with self._lock:
+            delay = self.mean_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep(max(0.0, delay) / 1000)
+
+
+# ============================================
+# GEMINI
+# ============================================
+
+class FakeGemini:
+    """Motor de respuestas con la interfaz de GeminiEngine.generar_respuesta."""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: int = 0):
+        self._latency = _Latency(latency_ms, jitter_ms, seed)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generar_respuesta(self, mensaje_usuario, client_data, numero_telefono, *args, **kwargs) -> str:
+        with self._lock:
+            self.calls += 1
+        self._latency.sleep()
+        return f"Con gusto te ayudo. Recibimos: {str(mensaje_usuario)[:40]}"
+
+
+# ============================================
+# WHATSAPP (GRAPH API)
+# ============================================
+
+class _FakeResponse:
+    def __init__(self, status_code: int, body: str):
+        self.status_code = status_code
+        self.text = body
+
+    def json(self):
+        import json
+        return json.loads(self.text)
+
+
+class FakeGraphAPI:
+    """
+    Sustituto del módulo `requests` para whatsapp_service: responde 200 a
+    cada POST y cuenta los envíos por tipo de mensaje.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: int = 0):
+        self._latency = _Latency(latency_ms, jitter_ms, seed)
+        self.sends: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def post(self, url, headers=None, json=None, data=None, **kwargs):
+        if json is None and data is not None:
+            import json as _json
+            json = _json.loads(data)
+        kind = (json or {}).get('type', 'unknown')
+        if kind == 'interactive':
+            kind = f"interactive.{json['interactive'].get('type')}"
+        with self._lock:
+            self.sends[kind] += 1
+            sequence = sum(self.sends.values())
+        self._latency.sleep()
+        return _FakeResponse(200, '{"messaging_product":"whatsapp","messages":[{"id":"wamid.FAKE%d"}]}' % sequence)
+
+    def install(self, *modules):
+        """Reemplaza `requests` en los módulos dados (ej. main.whatsapp_service)."""
+        for module in modules:
+            module.requests = self
+
+
+# ============================================
+# FIRESTORE
+# ============================================
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _resolve(current: Optional[Dict[str, Any]], data: Dict[str, Any], merge: bool) -> Dict[str, Any]:
+    """Aplica un set/update con transforms (Increment, SERVER_TIMESTAMP)."""
+    result = dict(current or {}) if merge else {}
+    for key, value in data.items():
+        if firestore is not None and value is firestore.SERVER_TIMESTAMP:
+            value = _now()
+        elif firestore is not None and isinstance(value, firestore.Increment):
+            value = (result.get(key) or 0) + value.value
+        result[key] = value
+    return result
+
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+class FakeSnapshot:
+    def __init__(self, reference: "FakeDocument", data: Optional[Dict[str, Any]], fields: Optional[List[str]] = None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        if data is not None and fields is not None:
+            data = {key: value for key, value in data.items() if key in fields}
+        self._data = data
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field: str):
+        return (self._data or {}).get(field)
+
+
+class FakeDocument:
+    def __init__(self, db: "FakeFirestore", path: Tuple[str, ...]):
+        self._db = db
+        self.path = path
+        self.id = path[-1]
+
+    def collection(self, name: str) -> "FakeQuery":
+        return FakeQuery(self._db, self.path + (name,))
+
+    def get(self, **kwargs) -> FakeSnapshot:
+        self._db._rpc()
+        return FakeSnapshot(self, self._db._read(self.path))
+
+    def set(self, data: Dict[str, Any], merge: bool = False):
+        self._db._rpc()
+        self._db._write(self.path, data, merge)
+
+    def update(self, data: Dict[str, Any]):
+        self._db._rpc()
+        self._db._write(self.path, data, True)
+
+    def delete(self):
+        self._db._rpc()
+        self._db._delete(self.path)
+
+
+class FakeQuery:
+    """Colección o consulta (inmutable: cada método retorna una nueva)."""
+
+    def __init__(self, db: "FakeFirestore", path: Tuple[str, ...], filters=(), order=(),
+                 limit=None, fields=None, after=None):
+        self._db = db
+        self.path = path
+        self._filters = filters
+        self._order = order
+        self._limit = limit
+        self._fields = fields
+        self._after = after
+
+    def _copy(self, **changes) -> "FakeQuery":
+        state = dict(filters=self._filters, order=self._order, limit=self._limit, fields=self._fields, after=self._after)
+        state.update(changes)
+        return FakeQuery(self._db, self.path, **state)
+
+    def document(self, document_id: Optional[str] = None) -> FakeDocument:
+        return FakeDocument(self._db, self.path + (document_id or uuid.uuid4().hex[:20],))
+
+    def add(self, data: Dict[str, Any]):
+        ref = self.document()
+        ref.set(data)
+        return _now(), ref
+
+    def where(self, field: str, op: str, value) -> "FakeQuery":
+        return self._copy(filters=self._filters + ((field, _OPERATORS[op], value),))
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> "FakeQuery":
+        return self._copy(order=self._order + ((field, direction == "DESCENDING"),))
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._copy(limit=count)
+
+    def select(self, fields: Iterable[str]) -> "FakeQuery":
+        return self._copy(fields=list(fields))
+
+    def start_after(self, cursor) -> "FakeQuery":
+        """`cursor`: snapshot, o dict {campo: valor} con los primeros campos de order_by."""
+        return self._copy(after=dict(cursor) if isinstance(cursor, dict) else cursor.id)
+
+    def _orders(self) -> List[Tuple[str, bool]]:
+        """order_by explícitos más `__name__` en la dirección del último (como Firestore)."""
+        orders = list(self._order)
+        if orders and orders[-1][0] != '__name__':
+            orders.append(('__name__', orders[-1][1]))
+        return orders
+
+    @staticmethod
+    def _value(row, field: str):
+        return row[0] if field == '__name__' else row[1][field]
+
+    def _is_after(self, row, cursor: Dict[str, Any], orders) -> bool:
+        for field, descending in orders:
+            if field not in cursor:
+                break
+            bound = cursor[field]
+            if field == '__name__' and not isinstance(bound, str):
+                bound = bound.id
+            value = self._value(row, field)
+            if value != bound:
+                return value < bound if descending else value > bound
+        return False
+
+    def stream(self, **kwargs):
+        self._db._rpc()
+        rows = [(doc_id, data) for doc_id, data in self._db._list(self.path)
+                if all(field in data and test(data[field], value) for field, test, value in self._filters)]
+        orders = self._orders()
+        rows = [row for row in rows if all(field == '__name__' or field in row[1] for field, _ in orders)]
+        for field, descending in reversed(orders):
+            rows.sort(key=lambda row, field=field: self._value(row, field), reverse=descending)
+        if isinstance(self._after, dict):
+            rows = [row for row in rows if self._is_after(row, self._after, orders)]
+        elif self._after is not None:
+            ids = [doc_id for doc_id, _ in rows]
+            if self._after in ids:
+                rows = rows[ids.index(self._after) + 1:]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return iter([FakeSnapshot(FakeDocument(self._db, self.path + (doc_id,)), data, self._fields)
+                     for doc_id, data in rows])
+
+    def get(self, **kwargs) -> List[FakeSnapshot]:
+        return list(self.stream())
+
+
+class FakeBatch:
+    def __init__(self, db: "FakeFirestore"):
+        self._db = db
+        self._ops = []
+
+    def set(self, ref: FakeDocument, data: Dict[str, Any], merge: bool = False):
+        self._ops.append(('set', ref.path, data, merge))
+
+    def update(self, ref: FakeDocument, data: Dict[str, Any]):
+        self._ops.append(('set', ref.path, data, True))
+
+    def delete(self, ref: FakeDocument):
+        self._ops.append(('delete', ref.path, None, False))
+
+    def commit(self):
+        if len(self._ops) > 500:
+            raise ValueError("Un batch de Firestore admite máximo 500 escrituras")
+        self._db._rpc()
+        with self._db._lock:
+            for op, path, data, merge in self._ops:
+                if op == 'set':
+                    self._db._write(path, data, merge)
+                else:
+                    self._db._delete(path)
+        self._ops = []
+
+
+class FakeFirestore:
+    """Cliente de Firestore en memoria (indexado por colección)."""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: int = 0):
+        self._latency = _Latency(latency_ms, jitter_ms, seed)
+        self._collections: Dict[Tuple[str, ...], Dict[str, Dict[str, Any]]] = defaultdict(dict)
+        self._lock = threading.RLock()
+        self.rpcs = 0
+
+    def _rpc(self):
+        self.rpcs += 1
+        self._latency.sleep()
+
+    def _read(self, path) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._collections.get(path[:-1], {}).get(path[-1])
+
+    def _write(self, path, data, merge):
+        with self._lock:
+            documents = self._collections[path[:-1]]
+            documents[path[-1]] = _resolve(documents.get(path[-1]), data, merge)
+
+    def _delete(self, path):
+        with self._lock:
+            self._collections.get(path[:-1], {}).pop(path[-1], None)
+
+    def _list(self, collection_path):
+        with self._lock:
+            return list(self._collections.get(collection_path, {}).items())
+
+    def collection(self, name: str) -> FakeQuery:
+        return FakeQuery(self, (name,))
+
+    def document(self, path: str) -> FakeDocument:
+        return FakeDocument(self, tuple(path.split('/')))
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+    def get_all(self, refs: Iterable[FakeDocument], **kwargs) -> List[FakeSnapshot]:
+        self._rpc()
+        return [FakeSnapshot(ref, self._read(ref.path)) for ref in refs]
+
+    def count(self, collection_path: str) -> int:
+        """Documentos en una colección (ej. 'clients/1/chats'), para verificar corridas."""
+        return len(self._list(tuple(collection_path.split('/'))))
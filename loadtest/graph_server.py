@@ -0,0 +1,182 @@
+"""
+Servidor HTTP local que imita la Graph API de WhatsApp (POST /messages).
+
+A diferencia de `fakes.FakeGraphAPI` (que reemplaza `requests` en proceso),
+aquí el envío pasa por HTTP real: sirve para medir cambios de pooling de
+conexiones, timeouts y concurrencia del cliente.
+
+- Responde con el formato de Meta: 200 con `messages[0].id`, o errores
+  500 (code 131000) y 429 (code 130429) con las tasas configuradas
+- Latencia configurable por respuesta
+- HTTP/1.1 con keep-alive
+- Registra cada envío: `server.sends` (conteo por tipo) y `server.records`;
+  desde otro proceso, `GET /_sends` retorna el resumen en JSON
+
+Se inyecta en la app con WHATSAPP_API_BASE_URL=<server.base_url>.
+
+Uso: python -m loadtest.graph_server --port 8089 --latency-ms 120 --error-rate 0.01
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+API_VERSION = "v22.0"
+
+
+class FakeGraphServer:
+    """Graph API falsa en un hilo (también usable como context manager)."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, seed: int = 0, keep_records: bool = True):
+        """
+        Args:
+            host: Interfaz donde escuchar
+            port: Puerto (0 = uno libre)
+            latency_ms: Latencia media por respuesta
+            jitter_ms: Variación uniforme ± sobre la media
+            error_rate: Probabilidad de responder 500
+            rate_limit_rate: Probabilidad de responder 429
+            seed: Semilla de los sorteos (por destinatario y número de envío)
+            keep_records: Guardar cada envío en `records`
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.seed = seed
+        self.keep_records = keep_records
+        self.sends: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.records: List[Dict[str, Any]] = []
+        self._per_recipient: Counter = Counter()
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/{API_VERSION}"
+
+    def start(self) -> "FakeGraphServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-graph-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'sends': dict(self.sends), 'statuses': dict(self.statuses), 'total': sum(self.sends.values())}
+
+    def _record(self, phone_number_id: str, body: Dict[str, Any]):
+        """Registra el envío y decide la respuesta: (status, json)."""
+        kind = body.get('type', 'unknown')
+        if kind == 'interactive':
+            kind = f"interactive.{body.get('interactive', {}).get('type')}"
+        to = str(body.get('to', ''))
+        with self._lock:
+            self._per_recipient[to] += 1
+            sequence = sum(self.sends.values()) + 1
+            nth = self._per_recipient[to]
+        rng = random.Random(f"{self.seed}:{to}:{nth}")
+        delay = self.latency_ms + rng.uniform(-self.jitter_ms, self.jitter_ms)
+        draw = rng.random()
+
+        if draw < self.error_rate:
+            status, response = 500, {'error': {'message': "(#131000) Something went wrong", 'type': "OAuthException", 'code': 131000}}
+        elif draw < self.error_rate + self.rate_limit_rate:
+            status, response = 429, {'error': {'message': "(#130429) Rate limit hit", 'type': "OAuthException", 'code': 130429}}
+        else:
+            status, response = 200, {
+                'messaging_product': 'whatsapp',
+                'contacts': [{'input': to, 'wa_id': to}],
+                'messages': [{'id': f"wamid.FAKE{sequence:010d}"}],
+            }
+        with self._lock:
+            self.sends[kind] += 1
+            self.statuses[status] += 1
+            if self.keep_records:
+                self.records.append({'phone_number_id': phone_number_id, 'to': to, 'type': kind, 'status': status})
+        if delay > 0:
+            time.sleep(delay / 1000)
+        return status, response
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, status: int, body: Dict[str, Any]):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                parts = self.path.strip("/").split("/")
+                if len(parts) != 3 or parts[2] != "messages":
+                    return self._reply(404, {'error': {'message': f"Unknown path {self.path}", 'code': 803}})
+                if not self.headers.get("Authorization", "").startswith("Bearer "):
+                    return self._reply(401, {'error': {'message': "Invalid OAuth access token", 'code': 190}})
+                try:
+                    body = json.loads(raw or b"{}")
+                except ValueError:
+                    return self._reply(400, {'error': {'message': "Invalid JSON", 'code': 100}})
+                self._reply(*server._record(parts[1], body))
+
+            def do_GET(self):
+                if self.path == "/_sends":
+                    return self._reply(200, server.summary())
+                self._reply(404, {'error': {'message': f"Unknown path {self.path}", 'code': 803}})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Graph API de WhatsApp falsa para pruebas sin red")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probabilidad de 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Probabilidad de 429")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = FakeGraphServer(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate,
+                             args.rate_limit_rate, args.seed, keep_records=False)
+    print(f"📡 Graph API falsa en {server.base_url}  (WHATSAPP_API_BASE_URL={server.base_url})")
+    server.start()
+    try:
+        while True:
+            time.sleep(60)
+            print(f"📊 {server.summary()}")
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+"""
+Replay de payloads del webhook contra la app FastAPI en proceso.
+
+Cada target prepara su app con datos sembrados y los stand-ins de fakes.py
+(o, según las opciones, el GeminiEngine real con fake_genai.py y envíos por
+HTTP a graph_server.py, inyectados por configuración):
+
+- `src`: base SQLite temporal (esquema de migrations.py) con los tenants
+- `functions`: FakeFirestore con clients, config/menu y meta/tenants
+
+Los dos paquetes se llaman `src`, así que un proceso solo puede cargar un
+target (bench_webhook.py corre uno por invocación).
+
+Los payloads se envían con httpx.ASGITransport (sin sockets) con N requests
+concurrentes. Se mide la latencia de cada POST desde el cliente y, con un
+listener del tracer, la duración de cada span de la app (tenant.lookup,
+gemini, whatsapp.*, db.*, ...) para el desglose por etapa.
+"""
+
+import asyncio
+import contextlib
+import io
+import math
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from .fakes import FakeFirestore, FakeGemini, FakeGraphAPI
+from .payloads import WebhookPayloadFactory, count_messages
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WEBHOOK_SPAN = "POST /webhook"
+
+
+@dataclass
+class LoadOptions:
+    """Parámetros de una corrida (los mismos valores = la misma carga)."""
+
+    requests: int = 2000
+    tenants: int = 20
+    users: int = 500
+    seed: int = 42
+    concurrency: int = 16
+    warmup: int = 100
+    gemini_ms: float = 0.0
+    whatsapp_ms: float = 0.0
+    firestore_ms: float = 0.0
+    # Ventana de agrupación de ráfagas de la app; 0 la desactiva para que
+    # cada request se responda sin esperar
+    coalesce_window_seconds: float = 0.0
+    # 'stub': FakeGemini en lugar del motor. 'genai': el GeminiEngine real
+    # (conocimiento, historial, reintentos) con el cliente de fake_genai.py
+    engine: str = "stub"
+    gemini_503_rate: float = 0.0
+    gemini_429_rate: float = 0.0
+    # Espera base entre reintentos de Gemini (None = la de la app)
+    gemini_retry_delay_seconds: Optional[float] = None
+    # 'inprocess': FakeGraphAPI en lugar de requests. 'http': envíos por HTTP
+    # real a graph_server.FakeGraphServer
+    graph: str = "inprocess"
+    whatsapp_error_rate: float = 0.0
+    whatsapp_429_rate: float = 0.0
+
+
+@dataclass
+class Target:
+    """App lista para recibir tráfico, con sus stand-ins."""
+
+    name: str
+    app: Any
+    tracer: Any
+    # Stand-in de Gemini (FakeGemini o FakeGenaiClient) y de la Graph API
+    # (FakeGraphAPI o FakeGraphServer)
+    gemini: Any
+    graph: Any
+    firestore: Optional[FakeFirestore] = None
+    cleanups: List[Callable[[], None]] = field(default_factory=list)
+
+    def cleanup(self):
+        for cleanup in reversed(self.cleanups):
+            cleanup()
+
+    def faults(self) -> Counter:
+        """Errores inyectados hasta ahora por los stand-ins."""
+        faults = Counter({f"gemini_{code}": count for code, count in getattr(self.gemini, 'errors', {}).items()})
+        faults.update({f"whatsapp_{code}": count for code, count in getattr(self.graph, 'statuses', {}).items() if code != 200})
+        return faults
+
+
+# ============================================
+# TARGETS
+# ============================================
+
+def _prepare_environment(options: LoadOptions, app_dir: str):
+    """
+    Variables de entorno que la app lee al importarse (incluye la inyección de
+    stand-ins por configuración). Con `graph='http'` arranca el servidor falso.
+    """
+    os.environ["COALESCE_WINDOW_SECONDS"] = str(options.coalesce_window_seconds)
+    os.environ["LOG_LEVEL"] = "ERROR"
+    os.environ["VERIFICATION_CODE_STORE"] = "memory"
+    if options.engine == "genai":
+        os.environ.update({
+            "GEMINI_CLIENT_FACTORY": "loadtest.fake_genai:from_env",
+            "FAKE_GENAI_LATENCY_MS": str(options.gemini_ms),
+            "FAKE_GENAI_JITTER_MS": str(options.gemini_ms / 4),
+            "FAKE_GENAI_503_RATE": str(options.gemini_503_rate),
+            "FAKE_GENAI_429_RATE": str(options.gemini_429_rate),
+            "FAKE_GENAI_SEED": str(options.seed),
+        })
+    if options.gemini_retry_delay_seconds is not None:
+        os.environ["GEMINI_RETRY_DELAY_SECONDS"] = str(options.gemini_retry_delay_seconds)
+
+    server = None
+    if options.graph == "http":
+        from .graph_server import FakeGraphServer
+        server = FakeGraphServer(latency_ms=options.whatsapp_ms, jitter_ms=options.whatsapp_ms / 4,
+                                 error_rate=options.whatsapp_error_rate, rate_limit_rate=options.whatsapp_429_rate,
+                                 seed=options.seed, keep_records=False).start()
+        os.environ["WHATSAPP_API_BASE_URL"] = server.base_url
+
+    if 'src' in sys.modules:
+        raise RuntimeError("El paquete src ya está cargado: usa un proceso por target")
+    sys.path.insert(0, app_dir)
+    return server
+
+
+def _install_stand_ins(target: Target, main, options: LoadOptions, server):
+    """Motor de Gemini y Graph API de la app según `options.engine` / `options.graph`."""
+    if options.engine == "genai":
+        # El cliente sale de GEMINI_CLIENT_FACTORY (ver _prepare_environment)
+        main.gemini = main.GeminiEngine(api_key="load-test")
+        target.gemini = main.gemini.client
+    else:
+        main.gemini = target.gemini = FakeGemini(options.gemini_ms, options.gemini_ms / 4, options.seed)
+
+    if server is not None:
+        target.graph = server
+        target.cleanups.append(server.stop)
+    else:
+        target.graph = FakeGraphAPI(options.whatsapp_ms, options.whatsapp_ms / 4, options.seed)
+        target.graph.install(main.whatsapp_service)
+
+
+def setup_src(factory: WebhookPayloadFactory, options: LoadOptions) -> Target:
+    """App de src/ (SQLite) sobre una base temporal con los tenants sembrados."""
+    server = _prepare_environment(options, ROOT)
+    workdir = tempfile.mkdtemp(prefix="zotek_load_")
+    from src import database
+    database.DB_NAME = os.path.join(workdir, "load.db")
+    from src import main
+    from src.tracing import tracer
+
+    conn = sqlite3.connect(database.DB_NAME)
+    with conn:
+        conn.executemany(
+            "INSERT INTO clients (id, name, whatsapp_token, phone_number_id, verify_token, plan) VALUES (?, ?, ?, ?, ?, ?)",
+            [(t.id, t.name, f"EAAG_load_{t.id}", t.phone_number_id, f"verify_{t.id}", "enterprise") for t in factory.tenants]
+        )
+    conn.close()
+    database._refresh_tenants()
+
+    target = Target("src", main.app, tracer, None, None, cleanups=[lambda: shutil.rmtree(workdir, ignore_errors=True)])
+    _install_stand_ins(target, main, options, server)
+    main.rate_limiter.is_allowed = lambda *args, **kwargs: True
+    return target
+
+
+def setup_functions(factory: WebhookPayloadFactory, options: LoadOptions) -> Target:
+    """App de functions/ (Firestore) sobre FakeFirestore."""
+    server = _prepare_environment(options, os.path.join(ROOT, "functions"))
+    db = FakeFirestore(options.firestore_ms, options.firestore_ms / 4, options.seed)
+    from src import database
+    database.get_db = lambda: db
+    from src import main
+    from src.tracing import tracer
+
+    batch = db.batch()
+    for tenant in factory.tenants:
+        ref = db.collection('clients').document(str(tenant.id))
+        batch.set(ref, {
+            'name': tenant.name,
+            'phone_number_id': tenant.phone_number_id,
+            'whatsapp_token': f"EAAG_load_{tenant.id}",
+            'plan': 'enterprise',
+            'is_active': True,
+        })
+        # Un tercio de los tenants con fallback_text: en el resto el texto
+        # libre llega a Gemini
+        batch.set(ref.collection('config').document('menu'), tenant.menu(fallback=tenant.id % 3 == 0))
+    batch.commit()
+    database.mark_tenants_changed()
+
+    target = Target("functions", main.app, tracer, None, None, firestore=db)
+    _install_stand_ins(target, main, options, server)
+    return target
+
+
+TARGETS: Dict[str, Callable[[WebhookPayloadFactory, LoadOptions], Target]] = {
+    'src': setup_src,
+    'functions': setup_functions,
+}
+
+
+# ============================================
+# MEDICIÓN
+# ============================================
+
+def percentile(values: List[float], p: float) -> float:
+    """Percentil por rango más cercano (0 si no hay valores)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class SpanRecorder:
+    """Listener del tracer: duraciones por nombre de span mientras está activo."""
+
+    def __init__(self):
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+        self.active = False
+
+    def __call__(self, span):
+        if self.active:
+            self.durations[span.name].append(span.duration_ms)
+
+
+@dataclass
+class LoadResult:
+    """Resultado de una corrida (serializable para comparar contra un baseline)."""
+
+    target: str
+    options: Dict[str, Any]
+    seconds: float
+    requests: int
+    messages: int
+    statuses: int
+    latencies_ms: List[float] = field(repr=False)
+    stages: Dict[str, List[float]] = field(repr=False)
+    outcomes: Counter
+    gemini_calls: int
+    whatsapp_sends: Counter
+    # Errores inyectados por los stand-ins (gemini_503, whatsapp_429, ...)
+    faults: Counter
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests / self.seconds if self.seconds else 0.0
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.messages / self.seconds if self.seconds else 0.0
+
+    def latency(self, p: float) -> float:
+        return percentile(self.latencies_ms, p)
+
+    def stage_summary(self) -> List[Dict[str, Any]]:
+        """Por span: llamadas, p50/p95 y % del tiempo total del webhook."""
+        webhook_total = sum(self.stages.get(WEBHOOK_SPAN, ())) or 1.0
+        rows = [
+            {
+                'stage': name,
+                'count': len(durations),
+                'p50_ms': percentile(durations, 50),
+                'p95_ms': percentile(durations, 95),
+                'total_ms': sum(durations),
+                'share': sum(durations) / webhook_total,
+            }
+            for name, durations in self.stages.items()
+        ]
+        rows.sort(key=lambda row: row['total_ms'], reverse=True)
+        return rows
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'target': self.target,
+            'options': self.options,
+            'seconds': round(self.seconds, 4),
+            'requests': self.requests,
+            'messages': self.messages,
+            'statuses': self.statuses,
+            'requests_per_second': round(self.requests_per_second, 2),
+            'messages_per_second': round(self.messages_per_second, 2),
+            'latency_ms': {f"p{p}": round(self.latency(p), 3) for p in (50, 95, 99)},
+            'stages': [{k: round(v, 4) if isinstance(v, float) else v for k, v in row.items()}
+                       for row in self.stage_summary()],
+            'outcomes': dict(self.outcomes),
+            'gemini_calls': self.gemini_calls,
+            'whatsapp_sends': dict(self.whatsapp_sends),
+            'faults': dict(self.faults),
+        }
+
+
+async def _replay(client, payloads: List[Dict[str, Any]], concurrency: int, latencies: List[float], outcomes: Counter):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(payload):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post("/webhook", json=payload)
+            latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            outcomes[f"http_{response.status_code}"] += 1
+            return
+        body = response.json()
+        results = body.get('results') if isinstance(body, dict) else None
+        if results:
+            outcomes.update(result.get('status', 'unknown') for result in results)
+        else:
+            outcomes[body.get('status', 'unknown') if isinstance(body, dict) else 'unknown'] += 1
+
+    await asyncio.gather(*(send(payload) for payload in payloads))
+
+
+async def _session(target: Target, recorder: SpanRecorder, warmup, payloads, options: LoadOptions):
+    """Calentamiento y corrida medida sobre el mismo event loop y cliente."""
+    import httpx
+
+    transport = httpx.ASGITransport(app=target.app, client=("127.0.0.1", 40000))
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        await _replay(client, warmup, options.concurrency, [], Counter())
+        baseline = (target.gemini.calls, Counter(target.graph.sends), target.faults())
+
+        latencies: List[float] = []
+        outcomes: Counter = Counter()
+        recorder.active = True
+        started = time.perf_counter()
+        await _replay(client, payloads, options.concurrency, latencies, outcomes)
+        seconds = time.perf_counter() - started
+        recorder.active = False
+    return seconds, latencies, outcomes, baseline
+
+
+def run(target_name: str, options: LoadOptions, quiet: bool = True) -> LoadResult:
+    """
+    Prepara el target, calienta con `options.warmup` payloads y mide
+    `options.requests` payloads.
+
+    Args:
+        target_name: 'src' o 'functions'
+        options: Parámetros de la corrida
+        quiet: Silenciar los prints de la app durante la corrida
+
+    Returns:
+        LoadResult con throughput, latencias y desglose por etapa
+    """
+    factory = WebhookPayloadFactory(options.tenants, options.users, options.seed)
+    warmup = list(factory.generate(options.warmup))
+    payloads = list(factory.generate(options.requests))
+
+    output = contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext()
+    with output:
+        target = TARGETS[target_name](factory, options)
+        recorder = SpanRecorder()
+        target.tracer.add_listener(recorder)
+        try:
+            seconds, latencies, outcomes, (gemini_before, sends_before, faults_before) = asyncio.run(
+                _session(target, recorder, warmup, payloads, options))
+        finally:
+            target.cleanup()
+
+    messages = statuses = 0
+    for payload in payloads:
+        m, s = count_messages(payload)
+        messages += m
+        statuses += s
+    return LoadResult(
+        target=target_name,
+        options=vars(options).copy(),
+        seconds=seconds,
+        requests=len(payloads),
+        messages=messages,
+        statuses=statuses,
+        latencies_ms=latencies,
+        stages=dict(recorder.durations),
+        outcomes=outcomes,
+        gemini_calls=target.gemini.calls - gemini_before,
+        whatsapp_sends=target.graph.sends - sends_before,
+        faults=target.faults() - faults_before,
+    )
+
+
+# ============================================
+# REPORTE Y REGRESIONES
+# ============================================
+
+def render(result: LoadResult, top: int = 15) -> str:
+    options = result.options
+    lines = [
+        f"🎯 {result.target}: {result.requests} requests ({result.messages} mensajes, {result.statuses} estados), "
+        f"{options['tenants']} tenants, {options['users']} usuarios, concurrencia {options['concurrency']}, semilla {options['seed']}",
+        f"   stand-ins: gemini {options['engine']} {options['gemini_ms']} ms "
+        f"(503 {options['gemini_503_rate']:.0%}, 429 {options['gemini_429_rate']:.0%}), "
+        f"whatsapp {options['graph']} {options['whatsapp_ms']} ms"
+        + (f" (500 {options['whatsapp_error_rate']:.0%}, 429 {options['whatsapp_429_rate']:.0%})" if options['graph'] == 'http' else "")
+        + (f", firestore {options['firestore_ms']} ms" if result.target == 'functions' else ""),
+        "",
+        f"⚡ {result.requests_per_second:.1f} req/s   {result.messages_per_second:.1f} mensajes/s   ({result.seconds:.2f} s)",
+        f"⏱️  latencia POST /webhook: p50 {result.latency(50):.2f} ms   p95 {result.latency(95):.2f} ms   p99 {result.latency(99):.2f} ms",
+        "",
+        f"{'etapa (span)':<34}{'llamadas':>10}{'p50 ms':>10}{'p95 ms':>10}{'total ms':>12}{'% webhook':>11}",
+    ]
+    for row in result.stage_summary()[:top]:
+        lines.append(f"{row['stage']:<34}{row['count']:>10}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}"
+                     f"{row['total_ms']:>12.1f}{row['share'] * 100:>10.1f}%")
+    lines += [
+        "",
+        "resultados: " + ", ".join(f"{k}={v}" for k, v in result.outcomes.most_common()),
+        f"gemini: {result.gemini_calls} llamadas   whatsapp: " + ", ".join(f"{k}={v}" for k, v in sorted(result.whatsapp_sends.items())),
+    ]
+    if result.faults:
+        lines.append("errores inyectados: " + ", ".join(f"{k}={v}" for k, v in sorted(result.faults.items())))
+    return "\n".join(lines)
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Regresiones de `current` contra `baseline` (dicts de LoadResult.to_dict).
+
+    Args:
+        current: Corrida actual
+        baseline: Corrida de referencia (misma carga)
+        tolerance: Empeoramiento relativo permitido (0.15 = 15%)
+
+    Returns:
+        Lista de regresiones (vacía si no hay)
+    """
+    regressions = []
+    if current['options'] != baseline['options'] or current['target'] != baseline['target']:
+        regressions.append("la carga no coincide con el baseline (target u opciones distintas)")
+        return regressions
+    for key in ('requests_per_second', 'messages_per_second'):
+        if current[key] < baseline[key] * (1 - tolerance):
+            regressions.append(f"{key}: {current[key]} < {baseline[key]} (-{1 - current[key] / baseline[key]:.0%})")
+    for p, value in current['latency_ms'].items():
+        reference = baseline['latency_ms'][p]
+        if value > reference * (1 + tolerance):
+            regressions.append(f"latencia {p}: {value} ms > {reference} ms (+{value / reference - 1:.0%})")
+    return regressions
@@ -0,0 +1,208 @@
+"""
+Generador de payloads realistas del webhook de WhatsApp Cloud API (Meta).
+
+Para N tenants (phone_number_id) y M usuarios produce la mezcla de tráfico
+que llega en producción:
+
+- Mensajes de texto (saludos, preguntas de horario/precio, citas)
+- Respuestas de botón (`button_reply`) y de lista (`list_reply`) con los
+  títulos del menú del tenant
+- Payloads solo de estados (sent/delivered/read y algún failed)
+- Payloads con varios mensajes: ráfagas del mismo usuario o varios usuarios
+  del mismo tenant en un solo POST
+
+Todo sale de un `random.Random(seed)`: la misma semilla genera exactamente
+los mismos payloads (ids de mensaje incluidos), para comparar corridas.
+"""
+
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+TEXTS = (
+    "Hola", "hola", "Buenas tardes", "menu", "¿Cuál es su horario?",
+    "¿Atienden los sábados?", "Quiero agendar una cita", "¿Cuánto cuesta una limpieza dental?",
+    "¿Dónde están ubicados?", "¿Aceptan tarjeta?", "Necesito cambiar mi cita del jueves",
+    "Gracias", "ok", "¿Tienen disponibilidad mañana en la tarde?",
+    "Me duele una muela, ¿pueden atenderme hoy?", "¿Hacen factura?",
+)
+
+MENU_OPTIONS = (
+    ("📅", "Agendar cita"), ("🕐", "Horarios"), ("💲", "Precios"),
+    ("📍", "Ubicación"), ("🦷", "Servicios"), ("👩‍⚕️", "Hablar con alguien"),
+)
+
+PROFILE_NAMES = ("Ana", "Luis", "María", "Jorge", "Sofía", "Carlos", "Valeria", "Miguel", "Fernanda", "José")
+
+# Códigos de error reales de entregas fallidas
+FAILED_STATUS_ERRORS = ((131026, "Message undeliverable"), (131047, "Re-engagement message"), (131051, "Unsupported message type"))
+
+
+@dataclass(frozen=True)
+class Tenant:
+    """Tenant de la prueba (id en la base y número de WhatsApp Business)."""
+
+    id: int
+    name: str
+    phone_number_id: str
+    display_phone_number: str
+
+    def menu(self, fallback: bool = True) -> Dict[str, Any]:
+        """
+        Menú interactivo del tenant (formato de config/menu y menu_json).
+
+        Args:
+            fallback: Incluir `fallback_text` (sin él, el texto libre que no
+                coincide con una opción lo responde Gemini)
+        """
+        menu = {
+            'text': f"¡Hola! Bienvenid@ a {self.name}. ¿En qué te ayudo?",
+            'options': [
+                {'icon': icon, 'title': title, 'response': f"{title} de {self.name}: escríbenos y te atendemos."}
+                for icon, title in MENU_OPTIONS
+            ],
+        }
+        if fallback:
+            menu['fallback_text'] = "No entendí tu mensaje, elige una opción:"
+        return menu
+
+
+@dataclass(frozen=True)
+class TrafficMix:
+    """Proporciones del tráfico generado (no necesitan sumar 1)."""
+
+    text: float = 0.70
+    button_reply: float = 0.15
+    list_reply: float = 0.05
+    statuses: float = 0.10
+    # Probabilidad de que un payload de mensajes traiga varios (2-4)
+    multi_message: float = 0.15
+    # Dentro de los multi-mensaje: probabilidad de ráfaga del mismo usuario
+    same_user_burst: float = 0.6
+
+
+class WebhookPayloadFactory:
+    """Genera payloads de webhook para `tenants` tenants y `users` usuarios."""
+
+    def __init__(self, tenants: int = 20, users: int = 500, seed: int = 42, mix: Optional[TrafficMix] = None):
+        self.rng = random.Random(seed)
+        self.mix = mix or TrafficMix()
+        self.tenants: List[Tenant] = [
+            Tenant(
+                id=i + 1,
+                name=f"Consultorio {i + 1}",
+                phone_number_id=f"10{self.rng.randrange(10 ** 13):013d}",
+                display_phone_number=f"5255{self.rng.randrange(10 ** 8):08d}",
+            )
+            for i in range(tenants)
+        ]
+        # Cada usuario escribe siempre al mismo tenant
+        self.users: List[Tuple[str, Tenant]] = [
+            (f"521{self.rng.randrange(10 ** 10):010d}", self.tenants[i % len(self.tenants)])
+            for i in range(users)
+        ]
+        self._sequence = 0
+        self._clock = int(time.time())
+
+    # ============================================
+    # PIEZAS DEL PAYLOAD
+    # ============================================
+
+    def _message_id(self) -> str:
+        self._sequence += 1
+        return f"wamid.HBgM{self._sequence:012d}{self.rng.getrandbits(64):016X}"
+
+    def _timestamp(self) -> str:
+        self._clock += self.rng.randint(0, 2)
+        return str(self._clock)
+
+    def _message(self, kind: str, user: str) -> Dict[str, Any]:
+        message = {'from': user, 'id': self._message_id(), 'timestamp': self._timestamp(), 'type': kind}
+        if kind == 'text':
+            message['text'] = {'body': self.rng.choice(TEXTS)}
+            return message
+        icon, title = self.rng.choice(MENU_OPTIONS)
+        message['type'] = 'interactive'
+        if kind == 'button_reply':
+            message['interactive'] = {'type': 'button_reply', 'button_reply': {'id': f"btn_{title}", 'title': f"{icon} {title}"}}
+        else:
+            message['interactive'] = {'type': 'list_reply', 'list_reply': {'id': f"row_{title}", 'title': f"{icon} {title}", 'description': ""}}
+        return message
+
+    def _status(self, user: str) -> Dict[str, Any]:
+        status = {
+            'id': self._message_id(),
+            'status': self.rng.choices(('sent', 'delivered', 'read', 'failed'), (30, 35, 33, 2))[0],
+            'timestamp': self._timestamp(),
+            'recipient_id': user,
+        }
+        if status['status'] == 'failed':
+            code, title = self.rng.choice(FAILED_STATUS_ERRORS)
+            status['errors'] = [{'code': code, 'title': title}]
+        return status
+
+    @staticmethod
+    def _envelope(tenant: Tenant, value: Dict[str, Any]) -> Dict[str, Any]:
+        value = {
+            'messaging_product': 'whatsapp',
+            'metadata': {'display_phone_number': tenant.display_phone_number, 'phone_number_id': tenant.phone_number_id},
+            **value,
+        }
+        return {
+            'object': 'whatsapp_business_account',
+            'entry': [{'id': f"WABA{tenant.id}", 'changes': [{'value': value, 'field': 'messages'}]}],
+        }
+
+    def _contact(self, user: str) -> Dict[str, Any]:
+        return {'profile': {'name': self.rng.choice(PROFILE_NAMES)}, 'wa_id': user}
+
+    # ============================================
+    # PAYLOADS
+    # ============================================
+
+    def _message_kind(self) -> str:
+        mix = self.mix
+        return self.rng.choices(('text', 'button_reply', 'list_reply'), (mix.text, mix.button_reply, mix.list_reply))[0]
+
+    def statuses_payload(self) -> Dict[str, Any]:
+        user, tenant = self.rng.choice(self.users)
+        statuses = [self._status(user) for _ in range(self.rng.randint(1, 3))]
+        return self._envelope(tenant, {'statuses': statuses})
+
+    def messages_payload(self, count: int = 1) -> Dict[str, Any]:
+        user, tenant = self.rng.choice(self.users)
+        senders = [user]
+        if count > 1:
+            if self.rng.random() < self.mix.same_user_burst:
+                senders = [user] * count
+            else:
+                # Otros usuarios del mismo tenant
+                same_tenant = [u for u, t in self.users if t is tenant] or [user]
+                senders = [self.rng.choice(same_tenant) for _ in range(count)]
+        messages = [self._message(self._message_kind(), sender) for sender in senders]
+        contacts = [self._contact(sender) for sender in dict.fromkeys(senders)]
+        return self._envelope(tenant, {'contacts': contacts, 'messages': messages})
+
+    def payload(self) -> Dict[str, Any]:
+        """Un payload siguiendo la mezcla de tráfico."""
+        mix = self.mix
+        if self.rng.random() < mix.statuses / (mix.text + mix.button_reply + mix.list_reply + mix.statuses):
+            return self.statuses_payload()
+        count = self.rng.randint(2, 4) if self.rng.random() < mix.multi_message else 1
+        return self.messages_payload(count)
+
+    def generate(self, count: int) -> Iterator[Dict[str, Any]]:
+        for _ in range(count):
+            yield self.payload()
+
+
+def count_messages(payload: Dict[str, Any]) -> Tuple[int, int]:
+    """(mensajes, estados) de un payload."""
+    messages = statuses = 0
+    for entry in payload.get('entry', []):
+        for change in entry.get('changes', []):
+            value = change.get('value', {})
+            messages += len(value.get('messages', []))
+            statuses += len(value.get('statuses', []))
+    return messages, statuses
@@ -0,0 +1,126 @@
+"""
+Caché de tokens JWT verificados y del usuario (principal) que representan.
+
+Una carga del panel dispara 5-10 llamadas a la API con el mismo token; sin
+caché cada una repite `jwt.decode` (HMAC) y, en Firebase, la búsqueda del
+cliente por email. Aquí el token se verifica y se resuelve una sola vez:
+
+- La llave es el SHA-256 del token (el token no se guarda en memoria)
+- Cada entrada vence al expirar el token (`exp`) o a los `max_ttl_seconds`,
+  lo que ocurra primero, para que cambios de rol o de cliente se reflejen
+- Al llenarse, se descartan primero las entradas vencidas y luego las menos
+  usadas (LRU)
+
+Mismo módulo en src/ y functions/src/.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+TOKEN_CACHE_MAX_ENTRIES = 1024
+TOKEN_CACHE_MAX_TTL_SECONDS = 300
+
+
+class Principal:
+    """Usuario autenticado: email, rol y cliente vinculado."""
+
+    __slots__ = ('email', 'role', 'client_id')
+
+    def __init__(self, email: str, role: str = "client", client_id: Optional[str] = None):
+        self.email = email
+        self.role = role
+        self.client_id = client_id
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role == "admin"
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"email": self.email, "role": self.role, "client_id": self.client_id}
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """Principals por token verificado, con vencimiento y tope de entradas."""
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_MAX_ENTRIES, max_ttl_seconds: float = TOKEN_CACHE_MAX_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_ttl_seconds = max_ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # llave -> (principal, vence)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Principal]:
+        key = token_key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            principal, expires_at = entry
+            if now >= expires_at:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return principal
+
+    def put(self, token: str, principal: Principal, token_exp: Optional[float] = None):
+        expires_at = time.time() + self.max_ttl_seconds
+        if token_exp is not None:
+            expires_at = min(expires_at, float(token_exp))
+        key = token_key(token)
+        with self._lock:
+            self._entries[key] = (principal, expires_at)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        now = time.time()
+        for key in [k for k, (_, expires_at) in self._entries.items() if now >= expires_at]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def resolve(self, token: str, decode: Callable[[str], Dict[str, Any]], build: Callable[[Dict[str, Any]], Principal]) -> Principal:
+        """
+        Principal del token desde el caché o, si no está, verificándolo.
+
+        Args:
+            token: JWT recibido
+            decode: Verifica y decodifica el token (lanza si es inválido)
+            build: Construye el Principal a partir del payload
+
+        Returns:
+            Principal del token (las excepciones de `decode`/`build` se propagan
+            y no se cachea nada)
+        """
+        principal = self.get(token)
+        if principal is not None:
+            return principal
+        payload = decode(token)
+        principal = build(payload)
+        self.put(token, principal, payload.get("exp"))
+        return principal
+
+    def invalidate(self, token: Optional[str] = None):
+        """Descarta un token (ej. logout) o todo el caché."""
+        with self._lock:
+            if token is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(token_key(token), None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
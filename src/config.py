@@ -9,6 +9,8 @@ import os
 from dotenv import load_dotenv
 from typing import Dict, Any
 
+from .demo_registry import demos
+
 # Cargar variables de entorno
 load_dotenv()
 
@@ -24,6 +26,8 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "ZOTEK_SECRET_DEFAULT_CHANGE_ME")
     ADMIN_EMAIL = os.getenv("ADMIN_EMAIL", "zoteksolucionesia@gmail.com")
     EMAIL_APP_PASSWORD = os.getenv("EMAIL_APP_PASSWORD")
+    SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+    SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
     
     # WhatsApp
     WHATSAPP_APP_SECRET = os.getenv("WHATSAPP_APP_SECRET")  # Para verificar firma de webhooks
@@ -34,7 +38,10 @@ class Config:
     GEMINI_MODEL_ID = "gemini-2.0-flash"
     GEMINI_TEMPERATURE = 0.5
     GEMINI_MAX_RETRIES = 3
-    GEMINI_RETRY_DELAY_SECONDS = 2
+    GEMINI_RETRY_DELAY_SECONDS = float(os.getenv("GEMINI_RETRY_DELAY_SECONDS", "2"))
+    # Cliente de genai alternativo como "modulo:funcion" (ej. el stand-in sin red
+    # loadtest.fake_genai:from_env); vacío = google.genai.Client
+    GEMINI_CLIENT_FACTORY = os.getenv("GEMINI_CLIENT_FACTORY", "")
     
     # ============================================
     # CONFIGURACIÓN DE BASE DE DATOS
@@ -45,14 +52,13 @@ class Config:
     
     # Firebase/Production
     IS_PRODUCTION = bool(os.environ.get('K_SERVICE') or os.environ.get('FIREBASE_CONFIG'))
-    TEMP_DB = "/tmp/consultorio.db"  # Para Firebase Functions
-    
-    # ============================================
-    # IDs DE DEMO (Hardcodeados para demos siempre disponibles)
-    # ============================================
-    DEMO_RESTAURANTE_ID = 9991
-    DEMO_CLINICA_ID = 9992
-    DEMO_TIENDA_ID = 9993
+    # Overlay de escrituras en /tmp sobre la base empaquetada (ver sqlite_overlay.py)
+    OVERLAY_DB = "/tmp/consultorio-overlay.db"
+    # Snapshot del overlay para restaurarlo en el siguiente cold start (ej. volumen montado)
+    DB_SNAPSHOT_PATH = os.getenv("SQLITE_SNAPSHOT_PATH")
+    DB_SNAPSHOT_INTERVAL_SECONDS = int(os.getenv("SQLITE_SNAPSHOT_INTERVAL_SECONDS", "300"))
+    # Cada cuánto se revisa si cambió la tabla clients (snapshot de tenants en memoria)
+    TENANT_POLL_INTERVAL_SECONDS = float(os.getenv("TENANT_POLL_INTERVAL_SECONDS", "2"))
     
     # ============================================
     # PLANES Y LÍMITES DE USO
@@ -80,6 +86,13 @@ class Config:
         },
     }
     
+    # Uploads que exceden `knowledge_base_mb`: 'compact' (compactar y rechazar
+    # solo si aun así no cabe) o 'reject' (rechazar directamente)
+    KNOWLEDGE_OVER_QUOTA_POLICY = os.getenv("KNOWLEDGE_OVER_QUOTA_POLICY", "compact")
+    
+    # Códigos 2FA: 'sqlite' (compartido entre workers) o 'memory' (un solo proceso)
+    VERIFICATION_CODE_STORE = os.getenv("VERIFICATION_CODE_STORE", "sqlite")
+    
     # ============================================
     # RATE LIMITING
     # ============================================
@@ -104,6 +117,13 @@ class Config:
     WEBHOOK_VERIFY_TOKEN_PARAM = "hub.verify_token"
     WEBHOOK_CHALLENGE_PARAM = "hub.challenge"
     WEBHOOK_MODE_PARAM = "hub.mode"
+    WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "8"))  # Conversaciones en paralelo por payload
+    WEBHOOK_DEDUP_CACHE_SIZE = 1000  # IDs de mensajes recordados para ignorar reintentos
+    
+    # Agrupación de ráfagas: mensajes seguidos del mismo usuario => una sola llamada a Gemini
+    COALESCE_WINDOW_SECONDS = float(os.getenv("COALESCE_WINDOW_SECONDS", "0"))  # 0 = desactivado (el líder ocupa un hilo mientras espera)
+    COALESCE_MAX_WAIT_SECONDS = 5.0  # Espera máxima desde el primer mensaje de la ráfaga
+    COALESCE_MAX_MESSAGES = 10  # Mensajes máximos por ráfaga
     
     # ============================================
     # FIREBASE FUNCTIONS
@@ -115,12 +135,18 @@ class Config:
     # MÉTRICAS Y MONITOREO
     # ============================================
     METRICS_WINDOW_SECONDS = 3600  # Ventana de métricas (1 hora)
+    METRICS_WINDOW_SLOTS = 60  # Slots de la ventana deslizante (1 minuto cada uno)
+    METRICS_MAX_TRACKED_TENANTS = 10000  # Tope de clientes en memoria
+    METRICS_ROLLUP_INTERVAL_SECONDS = 60  # Frecuencia de persistencia de rollups en SQLite
+    METRICS_ROLLUP_RETENTION_HOURS = 48  # Rollups más antiguos se borran al persistir uno nuevo
+    METRICS_SCRAPE_TOKEN = os.getenv("METRICS_SCRAPE_TOKEN")  # Bearer opcional para /metrics
     
     # ============================================
     # URLs Y RUTAS
     # ============================================
     WHATSAPP_API_VERSION = "v22.0"
-    WHATSAPP_API_BASE_URL = f"https://graph.facebook.com/{WHATSAPP_API_VERSION}"
+    # Sobrescribible para apuntar a un stand-in local (loadtest/graph_server.py)
+    WHATSAPP_API_BASE_URL = os.getenv("WHATSAPP_API_BASE_URL", f"https://graph.facebook.com/{WHATSAPP_API_VERSION}")
     
     # ============================================
     # SEGURIDAD
@@ -148,19 +174,9 @@ class Config:
     
     @classmethod
     def get_db_path(cls) -> str:
-        """Obtiene la ruta de la base de datos según el entorno."""
+        """Obtiene la ruta de la base de datos según el entorno (en producción, el overlay)."""
         if cls.IS_PRODUCTION:
-            import shutil
-            import os as _os
-            
-            # Copiar DB a tmp si no existe
-            if not _os.path.exists(cls.TEMP_DB):
-                try:
-                    shutil.copy2(cls.ORIGINAL_DB, cls.TEMP_DB)
-                    _os.chmod(cls.TEMP_DB, 0o666)
-                except Exception as e:
-                    print(f"⚠️ Error copying DB to /tmp: {e}")
-            return cls.TEMP_DB
+            return cls.OVERLAY_DB
         return cls.ORIGINAL_DB
     
     @classmethod
@@ -174,15 +190,21 @@ class Config:
         limits = cls.get_plan_limits(plan)
         return limits.get('monthly_messages', 0) == -1
     
+    @classmethod
+    def get_knowledge_quota_bytes(cls, plan: str) -> int:
+        """Cuota de conocimiento de un plan en bytes (-1 = ilimitado)."""
+        megabytes = cls.get_plan_limits(plan).get('knowledge_base_mb', 5)
+        return -1 if megabytes == -1 else int(megabytes * 1024 * 1024)
+    
     @classmethod
     def get_demo_client_ids(cls) -> list:
-        """Retorna la lista de IDs de clientes demo."""
-        return [cls.DEMO_RESTAURANTE_ID, cls.DEMO_CLINICA_ID, cls.DEMO_TIENDA_ID]
+        """Retorna la lista de IDs de clientes demo (del registro en src/demos.json)."""
+        return demos.sqlite_ids()
     
     @classmethod
     def is_demo_client(cls, client_id: int) -> bool:
         """Verifica si un ID corresponde a un cliente demo."""
-        return client_id in cls.get_demo_client_ids()
+        return demos.by_sqlite_id(client_id) is not None
 
 
 # Instancia global para acceso rápido
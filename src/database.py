@@ -2,8 +2,22 @@ import sqlite3
 import json
 import os
 import re
+import hashlib
+import html
+import time
 from typing import Optional, Dict, Any, List, Tuple
 
+from .tracing import tracer
+from .demo_registry import demos
+from . import jsonutil
+from . import migrations
+from .config import Config
+from .models import Client, HistoryMessage
+from .sqlite_overlay import OverlayDatabase
+from .storage import ChatExchange, SQLiteStorage
+from .tenant_snapshot import TenantDirectory
+from .services import pdf_text
+
 # Pointing to the new data directory location
 ORIGINAL_DB = os.path.join(os.path.dirname(__file__), "..", "data", "consultorio.db")
 DB_NAME = ORIGINAL_DB
@@ -40,204 +54,146 @@ def sanitize_message_preview(message: str, max_length: int = 50) -> str:
         return message
     return message[:max_length] + "..."
 
-# Workaround for Firebase Functions (Read-only filesystem)
-if os.environ.get('K_SERVICE') or os.environ.get('FIREBASE_CONFIG'):
-    import shutil
-    TEMP_DB = "/tmp/consultorio.db"
-    if not os.path.exists(TEMP_DB):
-        print(f"📦 Copying database to /tmp for writing: {ORIGINAL_DB} -> {TEMP_DB}")
-        try:
-            shutil.copy2(ORIGINAL_DB, TEMP_DB)
-            # Ensure permissions
-            os.chmod(TEMP_DB, 0o666)
-        except Exception as e:
-            print(f"⚠️ Error copying DB to /tmp: {e}")
-            # Fallback will stay as the original read-only DB
-    DB_NAME = TEMP_DB
+# Firebase Functions (filesystem de solo lectura): la base empaquetada se lee
+# en modo inmutable y las escrituras van a un overlay en /tmp (ver sqlite_overlay.py)
+overlay: Optional[OverlayDatabase] = None
+if Config.IS_PRODUCTION:
+    overlay = OverlayDatabase(ORIGINAL_DB, Config.OVERLAY_DB, snapshot_path=Config.DB_SNAPSHOT_PATH)
+    overlay.bootstrap()
+    print(f"📦 Overlay SQLite listo en {overlay.bootstrap_seconds * 1000:.1f} ms: {overlay.overlay_path}")
+    DB_NAME = overlay.overlay_path
+
+
+def _connect(**kwargs) -> sqlite3.Connection:
+    """Conexión a la base de la app (con la base empaquetada adjunta si hay overlay)."""
+    if overlay is not None:
+        return overlay.connect(**kwargs)
+    return sqlite3.connect(DB_NAME, **kwargs)
 
 def init_db():
-    """Inicializa la base de datos con el esquema multitenencia."""
+    """
+    Inicializa o actualiza el esquema multitenencia (ver migrations.py).
+
+    Si la base ya está en la última versión solo lee `PRAGMA user_version`,
+    así que es barato llamarla en cada arranque y desde cada worker.
+    """
     print(f"🗄️ Connecting to database: {DB_NAME}")
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        # Tabla de Clientes
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS clients (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                whatsapp_token TEXT NOT NULL,
-                phone_number_id TEXT NOT NULL UNIQUE,
-                verify_token TEXT NOT NULL,
-                system_instruction TEXT,
-                stripe_api_key TEXT,
-                bank_name TEXT,
-                clabe TEXT,
-                beneficiary_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Manejar actualizaciones de esquema para tablas existentes
-        cursor.execute("PRAGMA table_info(clients)")
-        client_columns = [column[1] for column in cursor.fetchall()]
-        
-        new_cols = {
-            "bank_name": "TEXT",
-            "clabe": "TEXT",
-            "beneficiary_name": "TEXT",
-            "stripe_api_key": "TEXT",
-            "menu_json": "TEXT" 
-        }
-        
-        for col, type in new_cols.items():
-            if col not in client_columns:
-                print(f"🔧 Agregando columna '{col}' a la tabla 'clients'...")
-                cursor.execute(f'ALTER TABLE clients ADD COLUMN {col} {type}')
-        
-        # Tabla de Base de Conocimientos (Extraído de PDFs)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS knowledge_base (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_id INTEGER,
-                content TEXT NOT NULL,
-                source_file TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (client_id) REFERENCES clients (id)
-            )
-        ''')
-        
-        # Asegurar que la tabla exista (si no existía)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS citas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_id INTEGER,
-                cliente_telefono TEXT,
-                paciente_nombre TEXT,
-                fecha_hora TEXT,
-                motivo TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (client_id) REFERENCES clients (id)
-            )
-        ''')
+        applied = migrations.migrate(DB_NAME)
+        if applied:
+            print(f"✅ Base de datos multitenencia migrada a la versión {applied[-1]}.")
+    except Exception as e:
+        print(f"❌ Error al inicializar la base de datos: {e}")
 
-        # Tabla de Message Logs (para métricas y facturación)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS message_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_id INTEGER NOT NULL,
-                direction TEXT NOT NULL,
-                phone_number TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (client_id) REFERENCES clients (id)
-            )
-        ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_logs_client ON message_logs(client_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_logs_date ON message_logs(created_at)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_logs_client_date ON message_logs(client_id, created_at)')
 
-        # Tabla de Historial de Conversación (para contexto con Gemini)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS conversation_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                phone_number TEXT NOT NULL,
-                content TEXT NOT NULL,
-                is_user INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_phone ON conversation_history(phone_number)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_date ON conversation_history(created_at)')
+# ============================================
+# SNAPSHOT DE TENANTS (lecturas de clients en memoria)
+# ============================================
 
-        # Agregar columna 'plan' a clients si no existe
-        cursor.execute("PRAGMA table_info(clients)")
-        client_columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'plan' not in client_columns:
-            print("🔧 Agregando columna 'plan' a la tabla 'clients'...")
-            cursor.execute("ALTER TABLE clients ADD COLUMN plan TEXT DEFAULT 'free'")
+def _load_clients() -> List[Client]:
+    conn = _connect()
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT * FROM clients").fetchall()
+    conn.close()
+    return [Client.from_row(row) for row in rows]
 
-        conn.commit()
-        conn.close()
-        print("✅ Base de datos multitenencia inicializada.")
+
+def _read_tenant_version() -> int:
+    """Contador de escrituras en clients (lo mantienen triggers, ver migrations.py)."""
+    conn = _connect()
+    row = conn.execute("SELECT version FROM tenant_version WHERE id = 1").fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+
+tenants = TenantDirectory(_load_clients, _read_tenant_version, poll_interval_seconds=Config.TENANT_POLL_INTERVAL_SECONDS)
+
+# Backend de la interfaz común de almacenamiento (ver storage.py)
+storage = SQLiteStorage(_connect, tenants)
+
+
+def _refresh_tenants():
+    """Tras escribir en clients: este worker ve el cambio de inmediato (los demás al revisar la versión)."""
+    try:
+        tenants.refresh()
     except Exception as e:
-        print(f"❌ Error al inicializar la base de datos: {e}")
+        print(f"⚠️ ERROR actualizando snapshot de tenants: {e}")
+
+
+def _find_client(snapshot_lookup, where: str, value) -> Optional[Client]:
+    """
+    Cliente desde la foto en memoria (inmutable, se comparte sin copiar) o,
+    si no está, desde la base.
+    """
+    client = snapshot_lookup(tenants.current())
+    if client is not None:
+        return client
+    # No está en la foto: puede haberlo creado otro worker hace unos segundos
+    conn = _connect()
+    conn.row_factory = sqlite3.Row
+    row = conn.execute(f"SELECT * FROM clients WHERE {where} = ?", (value,)).fetchone()
+    conn.close()
+    if row is None:
+        return None
+    tenants.wake()
+    return Client.from_row(row)
 
+
+@tracer.traced("db.get_client_by_phone_id")
 def get_client_by_phone_id(phone_number_id):
     """Obtiene los datos de un cliente por su Phone Number ID."""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM clients WHERE phone_number_id = ?", (phone_number_id,))
-        client = cursor.fetchone()
-        conn.close()
-        return dict(client) if client else None
+        return _find_client(lambda snapshot: snapshot.get_by_phone(phone_number_id), "phone_number_id", phone_number_id)
     except Exception as e:
         print(f"❌ ERROR get_client_by_phone_id: {e}")
         return None
 
+@tracer.traced("db.list_clients")
 def list_clients():
     """Retorna una lista de todos los clientes, incluyendo los de demostración."""
-    # Inyectar clientes demo que siempre deben estar visibles
-    demo_clients = [
-        {
-            "id": 9991, 
-            "name": "🍕 Demo Restaurante V9", 
-            "phone": "521550000001",
-            "phone_number_id": "demo_restaurante", 
-            "email": "demo@zotek.ia", 
-            "response_type": "text",
-            "gemini_prompt": "Eres el asistente de una Pizzería Gourmet. Saluda con entusiasmo y ofrece las pizzas del día.",
-            "created_at": "2024-01-01 00:00:00",
-            "menu_json": '{"text": "¡Bienvenido a *La Trattoria*! 👋 Soy tu asistente virtual. ¿Qué te gustaría hacer hoy?", "options": [{"title": "Ver Menú", "icon": "🍕", "response": "Nuestro menú incluye pizzas a la leña, pastas frescas y postres italianos."}, {"title": "Hacer Reserva", "icon": "📅", "response": "Indícanos la fecha y hora para verificar disponibilidad."}, {"title": "Horarios", "icon": "⏰", "response": "Estamos abiertos todos los días de 12:00 PM a 11:00 PM."}], "fallback_text": "Lo siento, no entendí eso. Aquí tienes las opciones principales de La Trattoria:"}'
-        },
-        {
-            "id": 9992, 
-            "name": "🏥 Demo Clínica Dental", 
-            "phone": "521550000002",
-            "phone_number_id": "demo_clinica", 
-            "email": "demo@zotek.ia", 
-            "response_type": "text",
-            "gemini_prompt": "Eres el asistente de una Clínica Dental. Ayuda a los pacientes a conocer los servicios de ortodoncia y limpieza.",
-            "created_at": "2024-01-01 00:00:00",
-            "menu_json": '{"text": "Bienvenido a la *Clínica San Juan*. 🏥 ¿En qué podemos ayudarte hoy?", "options": [{"title": "Agendar Cita", "icon": "📅", "response": "Por favor, dinos para qué especialidad buscas cita."}, {"title": "Especialidades", "icon": "👨‍⚕️", "response": "Contamos con Medicina General, Odontología y Pediatría."}, {"title": "Ubicación", "icon": "📍", "response": "Estamos en Av. Central #123. Haz clic aquí para ver en el mapa: https://maps.google.com"}], "fallback_text": "No comprendo tu solicitud. Selecciona una de estas opciones de la clínica:"}'
-        },
-        {
-            "id": 9993, 
-            "name": "🛍️ Demo Tienda e-Commerce", 
-            "phone": "521550000003",
-            "phone_number_id": "demo_tienda", 
-            "email": "demo@zotek.ia", 
-            "response_type": "text",
-            "gemini_prompt": "Eres el asistente de una tienda de gadgets tecnológicos. Recomienda los mejores productos según las necesidades del cliente.",
-            "created_at": "2024-01-01 00:00:00",
-            "menu_json": '{"text": "¡Hola! Bienvenido a *Moda Urbana*. 🛍️ ✨ ¿Cómo podemos ayudarte con tu estilo hoy?", "options": [{"title": "Ver Catálogo", "icon": "👕", "response": "Nuestra nueva colección de otoño ya está disponible."}, {"title": "Tallas", "icon": "📏", "response": "Manejamos tallas desde XS hasta XL en la mayoría de nuestras prendas."}, {"title": "Devoluciones", "icon": "🔄", "response": "Tienes 30 días para realizar cambios o devoluciones con tu ticket."}], "fallback_text": "Ups, no reconozco eso. Aquí tienes lo que puedo hacer por ti en Moda Urbana:"}'
-        }
-    ]
-    
+    # Clientes demo que siempre deben estar visibles (registro precargado)
+    demo_clients = demos.sqlite_clients()
+
     try:
-        conn = sqlite3.connect(DB_NAME)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM clients")
-        rows = cursor.fetchall()
-        conn.close()
-        real_clients = [dict(row) for row in rows]
+        real_clients = [client.as_dict() for client in tenants.current().clients]
         return demo_clients + real_clients
     except Exception as e:
         print(f"❌ ERROR list_clients: {e}")
         return demo_clients
 
+def _column_value(value):
+    """Dicts/listas se guardan como JSON en columnas TEXT."""
+    return jsonutil.dumps(value) if isinstance(value, (dict, list)) else value
+
+
+def _with_menu_version(data):
+    """
+    Si `data` trae menu_json, lo normaliza a texto JSON y agrega menu_version.
+
+    Returns:
+        (data, menú parseado o None si no cambia el menú)
+    """
+    if 'menu_json' not in data:
+        return data, None
+    data = dict(data)
+    menu = data['menu_json']
+    if menu is None or isinstance(menu, (bytes, str)):
+        menu = _parse_menu(menu)
+    else:
+        data['menu_json'] = jsonutil.dumps(menu)
+    data['menu_version'] = time.time_ns()
+    return data, menu
+
+
 def update_client(client_id, data):
     """Actualiza los datos de un cliente. Si no existe en BD (ej. demo), lo inserta."""
+    data, new_menu = _with_menu_version(data)
     fields = []
     values = []
     for key, value in data.items():
         if key != 'id' and key != 'created_at':
             fields.append(f"{key} = ?")
-            values.append(value if not isinstance(value, (dict, list)) else json.dumps(value))
+            values.append(_column_value(value))
     
     if not fields:
         return False
@@ -246,7 +202,7 @@ def update_client(client_id, data):
     query = f"UPDATE clients SET {', '.join(fields)} WHERE id = ?"
     
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = _connect()
         cursor = conn.cursor()
         cursor.execute(query, values)
         rows_affected = cursor.rowcount
@@ -276,7 +232,7 @@ def update_client(client_id, data):
             for key, value in data.items():
                 if key != 'id' and key != 'created_at':
                     insert_cols.append(key)
-                    insert_vals.append(value if not isinstance(value, (dict, list)) else json.dumps(value))
+                    insert_vals.append(_column_value(value))
             
             placeholders = ', '.join(['?'] * len(insert_cols))
             insert_query = f"INSERT INTO clients ({', '.join(insert_cols)}) VALUES ({placeholders})"
@@ -285,6 +241,9 @@ def update_client(client_id, data):
         
         conn.commit()
         conn.close()
+        if new_menu is not None:
+            _cache_menu(client_id, data['menu_version'], new_menu)
+        _refresh_tenants()
         return True
     except Exception as e:
         print(f"❌ ERROR UPDATE CLIENT: {e}")
@@ -294,71 +253,41 @@ def update_client(client_id, data):
 
 def add_client(data):
     """Agrega un nuevo cliente."""
+    data, _ = _with_menu_version(data)
     columns = []
     placeholders = []
     values = []
     for key, value in data.items():
         columns.append(key)
         placeholders.append("?")
-        values.append(value)
+        values.append(_column_value(value))
         
     query = f"INSERT INTO clients ({', '.join(columns)}) VALUES ({', '.join(placeholders)})"
     
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = _connect()
         cursor = conn.cursor()
         cursor.execute(query, values)
         conn.commit()
         conn.close()
+        _refresh_tenants()
         return True
     except Exception as e:
         print(f"❌ ERROR ADD CLIENT: {e}")
         return False
 
+@tracer.traced("db.get_client_by_id")
 def get_client_by_id(client_id):
     """Obtiene un cliente por su ID numérico, incluyendo clientes demo."""
-    # Soporte para IDs de demo hardcodeados
-    demo_ids = {
-        9991: {
-            "id": 9991, 
-            "name": "🍕 Demo Restaurante V9", 
-            "phone_number_id": "demo_restaurante", 
-            "email": "demo@zotek.ia",
-            "system_instruction": "Eres el asistente de una Pizzería Gourmet. Saluda con entusiasmo y ofrece las pizzas del día.",
-            "menu_json": '{"text": "¡Bienvenido a *La Trattoria*! 👋 Soy tu asistente virtual. ¿Qué te gustaría hacer hoy?", "options": [{"title": "Ver Menú", "icon": "🍕", "response": "Nuestro menú incluye pizzas a la leña, pastas frescas y postres italianos."}, {"title": "Hacer Reserva", "icon": "📅", "response": "Indícanos la fecha y hora para verificar disponibilidad."}, {"title": "Horarios", "icon": "⏰", "response": "Estamos abiertos todos los días de 12:00 PM a 11:00 PM."}], "fallback_text": "Lo siento, no entendí eso. Aquí tienes las opciones principales de La Trattoria:"}'
-        },
-        9992: {
-            "id": 9992, 
-            "name": "🏥 Demo Clínica Dental", 
-            "phone_number_id": "demo_clinica", 
-            "email": "demo@zotek.ia",
-            "system_instruction": "Eres el asistente de una Clínica Dental. Ayuda a los pacientes a conocer los servicios de ortodoncia y limpieza.",
-            "menu_json": '{"text": "Bienvenido a la *Clínica San Juan*. 🏥 ¿En qué podemos ayudarte hoy?", "options": [{"title": "Agendar Cita", "icon": "📅", "response": "Por favor, dinos para qué especialidad buscas cita."}, {"title": "Especialidades", "icon": "👨‍⚕️", "response": "Contamos con Medicina General, Odontología y Pediatría."}, {"title": "Ubicación", "icon": "📍", "response": "Estamos en Av. Central #123. Haz clic aquí para ver en el mapa: https://maps.google.com"}], "fallback_text": "No comprendo tu solicitud. Selecciona una de estas opciones de la clínica:"}'
-        },
-        9993: {
-            "id": 9993, 
-            "name": "🛍️ Demo Tienda e-Commerce", 
-            "phone_number_id": "demo_tienda", 
-            "email": "demo@zotek.ia",
-            "system_instruction": "Eres el asistente de una tienda de gadgets tecnológicos. Recomienda los mejores productos según las necesidades del cliente.",
-            "menu_json": '{"text": "¡Hola! Bienvenido a *Moda Urbana*. 🛍️ ✨ ¿Cómo podemos ayudarte con tu estilo hoy?", "options": [{"title": "Ver Catálogo", "icon": "👕", "response": "Nuestra nueva colección de otoño ya está disponible."}, {"title": "Tallas", "icon": "📏", "response": "Manejamos tallas desde XS hasta XL en la mayoría de nuestras prendas."}, {"title": "Devoluciones", "icon": "🔄", "response": "Tienes 30 días para realizar cambios o devoluciones con tu ticket."}], "fallback_text": "Ups, no reconozco eso. Aquí tienes lo que puedo hacer por ti en Moda Urbana:"}'
-        }
-    }
-    
     try:
-        conn = sqlite3.connect(DB_NAME)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM clients WHERE id = ?", (client_id,))
-        client = cursor.fetchone()
-        conn.close()
-        
+        client = _find_client(lambda snapshot: snapshot.get_by_id(client_id), "id", client_id)
         if client:
-            return dict(client)
+            return client
         
         # Si no está en BD, buscar en demos
-        if int(client_id) in demo_ids:
-            return demo_ids[int(client_id)]
+        demo = demos.by_sqlite_id(client_id)
+        if demo:
+            return Client.from_dict(demo.sqlite_client())
             
         return None
     except Exception as e:
@@ -368,23 +297,132 @@ def get_client_by_id(client_id):
 def delete_client_db_entry(client_id):
     """Elimina un cliente de la base de datos (usado para resetear demos)."""
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = _connect()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM clients WHERE id = ?", (client_id,))
         conn.commit()
         conn.close()
+        invalidate_menu_cache(client_id)
+        _refresh_tenants()
         return True
     except Exception as e:
         print(f"❌ ERROR delete_client: {e}")
         return False
 
+# ============================================
+# CACHÉ DE MENÚS (menu_json ya parseado y serializado)
+# ============================================
+
+# client_id -> (menu_version, menú parseado, cuerpo JSON en bytes)
+_menu_cache: Dict[int, Tuple[Any, Dict[str, Any], bytes]] = {}
+
+
+def _parse_menu(menu_json) -> Dict[str, Any]:
+    """menu_json de la BD a dict; un menú vacío o inválido se vuelve {"options": []} (uno nuevo cada vez)."""
+    if not menu_json:
+        return {"options": []}
+    try:
+        menu = jsonutil.loads(menu_json)
+    except ValueError as e:
+        print(f"⚠️ menu_json inválido, se usa un menú vacío: {e}")
+        return {"options": []}
+    if not isinstance(menu, dict):
+        print(f"⚠️ menu_json no es un objeto ({type(menu).__name__}), se usa un menú vacío")
+        return {"options": []}
+    return menu
+
+
+def _cache_menu(client_id, version, menu: Dict[str, Any]) -> Tuple[Any, Dict[str, Any], bytes]:
+    entry = (version, menu, jsonutil.dumps_bytes(menu))
+    _menu_cache[int(client_id)] = entry
+    return entry
+
+
+def invalidate_menu_cache(client_id=None):
+    """Descarta el menú cacheado de un cliente (o de todos)."""
+    if client_id is None:
+        _menu_cache.clear()
+    else:
+        _menu_cache.pop(int(client_id), None)
+
+
+def _get_menu_entry(client_id) -> Optional[Tuple[Any, Dict[str, Any], bytes]]:
+    """
+    Menú del cliente desde el caché, validado contra `clients.menu_version`.
+
+    En un acierto solo se lee la versión (sin traer ni parsear menu_json). La
+    versión es el instante de la última escritura del menú (ns), así que otro
+    worker que cambie el menú, o un borrado y reinserción, invalidan el caché.
+    """
+    client_id = int(client_id)
+    cached = _menu_cache.get(client_id)
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT menu_version FROM clients WHERE id = ?", (client_id,)).fetchone()
+        if row is None:
+            demo = demos.by_sqlite_id(client_id)
+            if not demo:
+                _menu_cache.pop(client_id, None)
+                return None
+            version = 'demo'
+        else:
+            version = row[0] or 0
+        if cached and cached[0] == version:
+            return cached
+        if version == 'demo':
+            return _cache_menu(client_id, version, demo.menu)
+        row = conn.execute("SELECT menu_json, menu_version FROM clients WHERE id = ?", (client_id,)).fetchone()
+        if row is None:
+            return None
+        return _cache_menu(client_id, row[1] or 0, _parse_menu(row[0]))
+    finally:
+        conn.close()
+
+
+@tracer.traced("db.get_client_menu")
+def get_client_menu(client_id) -> Optional[Dict[str, Any]]:
+    """
+    Menú parseado de un cliente (compartido: no modificar).
+
+    Returns:
+        Dict del menú ({"options": []} si no tiene), o None si el cliente no existe
+    """
+    try:
+        entry = _get_menu_entry(client_id)
+        return entry[1] if entry else None
+    except Exception as e:
+        print(f"❌ ERROR get_client_menu: {e}")
+        return None
+
+
+@tracer.traced("db.get_client_menu_bytes")
+def get_client_menu_bytes(client_id) -> Optional[bytes]:
+    """
+    Menú de un cliente ya serializado a JSON, listo para la respuesta HTTP.
+
+    Returns:
+        Bytes del JSON, o None si el cliente no existe
+    """
+    try:
+        entry = _get_menu_entry(client_id)
+        return entry[2] if entry else None
+    except Exception as e:
+        print(f"❌ ERROR get_client_menu_bytes: {e}")
+        return None
+
 def list_client_documents(client_id):
     """Lista los archivos de conocimiento de un cliente."""
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = _connect()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute("SELECT id, source_file, updated_at FROM knowledge_base WHERE client_id = ?", (client_id,))
+        # Los chunks de un documento versionado se listan como una sola entrada
+        cursor.execute('''
+            SELECT MIN(id) AS id, source_file, MAX(updated_at) AS updated_at, COUNT(*) AS chunks
+            FROM knowledge_base WHERE client_id = ?
+            GROUP BY COALESCE(document_key, 'row:' || id)
+            ORDER BY MIN(id)
+        ''', (client_id,))
         rows = cursor.fetchall()
         conn.close()
         return [dict(row) for row in rows]
@@ -392,24 +430,329 @@ def list_client_documents(client_id):
         print(f"❌ ERROR list_client_documents: {e}")
         return []
 
+@tracer.traced("db.get_client_knowledge")
 def get_client_knowledge(client_id):
     """Obtiene todo el conocimiento acumulado de un cliente."""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute("SELECT content FROM knowledge_base WHERE client_id = ?", (client_id,))
-        rows = cursor.fetchall()
-        conn.close()
-        return "\n".join([row[0] for row in rows])
+        return storage.get_knowledge(client_id)
     except Exception as e:
         print(f"❌ ERROR get_client_knowledge: {e}")
         return ""
 
 
+# ============================================
+# VERSIONADO DE CONOCIMIENTO
+# ============================================
+
+def content_hash(text: str) -> str:
+    """Hash SHA-256 (hex) de un texto."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def knowledge_document_key(source_file: Optional[str], content: str = "") -> str:
+    """Clave estable de un documento: derivada del nombre del archivo (o del contenido)."""
+    key = source_file.strip().lower() if source_file else content_hash(content)
+    return "doc_" + hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+
+def get_knowledge_version(client_id) -> int:
+    """Versión actual del conocimiento del cliente (se incrementa en cada cambio)."""
+    try:
+        conn = _connect()
+        row = conn.execute("SELECT knowledge_version FROM clients WHERE id = ?", (client_id,)).fetchone()
+        conn.close()
+        return (row[0] or 0) if row else 0
+    except Exception as e:
+        print(f"❌ ERROR get_knowledge_version: {e}")
+        return 0
+
+
+def _document_bytes(cursor, client_id, document_key: str, source_file: Optional[str]) -> int:
+    """Bytes guardados actualmente para un documento (incluye filas antiguas del mismo archivo)."""
+    cursor.execute('''
+        SELECT COALESCE(SUM(length(CAST(content AS BLOB))), 0) FROM knowledge_base
+        WHERE client_id = ? AND (document_key = ? OR (document_key IS NULL AND source_file = ?))
+    ''', (client_id, document_key, source_file))
+    return cursor.fetchone()[0]
+
+
+def _store_document(cursor, client_id, document_key: str, source_file: Optional[str],
+                    chunks: List[str], chunk_hashes: List[str], existing_version: Optional[int]) -> Tuple[int, int, int]:
+    """
+    Escribe los chunks de un documento dentro de una transacción abierta.
+
+    Returns:
+        Tuple (chunks escritos, chunks eliminados, nueva versión)
+    """
+    cursor.execute(
+        "SELECT chunk_index, content_hash FROM knowledge_base WHERE client_id = ? AND document_key = ?",
+        (client_id, document_key)
+    )
+    previous = dict(cursor.fetchall())
+
+    written = 0
+    for index, (chunk, chunk_hash) in enumerate(zip(chunks, chunk_hashes)):
+        if previous.get(index) == chunk_hash:
+            continue
+        if index in previous:
+            cursor.execute('''
+                UPDATE knowledge_base SET content = ?, content_hash = ?, source_file = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE client_id = ? AND document_key = ? AND chunk_index = ?
+            ''', (chunk, chunk_hash, source_file, client_id, document_key, index))
+        else:
+            cursor.execute('''
+                INSERT INTO knowledge_base (client_id, content, source_file, document_key, chunk_index, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (client_id, chunk, source_file, document_key, index, chunk_hash))
+        written += 1
+
+    # Se cuentan con SELECT: en el overlay de producción knowledge_base es una
+    # vista con triggers y `rowcount` de un DELETE sobre ella es 0
+    deleted = sum(1 for index in previous if index >= len(chunks))
+    cursor.execute(
+        "DELETE FROM knowledge_base WHERE client_id = ? AND document_key = ? AND chunk_index >= ?",
+        (client_id, document_key, len(chunks))
+    )
+    if source_file:
+        cursor.execute(
+            "SELECT COUNT(*) FROM knowledge_base WHERE client_id = ? AND source_file = ? AND document_key IS NULL",
+            (client_id, source_file)
+        )
+        deleted += cursor.fetchone()[0]
+        cursor.execute(
+            "DELETE FROM knowledge_base WHERE client_id = ? AND source_file = ? AND document_key IS NULL",
+            (client_id, source_file)
+        )
+
+    version = (existing_version + 1) if existing_version else 1
+    cursor.execute('''
+        INSERT INTO knowledge_documents (client_id, document_key, source_file, content_hash, chunk_count, version)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(client_id, document_key) DO UPDATE SET
+            source_file = excluded.source_file, content_hash = excluded.content_hash,
+            chunk_count = excluded.chunk_count, version = excluded.version, updated_at = CURRENT_TIMESTAMP
+    ''', (client_id, document_key, source_file, content_hash("".join(chunk_hashes)), len(chunks), version))
+    return written, deleted, version
+
+
+def _adjust_knowledge_bytes(cursor, client_id, delta: int):
+    """Actualiza el contador incremental de bytes y la versión de conocimiento del cliente."""
+    cursor.execute('''
+        UPDATE clients SET knowledge_bytes = MAX(0, COALESCE(knowledge_bytes, 0) + ?),
+            knowledge_version = COALESCE(knowledge_version, 0) + 1
+        WHERE id = ?
+    ''', (delta, client_id))
+
+
+def get_knowledge_usage(client_id) -> Dict[str, Any]:
+    """
+    Uso de la base de conocimientos de un cliente contra la cuota de su plan.
+
+    Returns:
+        Dict con plan, used_bytes, quota_bytes (-1 = ilimitado) y percent
+    """
+    from .config import Config
+
+    try:
+        conn = _connect()
+        row = conn.execute("SELECT plan, knowledge_bytes FROM clients WHERE id = ?", (client_id,)).fetchone()
+        conn.close()
+    except Exception as e:
+        print(f"❌ ERROR get_knowledge_usage: {e}")
+        row = None
+    plan = (row[0] if row else None) or 'free'
+    used = (row[1] if row else 0) or 0
+    quota = Config.get_knowledge_quota_bytes(plan)
+    return {
+        'plan': plan,
+        'used_bytes': used,
+        'quota_bytes': quota,
+        'percent': round(used * 100 / quota, 1) if quota > 0 else 0,
+    }
+
+
+@tracer.traced("db.upsert_knowledge_document")
+def upsert_knowledge_document(client_id, source_file: Optional[str], chunks: List[str],
+                              over_quota_policy: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Guarda un documento de conocimiento por chunks, versionado por hash.
+
+    - Si el contenido es idéntico al guardado, no escribe nada
+    - Si cambió, reescribe solo los chunks cuyo hash cambió y elimina los sobrantes
+    - Las filas antiguas (sin versionar) del mismo archivo se reemplazan
+    - Verifica la cuota `knowledge_base_mb` del plan: si el documento no cabe,
+      lo compacta (política 'compact') y lo rechaza si aun así no cabe
+    - Mantiene `clients.knowledge_bytes` e incrementa `clients.knowledge_version`
+
+    Args:
+        client_id: ID del cliente
+        source_file: Nombre del archivo de origen
+        chunks: Textos del documento en orden
+        over_quota_policy: 'compact' | 'reject' (default: Config.KNOWLEDGE_OVER_QUOTA_POLICY)
+
+    Returns:
+        Dict con status ('created' | 'updated' | 'unchanged' | 'over_quota'), version,
+        chunks_written, chunks_deleted, bytes, bytes_saved (compactación) y quota_bytes
+    """
+    from .config import Config
+
+    policy = over_quota_policy or Config.KNOWLEDGE_OVER_QUOTA_POLICY
+    document_key = knowledge_document_key(source_file, "".join(chunks))
+    chunk_hashes = [content_hash(chunk) for chunk in chunks]
+    new_bytes = sum(pdf_text.text_bytes(chunk) for chunk in chunks)
+
+    conn = _connect(isolation_level=None)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            "SELECT content_hash, version FROM knowledge_documents WHERE client_id = ? AND document_key = ?",
+            (client_id, document_key)
+        )
+        existing = cursor.fetchone()
+        if existing and existing[0] == content_hash("".join(chunk_hashes)):
+            cursor.execute("ROLLBACK")
+            return {'status': 'unchanged', 'version': existing[1], 'chunks_written': 0, 'chunks_deleted': 0,
+                    'bytes': new_bytes, 'bytes_saved': 0}
+
+        cursor.execute("SELECT plan, knowledge_bytes FROM clients WHERE id = ?", (client_id,))
+        plan, used_bytes = cursor.fetchone() or ('free', 0)
+        quota = Config.get_knowledge_quota_bytes(plan or 'free')
+        # Bytes del cliente sin este documento (se reemplaza completo)
+        other_bytes = (used_bytes or 0) - _document_bytes(cursor, client_id, document_key, source_file)
+
+        bytes_saved = 0
+        if quota != -1 and other_bytes + new_bytes > quota and policy == 'compact' and chunks:
+            compacted = pdf_text.compact_chunks(chunks, max(len(chunk) for chunk in chunks)) or chunks
+            compacted_bytes = sum(pdf_text.text_bytes(chunk) for chunk in compacted)
+            bytes_saved = new_bytes - compacted_bytes
+            chunks, new_bytes = compacted, compacted_bytes
+            chunk_hashes = [content_hash(chunk) for chunk in chunks]
+            if existing and existing[0] == content_hash("".join(chunk_hashes)):
+                cursor.execute("ROLLBACK")
+                return {'status': 'unchanged', 'version': existing[1], 'chunks_written': 0, 'chunks_deleted': 0,
+                        'bytes': new_bytes, 'bytes_saved': bytes_saved}
+
+        if quota != -1 and other_bytes + new_bytes > quota:
+            cursor.execute("ROLLBACK")
+            print(f"⚠️ Conocimiento excede la cuota del plan '{plan}' (cliente {client_id}): "
+                  f"{other_bytes + new_bytes} > {quota} bytes")
+            return {
+                'status': 'over_quota',
+                'version': existing[1] if existing else None,
+                'chunks_written': 0,
+                'chunks_deleted': 0,
+                'bytes': new_bytes,
+                'bytes_saved': bytes_saved,
+                'used_bytes': used_bytes or 0,
+                'quota_bytes': quota,
+            }
+
+        written, deleted, version = _store_document(
+            cursor, client_id, document_key, source_file, chunks, chunk_hashes, existing[1] if existing else None)
+        _adjust_knowledge_bytes(cursor, client_id, new_bytes + other_bytes - (used_bytes or 0))
+        cursor.execute("COMMIT")
+        # knowledge_version cambió: la caché de conocimiento de Gemini lo lee del cliente
+        _refresh_tenants()
+        return {
+            'status': 'updated' if existing else 'created',
+            'version': version,
+            'chunks_written': written,
+            'chunks_deleted': deleted,
+            'bytes': new_bytes,
+            'bytes_saved': bytes_saved,
+            'quota_bytes': quota,
+        }
+    except Exception:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+@tracer.traced("db.compact_client_knowledge")
+def compact_client_knowledge(client_id) -> Dict[str, Any]:
+    """
+    Compacta todo el conocimiento de un cliente (encabezados/pies repetidos,
+    números de página, líneas y párrafos duplicados, espacios).
+
+    Los documentos antiguos sin versionar se convierten a documentos versionados.
+    Recalcula `clients.knowledge_bytes` desde cero al terminar.
+
+    Returns:
+        Dict con documents, documents_compacted, bytes_before, bytes_after y bytes_saved
+    """
+    conn = _connect(isolation_level=None)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute('''
+            SELECT id, document_key, source_file, content FROM knowledge_base
+            WHERE client_id = ? ORDER BY COALESCE(document_key, ''), chunk_index, id
+        ''', (client_id,))
+        documents: Dict[str, Dict[str, Any]] = {}
+        for row_id, document_key, source_file, content in cursor.fetchall():
+            group = document_key or (f"file:{source_file}" if source_file else f"row:{row_id}")
+            document = documents.setdefault(group, {'key': document_key, 'source_file': source_file, 'ids': [], 'chunks': []})
+            document['ids'].append(row_id)
+            document['chunks'].append(content)
+
+        bytes_before = bytes_after = compacted_count = 0
+        for document in documents.values():
+            size = sum(pdf_text.text_bytes(chunk) for chunk in document['chunks'])
+            compacted = pdf_text.compact_chunks(document['chunks'], max(len(chunk) for chunk in document['chunks']))
+            compacted_size = sum(pdf_text.text_bytes(chunk) for chunk in compacted)
+            bytes_before += size
+            if not compacted or compacted_size >= size:
+                bytes_after += size
+                continue
+
+            document_key = document['key']
+            if document_key is None:
+                # Fila antigua sin versionar: se reemplaza por un documento versionado
+                document_key = knowledge_document_key(document['source_file'], "".join(document['chunks']))
+                cursor.executemany("DELETE FROM knowledge_base WHERE id = ?", [(i,) for i in document['ids']])
+            cursor.execute(
+                "SELECT version FROM knowledge_documents WHERE client_id = ? AND document_key = ?",
+                (client_id, document_key)
+            )
+            existing = cursor.fetchone()
+            _store_document(cursor, client_id, document_key, document['source_file'], compacted,
+                            [content_hash(chunk) for chunk in compacted], existing[0] if existing else None)
+            bytes_after += compacted_size
+            compacted_count += 1
+
+        cursor.execute('''
+            UPDATE clients SET knowledge_bytes = ?,
+                knowledge_version = COALESCE(knowledge_version, 0) + ?
+            WHERE id = ?
+        ''', (bytes_after, 1 if compacted_count else 0, client_id))
+        cursor.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    _refresh_tenants()
+
+    print(f"🗜️ Conocimiento compactado (cliente {client_id}): {bytes_before} -> {bytes_after} bytes "
+          f"({compacted_count}/{len(documents)} documentos)")
+    return {
+        'documents': len(documents),
+        'documents_compacted': compacted_count,
+        'bytes_before': bytes_before,
+        'bytes_after': bytes_after,
+        'bytes_saved': bytes_before - bytes_after,
+    }
+
+
 # ============================================
 # TRACKING DE MENSAJES Y MÉTRICAS
 # ============================================
 
+@tracer.traced("db.track_message")
 def track_message(client_id: int, direction: str = "outbound", phone_number: str = None):
     """
     Registra un mensaje para métricas de facturación.
@@ -420,7 +763,7 @@ def track_message(client_id: int, direction: str = "outbound", phone_number: str
         phone_number: Número de teléfono (opcional, para logs)
     """
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = _connect()
         cursor = conn.cursor()
         cursor.execute("""
             INSERT INTO message_logs (client_id, direction, phone_number, created_at)
@@ -433,6 +776,7 @@ def track_message(client_id: int, direction: str = "outbound", phone_number: str
         print(f"⚠️ ERROR track_message: {e}")
 
 
+@tracer.traced("db.get_monthly_message_count")
 def get_monthly_message_count(client_id: int) -> int:
     """
     Obtiene la cantidad de mensajes del mes actual para facturación.
@@ -444,12 +788,13 @@ def get_monthly_message_count(client_id: int) -> int:
         Cantidad de mensajes en el mes actual
     """
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = _connect()
         cursor = conn.cursor()
+        # Rango sobre created_at (en lugar de strftime) para usar idx_message_logs_client_date
         cursor.execute("""
             SELECT COUNT(*) FROM message_logs 
             WHERE client_id = ? 
-            AND strftime('%Y-%m', created_at) = strftime('%Y-%m', 'now')
+            AND created_at >= datetime('now', 'start of month')
         """, (client_id,))
         count = cursor.fetchone()[0]
         conn.close()
@@ -459,18 +804,41 @@ def get_monthly_message_count(client_id: int) -> int:
         return 0
 
 
-def check_message_limit(client_id: int, plan: str = 'free') -> Tuple[bool, str]:
+@tracer.traced("db.get_monthly_message_counts")
+def get_monthly_message_counts() -> Dict[int, int]:
     """
-    Verifica si el cliente excedió su límite de mensajes mensual.
+    Obtiene los mensajes del mes actual de todos los clientes en una sola consulta agrupada.
+    
+    Returns:
+        Diccionario {client_id: cantidad de mensajes en el mes actual}
+    """
+    try:
+        conn = _connect()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT client_id, COUNT(*) FROM message_logs 
+            WHERE created_at >= datetime('now', 'start of month')
+            GROUP BY client_id
+        """)
+        counts = {row[0]: row[1] for row in cursor.fetchall()}
+        conn.close()
+        return counts
+    except Exception as e:
+        print(f"❌ ERROR get_monthly_message_counts: {e}")
+        return {}
+
+
+def evaluate_message_limit(current_count: int, plan: str = 'free') -> Tuple[bool, str]:
+    """
+    Evalúa el límite mensual de un plan contra un conteo ya calculado.
     
     Args:
-        client_id: ID del cliente
+        current_count: Mensajes del mes actual
         plan: Plan del cliente (free, basic, pro, enterprise)
     
     Returns:
         Tuple (allowed: bool, message: str)
     """
-    # Importar planes desde config si está disponible
     from .config import Config
     
     limits = Config.get_plan_limits(plan)
@@ -480,8 +848,6 @@ def check_message_limit(client_id: int, plan: str = 'free') -> Tuple[bool, str]:
     if monthly_limit == -1:
         return True, "Ilimitado"
     
-    current_count = get_monthly_message_count(client_id)
-    
     if current_count >= monthly_limit:
         return False, f"Límite de {monthly_limit} mensajes alcanzado. Mes: {current_count}/{monthly_limit}"
     
@@ -489,6 +855,58 @@ def check_message_limit(client_id: int, plan: str = 'free') -> Tuple[bool, str]:
     return True, f"{remaining} mensajes restantes este mes"
 
 
+@tracer.traced("db.check_message_limit")
+def check_message_limit(client_id: int, plan: str = 'free') -> Tuple[bool, str]:
+    """
+    Verifica si el cliente excedió su límite de mensajes mensual.
+    
+    Args:
+        client_id: ID del cliente
+        plan: Plan del cliente (free, basic, pro, enterprise)
+    
+    Returns:
+        Tuple (allowed: bool, message: str)
+    """
+    from .config import Config
+    
+    # Ilimitado: no hace falta contar
+    if Config.is_unlimited_plan(plan):
+        return True, "Ilimitado"
+    
+    return evaluate_message_limit(get_monthly_message_count(client_id), plan)
+
+
+def get_usage_summary() -> List[Dict[str, Any]]:
+    """
+    Obtiene el uso mensual y el estado del límite de todos los clientes.
+    
+    Usa una sola consulta agrupada sobre message_logs en lugar de
+    contar cliente por cliente (2N consultas).
+    
+    Returns:
+        Lista de diccionarios con client_id, client_name, plan,
+        monthly_messages, limit_allowed y message
+    """
+    counts = get_monthly_message_counts()
+    usage_data = []
+    
+    for client in list_clients():
+        plan = client.get('plan') or 'free'
+        monthly_count = counts.get(client['id'], 0)
+        allowed, message = evaluate_message_limit(monthly_count, plan)
+        
+        usage_data.append({
+            'client_id': client['id'],
+            'client_name': client.get('name'),
+            'plan': plan,
+            'monthly_messages': monthly_count,
+            'limit_allowed': allowed,
+            'message': message,
+        })
+    
+    return usage_data
+
+
 def get_message_stats(client_id: int = None) -> Dict[str, Any]:
     """
     Obtiene estadísticas de mensajes.
@@ -500,7 +918,7 @@ def get_message_stats(client_id: int = None) -> Dict[str, Any]:
         Diccionario con estadísticas
     """
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = _connect()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
@@ -547,43 +965,86 @@ def get_message_stats(client_id: int = None) -> Dict[str, Any]:
         return {'total': 0, 'inbound': 0, 'outbound': 0}
 
 
+def save_metrics_rollup(worker: str, interval_start: float, rows: List[Tuple[str, str, float]],
+                        retention_hours: int = Config.METRICS_ROLLUP_RETENTION_HOURS):
+    """
+    Persiste un rollup de métricas de un worker y, en la misma transacción,
+    borra los rollups (de todos los workers) más antiguos que la retención.
+    
+    Args:
+        worker: Identificador del proceso (host:pid)
+        interval_start: Inicio del intervalo (epoch en segundos)
+        rows: Lista de (nombre, etiqueta, valor)
+        retention_hours: Antigüedad máxima de los rollups que se conservan
+    """
+    try:
+        conn = _connect()
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO metrics_rollups (worker, interval_start, name, label, value)
+            VALUES (?, datetime(?, 'unixepoch'), ?, ?, ?)
+        """, [(worker, interval_start, name, label, value) for name, label, value in rows])
+        # Usa idx_metrics_rollups_date
+        cursor.execute("DELETE FROM metrics_rollups WHERE created_at < datetime('now', ?)",
+                       (f'-{int(retention_hours)} hours',))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"⚠️ ERROR save_metrics_rollup: {e}")
+
+
+def get_metrics_rollup_totals(window_seconds: int = 3600) -> Dict[str, Any]:
+    """
+    Suma los contadores persistidos por todos los workers en la ventana dada.
+    
+    Args:
+        window_seconds: Antigüedad máxima de los rollups a considerar
+    
+    Returns:
+        Diccionario {nombre: total} con los contadores de todos los workers
+    """
+    try:
+        conn = _connect()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT name, SUM(value)
+            FROM metrics_rollups
+            WHERE label = '' AND created_at >= datetime('now', ?)
+            GROUP BY name
+        """, (f'-{int(window_seconds)} seconds',))
+        rows = cursor.fetchall()
+        conn.close()
+        return {name: total for name, total in rows}
+    except Exception as e:
+        print(f"❌ ERROR get_metrics_rollup_totals: {e}")
+        return {}
+
+
 # ============================================
 # HISTORIAL DE CONVERSACIÓN
 # ============================================
 
-def add_to_conversation_history(phone_number: str, user_message: str, assistant_response: str):
+@tracer.traced("db.add_to_conversation_history")
+def add_to_conversation_history(phone_number: str, user_message: str, assistant_response: str, client_id: int = None):
     """
     Agrega un intercambio de mensajes al historial de conversación.
+    El índice de búsqueda (conversation_fts) se actualiza por trigger.
     
     Args:
         phone_number: Número de teléfono del usuario
         user_message: Mensaje del usuario
         assistant_response: Respuesta del asistente
+        client_id: ID del cliente dueño de la conversación
     """
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        # Insertar mensaje del usuario
-        cursor.execute("""
-            INSERT INTO conversation_history (phone_number, content, is_user, created_at)
-            VALUES (?, ?, 1, CURRENT_TIMESTAMP)
-        """, (phone_number, user_message))
-        
-        # Insertar respuesta del asistente
-        cursor.execute("""
-            INSERT INTO conversation_history (phone_number, content, is_user, created_at)
-            VALUES (?, ?, 0, CURRENT_TIMESTAMP)
-        """, (phone_number, assistant_response))
-        
-        conn.commit()
-        conn.close()
+        storage.append_messages([ChatExchange(client_id, phone_number, user_message, assistant_response)])
     except Exception as e:
         # No bloquear el flujo principal por errores de historial
         print(f"⚠️ ERROR add_to_conversation_history: {e}")
 
 
-def get_conversation_history(phone_number: str, limit: int = 10) -> List[Dict[str, Any]]:
+@tracer.traced("db.get_conversation_history")
+def get_conversation_history(phone_number: str, limit: int = 10) -> List[HistoryMessage]:
     """
     Obtiene el historial reciente de conversación para un usuario.
     
@@ -592,10 +1053,10 @@ def get_conversation_history(phone_number: str, limit: int = 10) -> List[Dict[st
         limit: Cantidad máxima de mensajes a retornar
     
     Returns:
-        Lista de mensajes con estructura: {content, is_user, created_at}
+        Lista de `HistoryMessage` (content, is_user, created_at), del más antiguo al más reciente
     """
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = _connect()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
@@ -611,12 +1072,133 @@ def get_conversation_history(phone_number: str, limit: int = 10) -> List[Dict[st
         conn.close()
         
         # Invertir para que el más antiguo vaya primero
-        return [dict(row) for row in reversed(rows)]
+        return [HistoryMessage.from_row(row) for row in reversed(rows)]
     except Exception as e:
         print(f"❌ ERROR get_conversation_history: {e}")
         return []
 
 
+# Marcadores internos del resaltado: se escapa el HTML del mensaje y luego se
+# reemplazan por <mark> (el contenido viene de usuarios de WhatsApp)
+_HIGHLIGHT_OPEN = "\x02"
+_HIGHLIGHT_CLOSE = "\x03"
+SEARCH_MAX_PAGE_SIZE = 100
+
+
+def _fts_query(client_id: int, query: str) -> str:
+    """
+    Convierte el texto del usuario en una consulta FTS5 segura: todos los
+    términos como prefijo, restringida a los mensajes del cliente.
+    """
+    terms = " ".join(f'"{term}"*' for term in re.findall(r"\w+", query))
+    return f'client_id:"{int(client_id)}" AND content:({terms})' if terms else ""
+
+
+def _render_highlight(text: str) -> str:
+    escaped = html.escape(text or "")
+    return escaped.replace(_HIGHLIGHT_OPEN, "<mark>").replace(_HIGHLIGHT_CLOSE, "</mark>")
+
+
+@tracer.traced("db.search_conversation_history")
+def search_conversation_history(
+    client_id: int,
+    query: str,
+    page: int = 1,
+    page_size: int = 20,
+    phone_number: str = None,
+    since: str = None,
+    until: str = None,
+    order: str = "relevance",
+) -> Dict[str, Any]:
+    """
+    Búsqueda de texto completo en el historial de conversación de un cliente.
+
+    Args:
+        client_id: ID del cliente
+        query: Texto a buscar (cada palabra se busca como prefijo, sin acentos)
+        page: Página (desde 1)
+        page_size: Resultados por página (máx. SEARCH_MAX_PAGE_SIZE)
+        phone_number: Filtrar por usuario (opcional)
+        since / until: Rango de fechas 'YYYY-MM-DD[ HH:MM:SS]' (opcional)
+        order: 'relevance' (bm25) o 'recent'
+
+    Returns:
+        Dict con results ({id, phone_number, is_user, created_at, snippet}),
+        total, page, page_size y has_more
+    """
+    page = max(1, int(page))
+    page_size = max(1, min(int(page_size), SEARCH_MAX_PAGE_SIZE))
+    empty = {'results': [], 'total': 0, 'page': page, 'page_size': page_size, 'has_more': False}
+    match = _fts_query(client_id, query or "")
+    if not match:
+        return empty
+
+    filters = ["h.client_id = ?"]
+    params: List[Any] = [client_id]
+    if phone_number:
+        filters.append("h.phone_number = ?")
+        params.append(phone_number)
+    if since:
+        filters.append("h.created_at >= ?")
+        params.append(since)
+    if until:
+        filters.append("h.created_at < ?")
+        params.append(until)
+    where = " AND ".join(filters)
+    order_by = "h.created_at DESC, h.id DESC" if order == "recent" else "bm25(conversation_fts, 1.0, 0.0), h.id DESC"
+
+    try:
+        conn = _connect()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT COUNT(*) FROM conversation_fts
+                JOIN conversation_history h ON h.id = conversation_fts.rowid
+                WHERE conversation_fts MATCH ? AND {where}
+            """, [match] + params)
+            total = cursor.fetchone()[0]
+            cursor.execute(f"""
+                SELECT h.id, h.phone_number, h.is_user, h.created_at,
+                       snippet(conversation_fts, 0, ?, ?, '…', 16) AS snippet
+                FROM conversation_fts
+                JOIN conversation_history h ON h.id = conversation_fts.rowid
+                WHERE conversation_fts MATCH ? AND {where}
+                ORDER BY {order_by}
+                LIMIT ? OFFSET ?
+            """, [_HIGHLIGHT_OPEN, _HIGHLIGHT_CLOSE, match] + params + [page_size, (page - 1) * page_size])
+        except sqlite3.OperationalError:
+            # Sin FTS5: coincidencia simple por subcadena (sin ranking)
+            like_filters = where + "".join(" AND h.content LIKE ?" for _ in re.findall(r"\w+", query))
+            like_params = params + [f"%{term}%" for term in re.findall(r"\w+", query)]
+            cursor.execute(f"SELECT COUNT(*) FROM conversation_history h WHERE {like_filters}", like_params)
+            total = cursor.fetchone()[0]
+            cursor.execute(f"""
+                SELECT h.id, h.phone_number, h.is_user, h.created_at, h.content AS snippet
+                FROM conversation_history h WHERE {like_filters}
+                ORDER BY h.created_at DESC, h.id DESC LIMIT ? OFFSET ?
+            """, like_params + [page_size, (page - 1) * page_size])
+        rows = cursor.fetchall()
+        conn.close()
+    except Exception as e:
+        print(f"❌ ERROR search_conversation_history: {e}")
+        return empty
+
+    results = []
+    for row in rows:
+        result = dict(row)
+        result['is_user'] = bool(result['is_user'])
+        result['snippet'] = _render_highlight(result['snippet'])
+        results.append(result)
+    return {
+        'results': results,
+        'total': total,
+        'page': page,
+        'page_size': page_size,
+        'has_more': page * page_size < total,
+    }
+
+
 def clear_conversation_history(phone_number: str = None, older_than_days: int = 30):
     """
     Limpia el historial de conversación.
@@ -626,7 +1208,7 @@ def clear_conversation_history(phone_number: str = None, older_than_days: int =
         older_than_days: Días de antigüedad para limpiar (default 30)
     """
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = _connect()
         cursor = conn.cursor()
         
         if phone_number:
@@ -0,0 +1,186 @@
+"""
+Registro de tenants demo (Restaurante, Clínica, Tienda).
+
+Los datos viven en `demos.json` (junto a este módulo) y se cargan una sola vez
+al importar: los menús se parsean y se serializan a `menu_json` por adelantado,
+los detectores de palabras clave se compilan a regex y las búsquedas por id,
+phone_number_id o demo_mode son O(1) sobre dicts.
+
+Cada demo tiene tres vistas:
+- sqlite: cliente demo del backend SQLite (ids 9991-9993)
+- firestore: documento clients/{id} de Firebase (ids demo_*)
+- assistant: nombre e instrucciones que se inyectan a Gemini en una sesión demo
+
+Los dicts devueltos son copias: el llamador puede modificarlos sin alterar el registro.
+"""
+
+import json
+import os
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+DEMOS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demos.json")
+
+DEMO_START_PHRASE = "quiero probar la demo de"
+
+
+def _fold(text: str) -> str:
+    """Minúsculas y sin acentos, para comparar palabras clave."""
+    text = unicodedata.normalize("NFKD", str(text or "").lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def _keyword_pattern(keywords: List[str]) -> "re.Pattern":
+    alternatives = sorted({re.escape(_fold(k)) for k in keywords}, key=len, reverse=True)
+    return re.compile("|".join(alternatives))
+
+
+class Demo:
+    """Un tenant demo ya preprocesado (solo lectura)."""
+
+    __slots__ = (
+        'key', 'demo_mode', 'menu', 'menu_json', 'welcome_text', 'button_titles',
+        'assistant_name', 'system_instruction', '_sqlite', '_firestore',
+    )
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.key = spec['key']
+        self.demo_mode = spec['demo_mode']
+        self.menu = spec['menu']
+        self.menu_json = json.dumps(self.menu, ensure_ascii=False)
+        self.welcome_text = self.menu.get('text', '')
+        self.button_titles = [option['title'] for option in self.menu.get('options', [])]
+        self.assistant_name = spec['assistant']['name']
+        self.system_instruction = spec['assistant']['system_instruction']
+
+        sqlite = dict(spec['sqlite'])
+        sqlite['gemini_prompt'] = sqlite['system_instruction']
+        sqlite['menu_json'] = self.menu_json
+        self._sqlite = sqlite
+        self._firestore = dict(spec['firestore'])
+
+    @property
+    def sqlite_id(self) -> int:
+        return self._sqlite['id']
+
+    @property
+    def firestore_id(self) -> str:
+        return self._firestore['id']
+
+    def sqlite_client(self) -> Dict[str, Any]:
+        """Cliente demo en el formato de la tabla clients de SQLite."""
+        return dict(self._sqlite)
+
+    def firestore_client(self) -> Dict[str, Any]:
+        """Documento clients/{id} de Firestore (sin el menú, que va en config/menu)."""
+        return dict(self._firestore)
+
+    def firestore_listing(self) -> Dict[str, Any]:
+        """Fila del demo en el listado de clientes de Firebase (datos de vitrina con el id de Firestore)."""
+        listing = {k: v for k, v in self._sqlite.items() if k not in ('system_instruction', 'menu_json')}
+        listing['id'] = self.firestore_id
+        listing['phone_number_id'] = self._firestore['phone_number_id']
+        return listing
+
+    def firestore_menu(self) -> Dict[str, Any]:
+        """Copia del menú para clients/{id}/config/menu."""
+        return json.loads(self.menu_json)
+
+
+class DemoRegistry:
+    """Índices de los tenants demo cargados desde `demos.json`."""
+
+    def __init__(self, specs: List[Dict[str, Any]]):
+        self.demos: List[Demo] = [Demo(spec) for spec in specs]
+        self._by_key = {demo.key: demo for demo in self.demos}
+        self._by_sqlite_id = {demo.sqlite_id: demo for demo in self.demos}
+        self._by_client_id = {demo.firestore_id: demo for demo in self.demos}
+        self._by_phone_number_id = {}
+        self._by_mode = {}
+        start_keywords, name_keywords = {}, {}
+        for demo, spec in zip(self.demos, specs):
+            for phone_number_id in (spec['sqlite']['phone_number_id'], spec['firestore']['phone_number_id']):
+                self._by_phone_number_id[phone_number_id.lower()] = demo
+            for mode in [demo.demo_mode] + spec.get('demo_mode_aliases', []):
+                self._by_mode[_fold(mode)] = demo
+            for keyword in spec.get('start_keywords', []):
+                start_keywords[_fold(keyword)] = demo
+            for keyword in spec.get('name_keywords', []):
+                name_keywords[_fold(keyword)] = demo
+
+        self._start_keywords = start_keywords
+        self._start_pattern = _keyword_pattern(list(start_keywords))
+        self._key_pattern = _keyword_pattern(list(self._by_key))
+        self._name_keywords = name_keywords
+        self._name_pattern = _keyword_pattern(list(name_keywords))
+
+    @classmethod
+    def load(cls, path: str = DEMOS_FILE) -> "DemoRegistry":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f)['demos'])
+
+    # ============================================
+    # BÚSQUEDAS O(1)
+    # ============================================
+
+    def by_key(self, key: str) -> Optional[Demo]:
+        return self._by_key.get(key)
+
+    def by_sqlite_id(self, client_id) -> Optional[Demo]:
+        try:
+            return self._by_sqlite_id.get(int(client_id))
+        except (TypeError, ValueError):
+            return None
+
+    def by_client_id(self, client_id: str) -> Optional[Demo]:
+        return self._by_client_id.get(client_id)
+
+    def by_phone_number_id(self, phone_number_id: str) -> Optional[Demo]:
+        return self._by_phone_number_id.get(str(phone_number_id or '').lower())
+
+    def by_mode(self, demo_mode: str) -> Optional[Demo]:
+        """Demo de una sesión ('Restaurante', 'Clínica'/'Clinica', 'Tienda')."""
+        return self._by_mode.get(_fold(demo_mode))
+
+    def sqlite_ids(self) -> List[int]:
+        return list(self._by_sqlite_id)
+
+    def sqlite_clients(self) -> List[Dict[str, Any]]:
+        return [demo.sqlite_client() for demo in self.demos]
+
+    def firestore_listing(self) -> List[Dict[str, Any]]:
+        return [demo.firestore_listing() for demo in self.demos]
+
+    # ============================================
+    # DETECTORES (regex precompiladas)
+    # ============================================
+
+    def match_start_command(self, text: str) -> Optional[Demo]:
+        """
+        Demo pedida con "Quiero probar la demo de ..." (o None si el texto no es ese comando).
+        """
+        folded = _fold(text)
+        if DEMO_START_PHRASE not in folded:
+            return None
+        match = self._start_pattern.search(folded)
+        return self._start_keywords[match.group(0)] if match else None
+
+    def match_client(self, client_id: str = '', phone_number_id: str = '', name: str = '') -> Optional[Demo]:
+        """
+        Identifica la demo de un cliente de Firestore: por phone_number_id exacto,
+        por la clave de la demo dentro del phone_number_id o del id, y por último
+        por palabras clave del nombre.
+        """
+        demo = self.by_client_id(client_id) or self.by_phone_number_id(phone_number_id)
+        if demo:
+            return demo
+        match = self._key_pattern.search(_fold(phone_number_id)) or self._key_pattern.search(_fold(client_id))
+        if match:
+            return self._by_key[match.group(0)]
+        match = self._name_pattern.search(_fold(name))
+        return self._name_keywords[match.group(0)] if match else None
+
+
+# Registro global, cargado una sola vez al importar
+demos = DemoRegistry.load()
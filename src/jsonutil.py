@@ -0,0 +1,54 @@
+"""
+(De)serialización JSON con orjson cuando está instalado.
+
+orjson parsea y serializa varias veces más rápido que el módulo `json` y
+produce bytes UTF-8 directamente (lo que envía la respuesta HTTP). Si no está
+disponible se usa `json` con la misma salida compacta.
+
+`FastJSONResponse` es la clase de respuesta por defecto de las apps FastAPI.
+"""
+
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+HAS_ORJSON = orjson is not None
+
+
+def loads(data) -> Any:
+    """Parsea JSON desde str o bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Serializa a bytes UTF-8 (cuerpo listo para una respuesta HTTP)."""
+    if orjson is not None:
+        # Llaves no-str (ej. ids numéricos) como cadenas, igual que json.dumps
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    """Serializa a str (para columnas TEXT de SQLite)."""
+    return dumps_bytes(obj).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Respuesta JSON serializada con orjson (equivalente a `ORJSONResponse`, pero
+    con respaldo a `json` si orjson no está instalado).
+
+    Devolverla directamente desde una ruta con un payload de tipos JSON nativos
+    también evita el `jsonable_encoder` genérico de FastAPI.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
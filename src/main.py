@@ -3,10 +3,10 @@
 import os
 import json
 import random
-import smtplib
 import hmac
 import hashlib
 import time
+import asyncio
 from email.mime.text import MIMEText
 from datetime import datetime, timedelta
 from fastapi import FastAPI, Request, HTTPException, Depends, status
@@ -14,14 +14,25 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
-from collections import deque, defaultdict
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response
+from collections import defaultdict
 from dotenv import load_dotenv
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 # Local imports
 from . import database
 from .config import Config
+from .jsonutil import FastJSONResponse
+from .auth_cache import Principal, TokenCache
+from . import verification_store
+from .mailer import SMTPMailer, MailQueueFull
+from .models import InboundMessage
+from .schemas import ClientOut, ChatSearchPage
+from .metrics import MetricsRegistry
+from . import tracing
+from .tracing import tracer
+from . import webhook_batch
+from .coalescer import MessageCoalescer
 from .services import whatsapp_service
 from .services.gemini_service import GeminiEngine
 
@@ -41,8 +52,11 @@ WHATSAPP_APP_SECRET = Config.WHATSAPP_APP_SECRET
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/verify-code")
 
-# In-memory storage for 2FA codes (In production use Redis)
-verification_codes = {} # {email: {"code": str, "expiry": datetime}}
+# Códigos 2FA: en SQLite para que request-code y verify-code funcionen entre workers
+if Config.VERIFICATION_CODE_STORE == "memory":
+    verification_codes = verification_store.MemoryVerificationStore(SECRET_KEY)
+else:
+    verification_codes = verification_store.SQLiteVerificationStore(lambda: database.DB_NAME, SECRET_KEY)
 
 # ============================================
 # RATE LIMITING (Simple in-memory implementation)
@@ -90,18 +104,23 @@ class RateLimiter:
 rate_limiter = RateLimiter()
 
 # ============================================
-# MÉTRICAS EN MEMORIA
+# MÉTRICAS (histogramas por etapa + ventanas por cliente)
 # ============================================
-metrics = {
-    'total_messages': 0,
-    'messages_by_client': defaultdict(int),
-    'avg_response_time_ms': 0,
-    'gemini_errors': 0,
-    'whatsapp_errors': 0,
-    'webhook_requests': 0,
-    'rate_limited_requests': 0,
-    'start_time': time.time(),
-}
+metrics = MetricsRegistry(
+    window_seconds=Config.METRICS_WINDOW_SECONDS,
+    window_slots=Config.METRICS_WINDOW_SLOTS,
+    max_tenants=Config.METRICS_MAX_TRACKED_TENANTS,
+)
+
+
+def _record_stage_latency(span):
+    """Alimenta los histogramas por etapa con los spans que declaran `stage`."""
+    stage = span.attributes.get('stage')
+    if stage:
+        metrics.observe(stage, span.duration_ms)
+
+
+tracer.add_listener(_record_stage_latency)
 
 # Paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -116,11 +135,27 @@ print(f"🔒 Rate limiting: {Config.RATE_LIMIT_MESSAGES_PER_MINUTE}/min")
 print(f"📊 Metrics tracking: Enabled")
 print(f"----------------------------------")
 
-app = FastAPI()
+# Respuestas serializadas con orjson (FastJSONResponse) en lugar de json estándar
+app = FastAPI(default_response_class=FastJSONResponse)
 
-# Initialize Database Schema
+# Initialize Database Schema (migraciones pendientes; no-op si ya está al día)
 database.init_db()
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Abre el span raíz de cada request al webhook o la API; el webhook alimenta la etapa 'webhook'."""
+    if not tracing.should_trace(request.url.path):
+        with tracer.suppressed():
+            return await call_next(request)
+    attributes = {'http.method': request.method, 'http.route': request.url.path}
+    if request.method == "POST" and request.url.path == "/webhook":
+        attributes['stage'] = 'webhook'
+    with tracer.span(f"{request.method} {request.url.path}", **attributes) as span:
+        response = await call_next(request)
+        span.set_attribute('http.status_code', response.status_code)
+        response.headers['X-Trace-Id'] = span.trace_id
+        return response
+
 @app.exception_handler(404)
 async def custom_404_handler(request: Request, __):
     print(f"🛑 404 Error: {request.url.path}")
@@ -139,7 +174,14 @@ async def admin_dashboard():
     return FileResponse(os.path.join(ADMIN_DIR, "index.html"))
 
 # Cache for WhatsApp retries
-PROCESSED_MESSAGES = deque(maxlen=100)
+PROCESSED_MESSAGES = webhook_batch.RecentIds(Config.WEBHOOK_DEDUP_CACHE_SIZE)
+
+# Ventana de agrupación de ráfagas por conversación (ahorra llamadas a Gemini)
+coalescer = MessageCoalescer(
+    window_seconds=Config.COALESCE_WINDOW_SECONDS,
+    max_wait_seconds=Config.COALESCE_MAX_WAIT_SECONDS,
+    max_messages=Config.COALESCE_MAX_MESSAGES,
+)
 
 
 # ============================================
@@ -182,12 +224,22 @@ def verify_whatsapp_signature(request: Request, expected_signature: str) -> bool
 # Lazy initialization using app events or on first request to ensure DB is ready
 @app.on_event("startup")
 async def startup_event():
-    if not os.environ.get('K_SERVICE'):
-        database.init_db()
-
+    # El esquema ya se migró al importar el módulo (database.init_db arriba)
     global gemini
     gemini = GeminiEngine(api_key=GEMINI_API_KEY)
 
+    # Persistir rollups de métricas en SQLite (agregables entre workers)
+    metrics.start_rollup_thread(database.save_metrics_rollup, Config.METRICS_ROLLUP_INTERVAL_SECONDS)
+
+    # Serverless: respaldar el overlay de escrituras para sobrevivir a la instancia
+    if database.overlay is not None:
+        database.overlay.start_snapshot_thread(Config.DB_SNAPSHOT_INTERVAL_SECONDS)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if database.overlay is not None:
+        database.overlay.snapshot()
+
 @app.get("/webhook")
 async def verify_webhook(request: Request):
     token = request.query_params.get(Config.WEBHOOK_VERIFY_TOKEN_PARAM)
@@ -198,8 +250,7 @@ async def verify_webhook(request: Request):
 
 @app.post("/webhook")
 async def recibir_mensaje(request: Request):
-    start_time = time.time()
-    metrics['webhook_requests'] += 1
+    metrics.incr('webhook_requests')
     
     # ============================================
     # SEGURIDAD: Validar firma en producción
@@ -219,119 +270,253 @@ async def recibir_mensaje(request: Request):
         Config.RATE_LIMIT_MESSAGES_PER_MINUTE, 
         60
     ):
-        metrics['rate_limited_requests'] += 1
+        metrics.incr('rate_limited_requests')
         print(f"⚠️ Rate limit excedido para IP: {client_ip}")
         return {"status": "rate_limited"}, 429
     
     try:
         data = await request.json()
+    except Exception as e:
+        print(f"{tracer.log_prefix()}🔥 Error en Webhook: {e}")
+        return {"status": "ok"}
 
-        entry = data.get('entry', [{}])[0]
-        changes = entry.get('changes', [{}])[0]
-        value = changes.get('value', {})
-
-        if 'messages' in value:
-            message = value['messages'][0]
-            message_id = message.get('id')
-
-            if message_id in PROCESSED_MESSAGES:
-                return {"status": "already_processed"}
-
-            PROCESSED_MESSAGES.append(message_id)
-
-            numero_usuario = message['from']
-            texto_usuario = message.get('text', {}).get('body', "")
-            texto_menu = ""  # Default to empty string to avoid NameError
-            phone_number_id = value['metadata']['phone_number_id']
-
-            # Mexico normalization
-            if numero_usuario.startswith("521"):
-                numero_usuario = numero_usuario.replace("521", "52", 1)
-
-            # ============================================
-            # PRIVACIDAD: Logs sanitizados
-            # ============================================
-            phone_sanitized = database.sanitize_phone(numero_usuario)
-            message_preview = database.sanitize_message_preview(texto_usuario)
-            print(f"📩 Mensaje de {phone_sanitized} para {phone_number_id}: {message_preview}")
-
-            # 2. Get client data from DB
-            client_data = database.get_client_by_phone_id(phone_number_id)
-
-            if not client_data:
-                print(f"⚠️ Negocio no registrado: {phone_number_id}")
-                return {"status": "unrecognized_client"}
-
-            # ============================================
-            # MONETIZACIÓN: Verificar límite de mensajes
-            # ============================================
-            client_plan = client_data.get('plan', 'free')
-            allowed, limit_msg = database.check_message_limit(client_data['id'], client_plan)
-            if not allowed:
-                print(f"⚠️ Límite excedido para cliente {client_data['id']}: {limit_msg}")
-                # Enviar mensaje de límite alcanzado
-                whatsapp_service.enviar_mensaje_whatsapp(
-                    numero=numero_usuario,
-                    texto=f"⚠️ Has alcanzado tu límite de mensajes este mes ({limit_msg}). Por favor contacta a soporte para actualizar tu plan.",
-                    whatsapp_token=client_data['whatsapp_token'],
-                    phone_number_id=client_data['phone_number_id']
-                )
-                return {"status": "limit_exceeded"}
-
-            # 3. Process with Gemini (con caché e historial)
-            respuesta_ai = gemini.generar_respuesta(
-                texto_usuario, 
-                client_data, 
-                numero_usuario,
-                usar_historial=True  # Usar historial de conversación
-            )
+    # ============================================
+    # FAN-OUT: todos los entry/changes/messages/statuses del payload
+    # ============================================
+    events, statuses = webhook_batch.extract_events(data)
 
-            # 4. Send via WhatsApp
-            send_success = whatsapp_service.enviar_mensaje_whatsapp(
-                numero=numero_usuario,
-                texto=respuesta_ai,
-                whatsapp_token=client_data['whatsapp_token'],
-                phone_number_id=client_data['phone_number_id']
-            )
-            
-            if not send_success:
-                metrics['whatsapp_errors'] += 1
-                print(f"❌ Error enviando WhatsApp a {phone_sanitized}")
-            else:
-                print(f"✅ Respuesta enviada con éxito a {phone_sanitized}")
-
-            # ============================================
-            # TRACKING: Registrar mensaje para métricas
-            # ============================================
-            database.track_message(
-                client_id=client_data['id'],
-                direction="outbound",
-                phone_number=numero_usuario
-            )
+    if statuses:
+        procesar_estados(statuses)
+
+    events, duplicates = webhook_batch.dedupe_messages(events, PROCESSED_MESSAGES)
+    if duplicates:
+        metrics.incr('duplicate_messages', duplicates)
+    if not events:
+        return {"status": "already_processed" if duplicates else "ok", "statuses": len(statuses)}
+
+    absorbed = webhook_batch.coalesce_events(events, coalescer)
+    if absorbed:
+        metrics.incr('llm_calls_saved', absorbed)
+
+    memo = webhook_batch.BatchMemo()
+    results = await webhook_batch.fan_out(
+        events,
+        lambda event: procesar_mensaje(event, memo),
+        max_concurrency=Config.WEBHOOK_MAX_CONCURRENCY,
+        on_error=_error_en_mensaje,
+    )
+    metrics.incr('webhook_batch_messages', len(events))
+
+    return {"status": "ok", "messages": len(events), "statuses": len(statuses), "results": results}
+
+
+def _error_en_mensaje(event: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+    metrics.incr('gemini_errors')
+    print(f"{tracer.log_prefix()}🔥 Error en Webhook: {error}")
+    return {"status": "error"}
+
+
+def procesar_estados(statuses: list):
+    """Registra en bloque las actualizaciones de estado (sent/delivered/read/failed)."""
+    counts, failed = webhook_batch.summarize_statuses(statuses)
+    for state, count in counts.items():
+        metrics.incr(f'whatsapp_status_{state}', count)
+    for item in failed:
+        metrics.incr('whatsapp_errors')
+        print(f"{tracer.log_prefix()}❌ Entrega fallida {item['message_id']} ({item['phone_number_id']}): "
+              f"{item['error_code']} {item['error_title']}")
+
+
+def procesar_mensaje(event: Dict[str, Any], memo: webhook_batch.BatchMemo) -> Dict[str, Any]:
+    """
+    Procesa un mensaje entrante del webhook.
+
+    Si el mensaje se sumó a una ráfaga abierta de la misma conversación, no se
+    procesa aquí: el líder de la ráfaga responde a todos los textos juntos.
+
+    Args:
+        event: Evento de `webhook_batch.extract_events`
+        memo: Memo de lookups del payload
+
+    Returns:
+        Dict con el `status` del procesamiento
+    """
+    if event.get('coalesced'):
+        return {"status": "coalesced"}
+    with webhook_batch.merged_event(event, coalescer) as merged:
+        return _procesar_mensaje(merged, memo)
+
+
+def _procesar_mensaje(event: Dict[str, Any], memo: webhook_batch.BatchMemo) -> Dict[str, Any]:
+    """
+    Lookups por cliente (datos del cliente y límite del plan) compartidos entre
+    los mensajes del mismo payload mediante `memo`.
+    """
+    message = event['message']
+    phone_number_id = event['phone_number_id']
+
+    inbound = InboundMessage.from_webhook(message)
+    numero_usuario = inbound.sender
+    texto_usuario = inbound.text
+
+    # Mexico normalization
+    if numero_usuario.startswith("521"):
+        numero_usuario = numero_usuario.replace("521", "52", 1)
+
+    # ============================================
+    # PRIVACIDAD: Logs sanitizados
+    # ============================================
+    phone_sanitized = database.sanitize_phone(numero_usuario)
+    message_preview = database.sanitize_message_preview(texto_usuario)
+    print(f"{tracer.log_prefix()}📩 Mensaje de {phone_sanitized} para {phone_number_id}: {message_preview}")
+
+    # 2. Get client data from DB (una vez por cliente y payload)
+    def _load_client():
+        with tracer.span('tenant.lookup', stage='db', phone_number_id=phone_number_id):
+            return database.get_client_by_phone_id(phone_number_id)
+
+    client_data = memo.get(('client', phone_number_id), _load_client)
+
+    if not client_data:
+        print(f"{tracer.log_prefix()}⚠️ Negocio no registrado: {phone_number_id}")
+        return {"status": "unrecognized_client"}
+
+    # ============================================
+    # MONETIZACIÓN: Verificar límite de mensajes
+    # ============================================
+    client_plan = client_data.get('plan', 'free')
+
+    def _check_limit():
+        with tracer.span('limit.check', stage='db', client_id=client_data['id']):
+            return database.check_message_limit(client_data['id'], client_plan)
+
+    allowed, limit_msg = memo.get(('limit', client_data['id']), _check_limit)
+    if not allowed:
+        print(f"{tracer.log_prefix()}⚠️ Límite excedido para cliente {client_data['id']}: {limit_msg}")
+        # Enviar mensaje de límite alcanzado
+        whatsapp_service.enviar_mensaje_whatsapp(
+            numero=numero_usuario,
+            texto=f"⚠️ Has alcanzado tu límite de mensajes este mes ({limit_msg}). Por favor contacta a soporte para actualizar tu plan.",
+            whatsapp_token=client_data['whatsapp_token'],
+            phone_number_id=client_data['phone_number_id']
+        )
+        return {"status": "limit_exceeded"}
+
+    # 3. Process with Gemini (con caché e historial)
+    with tracer.span('gemini', stage='gemini', client_id=client_data['id']):
+        respuesta_ai = gemini.generar_respuesta(
+            texto_usuario, 
+            client_data, 
+            numero_usuario,
+            usar_historial=True  # Usar historial de conversación
+        )
+
+    # 4. Send via WhatsApp
+    with tracer.span('whatsapp.send', stage='whatsapp'):
+        send_success = whatsapp_service.enviar_mensaje_whatsapp(
+            numero=numero_usuario,
+            texto=respuesta_ai,
+            whatsapp_token=client_data['whatsapp_token'],
+            phone_number_id=client_data['phone_number_id']
+        )
+    
+    if not send_success:
+        metrics.incr('whatsapp_errors')
+        print(f"{tracer.log_prefix()}❌ Error enviando WhatsApp a {phone_sanitized}")
+    else:
+        print(f"{tracer.log_prefix()}✅ Respuesta enviada con éxito a {phone_sanitized}")
+
+    # ============================================
+    # TRACKING: Registrar mensaje para métricas
+    # ============================================
+    inbound_count = event.get('merged', 1)  # Mensajes de la ráfaga respondidos juntos
+    with tracer.span('usage.track', stage='db'):
+        database.track_message(
+            client_id=client_data['id'],
+            direction="outbound",
+            phone_number=numero_usuario
+        )
+        for _ in range(inbound_count):
             database.track_message(
                 client_id=client_data['id'],
                 direction="inbound",
                 phone_number=numero_usuario
             )
-            
-            # ============================================
-            # MÉTRICAS: Actualizar estadísticas
-            # ============================================
-            metrics['total_messages'] += 1
-            metrics['messages_by_client'][client_data['id']] += 1
-            
-            response_time_ms = (time.time() - start_time) * 1000
-            # Promedio móvil exponencial
-            metrics['avg_response_time_ms'] = (
-                metrics['avg_response_time_ms'] * 0.9 + response_time_ms * 0.1
-            )
+    
+    # ============================================
+    # MÉTRICAS: Actualizar estadísticas
+    # ============================================
+    metrics.incr('total_messages', inbound_count)
+    metrics.incr_tenant(client_data['id'], inbound_count)
+    return {"status": "sent" if send_success else "send_failed", "merged": inbound_count}
 
-    except Exception as e:
-        metrics['gemini_errors'] += 1
-        print(f"🔥 Error en Webhook: {e}")
 
-    return {"status": "ok"}
+# ============================================
+# SEGURIDAD: Helpers
+# ============================================
 
+def create_access_token(data: dict, expires_delta: timedelta = None):
+    print(f"🔑 Generating access token for: {data.get('sub')}")
+    to_encode = data.copy()
+    expire = datetime.utcnow() + (expires_delta or timedelta(hours=8))
+    to_encode.update({"exp": expire})
+    token = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    print(f"DEBUG: Token generated. Secret Key length: {len(SECRET_KEY)}")
+    return token
+
+# Tokens verificados -> Principal (una carga del panel hace 5-10 llamadas con el mismo token)
+token_cache = TokenCache()
+
+def _decode_token(token: str) -> Dict[str, Any]:
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+def _build_principal(payload: Dict[str, Any]) -> Principal:
+    email: str = payload.get("sub")
+    if email is None:
+        print("❌ Token payload missing 'sub'")
+        raise HTTPException(status_code=401, detail="Invalid token")
+    print(f"✅ Token decoded successfully for: {email}")
+    role = "admin" if email == ADMIN_EMAIL else "client"
+    return Principal(email, role, payload.get("client_id"))
+
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    """Usuario del token; la verificación JWT se hace una vez por token (ver TokenCache)."""
+    try:
+        return token_cache.resolve(token, _decode_token, _build_principal)
+    except JWTError as e:
+        print(f"❌ JWT Error: {e}")
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+async def get_current_user(principal: Principal = Depends(get_current_principal)):
+    return principal.email
+
+def _on_email_error(msg, error):
+    print(f"❌ Error enviando email a {msg['To']}: {error}")
+
+# Emails salientes: un hilo con la conexión SMTP autenticada (STARTTLS en 587) reutilizable
+mailer = SMTPMailer(Config.SMTP_HOST, Config.SMTP_PORT, ADMIN_EMAIL, EMAIL_PASSWORD, on_error=_on_email_error)
+
+def send_security_code(email: str, code: str):
+    """
+    Encola el email con el código (no bloquea el event loop).
+
+    Returns:
+        Future de la entrega, o None si no se pudo encolar
+    """
+    if not EMAIL_PASSWORD:
+        print("❌ ERROR: EMAIL_APP_PASSWORD no configurada en .env")
+        return None
+    
+    print(f"📧 Encolando email para {email}...")
+    msg = MIMEText(f"Tu código de acceso para Zotek Admin es: {code}\nExpira en 10 minutos.")
+    msg['Subject'] = f"{code} es tu código de verificación de Zotek"
+    msg['From'] = ADMIN_EMAIL
+    msg['To'] = email
+    try:
+        return mailer.submit(msg)
+    except MailQueueFull as e:
+        print(f"❌ {e}")
+        return None
 
 # ============================================
 # MÉTRICAS ENDPOINT
@@ -343,27 +528,74 @@ async def get_metrics(current_user: str = Depends(get_current_user)):
     
     Incluye:
     - Total de mensajes
-    - Tiempo promedio de respuesta
+    - Latencias p50/p95/p99 por etapa (webhook, db, gemini, whatsapp)
     - Errores de Gemini y WhatsApp
-    - Estadísticas por cliente
+    - Mensajes por cliente en la ventana de METRICS_WINDOW_SECONDS
+    - Contadores persistidos por todos los workers en la misma ventana
+    - Ráfagas agrupadas y llamadas a Gemini ahorradas
+    - Snapshot de tenants en memoria (versión, tamaño, latencia de recarga)
+    - Overlay SQLite en serverless (arranque y snapshots)
     """
-    uptime_seconds = time.time() - metrics['start_time']
+    uptime_seconds = metrics.uptime_seconds()
+    latency = metrics.latency_summary()
     
     # Obtener estadísticas globales de la BD
     db_stats = database.get_message_stats()
     
-    return {
+    # Payload de tipos nativos: se serializa directo, sin jsonable_encoder
+    return FastJSONResponse({
         'uptime_seconds': round(uptime_seconds, 2),
         'uptime_human': f"{uptime_seconds / 3600:.2f} horas",
-        'total_messages': metrics['total_messages'],
-        'avg_response_time_ms': round(metrics['avg_response_time_ms'], 2),
-        'gemini_errors': metrics['gemini_errors'],
-        'whatsapp_errors': metrics['whatsapp_errors'],
-        'webhook_requests': metrics['webhook_requests'],
-        'rate_limited_requests': metrics['rate_limited_requests'],
+        'worker_id': metrics.worker_id,
+        'total_messages': metrics.get('total_messages'),
+        'avg_response_time_ms': latency['webhook']['mean'],
+        'latency_ms': latency,
+        'gemini_errors': metrics.get('gemini_errors'),
+        'whatsapp_errors': metrics.get('whatsapp_errors'),
+        'webhook_requests': metrics.get('webhook_requests'),
+        'rate_limited_requests': metrics.get('rate_limited_requests'),
+        'coalescing': coalescer.stats(),
         'db_stats': db_stats,
-        'messages_by_client': dict(metrics['messages_by_client']),
-    }
+        'window_seconds': metrics.window_seconds,
+        'messages_by_client': metrics.tenant_counts(),
+        'all_workers': database.get_metrics_rollup_totals(metrics.window_seconds),
+        'tenants': database.tenants.stats(),
+        'sqlite_overlay': database.overlay.stats() if database.overlay is not None else None,
+    })
+
+
+@app.get("/metrics")
+async def prometheus_metrics(request: Request):
+    """Exposición de métricas en formato de texto de Prometheus."""
+    if Config.IS_PRODUCTION and not Config.METRICS_SCRAPE_TOKEN:
+        # En producción solo se expone si hay token de scrape configurado
+        raise HTTPException(status_code=404, detail="Not found")
+    if Config.METRICS_SCRAPE_TOKEN:
+        auth = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(auth, f"Bearer {Config.METRICS_SCRAPE_TOKEN}"):
+            raise HTTPException(status_code=401, detail="Invalid token")
+    tenant_stats = database.tenants.stats()
+    gauges = {}
+    if tenant_stats['loaded']:
+        gauges = {
+            'tenant_snapshot_tenants': tenant_stats['tenants'],
+            'tenant_snapshot_bytes': tenant_stats['size_bytes'],
+            'tenant_snapshot_refresh_ms': tenant_stats['refresh_ms'],
+            'tenant_snapshot_age_seconds': tenant_stats['age_seconds'],
+        }
+    return PlainTextResponse(metrics.render_prometheus(gauges=gauges), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/debug/traces")
+async def get_debug_traces(limit: int = 20, route: str = "POST /webhook", current_user: str = Depends(get_current_user)):
+    """
+    Lista las trazas más lentas entre las recientes del proceso.
+    
+    Args:
+        limit: Cantidad máxima de trazas
+        route: Prefijo del span raíz (por defecto solo webhooks)
+    """
+    return {'traces': tracer.collector.slowest(limit=limit, name_prefix=route)}
 
 
 @app.get("/api/metrics/usage")
@@ -381,7 +613,7 @@ async def get_usage_metrics(client_id: int = None, current_user: str = Depends(g
         
         plan = client_data.get('plan', 'free')
         monthly_count = database.get_monthly_message_count(client_id)
-        allowed, message = database.check_message_limit(client_id, plan)
+        allowed, message = database.evaluate_message_limit(monthly_count, plan)
         
         return {
             'client_id': client_id,
@@ -392,80 +624,9 @@ async def get_usage_metrics(client_id: int = None, current_user: str = Depends(g
             'message': message,
         }
     else:
-        # Estadísticas de todos los clientes
-        clients = database.list_clients()
-        usage_data = []
-        
-        for client in clients:
-            monthly_count = database.get_monthly_message_count(client['id'])
-            plan = client.get('plan', 'free')
-            allowed, message = database.check_message_limit(client['id'], plan)
-            
-            usage_data.append({
-                'client_id': client['id'],
-                'client_name': client.get('name'),
-                'plan': plan,
-                'monthly_messages': monthly_count,
-                'limit_allowed': allowed,
-            })
-        
-        return {'clients': usage_data}
-
-
-# ============================================
-# SEGURIDAD: Helpers
-# ============================================
-
-def create_access_token(data: dict, expires_delta: timedelta = None):
-    print(f"🔑 Generating access token for: {data.get('sub')}")
-    to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(hours=8))
-    to_encode.update({"exp": expire})
-    token = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    print(f"DEBUG: Token generated. Secret Key length: {len(SECRET_KEY)}")
-    return token
+        # Estadísticas de todos los clientes (una sola consulta agrupada)
+        return FastJSONResponse({'clients': database.get_usage_summary()})
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    print(f"🕵️ Validating token: {token[:10]}...{token[-10:] if len(token) > 20 else ''}")
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        print(f"✅ Token decoded successfully for: {email}")
-        if email is None:
-            print("❌ Token payload missing 'sub'")
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return email
-    except JWTError as e:
-        print(f"❌ JWT Error: {e}")
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-def send_security_code(email: str, code: str):
-    if not EMAIL_PASSWORD:
-        print("❌ ERROR: EMAIL_APP_PASSWORD no configurada en .env")
-        return False
-    
-    print(f"📧 Intentando enviar email a {email}...")
-    print(f"DEBUG: Enviando desde {ADMIN_EMAIL} (Pass length: {len(EMAIL_PASSWORD) if EMAIL_PASSWORD else 0})")
-    
-    try:
-        import smtplib
-        msg = MIMEText(f"Tu código de acceso para Zotek Admin es: {code}\nExpira en 10 minutos.")
-        msg['Subject'] = f"{code} es tu código de verificación de Zotek"
-        msg['From'] = ADMIN_EMAIL
-        msg['To'] = email
-
-        # Using SMTP with STARTTLS on 587 (Often more reliable for Gmail)
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.set_debuglevel(1) # Extra verbosity in logs
-            server.starttls()
-            server.login(ADMIN_EMAIL, EMAIL_PASSWORD)
-            server.send_message(msg)
-        return True
-    except Exception as e:
-        import traceback
-        print(f"❌ Error enviando email: {e}")
-        traceback.print_exc()
-        return False
 
 # --- Routes ---
 
@@ -490,63 +651,58 @@ async def request_code(request: Request):
         return JSONResponse(status_code=403, content={"detail": "Acceso restringido"})
     
     code = f"{random.randint(100000, 999999)}"
-    verification_codes[email] = {
-        "code": code,
-        "expiry": datetime.utcnow() + timedelta(minutes=10)
-    }
+    if not verification_codes.issue(email, code):
+        raise HTTPException(status_code=429, detail="Espera antes de pedir otro código")
     
-    if send_security_code(email, code):
-        return {"status": "code_sent"}
-    else:
-        raise HTTPException(status_code=500, detail="Error enviando el código")
+    delivery = send_security_code(email, code)
+    if delivery is None:
+        verification_codes.discard(email)
+        raise HTTPException(status_code=503, detail="Error enviando el código")
+    
+    # Responder ya; si la entrega falla se descarta el código para poder pedir otro
+    delivery.add_done_callback(lambda f: (f.cancelled() or f.exception()) and verification_codes.discard(email))
+    return {"status": "code_sent"}
 
 @app.post("/api/auth/verify-code")
 async def verify_code(request: Request):
     data = await request.json()
     email = data.get("email")
     code = data.get("code")
-    print(f"📩 Login attempt: Email={email}, Code={code}")
+    print(f"📩 Login attempt: Email={email}")
     
-    stored = verification_codes.get(email)
-    if not stored:
-        print(f"❌ No code found in memory for {email}")
-        raise HTTPException(status_code=401, detail="Código inválido o expirado")
-        
-    if stored["code"] != code:
-        print(f"❌ Code mismatch: expected {stored['code']}, got {code}")
-        raise HTTPException(status_code=401, detail="Código inválido o expirado")
-        
-    if datetime.utcnow() > stored["expiry"]:
-        print(f"❌ Code expired for {email}")
+    # Verifica en tiempo constante y consume el código (un solo uso)
+    result = verification_codes.verify(email, code)
+    if result == verification_store.LOCKED:
+        print(f"❌ Too many attempts for {email}")
+        raise HTTPException(status_code=429, detail=f"Demasiados intentos. Intenta de nuevo en {verification_codes.ttl_seconds // 60} minutos")
+    if result != verification_store.VERIFIED:
+        print(f"❌ Code {result} for {email}")
         raise HTTPException(status_code=401, detail="Código inválido o expirado")
     
     print(f"✅ Code verified for {email}")
-    # Clean up code
-    del verification_codes[email]
     
     access_token = create_access_token(data={"sub": email})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/api/me")
-async def get_me(current_user: str = Depends(get_current_user)):
-    print(f"👤 GET /api/me called for: {current_user}")
+async def get_me(principal: Principal = Depends(get_current_principal)):
     return {
-        "email": current_user,
-        "role": "admin" if current_user == ADMIN_EMAIL else "client"
+        "email": principal.email,
+        "role": principal.role
     }
 
 # --- Protected Admin API ---
 
-@app.get("/api/clients")
+@app.get("/api/clients", response_model=List[ClientOut], response_model_exclude_unset=True)
 async def list_clients(current_user: str = Depends(get_current_user)):
     return database.list_clients()
 
 @app.post("/api/clients")
 async def create_client(request: Request, current_user: str = Depends(get_current_user)):
     data = await request.json()
-    # Map 'menu' from frontend to 'menu_json' in DB
+    # Map 'menu' from frontend to 'menu_json' in DB (database serializa y versiona el menú)
     if 'menu' in data:
-        data['menu_json'] = json.dumps(data.pop('menu'))
+        data['menu_json'] = data.pop('menu')
         
     if database.add_client(data):
         return {"status": "created"}
@@ -555,9 +711,9 @@ async def create_client(request: Request, current_user: str = Depends(get_curren
 @app.put("/api/clients/{client_id}")
 async def update_client(client_id: int, request: Request, current_user: str = Depends(get_current_user)):
     data = await request.json()
-    # Map 'menu' from frontend to 'menu_json' in DB
+    # Map 'menu' from frontend to 'menu_json' in DB (database serializa y versiona el menú)
     if 'menu' in data:
-        data['menu_json'] = json.dumps(data.pop('menu'))
+        data['menu_json'] = data.pop('menu')
         
     if database.update_client(client_id, data):
         return {"status": "updated"}
@@ -565,17 +721,11 @@ async def update_client(client_id: int, request: Request, current_user: str = De
 
 @app.get("/api/clients/{client_id}/menu")
 async def get_client_menu(client_id: int, current_user: str = Depends(get_current_user)):
-    client = database.get_client_by_id(client_id)
-    if not client:
+    # Cuerpo ya serializado desde el caché de menús (sin json.loads/dumps por petición)
+    body = database.get_client_menu_bytes(client_id)
+    if body is None:
         raise HTTPException(status_code=404, detail="Client not found")
-        
-    menu_data = client.get("menu_json")
-    if menu_data:
-        try:
-            return json.loads(menu_data)
-        except:
-            return {"options": []}
-    return {"options": []}
+    return Response(content=body, media_type="application/json")
 
 @app.post("/api/clients/{client_id}/reset")
 async def reset_client(client_id: int, current_user: str = Depends(get_current_user)):
@@ -584,17 +734,60 @@ async def reset_client(client_id: int, current_user: str = Depends(get_current_u
         return {"status": "reset_successful"}
     raise HTTPException(status_code=400, detail="Error resetting client")
 
-@app.get("/api/clients/{client_id}")
+@app.get("/api/clients/{client_id}", response_model=ClientOut, response_model_exclude_unset=True)
 async def get_client(client_id: int, current_user: str = Depends(get_current_user)):
     client = database.get_client_by_id(client_id)
     if client:
-        return client
+        return client.as_dict()
     raise HTTPException(status_code=404, detail="Client not found")
 
 @app.get("/api/clients/{client_id}/documents")
 async def list_documents(client_id: int, current_user: str = Depends(get_current_user)):
     return database.list_client_documents(client_id)
 
+@app.get("/api/clients/{client_id}/chats/search", response_model=ChatSearchPage)
+async def search_chats(
+    client_id: int,
+    q: str,
+    page: int = 1,
+    page_size: int = 20,
+    user_number: str = None,
+    since: str = None,
+    until: str = None,
+    order: str = "relevance",
+    current_user: str = Depends(get_current_user),
+):
+    """
+    Búsqueda de texto completo en el historial de chats del cliente.
+
+    Args:
+        q: Texto a buscar (ej. "ortodoncia")
+        page / page_size: Paginación (page_size máx. 100)
+        user_number: Filtrar por número del usuario
+        since / until: Rango de fechas (YYYY-MM-DD)
+        order: 'relevance' o 'recent'
+
+    Returns:
+        Resultados con `snippet` resaltado (<mark>), total y has_more
+    """
+    if order not in ("relevance", "recent"):
+        raise HTTPException(status_code=400, detail="order debe ser 'relevance' o 'recent'")
+    return await asyncio.to_thread(
+        database.search_conversation_history,
+        client_id, q, page, page_size, user_number, since, until, order
+    )
+
+@app.get("/api/clients/{client_id}/knowledge/usage")
+async def get_knowledge_usage(client_id: int, current_user: str = Depends(get_current_user)):
+    """Bytes de conocimiento usados contra la cuota del plan."""
+    return database.get_knowledge_usage(client_id)
+
+@app.post("/api/clients/{client_id}/knowledge/compact")
+async def compact_knowledge(client_id: int, current_user: str = Depends(get_current_user)):
+    """Compacta el conocimiento del cliente y reporta los bytes ahorrados."""
+    result = await asyncio.to_thread(database.compact_client_knowledge, client_id)
+    return {"status": "compacted", **result, "usage": database.get_knowledge_usage(client_id)}
+
 @app.get("/api/settings")
 async def get_settings(request: Request, current_user: str = Depends(get_current_user)):
     """Returns public system configuration for the Settings panel."""
@@ -0,0 +1,305 @@
+"""
+Métricas del sistema para Zotek Soluciones IA SaaS.
+
+Incluye:
+- Histogramas de latencia estilo HDR (p50/p95/p99) por etapa (db, gemini, whatsapp)
+- Contadores por cliente en ventanas deslizantes de tamaño fijo
+- Exposición en formato de texto de Prometheus
+- Rollups periódicos para persistir en SQLite (compartidos entre workers)
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class LatencyHistogram:
+    """
+    Histograma de latencias con buckets log-lineales de tamaño fijo (estilo HDR).
+
+    Los valores se registran en microsegundos. Los primeros 64 µs son exactos y
+    a partir de ahí cada potencia de 2 se divide en 32 sub-buckets, lo que da un
+    error relativo máximo de ~3% con memoria constante (~900 enteros).
+    """
+
+    SUB_BITS = 6
+    LINEAR = 1 << SUB_BITS          # 64 buckets exactos
+    HALF = LINEAR >> 1              # 32 sub-buckets por octava
+    MAX_BITS = 32                   # hasta ~71 minutos en µs
+
+    def __init__(self):
+        self.counts = [0] * (self.LINEAR + self.HALF * (self.MAX_BITS - self.SUB_BITS))
+        self.count = 0
+        self.sum_us = 0
+        self.max_us = 0
+
+    def _index(self, value_us: int) -> int:
+        if value_us < self.LINEAR:
+            return value_us
+        exponent = min(value_us.bit_length(), self.MAX_BITS) - self.SUB_BITS
+        mantissa = min(value_us >> exponent, self.LINEAR - 1)
+        return self.LINEAR + (exponent - 1) * self.HALF + (mantissa - self.HALF)
+
+    def _bucket_midpoint(self, index: int) -> float:
+        if index < self.LINEAR:
+            return float(index)
+        exponent = (index - self.LINEAR) // self.HALF + 1
+        mantissa = (index - self.LINEAR) % self.HALF + self.HALF
+        low = mantissa << exponent
+        return low + ((1 << exponent) - 1) / 2
+
+    def record(self, value_ms: float):
+        """Registra una latencia en milisegundos."""
+        value_us = max(0, int(value_ms * 1000))
+        self.counts[self._index(value_us)] += 1
+        self.count += 1
+        self.sum_us += value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def percentile(self, p: float) -> float:
+        """
+        Calcula un percentil aproximado.
+
+        Args:
+            p: Percentil entre 0 y 100
+
+        Returns:
+            Latencia en milisegundos (0 si no hay datos)
+        """
+        if not self.count:
+            return 0.0
+        target = max(1, int(self.count * p / 100 + 0.999999))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(self._bucket_midpoint(index), self.max_us) / 1000
+        return self.max_us / 1000
+
+    def mean(self) -> float:
+        """Latencia promedio en milisegundos."""
+        return (self.sum_us / self.count) / 1000 if self.count else 0.0
+
+    def summary(self) -> Dict[str, float]:
+        """Resumen con count, mean, p50, p95, p99 y max (ms)."""
+        return {
+            'count': self.count,
+            'mean': round(self.mean(), 2),
+            'p50': round(self.percentile(50), 2),
+            'p95': round(self.percentile(95), 2),
+            'p99': round(self.percentile(99), 2),
+            'max': round(self.max_us / 1000, 2),
+        }
+
+
+class RollingCounter:
+    """
+    Contador en ventana deslizante con un anillo de slots de tamaño fijo.
+
+    La ventana se divide en `slots` intervalos; los slots vencidos se
+    reutilizan en lugar de acumular timestamps, así la memoria no crece
+    con el tráfico.
+    """
+
+    __slots__ = ('slot_seconds', 'slots', 'counts', 'epochs')
+
+    def __init__(self, window_seconds: int, slots: int):
+        self.slot_seconds = max(1, window_seconds // slots)
+        self.slots = slots
+        self.counts = [0] * slots
+        self.epochs = [-1] * slots
+
+    def add(self, amount: int = 1, now: float = None):
+        epoch = int((now or time.time()) // self.slot_seconds)
+        index = epoch % self.slots
+        if self.epochs[index] != epoch:
+            self.epochs[index] = epoch
+            self.counts[index] = 0
+        self.counts[index] += amount
+
+    def total(self, now: float = None) -> int:
+        current = int((now or time.time()) // self.slot_seconds)
+        oldest = current - self.slots + 1
+        return sum(c for c, e in zip(self.counts, self.epochs) if e >= oldest)
+
+
+class MetricsRegistry:
+    """Registro de métricas del proceso (contadores, latencias y uso por cliente)."""
+
+    STAGES = ('webhook', 'db', 'gemini', 'whatsapp')
+
+    def __init__(self, window_seconds: int = 3600, window_slots: int = 60, max_tenants: int = 10000):
+        self.window_seconds = window_seconds
+        self.window_slots = window_slots
+        self.max_tenants = max_tenants
+        self.start_time = time.time()
+        self.worker_id = f"{os.uname().nodename if hasattr(os, 'uname') else 'local'}:{os.getpid()}"
+
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+        self.latency: Dict[str, LatencyHistogram] = {s: LatencyHistogram() for s in self.STAGES}
+        self.tenants: Dict[Any, RollingCounter] = {}
+
+        # Acumulado desde el último rollup persistido
+        self._interval_latency: Dict[str, LatencyHistogram] = {s: LatencyHistogram() for s in self.STAGES}
+        self._interval_counters: Dict[str, int] = {}
+        self._interval_start = time.time()
+
+    # ---------- Registro ----------
+
+    def incr(self, name: str, amount: int = 1):
+        """Incrementa un contador del proceso."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+            self._interval_counters[name] = self._interval_counters.get(name, 0) + amount
+
+    def observe(self, stage: str, value_ms: float):
+        """Registra la latencia de una etapa en milisegundos."""
+        with self._lock:
+            if stage not in self.latency:
+                self.latency[stage] = LatencyHistogram()
+                self._interval_latency[stage] = LatencyHistogram()
+            self.latency[stage].record(value_ms)
+            self._interval_latency[stage].record(value_ms)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Context manager que mide la duración de un bloque y la registra en `stage`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - start) * 1000)
+
+    def incr_tenant(self, client_id: Any, amount: int = 1):
+        """Cuenta mensajes de un cliente en la ventana deslizante."""
+        with self._lock:
+            counter = self.tenants.get(client_id)
+            if counter is None:
+                if len(self.tenants) >= self.max_tenants:
+                    self._prune_tenants()
+                counter = self.tenants[client_id] = RollingCounter(self.window_seconds, self.window_slots)
+            counter.add(amount)
+
+    def _prune_tenants(self):
+        """Elimina clientes sin actividad en la ventana (llamar con el lock tomado)."""
+        now = time.time()
+        for client_id in [k for k, c in self.tenants.items() if c.total(now) == 0]:
+            del self.tenants[client_id]
+
+    # ---------- Lectura ----------
+
+    def get(self, name: str) -> int:
+        return self.counters.get(name, 0)
+
+    def tenant_counts(self) -> Dict[Any, int]:
+        """Mensajes por cliente dentro de la ventana actual."""
+        now = time.time()
+        with self._lock:
+            self._prune_tenants()
+            return {client_id: c.total(now) for client_id, c in self.tenants.items()}
+
+    def latency_summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {stage: h.summary() for stage, h in self.latency.items()}
+
+    def uptime_seconds(self) -> float:
+        return time.time() - self.start_time
+
+    # ---------- Exportación ----------
+
+    def render_prometheus(self, prefix: str = "zotek", gauges: Optional[Dict[str, float]] = None) -> str:
+        """
+        Genera la exposición en formato de texto de Prometheus (v0.0.4).
+
+        Args:
+            prefix: Prefijo de los nombres de métricas
+            gauges: Valores instantáneos de otros componentes (nombre -> valor)
+        """
+        lines = [
+            f"# HELP {prefix}_uptime_seconds Segundos desde el arranque del proceso",
+            f"# TYPE {prefix}_uptime_seconds gauge",
+            f"{prefix}_uptime_seconds {self.uptime_seconds():.3f}",
+        ]
+
+        with self._lock:
+            for name in sorted(self.counters):
+                metric = f"{prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {self.counters[name]}")
+
+            metric = f"{prefix}_stage_latency_ms"
+            lines.append(f"# HELP {metric} Latencia por etapa del webhook en milisegundos")
+            lines.append(f"# TYPE {metric} summary")
+            for stage, hist in self.latency.items():
+                for q in (0.5, 0.95, 0.99):
+                    lines.append(f'{metric}{{stage="{stage}",quantile="{q}"}} {hist.percentile(q * 100):.3f}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {hist.sum_us / 1000:.3f}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {hist.count}')
+
+        metric = f"{prefix}_tenant_messages_window"
+        lines.append(f"# HELP {metric} Mensajes por cliente en los últimos {self.window_seconds}s")
+        lines.append(f"# TYPE {metric} gauge")
+        for client_id, total in sorted(self.tenant_counts().items(), key=lambda kv: str(kv[0])):
+            lines.append(f'{metric}{{client_id="{client_id}"}} {total}')
+
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def collect_rollup(self) -> Tuple[float, List[Tuple[str, str, float]]]:
+        """
+        Toma el rollup del intervalo actual y lo reinicia.
+
+        Returns:
+            Tuple (inicio_del_intervalo, [(nombre, etiqueta, valor), ...])
+        """
+        with self._lock:
+            interval_start = self._interval_start
+            rows = [(name, '', float(value)) for name, value in self._interval_counters.items()]
+            for stage, hist in self._interval_latency.items():
+                if not hist.count:
+                    continue
+                rows.append(('latency_count', stage, float(hist.count)))
+                rows.append(('latency_sum_ms', stage, hist.sum_us / 1000))
+                rows.append(('latency_p50_ms', stage, hist.percentile(50)))
+                rows.append(('latency_p95_ms', stage, hist.percentile(95)))
+                rows.append(('latency_p99_ms', stage, hist.percentile(99)))
+
+            self._interval_counters = {}
+            self._interval_latency = {s: LatencyHistogram() for s in self.latency}
+            self._interval_start = time.time()
+
+        now = time.time()
+        for client_id, counter in list(self.tenants.items()):
+            total = counter.total(now)
+            if total:
+                rows.append(('tenant_messages_window', str(client_id), float(total)))
+        return interval_start, rows
+
+    def start_rollup_thread(self, persist: Callable[[str, float, List[Tuple[str, str, float]]], Any], interval_seconds: int):
+        """
+        Inicia un hilo daemon que persiste rollups periódicamente.
+
+        Args:
+            persist: Función (worker_id, inicio_intervalo, filas) que guarda el rollup
+            interval_seconds: Frecuencia de persistencia
+        """
+        def _loop():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    interval_start, rows = self.collect_rollup()
+                    if rows:
+                        persist(self.worker_id, interval_start, rows)
+                except Exception as e:
+                    print(f"⚠️ ERROR persistiendo rollup de métricas: {e}")
+
+        thread = threading.Thread(target=_loop, name="metrics-rollup", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,319 @@
+"""
+Migraciones del esquema SQLite versionadas con `PRAGMA user_version`.
+
+`init_db()` corre al importar `main` y en cada worker de uvicorn. Antes
+repetía todos los CREATE TABLE y varios `PRAGMA table_info` + ALTER en cada
+arranque, y dos workers podían intentar el mismo ALTER a la vez. Ahora:
+
+- Camino rápido: si `user_version` ya es la última versión no se hace nada más
+  (una sola lectura del encabezado de la base)
+- Si hay migraciones pendientes se toma el lock exclusivo de escritura
+  (`BEGIN EXCLUSIVE`), se vuelve a leer la versión (otro worker pudo
+  terminar mientras se esperaba el lock) y se aplican en una sola transacción
+  junto con el nuevo `user_version`: o se aplican todas o ninguna
+
+Las migraciones se agregan al final de MIGRATIONS y nunca se editan una vez
+publicadas. Las primeras son idempotentes (IF NOT EXISTS, columnas solo si
+faltan) porque las bases existentes tienen `user_version = 0` aunque ya
+tengan parte del esquema.
+"""
+
+import sqlite3
+from typing import Callable, Dict, List, Tuple
+
+from .verification_store import SQLiteVerificationStore
+
+MIGRATION_LOCK_TIMEOUT_SECONDS = 30
+
+
+def _columns(cursor, table: str) -> List[str]:
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [column[1] for column in cursor.fetchall()]
+
+
+def _add_columns(cursor, table: str, columns: Dict[str, str]) -> List[str]:
+    """
+    Agrega las columnas que falten en una tabla.
+
+    Returns:
+        Nombres de las columnas agregadas
+    """
+    existing = _columns(cursor, table)
+    added = []
+    for col, type in columns.items():
+        if col not in existing:
+            print(f"🔧 Agregando columna '{col}' a la tabla '{table}'...")
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {col} {type}')
+            added.append(col)
+    return added
+
+
+# ============================================
+# MIGRACIONES
+# ============================================
+
+def _base_schema(cursor):
+    """Tablas de clientes, conocimiento, citas, métricas e historial."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            whatsapp_token TEXT NOT NULL,
+            phone_number_id TEXT NOT NULL UNIQUE,
+            verify_token TEXT NOT NULL,
+            system_instruction TEXT,
+            stripe_api_key TEXT,
+            bank_name TEXT,
+            clabe TEXT,
+            beneficiary_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            menu_json TEXT,
+            menu_version INTEGER DEFAULT 0,
+            knowledge_version INTEGER DEFAULT 0,
+            knowledge_bytes INTEGER DEFAULT 0,
+            plan TEXT DEFAULT 'free'
+        )
+    ''')
+
+    # Tabla de Base de Conocimientos (Extraído de PDFs)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS knowledge_base (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER,
+            content TEXT NOT NULL,
+            source_file TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            document_key TEXT,
+            chunk_index INTEGER DEFAULT 0,
+            content_hash TEXT,
+            FOREIGN KEY (client_id) REFERENCES clients (id)
+        )
+    ''')
+
+    # Bases anteriores al versionado de conocimiento (chunks con hash por documento)
+    _add_columns(cursor, 'knowledge_base', {
+        "document_key": "TEXT",
+        "chunk_index": "INTEGER DEFAULT 0",
+        "content_hash": "TEXT",
+    })
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_knowledge_doc ON knowledge_base(client_id, document_key, chunk_index)')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS knowledge_documents (
+            client_id INTEGER NOT NULL,
+            document_key TEXT NOT NULL,
+            source_file TEXT,
+            content_hash TEXT NOT NULL,
+            chunk_count INTEGER NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (client_id, document_key)
+        )
+    ''')
+
+    # Bases anteriores: columnas agregadas a clients con el tiempo
+    added = _add_columns(cursor, 'clients', {
+        "bank_name": "TEXT",
+        "clabe": "TEXT",
+        "beneficiary_name": "TEXT",
+        "stripe_api_key": "TEXT",
+        "menu_json": "TEXT",
+        "menu_version": "INTEGER DEFAULT 0",
+        "knowledge_version": "INTEGER DEFAULT 0",
+        "knowledge_bytes": "INTEGER DEFAULT 0",
+        "plan": "TEXT DEFAULT 'free'",
+    })
+
+    # Contabilidad de bytes de conocimiento: calcular una vez al agregar la columna;
+    # después se mantiene de forma incremental en cada escritura
+    if 'knowledge_bytes' in added:
+        cursor.execute('''
+            UPDATE clients SET knowledge_bytes = (
+                SELECT COALESCE(SUM(length(CAST(content AS BLOB))), 0)
+                FROM knowledge_base WHERE knowledge_base.client_id = clients.id
+            )
+        ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS citas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER,
+            cliente_telefono TEXT,
+            paciente_nombre TEXT,
+            fecha_hora TEXT,
+            motivo TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES clients (id)
+        )
+    ''')
+
+    # Tabla de Message Logs (para métricas y facturación)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            direction TEXT NOT NULL,
+            phone_number TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES clients (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_logs_client ON message_logs(client_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_logs_date ON message_logs(created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_logs_client_date ON message_logs(client_id, created_at)')
+
+    # Tabla de Historial de Conversación (para contexto con Gemini)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone_number TEXT NOT NULL,
+            content TEXT NOT NULL,
+            is_user INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            client_id INTEGER
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_phone ON conversation_history(phone_number)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_date ON conversation_history(created_at)')
+    _add_columns(cursor, 'conversation_history', {"client_id": "INTEGER"})
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_client_date ON conversation_history(client_id, created_at)')
+
+    # Tabla de Rollups de Métricas (persistencia compartida entre workers)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS metrics_rollups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            worker TEXT NOT NULL,
+            interval_start TIMESTAMP NOT NULL,
+            name TEXT NOT NULL,
+            label TEXT NOT NULL DEFAULT '',
+            value REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_metrics_rollups_date ON metrics_rollups(created_at)')
+
+
+def _conversation_search(cursor):
+    """
+    Índice FTS5 (external content) sobre conversation_history.
+
+    `client_id` se indexa como columna para que el filtro por cliente se
+    resuelva dentro del índice (intersección de listas) y no fila por fila.
+    Los triggers lo mantienen al insertar/borrar/editar mensajes; si el índice
+    se crea sobre un historial existente se reconstruye una sola vez.
+    """
+    try:
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversation_fts'"
+        ).fetchone()
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS conversation_fts USING fts5(
+                content, client_id, content='conversation_history', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        # SQLite compilado sin FTS5: la búsqueda usa LIKE como respaldo
+        print(f"⚠️ FTS5 no disponible, búsqueda de chats sin índice: {e}")
+        return
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS conversation_fts_insert AFTER INSERT ON conversation_history BEGIN
+            INSERT INTO conversation_fts(rowid, content, client_id) VALUES (new.id, new.content, new.client_id);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS conversation_fts_delete AFTER DELETE ON conversation_history BEGIN
+            INSERT INTO conversation_fts(conversation_fts, rowid, content, client_id)
+            VALUES ('delete', old.id, old.content, old.client_id);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS conversation_fts_update AFTER UPDATE OF content, client_id ON conversation_history BEGIN
+            INSERT INTO conversation_fts(conversation_fts, rowid, content, client_id)
+            VALUES ('delete', old.id, old.content, old.client_id);
+            INSERT INTO conversation_fts(rowid, content, client_id) VALUES (new.id, new.content, new.client_id);
+        END
+    ''')
+    if not exists:
+        print("🔎 Construyendo índice de búsqueda del historial de conversación...")
+        cursor.execute("INSERT INTO conversation_fts(conversation_fts) VALUES ('rebuild')")
+
+
+def _verification_codes(cursor):
+    """Códigos de verificación 2FA (compartidos entre workers)."""
+    SQLiteVerificationStore.create_schema(cursor)
+
+
+def _tenant_version(cursor):
+    """
+    Contador de versión de la tabla clients (tenant_snapshot lo consulta para
+    saber si debe recargar); los triggers lo incrementan en cada escritura.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tenant_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO tenant_version (id, version) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS clients_version_{event.lower()} AFTER {event} ON clients BEGIN
+                UPDATE tenant_version SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+
+
+# (versión, descripción, función) en orden; la versión final queda en user_version
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "esquema base", _base_schema),
+    (2, "índice FTS5 del historial de conversación", _conversation_search),
+    (3, "códigos de verificación 2FA", _verification_codes),
+    (4, "contador de versión de clients", _tenant_version),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _user_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_path: str, timeout: float = MIGRATION_LOCK_TIMEOUT_SECONDS) -> List[int]:
+    """
+    Lleva la base a la última versión del esquema.
+
+    Args:
+        db_path: Ruta de la base SQLite
+        timeout: Segundos a esperar el lock si otro worker está migrando
+
+    Returns:
+        Versiones aplicadas por este proceso (vacía si ya estaba al día)
+    """
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        if _user_version(conn) >= LATEST_VERSION:
+            return []
+
+        conn.execute("BEGIN EXCLUSIVE")
+        try:
+            # Otro worker pudo migrar mientras esperábamos el lock
+            current = _user_version(conn)
+            cursor = conn.cursor()
+            applied = []
+            for version, description, apply in MIGRATIONS:
+                if version <= current:
+                    continue
+                print(f"🔧 Migración {version}: {description}")
+                apply(cursor)
+                applied.append(version)
+            if applied:
+                # PRAGMA no admite parámetros; la versión es un entero de MIGRATIONS
+                conn.execute(f"PRAGMA user_version = {applied[-1]}")
+            conn.execute("COMMIT")
+            return applied
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
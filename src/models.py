@@ -0,0 +1,291 @@
+"""
+Modelos compactos (`__slots__`) de tenants, menús y mensajes.
+
+Las filas se pasaban como dicts: cada cliente cacheado cuesta un dict con
+~20 llaves y el webhook de Firebase modificaba `client_data` en sitio para
+inyectar la demo. Estos modelos son dataclasses congeladas con slots:
+
+- `Client` guarda las columnas conocidas como atributos y el resto (campos
+  nuevos de Firestore) en `extra`. También es un `Mapping` de solo lectura
+  (`client['id']`, `client.get('plan')`, `dict(client)`) para que el código
+  que lo trataba como dict siga funcionando. En esa vista una columna en None
+  no existe: no aparece al iterar ni en `dict(client)`, `in` da False,
+  `client['campo']` lanza KeyError y `get()` devuelve el default. Para
+  serializar, `as_dict()` incluye las columnas nulas (la forma de la fila de
+  SQLite) y `as_dict(include_none=False)` las omite (la del documento de
+  Firestore)
+- Para cambiar campos en una request (demo) se usa `with_overrides()`, que
+  devuelve una copia: la instancia del snapshot de tenants no cambia
+- `Menu`/`MenuOption` parsean el menú una vez por payload (no en cada rama del
+  webhook); `HistoryMessage` e `InboundMessage` tipan el historial y el
+  mensaje entrante de WhatsApp
+
+Mismo módulo en src/ y functions/src/.
+"""
+
+from collections.abc import Mapping
+from dataclasses import dataclass, field, fields, replace
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+_EMPTY: Mapping = MappingProxyType({})
+
+
+def _fold(text: Any) -> str:
+    return str(text or "").lower().strip()
+
+
+@dataclass(frozen=True, slots=True)
+class Client(Mapping):
+    """Configuración de un tenant (fila de clients o documento de Firestore)."""
+
+    id: Any
+    name: Optional[str] = None
+    phone_number_id: Optional[str] = None
+    whatsapp_token: Optional[str] = None
+    verify_token: Optional[str] = None
+    whatsapp_number: Optional[str] = None
+    email: Optional[str] = None
+    plan: Optional[str] = None
+    is_active: Optional[bool] = None
+    system_instruction: Optional[str] = None
+    calendly_url: Optional[str] = None
+    response_type: Optional[str] = None
+    stripe_api_key: Optional[str] = None
+    bank_name: Optional[str] = None
+    clabe: Optional[str] = None
+    beneficiary_name: Optional[str] = None
+    menu_json: Optional[str] = None
+    menu_version: Optional[int] = None
+    knowledge_version: Optional[int] = None
+    knowledge_bytes: Optional[int] = None
+    created_at: Any = None
+    extra: Mapping = field(default_factory=lambda: _EMPTY)
+
+    # Constructores
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any], **overrides) -> "Client":
+        known: Dict[str, Any] = {}
+        extra: Dict[str, Any] = {}
+        for source in (data, overrides):
+            for key, value in source.items():
+                if key in _CLIENT_FIELD_SET:
+                    known[key] = value
+                else:
+                    extra[key] = value
+        return cls(extra=MappingProxyType(extra) if extra else _EMPTY, **known)
+
+    @classmethod
+    def from_row(cls, row) -> "Client":
+        """Desde un `sqlite3.Row` (sin pasar por un dict intermedio si no hay columnas extra)."""
+        keys = row.keys()
+        if _CLIENT_FIELD_SET.issuperset(keys):
+            return cls(**dict(zip(keys, row)))
+        return cls.from_dict(dict(zip(keys, row)))
+
+    @classmethod
+    def from_snapshot(cls, doc) -> "Client":
+        """Desde un DocumentSnapshot de Firestore (el ID del documento es `id`)."""
+        return cls.from_dict(doc.to_dict() or {}, id=doc.id)
+
+    def with_overrides(self, **changes) -> "Client":
+        """Copia con campos cambiados (conocidos o extra); la original no se modifica."""
+        known = {k: v for k, v in changes.items() if k in _CLIENT_FIELD_SET}
+        extra = {k: v for k, v in changes.items() if k not in _CLIENT_FIELD_SET}
+        if extra:
+            known['extra'] = MappingProxyType({**self.extra, **extra})
+        return replace(self, **known)
+
+    def as_dict(self, include_none: bool = True) -> Dict[str, Any]:
+        """
+        Columnas conocidas más los campos extra, para serializar.
+
+        Args:
+            include_none: Si es False, omite las columnas nulas (como `dict(client)`)
+        """
+        if not include_none:
+            return dict(self)
+        data = {name: getattr(self, name) for name in _CLIENT_FIELDS}
+        data.update(self.extra)
+        return data
+
+    # Interfaz de Mapping (compatibilidad con el código que usaba dicts).
+    # Una columna en None se trata como ausente en todos los métodos.
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _CLIENT_FIELD_SET:
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return value
+        return self.extra[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in _CLIENT_FIELD_SET:
+            value = getattr(self, key)
+            return default if value is None else value
+        return self.extra.get(key, default)
+
+    def __contains__(self, key) -> bool:
+        if key in _CLIENT_FIELD_SET:
+            return getattr(self, key) is not None
+        return key in self.extra
+
+    def __iter__(self) -> Iterator[str]:
+        for name in _CLIENT_FIELDS:
+            if getattr(self, name) is not None:
+                yield name
+        yield from self.extra
+
+    def __len__(self) -> int:
+        return sum(1 for name in _CLIENT_FIELDS if getattr(self, name) is not None) + len(self.extra)
+
+    __hash__ = None
+
+
+_CLIENT_FIELDS: Tuple[str, ...] = tuple(f.name for f in fields(Client) if f.name != 'extra')
+_CLIENT_FIELD_SET = frozenset(_CLIENT_FIELDS)
+
+
+@dataclass(frozen=True, slots=True)
+class MenuOption:
+    """Opción del menú interactivo; `submenu` si abre otro nivel."""
+
+    title: str
+    icon: str = ""
+    response: Optional[str] = None
+    submenu: Optional["Menu"] = None
+    legacy_options: Tuple["MenuOption", ...] = ()  # Estructura vieja: `opciones` anidadas
+
+    @classmethod
+    def from_value(cls, value: Any) -> "MenuOption":
+        """Acepta una opción como dict o como texto (menús antiguos)."""
+        if not isinstance(value, Mapping):
+            return cls(title=str(value))
+        submenu = value.get('submenu')
+        return cls(
+            title=str(value.get('title', 'Opción')),
+            icon=str(value.get('icon') or ''),
+            response=value.get('response'),
+            submenu=Menu.from_dict(submenu) if isinstance(submenu, Mapping) else None,
+            legacy_options=_parse_options(value.get('opciones')),
+        )
+
+    @property
+    def label(self) -> str:
+        """Texto del botón: icono + título."""
+        return f"{self.icon} {self.title}".strip()
+
+    @property
+    def children(self) -> Tuple["MenuOption", ...]:
+        """Opciones del siguiente nivel (las del submenú o, si no hay, las de la estructura vieja)."""
+        if self.submenu and self.submenu.options:
+            return self.submenu.options
+        return self.legacy_options
+
+
+def _parse_options(values) -> Tuple[MenuOption, ...]:
+    return tuple(MenuOption.from_value(value) for value in values or ())
+
+
+def _find_option(options: Tuple[MenuOption, ...], folded: str) -> Optional[MenuOption]:
+    for option in options:
+        if folded in (_fold(option.label), _fold(option.title)):
+            return option
+        found = _find_option(option.children, folded)
+        if found:
+            return found
+    return None
+
+
+@dataclass(frozen=True, slots=True)
+class Menu:
+    """Menú interactivo de un cliente (config/menu o menu_json), parseado una vez."""
+
+    text: Optional[str] = None
+    fallback_text: Optional[str] = None
+    options: Tuple[MenuOption, ...] = ()
+    legacy_options: Tuple[MenuOption, ...] = ()  # `opciones` junto a `options` (estructura vieja)
+
+    @classmethod
+    def from_dict(cls, data: Optional[Mapping[str, Any]]) -> "Menu":
+        data = data or {}
+        if 'options' in data:
+            options, legacy = data['options'], data.get('opciones')
+        else:
+            options, legacy = data.get('opciones'), None
+        return cls(
+            text=data.get('text'),
+            fallback_text=data.get('fallback_text'),
+            options=_parse_options(options),
+            legacy_options=_parse_options(legacy),
+        )
+
+    @property
+    def labels(self) -> Tuple[str, ...]:
+        """Textos de los botones del primer nivel."""
+        return tuple(option.label for option in self.options)
+
+    def find(self, text: str) -> Optional[MenuOption]:
+        """
+        Opción cuyo título (con o sin icono) coincide con el texto, buscando
+        también en los submenús.
+        """
+        folded = _fold(text)
+        return _find_option(self.options, folded) or _find_option(self.legacy_options, folded)
+
+
+@dataclass(frozen=True, slots=True)
+class HistoryMessage:
+    """Mensaje del historial de conversación."""
+
+    content: str
+    is_user: bool
+    created_at: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row) -> "HistoryMessage":
+        return cls(row['content'], bool(row['is_user']), row['created_at'])
+
+    @property
+    def role(self) -> str:
+        return "Usuario" if self.is_user else "Asistente"
+
+
+@dataclass(frozen=True, slots=True)
+class InboundMessage:
+    """Mensaje entrante de WhatsApp (texto o respuesta de botón/lista)."""
+
+    sender: str
+    type: str
+    text: str = ""
+    message_id: Optional[str] = None
+    timestamp: Optional[str] = None
+
+    @classmethod
+    def from_webhook(cls, message: Mapping[str, Any]) -> "InboundMessage":
+        """
+        Desde un elemento de `entry[].changes[].value.messages[]` del webhook.
+        En respuestas interactivas el texto es el título del botón/opción.
+        """
+        kind = message.get('type', 'text')
+        text = ""
+        if kind == 'text':
+            text = (message.get('text') or {}).get('body', "")
+        elif kind == 'interactive':
+            interactive = message.get('interactive') or {}
+            reply = interactive.get(interactive.get('type', ''))
+            if interactive.get('type') in ('button_reply', 'list_reply') and isinstance(reply, Mapping):
+                text = reply.get('title', "")
+        return cls(
+            sender=str(message.get('from', "")),
+            type=kind,
+            text=text or "",
+            message_id=message.get('id'),
+            timestamp=message.get('timestamp'),
+        )
+
+    @property
+    def is_interactive(self) -> bool:
+        return self.type == 'interactive'
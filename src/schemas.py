@@ -0,0 +1,74 @@
+"""
+Modelos de respuesta (Pydantic) de los endpoints más pesados del panel.
+
+Con `response_model`, FastAPI valida y serializa el resultado con pydantic-core
+(en Rust) en lugar de recorrerlo con el `jsonable_encoder` genérico; la
+respuesta final la escribe `FastJSONResponse` con orjson.
+
+Los modelos de clientes y chats aceptan campos extra: la tabla clients crece
+con migraciones, los documentos de Firestore no tienen esquema fijo y el panel
+usa todos sus campos. Mismo módulo en src/ y functions/src/.
+"""
+
+from typing import List, Optional, Union
+
+from pydantic import BaseModel, ConfigDict
+
+
+class ClientOut(BaseModel):
+    """Fila de la tabla clients (o cliente demo)."""
+
+    model_config = ConfigDict(extra='allow')
+
+    id: Union[int, str]
+    name: Optional[str] = None
+    phone_number_id: Optional[str] = None
+    email: Optional[str] = None
+    plan: Optional[str] = None
+
+
+class ChatSearchHit(BaseModel):
+    id: int
+    phone_number: Optional[str] = None
+    is_user: bool
+    created_at: Optional[str] = None
+    snippet: str
+
+
+class ChatSearchPage(BaseModel):
+    """Resultado de /api/clients/{id}/chats/search."""
+
+    results: List[ChatSearchHit]
+    total: int
+    page: int
+    page_size: int
+    has_more: bool
+
+
+
+class ChatOut(BaseModel):
+    """Chat de Firestore (clients/{id}/chats); con `fields` solo vienen algunos campos."""
+
+    model_config = ConfigDict(extra='allow')
+
+    id: str
+    user_number: Optional[str] = None
+    message: Optional[str] = None
+    response: Optional[str] = None
+    timestamp: Optional[str] = None
+
+
+class ChatThread(BaseModel):
+    user_number: Optional[str] = None
+    last_timestamp: Optional[str] = None
+    count: int
+    messages: List[ChatOut]
+
+
+class ChatsPage(BaseModel):
+    """Página de /api/clients/{id}/chats: trae `chats` o `threads` (se omite el otro)."""
+
+    chats: Optional[List[ChatOut]] = None
+    threads: Optional[List[ChatThread]] = None
+    next_cursor: Optional[str] = None
+    has_more: bool
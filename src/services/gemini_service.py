@@ -10,6 +10,7 @@ Incluye:
 
 from google import genai
 from google.genai import types
+import importlib
 import os
 import time
 import traceback
@@ -17,39 +18,63 @@ import json
 from typing import Dict, List, Optional, Any
 from .. import database
 from ..config import Config
+from ..tracing import tracer
+
+
+def crear_cliente_genai(api_key: Optional[str]):
+    """
+    Crea el cliente de genai.
+
+    Con `Config.GEMINI_CLIENT_FACTORY` ("modulo:funcion") usa esa fábrica en
+    lugar de google.genai.Client, para correr sin red contra un stand-in.
+
+    Args:
+        api_key: API key de Gemini
+
+    Returns:
+        Cliente con la interfaz `client.models.generate_content(...)`
+    """
+    if Config.GEMINI_CLIENT_FACTORY:
+        module_name, _, attribute = Config.GEMINI_CLIENT_FACTORY.partition(":")
+        factory = getattr(importlib.import_module(module_name), attribute)
+        return factory(api_key=api_key)
+    return genai.Client(api_key=api_key)
 
 
 class GeminiEngine:
     """Motor de IA basado en Gemini para generación de respuestas."""
     
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, client: Any = None):
         """
         Inicializa el cliente de Gemini.
         
         Args:
             api_key: API key de Gemini (opcional, usa Config si no se proporciona)
+            client: Cliente de genai ya creado (opcional, ej. un stand-in de pruebas)
         """
         self.api_key = api_key or Config.GEMINI_API_KEY
-        self.client = genai.Client(api_key=self.api_key)
+        self.client = client if client is not None else crear_cliente_genai(self.api_key)
         self.model_id = Config.GEMINI_MODEL_ID
         
         # Caché de conocimiento por cliente
         self._knowledge_cache: Dict[str, str] = {}
         self._cache_expiry: Dict[str, float] = {}
+        self._cache_version: Dict[str, Any] = {}  # knowledge_version con el que se cacheó
         self._cache_ttl = Config.KNOWLEDGE_CACHE_TTL_SECONDS  # 5 minutos
     
-    def _get_cached_knowledge(self, client_id: str) -> Optional[str]:
+    def _get_cached_knowledge(self, client_id: str, version: Any = None) -> Optional[str]:
         """
         Obtiene conocimiento cacheado para un cliente.
         
         Args:
             client_id: ID del cliente
+            version: knowledge_version actual del cliente (invalida si cambió)
         
         Returns:
             Conocimiento cacheado o None si no existe/expiró
         """
         if client_id in self._knowledge_cache:
-            if time.time() < self._cache_expiry.get(client_id, 0):
+            if time.time() < self._cache_expiry.get(client_id, 0) and self._cache_version.get(client_id) == version:
                 return self._knowledge_cache[client_id]
             else:
                 # Cache expirado, limpiar
@@ -58,15 +83,17 @@ class GeminiEngine:
                     del self._cache_expiry[client_id]
         return None
     
-    def _cache_knowledge(self, client_id: str, knowledge: str):
+    def _cache_knowledge(self, client_id: str, knowledge: str, version: Any = None):
         """
         Cachea conocimiento del cliente.
         
         Args:
             client_id: ID del cliente
             knowledge: Conocimiento a cachear
+            version: knowledge_version con el que se leyó
         """
         self._knowledge_cache[client_id] = knowledge
+        self._cache_version[client_id] = version
         self._cache_expiry[client_id] = time.time() + self._cache_ttl
     
     def _build_conversation_context(self, phone_number: str, limit: int = None) -> str:
@@ -88,11 +115,11 @@ class GeminiEngine:
         
         contexto_lines = []
         for msg in historial:
-            rol = "Usuario" if msg['is_user'] else "Asistente"
-            contexto_lines.append(f"{rol}: {msg['content']}")
+            contexto_lines.append(f"{msg.role}: {msg.content}")
         
         return "\n".join(contexto_lines)
     
+    @tracer.traced("gemini.generar_respuesta")
     def generar_respuesta(
         self, 
         mensaje_usuario: str, 
@@ -105,7 +132,7 @@ class GeminiEngine:
         
         Args:
             mensaje_usuario: Mensaje del usuario
-            client_data: Datos del cliente (dict de database)
+            client_data: Datos del cliente (`models.Client` de database)
             numero_telefono: Número de teléfono para historial
             usar_historial: Si True, incluye historial de conversación
         
@@ -116,10 +143,11 @@ class GeminiEngine:
         nombre_cliente = client_data.get('name', 'Cliente')
         
         # 1. Obtener conocimiento (de caché o BD)
-        conocimiento = self._get_cached_knowledge(client_id)
+        knowledge_version = client_data.get('knowledge_version')
+        conocimiento = self._get_cached_knowledge(client_id, knowledge_version)
         if conocimiento is None:
             conocimiento = database.get_client_knowledge(client_id)
-            self._cache_knowledge(client_id, conocimiento)
+            self._cache_knowledge(client_id, conocimiento, knowledge_version)
         
         # 2. Construir instrucción del sistema
         instrucciones_base = client_data.get('system_instruction') or \
@@ -149,14 +177,15 @@ class GeminiEngine:
         
         for attempt in range(max_retries):
             try:
-                response = self.client.models.generate_content(
-                    model=self.model_id,
-                    config={
-                        "system_instruction": prompt_sistema,
-                        "temperature": Config.GEMINI_TEMPERATURE,
-                    },
-                    contents=mensaje_usuario
-                )
+                with tracer.span("gemini.generate_content", attempt=attempt + 1, model=self.model_id):
+                    response = self.client.models.generate_content(
+                        model=self.model_id,
+                        config={
+                            "system_instruction": prompt_sistema,
+                            "temperature": Config.GEMINI_TEMPERATURE,
+                        },
+                        contents=mensaje_usuario
+                    )
                 
                 respuesta = response.text.strip() if response.text else "Lo siento, no pude generar una respuesta."
                 
@@ -166,7 +195,8 @@ class GeminiEngine:
                         database.add_to_conversation_history(
                             numero_telefono, 
                             mensaje_usuario, 
-                            respuesta
+                            respuesta,
+                            client_id=client_data['id']
                         )
                     except Exception as e:
                         print(f"⚠️ ERROR guardando historial: {e}")
@@ -0,0 +1,139 @@
+"""
+Extracción, limpieza, compactación y partición (chunks) de texto de PDFs.
+
+Funciones puras y sin dependencias de la app: los procesos del pool de
+extracción importan solo este módulo (no Firestore ni el logger).
+"""
+
+import re
+from collections import Counter
+from typing import Iterable, Iterator, List
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+_HYPHEN_BREAK = re.compile(r"(\w)-\n(\w)")
+_INLINE_SPACES = re.compile(r"[ \t ]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+_PAGE_NUMBER_LINE = re.compile(r"^(p[aá]g(ina)?\.?\s*)?\d{1,4}(\s*(de|/|of)\s*\d{1,4})?$", re.IGNORECASE)
+
+BOILERPLATE_MIN_REPEATS = 3  # Una línea corta repetida 3+ veces es encabezado/pie de página
+BOILERPLATE_MAX_LINE_CHARS = 120
+
+
+def count_pages(path: str) -> int:
+    """Número de páginas del PDF (solo lee la tabla de páginas)."""
+    return len(PdfReader(path).pages)
+
+
+def extract_pages(path: str, start: int, end: int) -> List[str]:
+    """
+    Extrae el texto de las páginas [start, end) de un PDF en disco.
+
+    Se ejecuta dentro de los procesos del pool, por eso recibe la ruta y abre
+    su propio lector.
+    """
+    reader = PdfReader(path)
+    pages = []
+    for index in range(start, min(end, len(reader.pages))):
+        try:
+            pages.append(reader.pages[index].extract_text() or "")
+        except Exception:
+            pages.append("")  # Una página dañada no debe abortar todo el documento
+    return pages
+
+
+def clean_text(text: str) -> str:
+    """
+    Normaliza el texto extraído de una página.
+
+    - Une palabras cortadas con guion al final de línea
+    - Colapsa espacios/tabs repetidos y recorta cada línea
+    - Limita las líneas en blanco consecutivas a una
+    """
+    if not text:
+        return ""
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = _HYPHEN_BREAK.sub(r"\1\2", text)
+    lines = [_INLINE_SPACES.sub(" ", line).strip() for line in text.split("\n")]
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def chunk_text(pages: Iterable[str], max_chars: int = 4000) -> Iterator[str]:
+    """
+    Agrupa el texto (ya limpio) en chunks de hasta `max_chars`, cortando por
+    párrafos. Consume las páginas de forma incremental.
+
+    Yields:
+        Chunks de texto en orden
+    """
+    parts: List[str] = []
+    size = 0
+    for page in pages:
+        for paragraph in page.split("\n\n"):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            # Párrafos más grandes que un chunk: cortar en trozos fijos
+            while len(paragraph) > max_chars:
+                if parts:
+                    yield "\n\n".join(parts)
+                    parts, size = [], 0
+                yield paragraph[:max_chars]
+                paragraph = paragraph[max_chars:]
+            if size + len(paragraph) + 2 > max_chars and parts:
+                yield "\n\n".join(parts)
+                parts, size = [], 0
+            parts.append(paragraph)
+            size += len(paragraph) + 2
+    if parts:
+        yield "\n\n".join(parts)
+
+
+def text_bytes(text: str) -> int:
+    """Tamaño en bytes (UTF-8) de un texto, la unidad de las cuotas de conocimiento."""
+    return len(text.encode('utf-8'))
+
+
+def compact_chunks(chunks: List[str], max_chars: int = 4000) -> List[str]:
+    """
+    Compacta el texto de un documento ya partido en chunks.
+
+    - Elimina números de página ("3", "Página 3 de 10")
+    - Deja solo la primera aparición de líneas cortas repetidas muchas veces
+      (encabezados y pies de página)
+    - Elimina líneas consecutivas repetidas y párrafos duplicados
+    - Normaliza espacios
+
+    Returns:
+        Nuevos chunks (re-particionados a `max_chars`)
+    """
+    paragraphs = [clean_text(p) for chunk in chunks for p in chunk.split("\n\n")]
+    line_counts = Counter(
+        line for p in paragraphs for line in p.split("\n")
+        if line and len(line) <= BOILERPLATE_MAX_LINE_CHARS
+    )
+    boilerplate = {line for line, count in line_counts.items() if count >= BOILERPLATE_MIN_REPEATS}
+
+    kept_paragraphs: List[str] = []
+    seen_boilerplate = set()
+    seen_paragraphs = set()
+    for paragraph in paragraphs:
+        lines: List[str] = []
+        for line in paragraph.split("\n"):
+            if not line or _PAGE_NUMBER_LINE.match(line):
+                continue
+            if line in boilerplate:
+                if line in seen_boilerplate:
+                    continue
+                seen_boilerplate.add(line)
+            if lines and lines[-1] == line:
+                continue
+            lines.append(line)
+        compacted = "\n".join(lines)
+        if compacted and compacted not in seen_paragraphs:
+            seen_paragraphs.add(compacted)
+            kept_paragraphs.append(compacted)
+    return list(chunk_text(["\n\n".join(kept_paragraphs)], max_chars))
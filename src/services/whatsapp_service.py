@@ -1,8 +1,12 @@
 import requests
 
+from ..config import Config
+from ..tracing import tracer
+
+@tracer.traced("whatsapp.enviar_mensaje")
 def enviar_mensaje_whatsapp(numero, texto, whatsapp_token, phone_number_id):
     """Envía un mensaje de texto plano a través de la API de WhatsApp Cloud."""
-    url = f"https://graph.facebook.com/v22.0/{phone_number_id}/messages"
+    url = f"{Config.WHATSAPP_API_BASE_URL}/{phone_number_id}/messages"
     headers = {
         "Authorization": f"Bearer {whatsapp_token}",
         "Content-Type": "application/json"
@@ -15,6 +19,9 @@ def enviar_mensaje_whatsapp(numero, texto, whatsapp_token, phone_number_id):
     }
     try:
         response = requests.post(url, headers=headers, json=data)
+        span = tracer.current_span()
+        if span:
+            span.set_attribute("http.status_code", response.status_code)
         if response.status_code == 200:
             print(f"✅ WHATSAPP [{numero}]: {texto[:50]}...")
             return True
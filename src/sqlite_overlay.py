@@ -0,0 +1,332 @@
+"""
+Arranque de SQLite en serverless sin copiar la base empaquetada.
+
+En Firebase/Cloud Run el código es de solo lectura y antes se copiaba
+`data/consultorio.db` completa a /tmp en cada cold start (tiempo proporcional
+al tamaño de la base) y lo escrito se perdía al morir la instancia. Aquí:
+
+- La base empaquetada se abre como `file:...?mode=ro&immutable=1` (sin locks
+  ni lectura del journal), se adjunta como `base` y nunca se escribe
+- Las escrituras van a una base overlay pequeña en /tmp (modo WAL) con el
+  esquema completo de migrations.py
+- SEEDED_TABLES (clients, knowledge_documents: pocas filas) se copian al
+  overlay una vez por deploy; quedan como tablas normales, migradas y
+  editables desde el panel
+- COPY_ON_WRITE_TABLES (knowledge_base: el grueso de la base) no se copian:
+  una vista TEMP une las filas del overlay con las de la base empaquetada de
+  los tenants que no se han editado, y triggers INSTEAD OF copian al overlay
+  las filas de un tenant la primera vez que se escribe su conocimiento
+- En ambos casos se copian solo las columnas que tiene la base empaquetada;
+  las columnas nuevas toman el DEFAULT de la migración
+- Historial, logs y métricas de la base empaquetada no se copian
+- Opcionalmente el overlay se respalda cada N segundos con la API de backup
+  de SQLite en `snapshot_path` (ej. un volumen montado) y se restaura de ahí
+  en el siguiente cold start. Si el deploy trae otra base empaquetada, sus
+  filas se agregan sin pisar las que ya existen en el overlay (ganan las
+  ediciones hechas desde el panel)
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from . import migrations
+
+# Configuración de tenants que se copia completa al overlay (en orden de copia)
+SEEDED_TABLES: Tuple[str, ...] = ("clients", "knowledge_documents")
+# Tablas grandes que se copian por tenant al escribirlas: tabla -> columna del tenant
+COPY_ON_WRITE_TABLES: Dict[str, str] = {"knowledge_base": "client_id"}
+
+
+def _store_name(table: str) -> str:
+    """Tabla del overlay con las filas editadas de una tabla copy-on-write."""
+    return f"{table}_overlay"
+
+
+def _uri(path: str, **params) -> str:
+    query = "&".join(f"{key}={value}" for key, value in params.items())
+    return f"file:{quote(os.path.abspath(path))}" + (f"?{query}" if query else "")
+
+
+class OverlayDatabase:
+    """Base empaquetada de solo lectura + overlay local para escrituras."""
+
+    def __init__(self, base_path: str, overlay_path: str, snapshot_path: Optional[str] = None):
+        self.base_path = base_path
+        self.overlay_path = overlay_path
+        self.snapshot_path = snapshot_path or None
+        self.base_tables: Tuple[str, ...] = ()
+        self.restored_from_snapshot = False
+        self.bootstrap_seconds = 0.0
+        self._connection_sql: List[str] = []  # Vistas y triggers TEMP de cada conexión
+        self._counters = {"snapshots": 0, "snapshot_errors": 0, "last_snapshot_ms": 0.0, "last_snapshot_bytes": 0}
+        self._snapshot_lock = threading.Lock()
+
+    # ============================================
+    # ARRANQUE
+    # ============================================
+
+    def bootstrap(self):
+        """
+        Prepara el overlay: lo restaura del snapshot si no existe, aplica
+        migraciones, prepara las vistas copy-on-write y copia SEEDED_TABLES de
+        la base empaquetada (si este deploy no las había copiado ya).
+        Si no hay base empaquetada, el overlay funciona como base completa.
+        """
+        started = time.perf_counter()
+        if not os.path.exists(self.overlay_path) and self.snapshot_path and os.path.exists(self.snapshot_path):
+            try:
+                self._copy(self.snapshot_path, self.overlay_path)
+                self.restored_from_snapshot = True
+                print(f"📦 Overlay restaurado desde snapshot: {self.snapshot_path}")
+            except Exception as e:
+                print(f"⚠️ Error restaurando snapshot {self.snapshot_path}: {e}")
+                if os.path.exists(self.overlay_path):
+                    os.remove(self.overlay_path)
+
+        conn = sqlite3.connect(self.overlay_path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS overlay_tenants (
+                    table_name TEXT NOT NULL,
+                    client_id INTEGER NOT NULL,
+                    PRIMARY KEY (table_name, client_id)
+                )
+            ''')
+            conn.execute("CREATE TABLE IF NOT EXISTS overlay_seed (fingerprint TEXT PRIMARY KEY, seeded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+            conn.commit()
+        finally:
+            conn.close()
+        migrations.migrate(self.overlay_path)
+
+        if os.path.exists(self.base_path):
+            self._prepare_base()
+        else:
+            print(f"⚠️ Base empaquetada no encontrada ({self.base_path}); se usa solo el overlay")
+        self.bootstrap_seconds = time.perf_counter() - started
+
+    def connect(self, **kwargs) -> sqlite3.Connection:
+        """Conexión al overlay con la base empaquetada adjunta (mismos kwargs que sqlite3.connect)."""
+        conn = sqlite3.connect(_uri(self.overlay_path), uri=True, **kwargs)
+        if self._connection_sql:
+            self._attach(conn)
+        return conn
+
+    def _attach(self, conn):
+        conn.execute("ATTACH DATABASE ? AS base", (_uri(self.base_path, mode="ro", immutable=1),))
+        for statement in self._connection_sql:
+            conn.execute(statement)
+
+    def _prepare_base(self):
+        conn = sqlite3.connect(self.overlay_path, timeout=migrations.MIGRATION_LOCK_TIMEOUT_SECONDS, isolation_level=None)
+        try:
+            conn.execute("ATTACH DATABASE ? AS base", (_uri(self.base_path, mode="ro", immutable=1),))
+            present = {row[0] for row in conn.execute("SELECT name FROM base.sqlite_master WHERE type = 'table'")}
+            self.base_tables = tuple(t for t in SEEDED_TABLES + tuple(COPY_ON_WRITE_TABLES) if t in present)
+            self._connection_sql = []
+            conn.execute("BEGIN IMMEDIATE")  # Otro worker puede estar creando las mismas tablas
+            try:
+                for table, key in COPY_ON_WRITE_TABLES.items():
+                    if table in present:
+                        self._create_store(conn, table, key)
+                        self._connection_sql += self._copy_on_write_sql(conn, table, key)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("DETACH DATABASE base")
+            self._attach(conn)
+            self._seed(conn, present)
+        finally:
+            conn.close()
+
+    def _seed(self, conn, present):
+        """
+        Copia al overlay las filas de SEEDED_TABLES de la base empaquetada.
+
+        Se hace una vez por versión de la base empaquetada (tabla overlay_seed)
+        dentro de una transacción IMMEDIATE, así que dos workers arrancando a la
+        vez no copian dos veces. INSERT OR IGNORE: las filas que ya existen en
+        el overlay no se pisan.
+        """
+        stat = os.stat(self.base_path)
+        fingerprint = f"{stat.st_size}:{stat.st_mtime_ns}"
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM overlay_seed WHERE fingerprint = ?", (fingerprint,)).fetchone():
+                conn.execute("COMMIT")
+                return
+            for table in SEEDED_TABLES:
+                if table in present:
+                    columns = ", ".join(self._shared_columns(conn, table))
+                    copied = conn.execute(
+                        f"INSERT OR IGNORE INTO main.{table} ({columns}) SELECT {columns} FROM base.{table}"
+                    ).rowcount
+                    print(f"📦 Overlay: {copied} filas de {table} copiadas de la base empaquetada")
+            for table in COPY_ON_WRITE_TABLES:
+                if table in present:
+                    # IDs nuevos del overlay después de los de la base (las filas copiadas conservan su ID)
+                    store, base_max = _store_name(table), f"(SELECT COALESCE(MAX(rowid), 0) FROM base.{table})"
+                    conn.execute(f"UPDATE main.sqlite_sequence SET seq = MAX(seq, {base_max}) WHERE name = ?", (store,))
+                    conn.execute(
+                        f"INSERT INTO main.sqlite_sequence (name, seq) SELECT ?, {base_max} "
+                        "WHERE NOT EXISTS (SELECT 1 FROM main.sqlite_sequence WHERE name = ?)", (store, store)
+                    )
+            if "clients" in present and "knowledge_base" in present and "knowledge_bytes" not in self._columns(conn, "base", "clients"):
+                # Base empaquetada anterior a la contabilidad de bytes: calcularla una vez
+                conn.execute('''
+                    UPDATE main.clients SET knowledge_bytes = (
+                        SELECT COALESCE(SUM(length(CAST(content AS BLOB))), 0)
+                        FROM knowledge_base WHERE knowledge_base.client_id = clients.id
+                    )
+                ''')
+            conn.execute("INSERT INTO overlay_seed (fingerprint) VALUES (?)", (fingerprint,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ============================================
+    # COPY-ON-WRITE
+    # ============================================
+
+    @staticmethod
+    def _columns(conn, schema: str, table: str) -> Dict[str, Optional[str]]:
+        """Columnas de una tabla -> expresión SQL de su DEFAULT (None si no tiene)."""
+        return {row[1]: row[4] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")}
+
+    def _shared_columns(self, conn, table: str) -> List[str]:
+        overlay_columns = self._columns(conn, "main", table)
+        return [c for c in self._columns(conn, "base", table) if c in overlay_columns]
+
+    def _create_store(self, conn, table: str, key: str):
+        """
+        Tabla del overlay con las filas editadas de `table` (`<table>_overlay`).
+
+        La vista TEMP tapa a `main.<table>` y dentro de un trigger no se puede
+        calificar el esquema de un INSERT/UPDATE/DELETE, así que las filas se
+        guardan en otra tabla con la misma definición que la migrada. Las
+        columnas que agreguen migraciones futuras se le agregan aquí.
+        """
+        store = _store_name(table)
+        ddl = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+        conn.execute(re.sub(rf"^CREATE TABLE\s+\"?{table}\"?", f"CREATE TABLE IF NOT EXISTS {store}", ddl, count=1))
+        existing = self._columns(conn, "main", store)
+        for row in conn.execute(f"PRAGMA main.table_info({table})").fetchall():
+            name, type, default = row[1], row[2], row[4]
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {store} ADD COLUMN {name} {type}" + (f" DEFAULT {default}" if default is not None else ""))
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{store}_{key} ON {store}({key})")
+
+    def _copy_on_write_sql(self, conn, table: str, key: str) -> List[str]:
+        """
+        Vista TEMP `table` (overlay + base de los tenants sin editar) y sus
+        triggers INSTEAD OF. Antes de escribir una fila, el tenant de la fila
+        se "materializa": sus filas de la base se copian al overlay (con el
+        mismo ID) y se registra en overlay_tenants.
+        """
+        store = _store_name(table)
+        overlay_columns = self._columns(conn, "main", table)
+        base_columns = self._columns(conn, "base", table)
+        shared = ", ".join(c for c in base_columns if c in overlay_columns)
+        names = ", ".join(overlay_columns)
+        from_base = ", ".join(
+            c if c in base_columns else f"{overlay_columns[c] or 'NULL'} AS {c}" for c in overlay_columns
+        )
+        edited = f"SELECT client_id FROM main.overlay_tenants WHERE table_name = '{table}'"
+
+        def materialize(ref: str) -> str:
+            return f"""
+                INSERT INTO {store} ({shared}) SELECT {shared} FROM base.{table}
+                WHERE {key} = {ref} AND {ref} NOT IN ({edited});
+                INSERT OR IGNORE INTO overlay_tenants (table_name, client_id)
+                SELECT '{table}', {ref} WHERE {ref} IS NOT NULL;
+            """
+
+        values = ", ".join(
+            f"COALESCE(NEW.{c}, {overlay_columns[c]})" if overlay_columns[c] is not None else f"NEW.{c}"
+            for c in overlay_columns
+        )
+        assignments = ", ".join(f"{c} = NEW.{c}" for c in overlay_columns if c != "id")
+        return [
+            f"""
+                CREATE TEMP VIEW {table} AS
+                SELECT {names} FROM main.{store}
+                UNION ALL
+                SELECT {from_base} FROM base.{table} WHERE {key} NOT IN ({edited})
+            """,
+            f"CREATE TEMP TRIGGER {table}_insert INSTEAD OF INSERT ON {table} BEGIN {materialize('NEW.' + key)} "
+            f"INSERT INTO {store} ({names}) VALUES ({values}); END",
+            f"CREATE TEMP TRIGGER {table}_update INSTEAD OF UPDATE ON {table} BEGIN {materialize('OLD.' + key)} "
+            f"{materialize('NEW.' + key)} UPDATE {store} SET {assignments} WHERE id = OLD.id; END",
+            f"CREATE TEMP TRIGGER {table}_delete INSTEAD OF DELETE ON {table} BEGIN {materialize('OLD.' + key)} "
+            f"DELETE FROM {store} WHERE id = OLD.id; END",
+        ]
+
+    # ============================================
+    # SNAPSHOTS
+    # ============================================
+
+    @staticmethod
+    def _copy(source_path: str, target_path: str):
+        """Copia consistente con la API de backup (no bloquea a los escritores)."""
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    def snapshot(self) -> bool:
+        """
+        Respalda el overlay en `snapshot_path` (escribe a un temporal y lo
+        reemplaza, para no dejar un snapshot a medias).
+
+        Returns:
+            True si se guardó el snapshot
+        """
+        if not self.snapshot_path:
+            return False
+        with self._snapshot_lock:
+            started = time.perf_counter()
+            partial = f"{self.snapshot_path}.tmp"
+            try:
+                self._copy(self.overlay_path, partial)
+                os.replace(partial, self.snapshot_path)
+            except Exception as e:
+                self._counters["snapshot_errors"] += 1
+                print(f"⚠️ ERROR guardando snapshot del overlay: {e}")
+                return False
+            self._counters["snapshots"] += 1
+            self._counters["last_snapshot_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            self._counters["last_snapshot_bytes"] = os.path.getsize(self.snapshot_path)
+            return True
+
+    def start_snapshot_thread(self, interval_seconds: int):
+        """Inicia un hilo daemon que respalda el overlay periódicamente."""
+        if not self.snapshot_path:
+            return None
+
+        def _loop():
+            while True:
+                time.sleep(interval_seconds)
+                self.snapshot()
+
+        thread = threading.Thread(target=_loop, name="sqlite-overlay-snapshot", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            self._counters,
+            base_tables=list(self.base_tables),
+            bootstrap_ms=round(self.bootstrap_seconds * 1000, 2),
+            restored_from_snapshot=self.restored_from_snapshot,
+            overlay_bytes=os.path.getsize(self.overlay_path) if os.path.exists(self.overlay_path) else 0,
+        )
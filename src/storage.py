@@ -0,0 +1,260 @@
+"""
+Interfaz única de almacenamiento sobre SQLite, Firestore y memoria.
+
+`src/database.py` (SQLite) y `functions/src/database.py` (Firestore) crecieron
+por separado: el historial se guarda con `add_to_conversation_history` en uno
+y `save_chat_message` en el otro, y `get_client_knowledge` une los chunks de
+forma distinta. `Storage` fija un contrato común con operaciones por lotes:
+
+- `get_tenants_many(ids)`: varios clientes en una lectura (primero la foto de
+  tenants, luego un solo `IN (...)` / `get_all` para los que falten)
+- `append_messages(exchanges)`: varios intercambios en una transacción/batch
+- `get_history_many(keys, limit)`: historial de varias conversaciones
+- `get_knowledge(client_id)`: chunks en orden de documento, unidos con
+  KNOWLEDGE_SEPARATOR ("" si no hay conocimiento)
+
+Cada app trae solo su backend: `SQLiteStorage` aquí y `FirestoreStorage` en
+functions/src/storage.py. El contrato y `MemoryStorage` (benchmarks y
+pruebas locales) son iguales en los dos módulos. tests/test_storage.py y
+`bench_storage.py` verifican que los tres backends cumplan el mismo contrato.
+"""
+
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Protocol, Sequence, Tuple, runtime_checkable
+
+from .models import Client, HistoryMessage
+
+KNOWLEDGE_SEPARATOR = "\n\n"
+
+# Límite del backend por operación
+SQLITE_MAX_PARAMS = 900          # SQLITE_MAX_VARIABLE_NUMBER es 999 en builds antiguos
+
+# (str(client_id), número del usuario)
+HistoryKey = Tuple[str, str]
+
+
+def history_key(client_id, user_number) -> HistoryKey:
+    return (str(client_id), str(user_number))
+
+
+def _chunks(items: Sequence, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _unique(values: Iterable) -> List:
+    return list(dict.fromkeys(values))
+
+
+@dataclass(frozen=True, slots=True)
+class ChatExchange:
+    """Mensaje del usuario y respuesta del asistente en una conversación."""
+
+    client_id: Any
+    user_number: str
+    message: str
+    response: str
+
+
+@runtime_checkable
+class Storage(Protocol):
+    """Contrato común de los backends (ver docstring del módulo)."""
+
+    backend: str
+
+    def get_tenants_many(self, client_ids: Iterable[Any]) -> Dict[str, Client]:
+        """Clientes encontrados, por str(id); los que no existen no aparecen."""
+        ...
+
+    def append_messages(self, exchanges: Sequence[ChatExchange]) -> int:
+        """Guarda los intercambios (en orden) y retorna cuántos se guardaron."""
+        ...
+
+    def get_history_many(self, keys: Iterable[HistoryKey], limit: int = 10) -> Dict[HistoryKey, List[HistoryMessage]]:
+        """
+        Últimos `limit` mensajes (usuario y asistente) de cada conversación,
+        del más antiguo al más reciente. Toda llave pedida aparece (lista vacía si no hay).
+        """
+        ...
+
+    def get_knowledge(self, client_id) -> str:
+        ...
+
+
+class _TenantSnapshotMixin:
+    """Lecturas de clientes desde la foto de tenants antes de ir a la base."""
+
+    tenants = None
+
+    def _split_snapshot(self, client_ids: Iterable[Any]) -> Tuple[Dict[str, Client], List[str]]:
+        found: Dict[str, Client] = {}
+        missing: List[str] = []
+        snapshot = self.tenants.current() if self.tenants is not None else None
+        for client_id in _unique(str(c) for c in client_ids):
+            client = snapshot.get_by_id(client_id) if snapshot is not None else None
+            if client is not None:
+                found[client_id] = client
+            else:
+                missing.append(client_id)
+        return found, missing
+
+    def _wake_tenants(self):
+        # Había clientes en la base que no estaban en la foto
+        if self.tenants is not None:
+            self.tenants.wake()
+
+
+# ============================================
+# MEMORIA
+# ============================================
+
+class MemoryStorage:
+    """Backend en memoria, para benchmarks y pruebas locales (no persiste)."""
+
+    backend = "memory"
+
+    def __init__(self, clients: Iterable[Any] = (), knowledge: Optional[Mapping[Any, Sequence[str]]] = None):
+        """
+        Args:
+            clients: Clientes iniciales (`Client` o dicts con `id`)
+            knowledge: Chunks de conocimiento por client_id, en orden
+        """
+        self._lock = threading.Lock()
+        self._clients: Dict[str, Client] = {}
+        self._history: Dict[HistoryKey, List[HistoryMessage]] = {}
+        self._knowledge: Dict[str, List[str]] = {}
+        for client in clients:
+            self.put_client(client)
+        for client_id, chunks in (knowledge or {}).items():
+            self.set_knowledge(client_id, chunks)
+
+    def put_client(self, client):
+        client = client if isinstance(client, Client) else Client.from_dict(client)
+        self._clients[str(client.id)] = client
+
+    def set_knowledge(self, client_id, chunks: Sequence[str]):
+        self._knowledge[str(client_id)] = list(chunks)
+
+    def get_tenants_many(self, client_ids: Iterable[Any]) -> Dict[str, Client]:
+        clients = self._clients
+        return {key: clients[key] for key in _unique(str(c) for c in client_ids) if key in clients}
+
+    def append_messages(self, exchanges: Sequence[ChatExchange]) -> int:
+        created_at = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            for exchange in exchanges:
+                history = self._history.setdefault(history_key(exchange.client_id, exchange.user_number), [])
+                history.append(HistoryMessage(exchange.message, True, created_at))
+                history.append(HistoryMessage(exchange.response, False, created_at))
+        return len(exchanges)
+
+    def get_history_many(self, keys: Iterable[HistoryKey], limit: int = 10) -> Dict[HistoryKey, List[HistoryMessage]]:
+        result = {}
+        for key in _unique(history_key(*key) for key in keys):
+            history = self._history.get(key, ())
+            result[key] = list(history[-limit:]) if limit > 0 else []
+        return result
+
+    def get_knowledge(self, client_id) -> str:
+        return KNOWLEDGE_SEPARATOR.join(self._knowledge.get(str(client_id), ()))
+
+
+# ============================================
+# SQLITE
+# ============================================
+
+class SQLiteStorage(_TenantSnapshotMixin):
+    """Backend sobre el esquema de migrations.py (tablas clients, conversation_history, knowledge_base)."""
+
+    backend = "sqlite"
+
+    def __init__(self, connect: Callable[..., sqlite3.Connection], tenants=None):
+        """
+        Args:
+            connect: Abre una conexión (ej. `database._connect`, que respeta el overlay)
+            tenants: `TenantDirectory` opcional para servir clientes desde memoria
+        """
+        self._connect = connect
+        self.tenants = tenants
+
+    def get_tenants_many(self, client_ids: Iterable[Any]) -> Dict[str, Client]:
+        found, missing = self._split_snapshot(client_ids)
+        if not missing:
+            return found
+        loaded = 0
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            for chunk in _chunks(missing, SQLITE_MAX_PARAMS):
+                placeholders = ",".join("?" * len(chunk))
+                for row in conn.execute(f"SELECT * FROM clients WHERE id IN ({placeholders})", chunk):
+                    found[str(row['id'])] = Client.from_row(row)
+                    loaded += 1
+        finally:
+            conn.close()
+        if loaded:
+            self._wake_tenants()
+        return found
+
+    def append_messages(self, exchanges: Sequence[ChatExchange]) -> int:
+        if not exchanges:
+            return 0
+        rows = []
+        for exchange in exchanges:
+            rows.append((exchange.client_id, exchange.user_number, exchange.message, 1))
+            rows.append((exchange.client_id, exchange.user_number, exchange.response, 0))
+        conn = self._connect()
+        try:
+            with conn:
+                # El índice de búsqueda (conversation_fts) se actualiza por trigger
+                conn.executemany("""
+                    INSERT INTO conversation_history (client_id, phone_number, content, is_user, created_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                """, rows)
+        finally:
+            conn.close()
+        return len(exchanges)
+
+    def get_history_many(self, keys: Iterable[HistoryKey], limit: int = 10) -> Dict[HistoryKey, List[HistoryMessage]]:
+        keys = _unique(history_key(*key) for key in keys)
+        result: Dict[HistoryKey, List[HistoryMessage]] = {key: [] for key in keys}
+        if not keys or limit <= 0:
+            return result
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            # Una consulta por bloque de conversaciones; ROW_NUMBER() corta cada una en `limit`
+            for chunk in _chunks(keys, SQLITE_MAX_PARAMS // 2):
+                values = ",".join("(?, ?)" for _ in chunk)
+                params = [value for key in chunk for value in key]
+                rows = conn.execute(f"""
+                    SELECT client_id, phone_number, content, is_user, created_at FROM (
+                        SELECT client_id, phone_number, content, is_user, created_at, id,
+                               ROW_NUMBER() OVER (
+                                   PARTITION BY client_id, phone_number ORDER BY created_at DESC, id DESC
+                               ) AS position
+                        FROM conversation_history
+                        WHERE (client_id, phone_number) IN (VALUES {values})
+                    )
+                    WHERE position <= ?
+                    ORDER BY client_id, phone_number, created_at, id
+                """, params + [limit])
+                for row in rows:
+                    result[history_key(row['client_id'], row['phone_number'])].append(HistoryMessage.from_row(row))
+        finally:
+            conn.close()
+        return result
+
+    def get_knowledge(self, client_id) -> str:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT content FROM knowledge_base WHERE client_id = ? ORDER BY COALESCE(document_key, ''), chunk_index, id",
+                (client_id,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return KNOWLEDGE_SEPARATOR.join(row[0] for row in rows)
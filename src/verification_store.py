@@ -0,0 +1,342 @@
+"""
+Almacén de códigos de verificación (2FA por email) con vencimiento.
+
+Los códigos deben sobrevivir a que `request-code` y `verify-code` caigan en
+workers o instancias distintas, así que el almacén es intercambiable:
+
+- MemoryVerificationStore: un solo proceso (desarrollo); barre los vencidos
+  cada SWEEP_INTERVAL_SECONDS
+- SQLiteVerificationStore: compartido entre workers de uvicorn (tabla
+  verification_codes con índice por vencimiento)
+- FirestoreVerificationStore: compartido entre instancias de Cloud Functions
+  (colección verification_codes con política TTL sobre `expires_at`)
+
+En todos se guarda solo un HMAC del código, se compara en tiempo constante y
+cada verificación fallida cuenta: al llegar a MAX_ATTEMPTS el registro queda
+bloqueado durante CODE_TTL_SECONDS; mientras tanto verify() responde LOCKED y
+issue() no emite códigos nuevos (si no, cada código nuevo daría otros
+MAX_ATTEMPTS intentos). Verificar es atómico (lock, transacción SQLite o
+transacción de Firestore).
+
+Mismo módulo en src/ y functions/src/.
+"""
+
+import abc
+import hashlib
+import hmac
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+CODE_TTL_SECONDS = 600  # 10 minutos
+MAX_ATTEMPTS = 5
+RESEND_INTERVAL_SECONDS = 30
+SWEEP_INTERVAL_SECONDS = 60
+
+# Resultados de verify()
+VERIFIED = "ok"
+INVALID = "invalid"
+EXPIRED = "expired"
+LOCKED = "locked"
+
+
+def normalize_email(email: str) -> str:
+    return str(email or "").lower().strip()
+
+
+def email_key(email: str) -> str:
+    """Llave del registro (no expone el email en IDs de documentos)."""
+    return hashlib.sha256(normalize_email(email).encode("utf-8")).hexdigest()
+
+
+class VerificationStore(abc.ABC):
+    """
+    Lógica común: los backends solo leen/escriben registros
+    {code_digest, expires_at, issued_at, attempts} de forma atómica.
+
+    Un registro con attempts >= max_attempts es un bloqueo vigente hasta
+    `expires_at`.
+    """
+
+    def __init__(self, secret: str, ttl_seconds: int = CODE_TTL_SECONDS, max_attempts: int = MAX_ATTEMPTS,
+                 resend_interval_seconds: int = RESEND_INTERVAL_SECONDS):
+        self._secret = str(secret or "").encode("utf-8")
+        self.ttl_seconds = ttl_seconds
+        self.max_attempts = max_attempts
+        self.resend_interval_seconds = resend_interval_seconds
+
+    def _digest(self, email: str, code: str) -> str:
+        message = f"{normalize_email(email)}:{str(code or '').strip()}".encode("utf-8")
+        return hmac.new(self._secret, message, hashlib.sha256).hexdigest()
+
+    def _new_record(self, email: str, code: str, now: float) -> Dict[str, Any]:
+        return {
+            "code_digest": self._digest(email, code),
+            "expires_at": now + self.ttl_seconds,
+            "issued_at": now,
+            "attempts": 0,
+        }
+
+    def _is_locked(self, record: Dict[str, Any]) -> bool:
+        return record["attempts"] >= self.max_attempts
+
+    def _can_issue(self, record: Optional[Dict[str, Any]], now: float) -> bool:
+        """
+        No reemitir mientras el email esté bloqueado, ni antes de
+        RESEND_INTERVAL_SECONDS si el código anterior sigue vigente.
+        """
+        if record is None or now >= record["expires_at"]:
+            return True
+        if self._is_locked(record):
+            return False
+        return now - record["issued_at"] >= self.resend_interval_seconds
+
+    def _check(self, record: Optional[Dict[str, Any]], email: str, code: str, now: float) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Returns:
+            (resultado, registro a guardar o None para borrarlo)
+        """
+        if record is None:
+            return INVALID, None
+        if now >= record["expires_at"]:
+            return EXPIRED, None
+        if self._is_locked(record):
+            return LOCKED, record
+        if hmac.compare_digest(record["code_digest"], self._digest(email, code)):
+            return VERIFIED, None
+        attempts = record["attempts"] + 1
+        if attempts >= self.max_attempts:
+            # Se conserva como bloqueo: el vencimiento corre desde el último intento
+            return LOCKED, dict(record, attempts=attempts, expires_at=now + self.ttl_seconds)
+        return INVALID, dict(record, attempts=attempts)
+
+    # Interfaz pública
+
+    @abc.abstractmethod
+    def issue(self, email: str, code: str) -> bool:
+        """
+        Guarda un código nuevo para el email (reemplaza el anterior).
+
+        Returns:
+            False si se pidió otro código hace menos de RESEND_INTERVAL_SECONDS
+            o si el email está bloqueado por demasiados intentos
+        """
+
+    @abc.abstractmethod
+    def verify(self, email: str, code: str) -> str:
+        """
+        Verifica y consume el código.
+
+        Returns:
+            VERIFIED, INVALID, EXPIRED o LOCKED (demasiados intentos)
+        """
+
+    @abc.abstractmethod
+    def discard(self, email: str):
+        """Borra el código del email (ej. si no se pudo enviar)."""
+
+
+class MemoryVerificationStore(VerificationStore):
+    """Códigos en memoria del proceso (no compartidos entre workers)."""
+
+    def __init__(self, *args, sweep_interval_seconds: int = SWEEP_INTERVAL_SECONDS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._sweep_interval = sweep_interval_seconds
+        self._next_sweep = time.time() + sweep_interval_seconds
+
+    def _sweep(self, now: float):
+        if now < self._next_sweep:
+            return
+        for key in [k for k, r in self._records.items() if now >= r["expires_at"]]:
+            del self._records[key]
+        self._next_sweep = now + self._sweep_interval
+
+    def issue(self, email: str, code: str) -> bool:
+        now = time.time()
+        key = email_key(email)
+        with self._lock:
+            self._sweep(now)
+            if not self._can_issue(self._records.get(key), now):
+                return False
+            self._records[key] = self._new_record(email, code, now)
+            return True
+
+    def verify(self, email: str, code: str) -> str:
+        now = time.time()
+        key = email_key(email)
+        with self._lock:
+            self._sweep(now)
+            result, record = self._check(self._records.get(key), email, code, now)
+            if record is None:
+                self._records.pop(key, None)
+            else:
+                self._records[key] = record
+            return result
+
+    def discard(self, email: str):
+        with self._lock:
+            self._records.pop(email_key(email), None)
+
+    def __len__(self):
+        return len(self._records)
+
+
+class SQLiteVerificationStore(VerificationStore):
+    """Códigos en la tabla verification_codes (compartida por los workers de uvicorn)."""
+
+    def __init__(self, db_path: Callable[[], str], *args, sweep_interval_seconds: int = SWEEP_INTERVAL_SECONDS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._db_path = db_path
+        self._sweep_interval = sweep_interval_seconds
+        self._next_sweep = 0.0
+
+    @staticmethod
+    def create_schema(cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS verification_codes (
+                email_key TEXT PRIMARY KEY,
+                code_digest TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                issued_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_verification_codes_expiry ON verification_codes(expires_at)')
+
+    def _connect(self):
+        conn = sqlite3.connect(self._db_path(), timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _read(self, conn, key: str) -> Optional[Dict[str, Any]]:
+        row = conn.execute(
+            "SELECT code_digest, expires_at, issued_at, attempts FROM verification_codes WHERE email_key = ?", (key,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def _maybe_sweep(self, conn, now: float):
+        if now >= self._next_sweep:
+            conn.execute("DELETE FROM verification_codes WHERE expires_at <= ?", (now,))
+            self._next_sweep = now + self._sweep_interval
+
+    def issue(self, email: str, code: str) -> bool:
+        now = time.time()
+        key = email_key(email)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._maybe_sweep(conn, now)
+            if not self._can_issue(self._read(conn, key), now):
+                conn.execute("ROLLBACK")
+                return False
+            record = self._new_record(email, code, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO verification_codes (email_key, code_digest, expires_at, issued_at, attempts) VALUES (?, ?, ?, ?, ?)",
+                (key, record["code_digest"], record["expires_at"], record["issued_at"], record["attempts"])
+            )
+            conn.execute("COMMIT")
+            return True
+        finally:
+            conn.close()
+
+    def verify(self, email: str, code: str) -> str:
+        now = time.time()
+        key = email_key(email)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result, record = self._check(self._read(conn, key), email, code, now)
+            if record is None:
+                conn.execute("DELETE FROM verification_codes WHERE email_key = ?", (key,))
+            else:
+                conn.execute("UPDATE verification_codes SET attempts = ?, expires_at = ? WHERE email_key = ?",
+                             (record["attempts"], record["expires_at"], key))
+            conn.execute("COMMIT")
+            return result
+        finally:
+            conn.close()
+
+    def discard(self, email: str):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM verification_codes WHERE email_key = ?", (email_key(email),))
+        finally:
+            conn.close()
+
+
+class FirestoreVerificationStore(VerificationStore):
+    """
+    Códigos en la colección verification_codes (compartida por las instancias).
+
+    `expires_at` se guarda como Timestamp para que la política TTL de Firestore
+    borre los vencidos (ver fieldOverrides en firestore.indexes.json).
+    """
+
+    COLLECTION = "verification_codes"
+
+    def __init__(self, get_db: Callable[[], Any], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._get_db = get_db
+
+    @staticmethod
+    def _to_record(data: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if not data:
+            return None
+        record = dict(data)
+        for field in ("expires_at", "issued_at"):
+            if isinstance(record.get(field), datetime):
+                record[field] = record[field].timestamp()
+        return record
+
+    @staticmethod
+    def _to_document(record: Dict[str, Any]) -> Dict[str, Any]:
+        document = dict(record)
+        for field in ("expires_at", "issued_at"):
+            document[field] = datetime.fromtimestamp(record[field], tz=timezone.utc)
+        return document
+
+    def _run_transaction(self, key: str, body: Callable[[Any, Any, Optional[Dict[str, Any]]], Any]):
+        from firebase_admin import firestore
+
+        db = self._get_db()
+        ref = db.collection(self.COLLECTION).document(key)
+
+        @firestore.transactional
+        def run(transaction):
+            snapshot = ref.get(transaction=transaction)
+            return body(transaction, ref, self._to_record(snapshot.to_dict() if snapshot.exists else None))
+
+        return run(db.transaction())
+
+    def issue(self, email: str, code: str) -> bool:
+        now = time.time()
+
+        def body(transaction, ref, current):
+            if not self._can_issue(current, now):
+                return False
+            transaction.set(ref, self._to_document(self._new_record(email, code, now)))
+            return True
+
+        return self._run_transaction(email_key(email), body)
+
+    def verify(self, email: str, code: str) -> str:
+        now = time.time()
+
+        def body(transaction, ref, current):
+            result, record = self._check(current, email, code, now)
+            if record is None:
+                if current is not None:
+                    transaction.delete(ref)
+            else:
+                document = self._to_document(record)
+                transaction.update(ref, {"attempts": document["attempts"], "expires_at": document["expires_at"]})
+            return result
+
+        return self._run_transaction(email_key(email), body)
+
+    def discard(self, email: str):
+        self._get_db().collection(self.COLLECTION).document(email_key(email)).delete()
@@ -0,0 +1,252 @@
+"""
+Fan-out de payloads del webhook de WhatsApp Cloud API.
+
+Meta agrupa varios entry/changes/messages/statuses en un solo POST cuando hay
+carga. Este módulo:
+- Extrae TODOS los mensajes y actualizaciones de estado del payload
+- Descarta duplicados (reintentos de Meta) dentro del batch y entre requests
+- Agrupa por cliente (phone_number_id) y por usuario
+- Procesa las conversaciones en paralelo (hilos), conservando el orden de
+  llegada dentro de cada conversación
+- Resume los `statuses` en un solo conteo por tipo
+
+`BatchMemo` permite que los mensajes del mismo cliente compartan los lookups
+(cliente, menú, límite de plan) durante el procesamiento del payload.
+`coalesce_events` / `merged_event` conectan el batch con la ventana de
+agrupación por conversación (coalescer.MessageCoalescer).
+"""
+
+import asyncio
+import threading
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+
+def extract_events(data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Extrae todos los mensajes y estados de un payload del webhook.
+
+    Args:
+        data: Payload JSON recibido de Meta
+
+    Returns:
+        Tuple (mensajes, estados). Cada elemento es un dict con
+        `phone_number_id`, `value` (el bloque original) y `message` o `status`.
+    """
+    messages, statuses = [], []
+    for entry in data.get('entry') or []:
+        for change in entry.get('changes') or []:
+            value = change.get('value') or {}
+            phone_number_id = (value.get('metadata') or {}).get('phone_number_id')
+            for message in value.get('messages') or []:
+                messages.append({'phone_number_id': phone_number_id, 'value': value, 'message': message})
+            for status in value.get('statuses') or []:
+                statuses.append({'phone_number_id': phone_number_id, 'value': value, 'status': status})
+    return messages, statuses
+
+
+class RecentIds:
+    """
+    Últimos `maxlen` IDs de mensaje procesados, con búsqueda O(1).
+
+    El deque conserva el orden de llegada para descartar el más antiguo; el set
+    responde `in` sin recorrer el deque.
+    """
+
+    def __init__(self, maxlen: int):
+        self._order: deque = deque()
+        self._ids: set = set()
+        self.maxlen = maxlen
+
+    def __contains__(self, message_id) -> bool:
+        return message_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def append(self, message_id) -> None:
+        if message_id in self._ids:
+            return
+        if len(self._order) >= self.maxlen:
+            self._ids.discard(self._order.popleft())
+        self._order.append(message_id)
+        self._ids.add(message_id)
+
+
+def dedupe_messages(events: List[Dict[str, Any]], seen) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Descarta mensajes ya procesados (reintentos) o repetidos dentro del batch.
+
+    Args:
+        events: Eventos de mensaje de `extract_events`
+        seen: IDs ya procesados (`RecentIds`); se actualiza
+
+    Returns:
+        Tuple (eventos nuevos, cantidad de duplicados)
+    """
+    fresh, batch_ids, duplicates = [], set(), 0
+    for event in events:
+        message_id = event['message'].get('id')
+        if message_id and (message_id in batch_ids or message_id in seen):
+            duplicates += 1
+            continue
+        if message_id:
+            batch_ids.add(message_id)
+            seen.append(message_id)
+        fresh.append(event)
+    return fresh, duplicates
+
+
+def group_events(events: List[Dict[str, Any]], key: Callable[[Dict[str, Any]], Hashable]) -> "OrderedDict[Hashable, List[Dict[str, Any]]]":
+    """Agrupa eventos por `key` conservando el orden de primera aparición."""
+    groups: "OrderedDict[Hashable, List[Dict[str, Any]]]" = OrderedDict()
+    for event in events:
+        groups.setdefault(key(event), []).append(event)
+    return groups
+
+
+def conversation_key(event: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """Clave de conversación: (phone_number_id del cliente, número del usuario)."""
+    return event['phone_number_id'], event['message'].get('from')
+
+
+def summarize_statuses(statuses: List[Dict[str, Any]]) -> Tuple[Dict[str, int], List[Dict[str, Any]]]:
+    """
+    Resume las actualizaciones de estado (sent/delivered/read/failed) en bloque.
+
+    Returns:
+        Tuple ({estado: cantidad}, [detalle de los fallidos])
+    """
+    counts = Counter()
+    failed = []
+    for event in statuses:
+        status = event['status']
+        state = status.get('status', 'unknown')
+        counts[state] += 1
+        if state == 'failed':
+            errors = status.get('errors') or [{}]
+            failed.append({
+                'phone_number_id': event['phone_number_id'],
+                'message_id': status.get('id'),
+                'recipient_id': status.get('recipient_id'),
+                'error_code': errors[0].get('code'),
+                'error_title': errors[0].get('title'),
+            })
+    return dict(counts), failed
+
+
+def coalesce_events(events: List[Dict[str, Any]], coalescer, eligible: Callable[[Dict[str, Any]], bool] = None) -> int:
+    """
+    Registra los mensajes en la ventana de agrupación, en orden de llegada.
+
+    Todos los mensajes toman turno en su conversación; solo los de texto
+    elegibles se agrupan. Los demás (botones, listas, comandos excluidos por
+    `eligible`) se responden solos, después de la ráfaga que ya estaba abierta.
+
+    Marca cada evento con `burst` (ráfaga a la que pertenece) y `coalesced`
+    (True si su texto lo procesará el líder de la ráfaga).
+
+    Args:
+        events: Eventos de mensaje (ya deduplicados)
+        coalescer: MessageCoalescer del proceso
+        eligible: Filtro opcional (ej. excluir comandos que no deben mezclarse)
+
+    Returns:
+        Cantidad de mensajes absorbidos por una ráfaga existente
+    """
+    if not coalescer.enabled:
+        return 0
+    absorbed = 0
+    for event in sorted(events, key=lambda e: int(e['message'].get('timestamp') or 0)):
+        message = event['message']
+        mergeable = message.get('type', 'text') == 'text' and (eligible is None or eligible(event))
+        burst, is_leader = coalescer.add(conversation_key(event), message.get('text', {}).get('body', ""), mergeable)
+        event['burst'] = burst
+        event['coalesced'] = not is_leader
+        absorbed += 0 if is_leader else 1
+    return absorbed
+
+
+@contextmanager
+def merged_event(event: Dict[str, Any], coalescer) -> Iterator[Dict[str, Any]]:
+    """
+    Para el líder de una ráfaga: espera la ventana y su turno, y entrega una
+    copia del evento cuyo texto es la unión de todos los mensajes de la ráfaga.
+    Los mensajes no agrupables esperan su turno y se entregan tal cual, igual
+    que los eventos sin ráfaga.
+    """
+    burst = event.get('burst')
+    if burst is None:
+        yield event
+        return
+    with coalescer.flush(burst) as texts:
+        if not burst.mergeable:
+            yield event
+            return
+        message = dict(event['message'], text={'body': "\n".join(texts)})
+        yield dict(event, message=message, merged=len(texts))
+
+
+class BatchMemo:
+    """
+    Memo de lookups compartido por los mensajes de un mismo payload.
+
+    Cada clave se carga una sola vez aunque varios hilos la pidan a la vez
+    (ej. el cliente de un phone_number_id o su menú).
+    """
+
+    def __init__(self):
+        self._values: Dict[Hashable, Any] = {}
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        if key in self._values:
+            return self._values[key]
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._values:
+                self._values[key] = loader()
+            return self._values[key]
+
+
+async def fan_out(
+    events: List[Dict[str, Any]],
+    handler: Callable[[Dict[str, Any]], Any],
+    max_concurrency: int = 8,
+    on_error: Callable[[Dict[str, Any], Exception], Any] = None,
+) -> List[Any]:
+    """
+    Procesa los mensajes en paralelo por conversación y en orden dentro de cada una.
+
+    Args:
+        events: Eventos de mensaje (ya deduplicados)
+        handler: Función síncrona que procesa un evento y retorna su resultado
+        max_concurrency: Conversaciones procesándose a la vez
+        on_error: Función (evento, excepción) que produce el resultado si `handler` falla
+
+    Returns:
+        Resultados en el mismo orden que `events`
+    """
+    results: List[Any] = [None] * len(events)
+    positions = {id(event): i for i, event in enumerate(events)}
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    def run_conversation(conversation: List[Dict[str, Any]]):
+        # Orden de llegada dentro de la conversación (timestamp de Meta, estable)
+        for event in sorted(conversation, key=lambda e: int(e['message'].get('timestamp') or 0)):
+            try:
+                result = handler(event)
+            except Exception as e:
+                result = on_error(event, e) if on_error else {'status': 'error'}
+            results[positions[id(event)]] = result
+
+    async def run_group(conversation):
+        async with semaphore:
+            await asyncio.to_thread(run_conversation, conversation)
+
+    groups = group_events(events, conversation_key)
+    await asyncio.gather(*(run_group(conversation) for conversation in groups.values()))
+    return results
@@ -0,0 +1,12 @@
+"""
+Configuración común de pytest.
+
+Las pruebas importan la app de SQLite como `src.*` y los módulos de la app de
+Firebase como `functions.src.*` (los dos árboles se llaman `src`).
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
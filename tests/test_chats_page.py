@@ -0,0 +1,53 @@
+"""Paginación de chats (functions/src/database.py) sobre loadtest.fakes.FakeFirestore."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from functions.src import database
+from loadtest.fakes import FakeFirestore
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeFirestore()
+    monkeypatch.setattr(database, "get_db", lambda: db)
+    chats = db.collection('clients').document('1').collection('chats')
+    # Dos chats por segundo: el ID desempata los timestamps iguales
+    for i in range(7):
+        chats.document(f"chat_{i}").set({
+            'user_number': "5215550001", 'message': f"m{i}", 'response': "ok",
+            'timestamp': START + timedelta(seconds=i // 2),
+        })
+    return db
+
+
+def _all_pages(limit, on_page=None):
+    ids, cursor = [], None
+    while True:
+        page = database.get_client_chats_page(1, limit=limit, start_after=cursor)
+        ids += [chat['id'] for chat in page['chats']]
+        if on_page:
+            on_page(page)
+        if not page['has_more']:
+            return ids
+        cursor = page['next_cursor']
+
+
+def test_recorre_todos_los_chats_sin_repetir(db):
+    assert _all_pages(limit=2) == [f"chat_{i}" for i in reversed(range(7))]
+
+
+def test_el_cursor_sobrevive_al_borrado_de_su_documento(db):
+    def purge_last(page):
+        # Retención o purga borran el último chat entregado antes de pedir la siguiente página
+        db.collection('clients').document('1').collection('chats').document(page['chats'][-1]['id']).delete()
+
+    assert _all_pages(limit=3, on_page=purge_last) == [f"chat_{i}" for i in reversed(range(7))]
+
+
+@pytest.mark.parametrize("cursor", ["chat_3", "no-es-base64!", database.encode_chat_cursor(START.replace(tzinfo=None), "chat_3")])
+def test_cursor_invalido(db, cursor):
+    with pytest.raises(database.InvalidChatCursor):
+        database.get_client_chats_page(1, limit=2, start_after=cursor)
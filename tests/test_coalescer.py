@@ -0,0 +1,79 @@
+"""Orden por conversación y espera de turno acotada de MessageCoalescer."""
+import threading
+import time
+
+from src.coalescer import MessageCoalescer
+from src import webhook_batch
+
+
+def _event(kind, body, ts, user="5215550001"):
+    message = {'from': user, 'id': f"wamid.{ts}", 'timestamp': str(ts), 'type': kind}
+    if kind == 'text':
+        message['text'] = {'body': body}
+    else:
+        message['interactive'] = {'type': 'button_reply', 'button_reply': {'id': 'b', 'title': body}}
+    return {'phone_number_id': "pn_1", 'message': message}
+
+
+def _process(event, coalescer, log, hold=0.0):
+    if event.get('coalesced'):
+        return
+    with webhook_batch.merged_event(event, coalescer) as merged:
+        time.sleep(hold)
+        log.append(merged['message'].get('text', {}).get('body') or merged['message']['interactive']['button_reply']['title'])
+
+
+def test_desactivado_por_defecto():
+    coalescer = MessageCoalescer()
+    events = [_event('text', "hola", 1), _event('text', "precio", 2)]
+    assert not coalescer.enabled
+    assert webhook_batch.coalesce_events(events, coalescer) == 0
+    assert all('burst' not in e for e in events)
+
+
+def test_boton_espera_a_la_rafaga_de_texto_anterior():
+    coalescer = MessageCoalescer(window_seconds=0.2)
+    events = [_event('text', "hola", 1), _event('text', "quería saber", 2), _event('interactive', "Precios", 3)]
+    assert webhook_batch.coalesce_events(events, coalescer) == 1
+
+    log = []
+    threads = [threading.Thread(target=_process, args=(e, coalescer, log, 0.05)) for e in reversed(events)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert log == ["hola\nquería saber", "Precios"]
+
+
+def test_texto_despues_de_un_boton_abre_otra_rafaga():
+    coalescer = MessageCoalescer(window_seconds=0.1)
+    events = [_event('text', "hola", 1), _event('interactive', "Precios", 2), _event('text', "gracias", 3)]
+    assert webhook_batch.coalesce_events(events, coalescer) == 0
+
+    log = []
+    threads = [threading.Thread(target=_process, args=(e, coalescer, log)) for e in reversed(events)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert log == ["hola", "Precios", "gracias"]
+
+
+def test_turno_abandonado_se_salta_tras_el_timeout():
+    coalescer = MessageCoalescer(window_seconds=0.05, turn_timeout_seconds=0.2)
+    key = ("pn_1", "5215550001")
+    coalescer.add(key, "hola")  # su líder nunca llama a flush
+    stuck, _ = coalescer.add(key, "Precios", mergeable=False)
+
+    started = time.monotonic()
+    with coalescer.flush(stuck) as texts:
+        assert texts == ["Precios"]
+    assert 0.15 <= time.monotonic() - started < 2
+    assert coalescer.stats()['skipped_turns'] == 1
+
+    # La conversación queda libre: la siguiente ráfaga no espera
+    burst, _ = coalescer.add(key, "otra", mergeable=False)
+    started = time.monotonic()
+    with coalescer.flush(burst):
+        pass
+    assert time.monotonic() - started < 0.1
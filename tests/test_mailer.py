@@ -0,0 +1,147 @@
+"""SMTPMailer contra un servidor SMTP simulado (sin red)."""
+import smtplib
+import threading
+from email.mime.text import MIMEText
+
+import pytest
+
+from src import mailer as mailer_module
+from src.mailer import SMTPMailer
+
+
+class FakeSMTP:
+    """Sustituto de smtplib.SMTP: registra conexiones y mensajes enviados."""
+
+    instances = []
+    failures = []  # Excepciones a lanzar en los próximos send_message
+
+    def __init__(self, host, port, timeout=None):
+        self.host, self.port = host, port
+        self.sent = []
+        self.calls = []
+        self.closed = False
+        FakeSMTP.instances.append(self)
+
+    def starttls(self):
+        self.calls.append("starttls")
+
+    def login(self, username, password):
+        self.calls.append(("login", username))
+
+    def send_message(self, message):
+        if FakeSMTP.failures:
+            raise FakeSMTP.failures.pop(0)
+        self.sent.append(message)
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def fake_smtp(monkeypatch):
+    FakeSMTP.instances = []
+    FakeSMTP.failures = []
+    monkeypatch.setattr(mailer_module.smtplib, "SMTP", FakeSMTP)
+    return FakeSMTP
+
+
+def _code_email(code, to="admin@zotek.mx"):
+    # Mismo formato que send_security_code
+    msg = MIMEText(f"Tu codigo de acceso para el panel administrativo es: {code}\nExpira en 10 minutos.")
+    msg['Subject'] = f"{code} es tu código de verificación"
+    msg['From'] = "no-reply@zotek.mx"
+    msg['To'] = to
+    return msg
+
+
+def _sent_messages():
+    return [m for smtp in FakeSMTP.instances for m in smtp.sent]
+
+
+def test_envia_el_codigo_y_vacia_la_cola_al_cerrar():
+    mailer = SMTPMailer("smtp.test", 587, "no-reply@zotek.mx", "clave")
+    futures = [mailer.submit(_code_email(code)) for code in ("111111", "222222", "333333")]
+    mailer.close(timeout=5)
+
+    assert [f.result(timeout=1) for f in futures] == [True, True, True]
+    assert [m['Subject'].split()[0] for m in _sent_messages()] == ["111111", "222222", "333333"]
+    assert "333333" in _sent_messages()[-1].get_payload()
+
+    # El trabajador terminó y cerró la conexión, que se reutilizó entre envíos
+    assert not mailer._thread.is_alive()
+    assert len(FakeSMTP.instances) == 1
+    smtp = FakeSMTP.instances[0]
+    assert smtp.calls == ["starttls", ("login", "no-reply@zotek.mx")]
+    assert smtp.closed
+    assert mailer.stats() == {"sent": 3, "failed": 0, "retries": 0, "connections": 1, "queued": 0, "connected": False}
+
+
+def test_submit_no_espera_la_entrega(monkeypatch):
+    release = threading.Event()
+
+    class SlowSMTP(FakeSMTP):
+        def send_message(self, message):
+            release.wait(5)
+            super().send_message(message)
+
+    monkeypatch.setattr(mailer_module.smtplib, "SMTP", SlowSMTP)
+    mailer = SMTPMailer("smtp.test")
+    future = mailer.submit(_code_email("444444"))
+    assert not future.done()
+    release.set()
+    assert future.result(timeout=5) is True
+    mailer.close(timeout=5)
+    assert not mailer._thread.is_alive()
+
+
+def test_reintenta_errores_transitorios_y_reconecta():
+    FakeSMTP.failures = [smtplib.SMTPServerDisconnected("conexión perdida")]
+    mailer = SMTPMailer("smtp.test", backoff_seconds=0)
+    future = mailer.submit(_code_email("555555"))
+    assert future.result(timeout=5) is True
+    mailer.close(timeout=5)
+
+    assert [m['Subject'].split()[0] for m in _sent_messages()] == ["555555"]
+    assert len(FakeSMTP.instances) == 2
+    assert mailer.stats()["retries"] == 1
+
+
+def test_error_permanente_resuelve_el_future_con_la_excepcion():
+    errors = []
+    FakeSMTP.failures = [smtplib.SMTPRecipientsRefused({"x@zotek.mx": (550, b"no existe")})]
+    mailer = SMTPMailer("smtp.test", backoff_seconds=0, on_error=lambda msg, e: errors.append(msg['To']))
+    future = mailer.submit(_code_email("666666", to="x@zotek.mx"))
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        future.result(timeout=5)
+    mailer.close(timeout=5)
+
+    assert errors == ["x@zotek.mx"]
+    assert mailer.stats()["failed"] == 1 and mailer.stats()["retries"] == 0
+
+
+def test_un_future_cancelado_no_se_envia(monkeypatch):
+    release = threading.Event()
+
+    class SlowSMTP(FakeSMTP):
+        def send_message(self, message):
+            release.wait(5)
+            super().send_message(message)
+
+    monkeypatch.setattr(mailer_module.smtplib, "SMTP", SlowSMTP)
+    mailer = SMTPMailer("smtp.test")
+    first = mailer.submit(_code_email("777777"))
+    second = mailer.submit(_code_email("888888"))
+    assert second.cancel()
+
+    # Lo que hace request-code: un código cuya entrega se canceló se descarta
+    discarded = []
+    second.add_done_callback(lambda f: (f.cancelled() or f.exception()) and discarded.append("888888"))
+    release.set()
+    assert first.result(timeout=5) is True
+    mailer.close(timeout=5)
+
+    assert discarded == ["888888"]
+    assert [m['Subject'].split()[0] for m in _sent_messages()] == ["777777"]
@@ -0,0 +1,144 @@
+"""`migrate()` concurrente desde varios hilos y procesos sobre la misma base."""
+import multiprocessing
+import sqlite3
+import threading
+
+import pytest
+
+from src import migrations
+
+WORKERS = 6
+
+
+def _migrate_in_process(db_path, start, results):
+    start.wait(30)
+    results.put(migrations.migrate(db_path))
+
+
+def _schema(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        objects = conn.execute("SELECT type, name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'").fetchall()
+        return {
+            "user_version": conn.execute("PRAGMA user_version").fetchone()[0],
+            "objects": sorted(objects),
+            "clients_columns": [c[1] for c in conn.execute("PRAGMA table_info(clients)")],
+            "tenant_version_rows": conn.execute("SELECT COUNT(*) FROM tenant_version").fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+
+def _assert_applied_once(results):
+    versions = [version for version, _, _ in migrations.MIGRATIONS]
+    assert sorted(results, key=len) == [[]] * (len(results) - 1) + [versions]
+
+
+@pytest.fixture
+def reference_schema(tmp_path):
+    path = str(tmp_path / "referencia.db")
+    migrations.migrate(path)
+    return _schema(path)
+
+
+def test_hilos_sobre_base_nueva_migran_una_sola_vez(tmp_path, reference_schema):
+    db_path = str(tmp_path / "zotek.db")
+    barrier = threading.Barrier(WORKERS)
+    results, errors = [], []
+
+    def worker():
+        try:
+            barrier.wait(10)
+            results.append(migrations.migrate(db_path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(WORKERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(60)
+
+    assert errors == []
+    _assert_applied_once(results)
+    assert _schema(db_path) == reference_schema
+    assert reference_schema["user_version"] == migrations.LATEST_VERSION
+
+
+def test_procesos_sobre_base_nueva_migran_una_sola_vez(tmp_path, reference_schema):
+    db_path = str(tmp_path / "zotek.db")
+    ctx = multiprocessing.get_context("spawn")
+    start, results = ctx.Event(), ctx.Queue()
+    processes = [ctx.Process(target=_migrate_in_process, args=(db_path, start, results)) for _ in range(WORKERS)]
+    for p in processes:
+        p.start()
+    start.set()
+    for p in processes:
+        p.join(60)
+
+    assert [p.exitcode for p in processes] == [0] * WORKERS
+    _assert_applied_once([results.get(timeout=5) for _ in processes])
+    assert _schema(db_path) == reference_schema
+
+
+def test_base_existente_sin_version_se_completa_una_vez(tmp_path, reference_schema):
+    # Base creada antes del versionado: clients sin las columnas nuevas y user_version = 0
+    db_path = str(tmp_path / "legado.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            whatsapp_token TEXT NOT NULL,
+            phone_number_id TEXT NOT NULL UNIQUE,
+            verify_token TEXT NOT NULL,
+            system_instruction TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute("CREATE TABLE knowledge_base (id INTEGER PRIMARY KEY AUTOINCREMENT, client_id INTEGER, content TEXT NOT NULL, source_file TEXT, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    conn.execute("INSERT INTO clients (name, whatsapp_token, phone_number_id, verify_token) VALUES ('Demo', 't', 'pn_1', 'v')")
+    conn.execute("INSERT INTO knowledge_base (client_id, content) VALUES (1, 'horario: 9 a 18')")
+    conn.commit()
+    conn.close()
+
+    barrier = threading.Barrier(WORKERS)
+    results = []
+
+    def worker():
+        barrier.wait(10)
+        results.append(migrations.migrate(db_path))
+
+    threads = [threading.Thread(target=worker) for _ in range(WORKERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(60)
+
+    _assert_applied_once(results)
+    schema = _schema(db_path)
+    assert schema["user_version"] == migrations.LATEST_VERSION
+    assert set(reference_schema["clients_columns"]) == set(schema["clients_columns"])
+    assert schema["tenant_version_rows"] == 1
+
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT plan, menu_version, knowledge_bytes FROM clients WHERE id = 1").fetchone()
+    finally:
+        conn.close()
+    assert row == ('free', 0, len("horario: 9 a 18".encode("utf-8")))
+
+
+def test_base_al_dia_no_toma_el_lock(tmp_path):
+    db_path = str(tmp_path / "zotek.db")
+    migrations.migrate(db_path)
+
+    # Otro worker escribiendo (transacción abierta) no bloquea el camino rápido
+    holder = sqlite3.connect(db_path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")
+    holder.execute("INSERT INTO message_logs (client_id, direction) VALUES (1, 'in')")
+    try:
+        assert migrations.migrate(db_path, timeout=0.1) == []
+    finally:
+        holder.execute("ROLLBACK")
+        holder.close()
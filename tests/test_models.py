@@ -0,0 +1,32 @@
+"""`Client` como Mapping: una columna en None se trata igual en todos los métodos."""
+import pytest
+
+from functions.src import models as functions_models
+from src import models
+
+
+@pytest.fixture(params=[models.Client, functions_models.Client], ids=["src", "functions"])
+def client(request):
+    return request.param.from_dict({'id': 7, 'name': "Consultorio", 'plan': None, 'color': None})
+
+
+def test_columna_nula_ausente_en_la_vista_mapping(client):
+    assert 'plan' not in client
+    assert 'plan' not in list(client)
+    assert len(client) == len(list(client)) == 3
+    with pytest.raises(KeyError):
+        client['plan']
+    assert client.get('plan', 'free') == 'free'
+    assert dict(client) == {'id': 7, 'name': "Consultorio", 'color': None}
+
+
+def test_extra_en_none_se_conserva_como_en_un_dict(client):
+    assert 'color' in client
+    assert client['color'] is None
+    assert client.get('color', 'azul') is None
+
+
+def test_as_dict(client):
+    full = client.as_dict()
+    assert full['plan'] is None and full['email'] is None and full['name'] == "Consultorio"
+    assert client.as_dict(include_none=False) == dict(client)
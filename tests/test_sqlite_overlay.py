@@ -0,0 +1,160 @@
+"""Overlay de producción: la base empaquetada es inmutable y la configuración de tenants se edita."""
+import hashlib
+import os
+import sqlite3
+import stat
+
+import pytest
+
+from src import database
+from src.sqlite_overlay import OverlayDatabase
+
+
+def _bundled_db(path):
+    """Base empaquetada de un deploy anterior: sin menu_version, knowledge_bytes ni document_key."""
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            whatsapp_token TEXT NOT NULL,
+            phone_number_id TEXT NOT NULL UNIQUE,
+            verify_token TEXT NOT NULL,
+            system_instruction TEXT,
+            plan TEXT DEFAULT 'free',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE knowledge_base (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER,
+            content TEXT NOT NULL,
+            source_file TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE conversation_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone_number TEXT NOT NULL,
+            content TEXT NOT NULL,
+            is_user INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO clients (name, whatsapp_token, phone_number_id, verify_token, plan)
+            VALUES ('Consultorio', 'tok', 'pn_1', 'vt', 'pro');
+        INSERT INTO clients (name, whatsapp_token, phone_number_id, verify_token)
+            VALUES ('Dental', 'tok', 'pn_3', 'vt');
+        INSERT INTO knowledge_base (client_id, content, source_file) VALUES (1, 'horario: lunes a viernes', 'faq.pdf');
+        INSERT INTO knowledge_base (client_id, content, source_file) VALUES (2, 'limpieza dental', 'servicios.pdf');
+        INSERT INTO conversation_history (phone_number, content, is_user) VALUES ('5215550001', 'hola', 1);
+    ''')
+    conn.commit()
+    conn.close()
+    os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+
+def _digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@pytest.fixture
+def bundled(tmp_path):
+    path = str(tmp_path / "consultorio.db")
+    _bundled_db(path)
+    return path
+
+
+@pytest.fixture
+def production_db(tmp_path, bundled, monkeypatch):
+    """database.py apuntando a un overlay, como en Firebase (Config.IS_PRODUCTION)."""
+    overlay = OverlayDatabase(bundled, str(tmp_path / "overlay.db"))
+    overlay.bootstrap()
+    monkeypatch.setattr(database, "overlay", overlay)
+    monkeypatch.setattr(database, "DB_NAME", overlay.overlay_path)
+    database.tenants.refresh()
+    return overlay
+
+
+def test_base_anterior_se_lee_con_el_esquema_migrado(production_db):
+    client = database.get_client_by_id(1)
+    assert client['name'] == 'Consultorio'
+    assert client['plan'] == 'pro'
+    assert client['menu_version'] == 0
+    assert client['knowledge_bytes'] == len('horario: lunes a viernes'.encode('utf-8'))
+    assert [d['source_file'] for d in database.list_client_documents(1)] == ['faq.pdf']
+    assert production_db.stats()['base_tables'] == ['clients', 'knowledge_base']
+    # El historial de la base empaquetada no se copia al overlay
+    assert database.get_conversation_history('5215550001') == []
+
+
+def test_clientes_y_conocimiento_editables_sin_tocar_la_base(production_db, bundled):
+    before = _digest(bundled)
+
+    assert database.update_client(1, {'name': 'Consultorio Centro', 'menu_json': {'title': 'Menú'}})
+    assert database.add_client({'name': 'Nuevo', 'whatsapp_token': 't2', 'phone_number_id': 'pn_2', 'verify_token': 'v2'})
+    result = database.upsert_knowledge_document(1, 'precios.pdf', ['consulta: 500'])
+    assert result['status'] == 'created'
+
+    client = database.get_client_by_id(1)
+    assert client['name'] == 'Consultorio Centro'
+    assert client['menu_version'] > 0
+    assert client['knowledge_bytes'] == len('horario: lunes a viernes'.encode('utf-8')) + len(b'consulta: 500')
+    assert database.get_client_by_phone_id('pn_2')['id'] == 3
+    assert sorted(d['source_file'] for d in database.list_client_documents(1)) == ['faq.pdf', 'precios.pdf']
+    assert _digest(bundled) == before
+
+
+def test_conocimiento_copy_on_write_por_tenant(production_db):
+    conn = production_db.connect()
+    try:
+        # Solo el conocimiento del tenant editado se copia al overlay
+        assert database.upsert_knowledge_document(1, 'faq.pdf', ['horario: sábados'])['chunks_deleted'] == 1
+        stored = conn.execute("SELECT client_id, content FROM main.knowledge_base_overlay").fetchall()
+        assert stored == [(1, 'horario: sábados')]
+        assert conn.execute("SELECT client_id FROM overlay_tenants").fetchall() == [(1,)]
+        # Los demás se siguen leyendo de la base empaquetada
+        assert database.get_client_knowledge(2) == 'limpieza dental'
+        assert database.get_client_knowledge(1) == 'horario: sábados'
+
+        # Compactar sin cambios no escribe: el tenant sigue en la base empaquetada
+        assert database.compact_client_knowledge(2)['documents_compacted'] == 0
+        assert conn.execute("SELECT client_id FROM overlay_tenants").fetchall() == [(1,)]
+        # Filas nuevas del overlay con IDs posteriores a los de la base
+        ids = [row[0] for row in conn.execute("SELECT id FROM knowledge_base WHERE client_id = 1")]
+        assert min(ids) > 2
+    finally:
+        conn.close()
+
+
+def test_reinicio_conserva_las_ediciones(production_db, bundled):
+    assert database.update_client(1, {'name': 'Editado'})
+
+    # Otro worker (o un cold start que restauró el snapshot) vuelve a arrancar el overlay
+    again = OverlayDatabase(bundled, production_db.overlay_path)
+    again.bootstrap()
+    conn = again.connect()
+    try:
+        assert conn.execute("SELECT name FROM clients WHERE id = 1").fetchall() == [('Editado',)]
+        assert conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0] == 2
+        assert conn.execute("SELECT COUNT(*) FROM knowledge_base").fetchone()[0] == 2
+    finally:
+        conn.close()
+    assert again.stats()['base_tables'] == ['clients', 'knowledge_base']
+
+
+def test_nuevo_deploy_agrega_tenants_sin_pisar_ediciones(production_db, bundled):
+    assert database.update_client(1, {'name': 'Editado'})
+
+    os.chmod(bundled, stat.S_IRUSR | stat.S_IWUSR)
+    conn = sqlite3.connect(bundled)
+    conn.execute("INSERT INTO clients (name, whatsapp_token, phone_number_id, verify_token) VALUES ('Otro', 't', 'pn_9', 'v')")
+    conn.commit()
+    conn.close()
+    os.utime(bundled, ns=(1, 1))
+
+    redeployed = OverlayDatabase(bundled, production_db.overlay_path)
+    redeployed.bootstrap()
+    conn = redeployed.connect()
+    try:
+        assert conn.execute("SELECT id, name FROM clients ORDER BY id").fetchall() == [(1, 'Editado'), (2, 'Dental'), (3, 'Otro')]
+    finally:
+        conn.close()
@@ -0,0 +1,137 @@
+"""
+Conformidad de los backends de storage: los mismos casos contra memoria,
+SQLite (src/storage.py) y Firestore (functions/src/storage.py).
+
+Firestore corre sobre loadtest.fakes.FakeFirestore, o contra el emulador si
+FIRESTORE_EMULATOR_HOST está definido.
+"""
+import os
+import sqlite3
+import time
+
+import pytest
+
+from functions.src import models as functions_models
+from functions.src import storage as functions_storage
+from loadtest.fakes import FakeFirestore
+from src import migrations
+from src import models
+from src import storage as src_storage
+from src.storage import KNOWLEDGE_SEPARATOR, ChatExchange, history_key
+
+CLIENTS = [{'id': i, 'name': f"Consultorio {i}", 'phone_number_id': f"pn_{i}"} for i in range(1, 4)]
+KNOWLEDGE = {1: ["uno", "dos", "tres"]}
+
+
+def memory_backend(tmp_path):
+    return src_storage.MemoryStorage(CLIENTS, KNOWLEDGE), ""
+
+
+def sqlite_backend(tmp_path):
+    path = str(tmp_path / "storage.db")
+    migrations.migrate(path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO clients (id, name, whatsapp_token, phone_number_id, verify_token) VALUES (?, ?, ?, ?, ?)",
+            [(c['id'], c['name'], "tok", c['phone_number_id'], "vt") for c in CLIENTS]
+        )
+        # Insertados en desorden: el orden lo dan document_key y chunk_index
+        conn.executemany(
+            "INSERT INTO knowledge_base (client_id, content, source_file, document_key, chunk_index) VALUES (?, ?, ?, ?, ?)",
+            [(client_id, chunk, "menu.pdf", "doc_menu", i) for client_id, chunks in KNOWLEDGE.items()
+             for i, chunk in reversed(list(enumerate(chunks)))]
+        )
+    conn.close()
+    return src_storage.SQLiteStorage(lambda **kw: sqlite3.connect(path, **kw)), ""
+
+
+def firestore_backend(tmp_path):
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        import firebase_admin
+        from firebase_admin import firestore
+        try:
+            firebase_admin.initialize_app(options={'projectId': 'zotek-tests'})
+        except ValueError:
+            pass
+        db, prefix = firestore.client(), f"test{time.time_ns()}_"
+    else:
+        db, prefix = FakeFirestore(), ""
+    for client in CLIENTS:
+        ref = db.collection('clients').document(prefix + str(client['id']))
+        ref.set({k: v for k, v in client.items() if k != 'id'})
+        for i, chunk in reversed(list(enumerate(KNOWLEDGE.get(client['id'], ())))):
+            ref.collection('knowledge').document(f"chunk_{i:04d}").set(
+                {'content': chunk, 'document_id': 'doc_menu', 'chunk_index': i})
+    return functions_storage.FirestoreStorage(lambda: db), prefix
+
+
+@pytest.fixture(params=[memory_backend, sqlite_backend, firestore_backend], ids=["memory", "sqlite", "firestore"])
+def backend(request, tmp_path):
+    """(storage, cid): cid(n) es el ID del cliente n en el backend (el emulador usa un prefijo por corrida)."""
+    storage, prefix = request.param(tmp_path)
+    return storage, lambda client_id: prefix + str(client_id)
+
+
+def test_implementa_storage(backend):
+    storage, _ = backend
+    assert isinstance(storage, src_storage.Storage)
+    assert isinstance(storage, functions_storage.Storage)
+
+
+def test_get_tenants_many(backend):
+    storage, cid = backend
+    tenants = storage.get_tenants_many([cid(1), cid(2), cid(1), cid(5000)])
+    assert sorted(tenants) == [cid(1), cid(2)]
+    assert all(isinstance(c, (models.Client, functions_models.Client)) for c in tenants.values())
+    assert tenants[cid(1)].get('phone_number_id') == "pn_1"
+    assert storage.get_tenants_many([]) == {}
+
+
+def test_append_y_historial(backend):
+    storage, cid = backend
+    client_a, client_b = cid(1), cid(2)
+    assert storage.append_messages([ChatExchange(client_a, "5215550001", f"hola {i}", f"respuesta {i}") for i in range(3)]) == 3
+    storage.append_messages([ChatExchange(client_a, "5215550002", "otro usuario", "ok"),
+                             ChatExchange(client_b, "5215550001", "otro cliente", "ok")])
+    assert storage.append_messages([]) == 0
+
+    keys = [(client_a, "5215550001"), (client_a, "5215550002"), (client_b, "5215550001"), (client_b, "000")]
+    history = storage.get_history_many(keys, limit=4)
+    assert set(history) == {history_key(*k) for k in keys}
+    # Del más antiguo al más reciente, usuario y luego asistente
+    assert [(m.content, m.is_user) for m in history[history_key(client_a, "5215550001")]] == [
+        ("hola 1", True), ("respuesta 1", False), ("hola 2", True), ("respuesta 2", False)]
+    assert [m.content for m in history[history_key(client_a, "5215550002")]] == ["otro usuario", "ok"]
+    assert [m.content for m in history[history_key(client_b, "5215550001")]] == ["otro cliente", "ok"]
+    assert history[history_key(client_b, "000")] == []
+
+    assert len(storage.get_history_many([keys[0]], limit=3)[history_key(*keys[0])]) == 3
+    assert storage.get_history_many([keys[0]], limit=0) == {history_key(*keys[0]): []}
+
+
+def test_append_por_separado_conserva_el_orden(backend):
+    storage, cid = backend
+    for i in range(3):
+        storage.append_messages([ChatExchange(cid(3), "5215550009", f"m{i}", f"r{i}")])
+    history = storage.get_history_many([(cid(3), "5215550009")], limit=10)[history_key(cid(3), "5215550009")]
+    assert [m.content for m in history] == ["m0", "r0", "m1", "r1", "m2", "r2"]
+
+
+def test_get_knowledge(backend):
+    storage, cid = backend
+    assert storage.get_knowledge(cid(1)) == KNOWLEDGE_SEPARATOR.join(["uno", "dos", "tres"])
+    assert storage.get_knowledge(cid(3)) == ""
+
+
+def test_firestore_divide_batches_de_mas_de_500_escrituras():
+    db = FakeFirestore()
+    storage = functions_storage.FirestoreStorage(lambda: db)
+    exchanges = [ChatExchange(1, f"52155{i:08d}", "hola", "ok") for i in range(functions_storage.FIRESTORE_MAX_BATCH_WRITES + 1)]
+    assert storage.append_messages(exchanges) == len(exchanges)
+    assert db.count('clients/1/chats') == len(exchanges)
+
+
+def test_cada_app_trae_solo_su_backend():
+    assert not hasattr(src_storage, 'FirestoreStorage')
+    assert not hasattr(functions_storage, 'SQLiteStorage')
@@ -0,0 +1,119 @@
+"""Códigos 2FA compartidos entre workers: SQLiteVerificationStore sobre un mismo archivo."""
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from src import verification_store
+from src.verification_store import SQLiteVerificationStore
+
+SECRET = "secreto-de-prueba"
+EMAIL = "Admin@Zotek.mx"
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "zotek.db")
+    conn = sqlite3.connect(path)
+    SQLiteVerificationStore.create_schema(conn.cursor())
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _worker(db_path, **kwargs):
+    """Un almacén por worker, como lo crea cada proceso de uvicorn."""
+    return SQLiteVerificationStore(lambda: db_path, SECRET, **kwargs)
+
+
+def _verify_in_process(db_path, email, code, results):
+    results.put(_worker(db_path).verify(email, code))
+
+
+def test_codigo_pedido_en_un_worker_se_verifica_en_otro(db_path):
+    worker_a, worker_b = _worker(db_path), _worker(db_path)
+    assert worker_a.issue(EMAIL, "123456")
+
+    assert worker_b.verify("admin@zotek.mx ", "123456") == verification_store.VERIFIED
+    # Consumido: ningún worker lo acepta de nuevo
+    assert worker_a.verify(EMAIL, "123456") == verification_store.INVALID
+    assert worker_b.verify(EMAIL, "123456") == verification_store.INVALID
+
+
+def test_codigo_pedido_en_un_proceso_se_verifica_en_otro_proceso(db_path):
+    assert _worker(db_path).issue(EMAIL, "654321")
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=_verify_in_process, args=(db_path, EMAIL, "654321", results))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+    assert results.get(timeout=5) == verification_store.VERIFIED
+    assert _worker(db_path).verify(EMAIL, "654321") == verification_store.INVALID
+
+
+def test_intentos_fallidos_se_suman_entre_workers(db_path):
+    worker_a, worker_b = _worker(db_path, max_attempts=3), _worker(db_path, max_attempts=3)
+    assert worker_a.issue(EMAIL, "111111")
+
+    assert worker_a.verify(EMAIL, "000000") == verification_store.INVALID
+    assert worker_b.verify(EMAIL, "000000") == verification_store.INVALID
+    assert worker_a.verify(EMAIL, "000000") == verification_store.LOCKED
+    # Bloqueado: el código correcto ya no sirve en ningún worker
+    assert worker_b.verify(EMAIL, "111111") == verification_store.LOCKED
+
+
+def test_bloqueo_impide_pedir_otro_codigo_hasta_que_vence(db_path):
+    worker_a = _worker(db_path, max_attempts=2, resend_interval_seconds=0)
+    worker_b = _worker(db_path, max_attempts=2, resend_interval_seconds=0)
+    assert worker_a.issue(EMAIL, "121212")
+    assert worker_a.verify(EMAIL, "000000") == verification_store.INVALID
+    assert worker_b.verify(EMAIL, "000000") == verification_store.LOCKED
+
+    # Ni otro worker emite un código nuevo (con sus intentos desde cero)
+    assert not worker_a.issue(EMAIL, "343434")
+    assert not worker_b.issue(EMAIL, "343434")
+    assert worker_b.verify(EMAIL, "343434") == verification_store.LOCKED
+
+    # Al vencer el bloqueo se puede pedir otro código
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("UPDATE verification_codes SET expires_at = 0")
+    conn.close()
+    assert worker_a.issue(EMAIL, "565656")
+    assert worker_b.verify(EMAIL, "565656") == verification_store.VERIFIED
+
+
+def test_bloqueo_en_memoria():
+    store = verification_store.MemoryVerificationStore(SECRET, max_attempts=1, resend_interval_seconds=0)
+    assert store.issue(EMAIL, "787878")
+    assert store.verify(EMAIL, "000000") == verification_store.LOCKED
+    assert not store.issue(EMAIL, "909090")
+    assert store.verify(EMAIL, "787878") == verification_store.LOCKED
+
+
+def test_un_backend_incompleto_falla_al_instanciarse():
+    class SinDiscard(verification_store.VerificationStore):
+        def issue(self, email, code):
+            return True
+
+        def verify(self, email, code):
+            return verification_store.INVALID
+
+    with pytest.raises(TypeError):
+        SinDiscard(SECRET)
+
+
+def test_reenvio_limitado_entre_workers(db_path):
+    worker_a, worker_b = _worker(db_path), _worker(db_path)
+    assert worker_a.issue(EMAIL, "222222")
+    assert not worker_b.issue(EMAIL, "333333")
+    assert worker_b.verify(EMAIL, "222222") == verification_store.VERIFIED
+
+
+def test_discard_en_un_worker_invalida_en_otro(db_path):
+    worker_a, worker_b = _worker(db_path), _worker(db_path)
+    assert worker_a.issue(EMAIL, "444444")
+    worker_a.discard(EMAIL)
+    assert worker_b.verify(EMAIL, "444444") == verification_store.INVALID
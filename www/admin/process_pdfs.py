@@ -1,10 +1,10 @@
-import sqlite3
 import os
 import sys
 
 # Ensure we can import from src
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from src import database
+from src.services import pdf_text
 
 # Note: This requires 'pypdf' or similar. I'll include a placeholder logic 
 # that can be expanded if the user installs dependencies.
@@ -25,19 +25,20 @@ def ingest_pdf(client_id, pdf_path):
 
     try:
         reader = PdfReader(pdf_path)
-        content = ""
-        for page in reader.pages:
-            content += page.extract_text() + "\n"
-        
-        conn = sqlite3.connect(database.DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO knowledge_base (client_id, content, source_file)
-            VALUES (?, ?, ?)
-        ''', (client_id, content, os.path.basename(pdf_path)))
-        conn.commit()
-        conn.close()
-        print(f"✅ Contenido del PDF '{os.path.basename(pdf_path)}' guardado para el cliente ID {client_id}.")
+        pages = (pdf_text.clean_text(page.extract_text() or "") for page in reader.pages)
+        chunks = list(pdf_text.chunk_text(pages))
+
+        # Versionado por hash: re-subir el mismo PDF no duplica el conocimiento
+        result = database.upsert_knowledge_document(client_id, os.path.basename(pdf_path), chunks)
+        if result['status'] == 'unchanged':
+            print(f"ℹ️ '{os.path.basename(pdf_path)}' no cambió (versión {result['version']}). Nada que actualizar.")
+        elif result['status'] == 'over_quota':
+            print(f"❌ '{os.path.basename(pdf_path)}' excede la cuota de conocimiento del plan "
+                  f"({result['used_bytes']} usados + {result['bytes']} nuevos > {result['quota_bytes']} bytes).")
+            return False
+        else:
+            print(f"✅ Contenido del PDF '{os.path.basename(pdf_path)}' guardado para el cliente ID {client_id} "
+                  f"(versión {result['version']}, {result['chunks_written']} chunks escritos, {result['chunks_deleted']} eliminados, {result['bytes_saved']} bytes ahorrados al compactar).")
         return True
     except Exception as e:
         print(f"❌ Error al procesar PDF: {e}")
@@ -956,7 +956,31 @@ function parseResponseToItems(text) {
 
 
 
-async function loadChats() {
+let chatsCursor = null;
+
+function renderChatCard(chat) {
+    const date = chat.timestamp ? new Date(chat.timestamp).toLocaleString() : '—';
+    const msg = escapeHtml(chat.message || '');
+    const resp = escapeHtml(chat.response || '');
+    return `
+        <div class="chat-card">
+            <div class="chat-card-header">
+                <span class="chat-card-user">📱 ${escapeHtml(chat.user_number || '')}</span>
+                <span class="chat-card-date">${escapeHtml(date)}</span>
+            </div>
+            <div class="chat-card-message">
+                <div class="chat-card-label">Usuario</div>
+                <div>${msg}</div>
+            </div>
+            <div>
+                <div class="chat-card-label">Bot</div>
+                <div class="chat-card-response">${resp}</div>
+            </div>
+        </div>
+    `;
+}
+
+async function loadChats(append = false) {
     const clientId = document.getElementById('chat-client-selector').value;
     const container = document.getElementById('chat-history-list');
     if (!container) return;
@@ -965,9 +989,12 @@ async function loadChats() {
         container.innerHTML = '<p class="chat-placeholder">Selecciona un cliente para ver el historial de conversaciones con el bot.</p>';
         return;
     }
+    if (!append) chatsCursor = null;
 
     try {
-        const res = await fetch(`/api/clients/${clientId}/chats`, {
+        const params = new URLSearchParams({ limit: '50' });
+        if (chatsCursor) params.set('start_after', chatsCursor);
+        const res = await fetch(`/api/clients/${clientId}/chats?${params}`, {
             headers: { 'Authorization': `Bearer ${token}` }
         });
         if (res.status === 401) {
@@ -975,34 +1002,27 @@ async function loadChats() {
             window.location.href = '/login';
             return;
         }
-        const chats = await res.json();
+        const page = await res.json();
+        const chats = page.chats || [];
+        chatsCursor = page.next_cursor;
 
-        if (chats.length === 0) {
+        if (!append && chats.length === 0) {
             container.innerHTML = '<p class="chat-placeholder">No hay mensajes registrados para este cliente aún.</p>';
             return;
         }
 
-        container.innerHTML = chats.map(chat => {
-            const date = chat.timestamp ? new Date(chat.timestamp).toLocaleString() : '—';
-            const msg = escapeHtml(chat.message || '');
-            const resp = escapeHtml(chat.response || '');
-            return `
-                <div class="chat-card">
-                    <div class="chat-card-header">
-                        <span class="chat-card-user">📱 ${escapeHtml(chat.user_number || '')}</span>
-                        <span class="chat-card-date">${escapeHtml(date)}</span>
-                    </div>
-                    <div class="chat-card-message">
-                        <div class="chat-card-label">Usuario</div>
-                        <div>${msg}</div>
-                    </div>
-                    <div>
-                        <div class="chat-card-label">Bot</div>
-                        <div class="chat-card-response">${resp}</div>
-                    </div>
-                </div>
-            `;
-        }).join('');
+        const moreBtn = document.getElementById('chat-load-more');
+        if (moreBtn) moreBtn.remove();
+        const html = chats.map(renderChatCard).join('');
+        if (append) {
+            container.insertAdjacentHTML('beforeend', html);
+        } else {
+            container.innerHTML = html;
+        }
+        if (page.has_more) {
+            container.insertAdjacentHTML('beforeend',
+                '<button id="chat-load-more" class="btn" onclick="loadChats(true)">Cargar más</button>');
+        }
     } catch (e) {
         console.error(e);
         container.innerHTML = '<p class="chat-placeholder">Error al cargar el historial. Intenta de nuevo.</p>';
@@ -1098,6 +1118,7 @@ async function handleFileSelect(event) {
             body: formData
         });
 
+        // La ingesta termina dentro del request: la respuesta ya es el resultado final
         const result = await response.json().catch(() => ({}));
 
         if (response.ok) {